@@ -1,28 +1,55 @@
 import time
 import logging
 from datetime import datetime, timedelta
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import requests
+from collections import deque, namedtuple
 import re
 from urllib.parse import urlparse, parse_qs
 import os
-from threading import Lock
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill
-from openpyxl.utils import get_column_letter
-import telebot
+from threading import Lock, Thread, Event, get_ident
+import queue
 import random
-import pytz
+import math
+import signal
 import json
-from gspread.exceptions import APIError
-from bs4 import BeautifulSoup  # Добавлено для парсинга HTML
-from google.oauth2.service_account import Credentials
-from gspread_formatting import CellFormat, format_cell_range, Color, TextFormat
+import io
+import ast
+from functools import lru_cache, wraps
+from contextlib import contextmanager
 import sys
+import argparse
+import importlib.util
 from logging.handlers import RotatingFileHandler
 import unicodedata 
 
+from raw_archive import ResponseArchive
+
+
+class LazyModule:
+    """
+    Модуль, который импортируется при первом обращении к атрибуту.
+    Google Sheets, Telegram, numpy и разбор HTML нужны не каждому запуску, а их импорт занимает сотни миллисекунд.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# Тяжелые зависимости импортируются при первом использовании
+gspread = LazyModule('gspread')
+requests = LazyModule('requests')
+telebot = LazyModule('telebot')
+pytz = LazyModule('pytz')
+np = LazyModule('numpy')
+cProfile = LazyModule('cProfile')
+pstats = LazyModule('pstats')
+bs4 = LazyModule('bs4')
+
+
 # **Добавьте импорт типов из модуля typing**
 from typing import Dict, Optional  # <--- Добавлено
 
@@ -45,6 +72,48 @@ console_handler.setLevel(logging.INFO)  # В терминал выводим INF
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
+class Clock:
+    """Источник текущего времени и ожидания для планировщика, лимитеров и повторных попыток."""
+    def time(self):
+        return time.time()
+
+    def now(self, timezone):
+        return datetime.now(timezone)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """
+    Часы симуляции: ожидание не блокирует, а сразу сдвигает время вперед, поэтому сутки слотов
+    проходят за секунды. Реальное время работы (запросы, разбор) тоже идет в счет и умножается
+    на work_scale. start - время начала симуляции (timestamp).
+    """
+    def __init__(self, start, work_scale=1.0):
+        self.lock = Lock()
+        self.start = start
+        self.work_scale = work_scale
+        self.slept = 0.0
+        self.real_started = time.perf_counter()
+
+    def time(self):
+        with self.lock:
+            return self.start + self.slept + (time.perf_counter() - self.real_started) * self.work_scale
+
+    def now(self, timezone):
+        return datetime.fromtimestamp(self.time(), timezone)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.slept += seconds
+
+
+# Часы скрипта; для симуляции заменяются на SimulatedClock
+clock = Clock()
+
 class APIRateLimiter:
     """Класс для ограничения количества запросов к API."""
     def __init__(self, max_requests, period):
@@ -56,21 +125,608 @@ class APIRateLimiter:
     def wait(self):
         """Ожидание перед следующим запросом, если достигнут лимит."""
         with self.lock:
-            now = time.time()
+            now = clock.time()
             # Удаляем устаревшие запросы
             self.requests = [r for r in self.requests if r > now - self.period]
             while len(self.requests) >= self.max_requests:
                 next_request_time = self.requests[0] + self.period
                 sleep_time = max(next_request_time - now, 0)
                 logging.debug(f"Достигнут лимит запросов. Спим {sleep_time:.2f} секунд.")
-                time.sleep(sleep_time)
-                now = time.time()
+                clock.sleep(sleep_time)
+                now = clock.time()
                 self.requests = [r for r in self.requests if r > now - self.period]
             self.requests.append(now)
 
 # Настройка лимитера на 1 запрос в секунду
 api_limiter = APIRateLimiter(max_requests=1, period=1)  # 1 запрос в секунду
 
+# Префикс имен метрик Prometheus и файл JSON-сводок циклов по умолчанию
+METRICS_PREFIX = 'check_product_monitor'
+DEFAULT_METRICS_SUMMARY_FILE = 'cycle_metrics.jsonl'
+# Ротация файла сводок - как у scraper.log
+METRICS_SUMMARY_MAX_BYTES = 5 * 1024 * 1024
+METRICS_SUMMARY_BACKUP_COUNT = 5
+
+
+class StageMetrics:
+    """
+    Таймеры и счетчики этапов цикла: сбор, запросы к провайдеру, разбор, запись в таблицу,
+    форматирование, XLSX и Telegram. Накопительные значения отдаются в формате Prometheus,
+    значения текущего цикла записываются в JSON-сводку (одна строка на цикл).
+    """
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self.lock = Lock()
+        self.stages = {}  # этап -> {'calls', 'errors', 'seconds', 'max_seconds', 'last_seconds'}
+        self.counters = {}
+        self.cycle_stages = {}
+        self.cycle_counters = {}
+        self.active_stages = {}  # id потока -> стек текущих этапов (для профилировщика)
+        self.cycle_started = None
+        self.cycle_slot = None
+        self.cycles = 0
+        self.last_cycle_seconds = 0.0
+
+    @contextmanager
+    def timer(self, stage):
+        """Контекстный менеджер: замеряет время блока как один вызов этапа stage."""
+        started = time.perf_counter()
+        failed = False
+        thread_stages = self.active_stages.setdefault(get_ident(), [])
+        thread_stages.append(stage)
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            thread_stages.pop()
+            self.observe(stage, time.perf_counter() - started, failed)
+
+    def timed(self, stage):
+        """Декоратор: замеряет каждый вызов функции как этап stage."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, stage, seconds, failed=False):
+        """Добавляет замер этапа в накопительные значения и в значения текущего цикла."""
+        with self.lock:
+            for stages in (self.stages, self.cycle_stages):
+                entry = stages.setdefault(stage, {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'last_seconds': 0.0})
+                entry['calls'] += 1
+                entry['errors'] += 1 if failed else 0
+                entry['seconds'] += seconds
+                entry['max_seconds'] = max(entry['max_seconds'], seconds)
+                entry['last_seconds'] = seconds
+
+    def inc(self, name, amount=1):
+        """Увеличивает счетчик name."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            self.cycle_counters[name] = self.cycle_counters.get(name, 0) + amount
+
+    def begin_cycle(self, slot=None):
+        """Начинает новый цикл: обнуляет значения цикла."""
+        with self.lock:
+            self.cycle_stages = {}
+            self.cycle_counters = {}
+            self.cycle_started = time.time()
+            self.cycle_slot = slot
+
+    def close_cycle(self):
+        """
+        Закрывает цикл: фиксирует время окончания и возвращает значения цикла для end_cycle.
+        begin_cycle заводит новые словари, поэтому фоновые этапы (таблица, XLSX, Telegram),
+        завершившиеся до начала следующего цикла, попадают в закрытый цикл.
+        """
+        finished = time.time()
+        with self.lock:
+            started = self.cycle_started or finished
+            self.cycles += 1
+            self.last_cycle_seconds = finished - started
+            return {
+                'started': started, 'finished': finished, 'slot': self.cycle_slot,
+                'stages': self.cycle_stages, 'counters': self.cycle_counters,
+            }
+
+    def end_cycle(self, summary_file=None, extra=None, cycle=None):
+        """
+        Завершает цикл (или закрытый ранее cycle из close_cycle) и дописывает его сводку
+        в summary_file (JSON, одна строка на цикл). Файл ротируется так же, как scraper.log.
+        """
+        cycle = cycle or self.close_cycle()
+        started, finished = cycle['started'], cycle['finished']
+        with self.lock:
+            summary = {
+                'cycle_started': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+                'cycle_finished': datetime.fromtimestamp(finished).isoformat(timespec='seconds'),
+                'duration_seconds': round(finished - started, 3),
+                'slot': cycle['slot'],
+                'stages': {
+                    stage: {key: round(value, 3) if isinstance(value, float) else value for key, value in entry.items()}
+                    for stage, entry in cycle['stages'].items()
+                },
+                'counters': dict(cycle['counters']),
+            }
+        if extra:
+            summary.update(extra)
+
+        stages_line = ", ".join(
+            f"{stage} {entry['seconds']:.1f} с/{entry['calls']}"
+            for stage, entry in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds'])
+        )
+        logging.info(f"Цикл завершен за {summary['duration_seconds']:.1f} с. Этапы: {stages_line or 'нет замеров'}")
+
+        if summary_file:
+            summary_logger = self._summary_logger(summary_file)
+            if summary_logger:
+                summary_logger.info(json.dumps(summary, ensure_ascii=False, default=str))
+        return summary
+
+    def _summary_logger(self, summary_file):
+        """Логгер JSON-сводок с ротацией файла summary_file. None, если файл не открывается."""
+        summary_logger = logging.getLogger(f'{self.prefix}.cycle_summary')
+        summary_logger.propagate = False
+        summary_logger.setLevel(logging.INFO)
+        handler = summary_logger.handlers[0] if summary_logger.handlers else None
+        if handler is not None and handler.baseFilename == os.path.abspath(summary_file):
+            return summary_logger
+        try:
+            new_handler = RotatingFileHandler(summary_file, maxBytes=METRICS_SUMMARY_MAX_BYTES,
+                                              backupCount=METRICS_SUMMARY_BACKUP_COUNT, encoding='utf-8')
+        except OSError as e:
+            logging.error(f"Не удалось записать сводку цикла в '{summary_file}': {str(e)}")
+            return None
+        new_handler.setFormatter(logging.Formatter('%(message)s'))
+        if handler is not None:
+            summary_logger.removeHandler(handler)
+            handler.close()
+        summary_logger.addHandler(new_handler)
+        return summary_logger
+
+    def render_prometheus(self):
+        """Возвращает накопительные метрики в текстовом формате Prometheus."""
+        with self.lock:
+            stages = {stage: dict(entry) for stage, entry in self.stages.items()}
+            counters = dict(self.counters)
+            cycles = self.cycles
+            last_cycle_seconds = self.last_cycle_seconds
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {self.prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{self.prefix}_{name}{labels} {value}")
+
+        def stage_labels(stage):
+            return '{stage="%s"}' % stage
+
+        metric('stage_seconds_total', 'counter', 'Суммарное время этапа в секундах.',
+               [(stage_labels(stage), f"{entry['seconds']:.6f}") for stage, entry in sorted(stages.items())])
+        metric('stage_calls_total', 'counter', 'Число вызовов этапа.',
+               [(stage_labels(stage), entry['calls']) for stage, entry in sorted(stages.items())])
+        metric('stage_errors_total', 'counter', 'Число вызовов этапа, завершившихся исключением.',
+               [(stage_labels(stage), entry['errors']) for stage, entry in sorted(stages.items())])
+        metric('stage_last_seconds', 'gauge', 'Длительность последнего вызова этапа в секундах.',
+               [(stage_labels(stage), f"{entry['last_seconds']:.6f}") for stage, entry in sorted(stages.items())])
+        metric('events_total', 'counter', 'Счетчики событий цикла.',
+               [('{name="%s"}' % name, value) for name, value in sorted(counters.items())])
+        metric('cycles_total', 'counter', 'Число завершенных циклов.', [('', cycles)])
+        metric('last_cycle_seconds', 'gauge', 'Длительность последнего цикла в секундах.', [('', f"{last_cycle_seconds:.3f}")])
+        return "\n".join(lines) + "\n"
+
+
+# Общие метрики этапов для всех циклов
+stage_metrics = StageMetrics()
+
+
+# Диапазон и точность гистограмм задержек запросов к провайдеру
+LATENCY_LOWEST_SECONDS = 0.001
+LATENCY_HIGHEST_SECONDS = 300.0
+LATENCY_SUB_BUCKETS = 32  # Корзин на каждую степень двойки: погрешность квантилей не больше 1/32
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек в духе HdrHistogram: диапазон от LATENCY_LOWEST_SECONDS до LATENCY_HIGHEST_SECONDS
+    разбит на степени двойки, каждая степень - на LATENCY_SUB_BUCKETS равных корзин.
+    Память фиксирована (около 600 счетчиков), значения выше диапазона попадают в последнюю корзину.
+    """
+    magnitudes = math.ceil(math.log2(LATENCY_HIGHEST_SECONDS / LATENCY_LOWEST_SECONDS))
+
+    def __init__(self):
+        self.counts = [0] * (1 + self.magnitudes * LATENCY_SUB_BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket_index(cls, seconds):
+        ratio = seconds / LATENCY_LOWEST_SECONDS
+        if ratio < 1:
+            return 0
+        magnitude = min(int(math.log2(ratio)), cls.magnitudes - 1)
+        sub_bucket = min(int((ratio / 2 ** magnitude - 1) * LATENCY_SUB_BUCKETS), LATENCY_SUB_BUCKETS - 1)
+        return 1 + magnitude * LATENCY_SUB_BUCKETS + sub_bucket
+
+    @staticmethod
+    def bucket_upper_bound(index):
+        if index == 0:
+            return LATENCY_LOWEST_SECONDS
+        magnitude, sub_bucket = divmod(index - 1, LATENCY_SUB_BUCKETS)
+        return LATENCY_LOWEST_SECONDS * 2 ** magnitude * (1 + (sub_bucket + 1) / LATENCY_SUB_BUCKETS)
+
+    def record(self, seconds):
+        self.counts[self.bucket_index(seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Верхняя граница корзины, в которую попадает квантиль q, или None для пустой гистограммы."""
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(q * self.total))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_upper_bound(index), self.max)
+        return self.max
+
+
+class ProviderLatency:
+    """
+    Задержки и исходы запросов к провайдеру по маркетплейсам. Гистограмма ведется на каждую тройку
+    (провайдер, маркетплейс, исход). Исходы: 2xx, 204, 4xx, 429, 5xx, timeout, error (ошибка соединения)
+    и parse_fail - ответ 200, из которого не удалось получить данные товара (он учтен и в 2xx).
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = {}
+        self.outcomes = {}
+
+    @staticmethod
+    def classify_status(status_code):
+        if status_code == 204:
+            return '204'
+        if status_code == 429:
+            return '429'
+        if 200 <= status_code < 300:
+            return '2xx'
+        if 400 <= status_code < 500:
+            return '4xx'
+        if status_code >= 500:
+            return '5xx'
+        return 'other'
+
+    def observe(self, provider, marketplace, outcome, seconds=None):
+        """Учитывает исход запроса; seconds добавляется в гистограмму, если задано."""
+        key = (provider, marketplace, outcome)
+        with self.lock:
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+            if seconds is not None:
+                self.histograms.setdefault(key, LatencyHistogram()).record(seconds)
+
+    def request(self, provider, marketplace, method, *args, **kwargs):
+        """Выполняет method(*args, **kwargs) (requests.get/post) и записывает задержку и исход запроса."""
+        started = time.perf_counter()
+        with stage_metrics.timer('provider_request'):
+            try:
+                response = method(*args, **kwargs)
+            except requests.exceptions.Timeout:
+                self.observe(provider, marketplace, 'timeout', time.perf_counter() - started)
+                raise
+            except requests.exceptions.RequestException:
+                self.observe(provider, marketplace, 'error', time.perf_counter() - started)
+                raise
+        self.observe(provider, marketplace, self.classify_status(response.status_code), time.perf_counter() - started)
+        return response
+
+    def record_parse_failure(self, provider, marketplace):
+        self.observe(provider, marketplace, 'parse_fail')
+
+    def percentiles(self, provider=None, marketplace=None, outcome=None):
+        """Квантили p50/p95/p99 по всем гистограммам, подходящим под фильтр (None - любое значение)."""
+        merged = LatencyHistogram()
+        with self.lock:
+            for (hist_provider, hist_marketplace, hist_outcome), histogram in self.histograms.items():
+                if provider not in (None, hist_provider) or marketplace not in (None, hist_marketplace) \
+                        or outcome not in (None, hist_outcome):
+                    continue
+                merged.merge(histogram)
+        result = {f"p{round(q * 100)}": merged.quantile(q) for q in LATENCY_QUANTILES}
+        result.update({'count': merged.total, 'max': merged.max if merged.total else None})
+        return result
+
+    def snapshot(self):
+        """Возвращает {'провайдер/маркетплейс': {квантили, 'outcomes': {исход: число}}} с начала работы."""
+        with self.lock:
+            outcomes = dict(self.outcomes)
+        result = {}
+        for provider, marketplace in sorted({key[:2] for key in outcomes}):
+            stats = self.percentiles(provider, marketplace)
+            stats = {key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()}
+            stats['outcomes'] = {
+                outcome: count for (p, m, outcome), count in sorted(outcomes.items()) if (p, m) == (provider, marketplace)
+            }
+            result[f"{provider}/{marketplace}"] = stats
+        return result
+
+    def log_summary(self):
+        for name, stats in self.snapshot().items():
+            outcomes_line = ", ".join(f"{outcome} {count}" for outcome, count in stats['outcomes'].items())
+            if stats['count']:
+                logging.info(
+                    f"Задержки {name}: p50 {stats['p50']:.2f} с, p95 {stats['p95']:.2f} с, "
+                    f"p99 {stats['p99']:.2f} с; исходы: {outcomes_line}"
+                )
+            else:
+                logging.info(f"Исходы запросов {name}: {outcomes_line}")
+
+    def render_prometheus(self, prefix):
+        """Возвращает квантили задержек (summary) и счетчики исходов в текстовом формате Prometheus."""
+        with self.lock:
+            histograms = list(self.histograms.items())
+            outcomes = sorted(self.outcomes.items())
+
+        def labels(provider, marketplace, outcome, extra=''):
+            return '{provider="%s",marketplace="%s",outcome="%s"%s}' % (provider, marketplace, outcome, extra)
+
+        lines = [
+            f"# HELP {prefix}_provider_request_seconds Задержка запросов к провайдеру в секундах.",
+            f"# TYPE {prefix}_provider_request_seconds summary",
+        ]
+        for key, histogram in sorted(histograms):
+            for q in LATENCY_QUANTILES:
+                quantile_labels = labels(*key, extra=',quantile="%s"' % q)
+                lines.append(f"{prefix}_provider_request_seconds{quantile_labels} {histogram.quantile(q):.6f}")
+            lines.append(f"{prefix}_provider_request_seconds_sum{labels(*key)} {histogram.sum:.6f}")
+            lines.append(f"{prefix}_provider_request_seconds_count{labels(*key)} {histogram.total}")
+        lines.append(f"# HELP {prefix}_provider_responses_total Исходы запросов к провайдеру.")
+        lines.append(f"# TYPE {prefix}_provider_responses_total counter")
+        for key, count in outcomes:
+            lines.append(f"{prefix}_provider_responses_total{labels(*key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Общие гистограммы задержек запросов к провайдеру
+provider_latency = ProviderLatency()
+
+
+# Профилирование по запросу: сигнал SIGUSR1 или файл-флаг
+DEFAULT_PROFILE_DIR = 'profiles'
+DEFAULT_PROFILE_TRIGGER_FILE = 'profile.request'
+PROFILE_SAMPLE_INTERVAL = 0.005  # Период выборки стеков, секунд
+PROFILE_TRIGGER_POLL = 5  # Как часто проверять файл-флаг, секунд
+PROFILE_TOP_FUNCTIONS = 60  # Сколько функций выводить в текстовый отчет cProfile
+
+
+class CycleProfiler:
+    """
+    Профилирование работающего процесса без перезапуска. Запрос - сигнал SIGUSR1 (Unix)
+    или файл profile_trigger_file в рабочей папке (удаляется после срабатывания).
+
+    По умолчанию профилируются следующие profile_cycles циклов: cProfile в основном потоке
+    и выборка стеков всех потоков, включая фоновую запись. Если задан profile_seconds,
+    выборка стеков запускается сразу на это число секунд, без cProfile.
+    Результаты пишутся в profile_dir: cprofile.prof и cprofile.txt, а также collapsed-стеки
+    (формат flamegraph.pl / speedscope) по этапам stage_metrics.
+    Без запроса профилировщик только раз в PROFILE_TRIGGER_POLL секунд проверяет файл-флаг.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.cycles = 1
+        self.seconds = 0
+        self.output_dir = DEFAULT_PROFILE_DIR
+        self.trigger_file = DEFAULT_PROFILE_TRIGGER_FILE
+        self.requested = False
+        self.cycles_left = 0
+        self.profile = None
+        self.samples = {}
+        self.sampler = None
+        self.stop_sampling = Event()
+
+    def install(self, config):
+        """Читает настройки из конфига и подключает сигнал и проверку файла-флага."""
+        self.cycles = config.get('profile_cycles') or 1
+        self.seconds = config.get('profile_seconds') or 0
+        self.output_dir = config.get('profile_dir', '').strip() or DEFAULT_PROFILE_DIR
+        self.trigger_file = config.get('profile_trigger_file', DEFAULT_PROFILE_TRIGGER_FILE).strip()
+        if hasattr(signal, 'SIGUSR1'):
+            # Обработчик только ставит флаг; профилирование запускается вне обработчика сигнала
+            signal.signal(signal.SIGUSR1, lambda signum, frame: setattr(self, 'requested', True))
+        Thread(target=self._watch_requests, name='profile-trigger', daemon=True).start()
+        logging.info(
+            f"Профилирование по запросу: SIGUSR1 или файл '{self.trigger_file}', "
+            f"{f'{self.seconds} с' if self.seconds else f'циклов: {self.cycles}'}, результаты в '{self.output_dir}'"
+        )
+
+    def _watch_requests(self):
+        while True:
+            time.sleep(PROFILE_TRIGGER_POLL)
+            if self.trigger_file and os.path.exists(self.trigger_file):
+                try:
+                    os.remove(self.trigger_file)
+                except OSError as e:
+                    logging.error(f"Не удалось удалить файл-флаг профилирования '{self.trigger_file}': {str(e)}")
+                    continue
+                self.requested = True
+            if self.requested and self.seconds:
+                self.requested = False
+                if self._start_sampling(time.time() + self.seconds):
+                    logging.info(f"Запущена выборка стеков на {self.seconds} с.")
+
+    def on_cycle_start(self):
+        """Начинает профилирование циклов, если оно запрошено."""
+        if not self.requested or self.seconds or self.profile is not None:
+            return
+        self.requested = False
+        if not self._start_sampling(None):
+            return
+        self.cycles_left = self.cycles
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        logging.info(f"Запущено профилирование следующих циклов: {self.cycles}.")
+
+    def on_cycle_end(self):
+        """Завершает профилирование после заданного числа циклов и сохраняет результаты."""
+        if self.profile is None:
+            return
+        self.cycles_left -= 1
+        if self.cycles_left > 0:
+            return
+        self.profile.disable()
+        self.stop_sampling.set()
+        self.sampler.join()
+        profile, self.profile = self.profile, None
+        self._dump(profile)
+
+    def _start_sampling(self, deadline):
+        with self.lock:
+            if self.sampler is not None and self.sampler.is_alive():
+                return False
+            self.samples = {}
+            self.stop_sampling.clear()
+            self.sampler = Thread(target=self._sample, args=(deadline,), name='profile-sampler', daemon=True)
+            self.sampler.start()
+            return True
+
+    def _sample(self, deadline):
+        """Собирает стеки всех потоков с привязкой к текущему этапу потока."""
+        own_thread = get_ident()
+        while not self.stop_sampling.wait(PROFILE_SAMPLE_INTERVAL):
+            if deadline and time.time() >= deadline:
+                break
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stages = stage_metrics.active_stages.get(thread_id)
+                stage = stages[-1] if stages else 'other'
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = (stage, ';'.join(reversed(frames)))
+                self.samples[key] = self.samples.get(key, 0) + 1
+        if deadline:
+            self._dump(None)
+
+    def _dump(self, profile):
+        path = os.path.join(self.output_dir, datetime.now().strftime('%Y%m%d-%H%M%S'))
+        try:
+            os.makedirs(path, exist_ok=True)
+            if profile is not None:
+                profile.dump_stats(os.path.join(path, 'cprofile.prof'))
+                with open(os.path.join(path, 'cprofile.txt'), 'w', encoding='utf-8') as f:
+                    pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+            by_stage = {}
+            for (stage, stack), count in sorted(self.samples.items()):
+                by_stage.setdefault(stage, []).append(f"{stack} {count}")
+            for stage, lines in by_stage.items():
+                with open(os.path.join(path, f'stacks-{stage}.folded'), 'w', encoding='utf-8') as f:
+                    f.write("\n".join(lines) + "\n")
+            # Общий файл: этап - корневой кадр каждого стека
+            with open(os.path.join(path, 'stacks.folded'), 'w', encoding='utf-8') as f:
+                for (stage, stack), count in sorted(self.samples.items()):
+                    f.write(f"{stage};{stack} {count}\n")
+        except OSError as e:
+            logging.error(f"Не удалось сохранить результаты профилирования в '{path}': {str(e)}")
+            return
+        logging.info(f"Результаты профилирования сохранены в '{path}' (выборок стеков: {sum(self.samples.values())}).")
+
+
+# Профилировщик процесса
+cycle_profiler = CycleProfiler()
+
+
+class MetricsRequestHandler:
+    """
+    Отдает метрики stage_metrics по адресу /metrics.
+    BaseHTTPRequestHandler подмешивается в start_metrics_server, чтобы не импортировать http.server при загрузке скрипта.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = (stage_metrics.render_prometheus() + provider_latency.render_prometheus(METRICS_PREFIX)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Запрос метрик: {format % args}")
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Запускает HTTP-сервер метрик в фоновом потоке. Возвращает сервер или None при ошибке."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handler = type('MetricsRequestHandler', (MetricsRequestHandler, BaseHTTPRequestHandler), {})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logging.error(f"Не удалось запустить сервер метрик на {host}:{port}: {str(e)}")
+        return None
+    Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Метрики Prometheus доступны по адресу http://{host}:{port}/metrics")
+    return server
+
+
+def finish_metrics_cycle(config):
+    """
+    Закрывает цикл метрик. Сводку пишет фоновая очередь 'metrics' после того, как опустеют
+    остальные очереди записи и очередь Telegram, поэтому основной цикл не ждет отправок.
+    """
+    summary_file = config.get('metrics_summary_file', DEFAULT_METRICS_SUMMARY_FILE)
+    cycle = stage_metrics.close_cycle()
+    cycle_profiler.on_cycle_end()
+    sink_executor.submit('metrics', write_metrics_summary, cycle, summary_file)
+
+
+def wait_for_sinks():
+    """
+    Ждет фоновую запись и отправку в Telegram без ограничения по времени: run --once
+    завершается только после них. Возвращает число неудачных задач записи и отправок с начала работы.
+    """
+    sink_executor.flush()
+    telegram_sink.flush()
+    sink_executor.log_metrics()
+    failures = sum(metrics['failed'] for metrics in sink_executor.get_metrics().values()) + telegram_sink.failed
+    if failures:
+        logging.error(f"Фоновая запись завершилась с ошибками: {failures}.")
+    return failures
+
+
+def write_metrics_summary(cycle, summary_file):
+    """Ждет фоновую запись цикла, чтобы в сводку попали таблица, XLSX и Telegram, и пишет сводку."""
+    sink_executor.flush(exclude=('metrics',))
+    telegram_sink.flush()
+    provider_latency.log_summary()
+    return stage_metrics.end_cycle(summary_file, {'sinks': sink_executor.get_metrics(), 'provider_latency': provider_latency.snapshot()}, cycle)
+
+
 def clean_urls(raw_value):
     """
     Очищает строку URL-адресов, корректно обрабатывает любые разделители,
@@ -90,6 +746,8 @@ def authorize_google_sheets(credentials_file):
     :param credentials_file: Путь к файлу учетных данных JSON
     :return: gspread.Client объект
     """
+    from google.oauth2.service_account import Credentials
+
     scopes = [
         'https://www.googleapis.com/auth/spreadsheets',
         'https://www.googleapis.com/auth/drive'
@@ -136,7 +794,10 @@ def load_config_from_sheets(client, spreadsheet_id, config_sheet_name=None):
         if key in url_keys:
             config[key] = clean_urls(value)
             logging.debug(f"Загружены URL для '{key}': {config[key]}")
-        elif key in ['update_time_hour', 'update_time_minute', 'batch_size']:
+        elif key in ['update_time_hour', 'update_time_minute', 'batch_size', 'prefetch_lead_minutes',
+                     'negative_cache_threshold', 'negative_cache_ttl_minutes', 'negative_cache_max_ttl_hours',
+                     'scraperapi_poll_interval', 'scraperapi_batch_timeout', 'scraperapi_block_retries', 'metrics_port',
+                     'profile_cycles', 'profile_seconds', 'raw_archive_max_mb']:
             try:
                 config[key] = int(value)
                 logging.debug(f"Загружено целое число для '{key}': {config[key]}")
@@ -157,6 +818,13 @@ def load_config_from_sheets(client, spreadsheet_id, config_sheet_name=None):
                 logging.debug(f"Загружены временные слоты для '{key}': {config[key]}")
             else:
                 config[key] = []
+        elif key == 'refresh_tiers':
+            config[key] = parse_refresh_tiers(value)
+            logging.debug(f"Загружены уровни обновления полей: {config[key]}")
+        elif key == 'alert_rules':
+            # Правила разделяются переносами строк или точкой с запятой
+            config[key] = [rule.strip() for rule in re.split(r'[\n\r;]+', value) if rule.strip()]
+            logging.debug(f"Загружены правила оповещений: {config[key]}")
         elif key == 'ScraperAPI':  # Изменено: добавляем ключ ScraperAPI
             config[key] = value
             logging.debug(f"Загружено значение для '{key}': {config[key]}")
@@ -184,29 +852,29 @@ def load_config_from_sheets(client, spreadsheet_id, config_sheet_name=None):
     logging.debug(f"Установлено имя компании: {company_name}")
 
     logging.info(f"Загруженная конфигурация из '{config_sheet_name}': {json.dumps(config, indent=2, ensure_ascii=False)}")
+
+    # Правила оповещений компилируются один раз при загрузке конфига
+    if config.get('alert_rules'):
+        config['compiled_alert_rules'] = compile_alert_rules(tuple(config['alert_rules']))
     return config
 
+# Шаблоны ASIN компилируются один раз; порядок альтернатив соответствует приоритету форматов URL
+ASIN_PATH_PATTERN = re.compile(r'/(?:dp|gp/product|product|ASIN|gp/aw/d|gp/offer-listing)/([A-Z0-9]{10})')
+ASIN_ANY_PATTERN = re.compile(r'([A-Z0-9]{10})')
+
+
+@lru_cache(maxsize=4096)
 def extract_asin(url):
-    """Извлекает ASIN из различных форматов URL Amazon."""
+    """Извлекает ASIN из различных форматов URL Amazon (результат кэшируется по URL)."""
     # Парсим URL
     parsed_url = urlparse(url)
-    path = parsed_url.path
 
     # Регулярное выражение для извлечения ASIN из пути URL
-    patterns = [
-        r'/dp/([A-Z0-9]{10})',
-        r'/gp/product/([A-Z0-9]{10})',
-        r'/product/([A-Z0-9]{10})',
-        r'/ASIN/([A-Z0-9]{10})',
-        r'/gp/aw/d/([A-Z0-9]{10})',
-        r'/gp/offer-listing/([A-Z0-9]{10})',
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, path)
-        if match:
-            asin = match.group(1)
-            logging.debug(f"Extracted ASIN {asin} from URL path: {url}")
-            return asin
+    match = ASIN_PATH_PATTERN.search(parsed_url.path)
+    if match:
+        asin = match.group(1)
+        logging.debug(f"Extracted ASIN {asin} from URL path: {url}")
+        return asin
     # Если не удалось найти ASIN в пути, попробуем извлечь из параметров запроса
     query_params = parse_qs(parsed_url.query)
     if 'asin' in query_params:
@@ -214,7 +882,7 @@ def extract_asin(url):
         logging.debug(f"Extracted ASIN {asin} from query parameters in URL: {url}")
         return asin
     # Если всё ещё не удалось найти ASIN, попробуем найти его в URL целиком
-    match = re.search(r'([A-Z0-9]{10})', url)
+    match = ASIN_ANY_PATTERN.search(url)
     if match:
         asin = match.group(1)
         logging.debug(f"Extracted ASIN {asin} from entire URL: {url}")
@@ -399,6 +1067,7 @@ CURRENCY_SYMBOLS = {
     # Добавьте другие валюты по необходимости
 }
 
+@lru_cache(maxsize=1024)
 def determine_currency(url):
     parsed_url = urlparse(url)
     domain = parsed_url.netloc.lower()
@@ -478,7 +1147,7 @@ def extract_rating(soup):
 def get_kyiv_time(timezone_str='Europe/Kiev'):
     """Возвращает текущее время в часовом поясе Киева."""
     timezone = pytz.timezone(timezone_str)
-    return datetime.now(timezone)
+    return clock.now(timezone)
 
 def get_next_slot(current_time, slots, timezone_str='Europe/Kiev'):
     """
@@ -501,267 +1170,1097 @@ def get_next_slot(current_time, slots, timezone_str='Europe/Kiev'):
     next_day = current_time + timedelta(days=1)
     return timezone.localize(datetime.combine(next_day.date(), first_slot))
 
-def send_telegram_message(bot, chat_id, message):
-    """Отправляет сообщение в Telegram."""
-    try:
-        bot.send_message(chat_id, message)
-        logging.info(f"Отправлено уведомление в Telegram")
-    except Exception as e:
-        logging.error(f"Не удалось отправить уведомление в Telegram: {str(e)}")
-
-def check_product_notifications(product_info, min_rating, price_threshold, coupon_threshold):
-    """Проверяет условия для отправки уведомлений."""
-    notifications = []
 
-    # Проверка рейтинга
-    rating = product_info.get("Rating", "Not Found")
-    if rating != "Not Found":
-        try:
-            rating_value = float(rating)
-            if rating_value < min_rating:
-                notifications.append(f"⚠️ Низкий рейтинг: {rating} звезд для ASIN {product_info['ASIN']}")
-        except ValueError:
-            notifications.append(f"⚠️ Некорректный рейтинг для ASIN {product_info['ASIN']}")
-
-    # Проверка изменения цены
-    full_price = product_info.get("Price", "Not Found")
-    prime_price = product_info.get("Prime Price", "Not Found")
-    if full_price != "Not Found" and prime_price != "Not Found":
-        try:
-            full_price_value = float(re.sub(r'[^\d.]', '', str(full_price))) if isinstance(full_price, (str, float)) else None
-            prime_price_value = float(re.sub(r'[^\d.]', '', str(prime_price))) if isinstance(prime_price, (str, float)) else None
-            if full_price_value and prime_price_value:
-                price_diff_percent = abs(full_price_value - prime_price_value) / full_price_value * 100
-                if price_diff_percent >= price_threshold:
-                    notifications.append(f"💰 Значительное изменение цены для ASIN {product_info['ASIN']}: Full ${full_price_value:.2f}, Prime ${prime_price_value:.2f}")
-        except ValueError:
-            notifications.append(f"⚠️ Некорректная цена для ASIN {product_info['ASIN']}")
-
-    # Проверка купона
-    coupon_discount = product_info.get("Coupon Discount", "Not Found")
-    if coupon_discount != "Not Found":
+class SlotScheduler:
+    """
+    Планировщик запусков по временным слотам с учетом дедлайнов.
+    Слот - это дедлайн, к которому данные должны быть собраны, поэтому запуск начинается
+    заранее (lead). Если цикл затянулся и пропустил слоты, они явно пропускаются ('skip')
+    или объединяются в один догоняющий запуск для последнего пропущенного слота ('merge').
+    Для каждого запуска записывается опоздание относительно слота.
+    """
+    def __init__(self, slots, timezone_str='Europe/Kiev', lead_seconds=None, overrun_policy='skip', history_size=200):
+        self.slots = sorted(set(slots))
+        self.timezone = pytz.timezone(timezone_str)
+        self.lead_seconds = lead_seconds
+        self.overrun_policy = overrun_policy if overrun_policy in ('skip', 'merge') else 'skip'
+        self.history = deque(maxlen=history_size)
+        self.average_duration = None
+        self.last_slot = None
+        # Упреждение не может превышать минимальный интервал между слотами
+        minutes = sorted(int(slot.split(':')[0]) * 60 + int(slot.split(':')[1]) for slot in self.slots)
+        gaps = [b - a for a, b in zip(minutes, minutes[1:])] + [minutes[0] + 24 * 60 - minutes[-1]] if minutes else [24 * 60]
+        self.max_lead_seconds = min(gaps) * 60
+
+    def _slots_between(self, start, end):
+        """Возвращает datetime слотов в интервале (start, end]."""
+        result = []
+        day = start.date()
+        while day <= end.date():
+            for slot in self.slots:
+                slot_time = datetime.strptime(slot, "%H:%M").time()
+                slot_datetime = self.timezone.localize(datetime.combine(day, slot_time))
+                if start < slot_datetime <= end:
+                    result.append(slot_datetime)
+            day += timedelta(days=1)
+        return result
+
+    def get_lead_seconds(self):
+        """Время упреждения: из конфига или по средней длительности прошлых циклов с запасом 20%,
+        но не больше минимального интервала между слотами."""
+        if self.lead_seconds is not None:
+            return self.lead_seconds
+        if self.average_duration is None:
+            return 0
+        return min(self.average_duration * 1.2, self.max_lead_seconds)
+
+    def plan(self, current_time):
+        """
+        Возвращает (slot_datetime, start_datetime) следующего запуска.
+        start_datetime может быть в прошлом - тогда запуск нужно начинать сразу.
+        """
+        if self.last_slot is None:
+            self.last_slot = current_time
+
+        missed_slots = self._slots_between(self.last_slot, current_time)
+        if missed_slots:
+            if self.overrun_policy == 'merge':
+                target_slot = missed_slots[-1]
+                for slot_datetime in missed_slots[:-1]:
+                    self._record_missed(slot_datetime, 'merged')
+                logging.warning(
+                    f"Предыдущий цикл пропустил слоты {[s.strftime('%H:%M') for s in missed_slots]}. "
+                    f"Догоняющий запуск для слота {target_slot.strftime('%H:%M')}."
+                )
+                return target_slot, current_time
+            for slot_datetime in missed_slots:
+                self._record_missed(slot_datetime, 'skipped')
+            logging.warning(f"Предыдущий цикл пропустил слоты {[s.strftime('%H:%M') for s in missed_slots]}, они пропущены.")
+            self.last_slot = missed_slots[-1]
+
+        # Следующий слот после текущего времени и после уже обработанного слота
+        next_slot = get_next_slot(max(current_time, self.last_slot), self.slots, self.timezone.zone)
+        start_time = next_slot - timedelta(seconds=self.get_lead_seconds())
+        return next_slot, max(start_time, current_time)
+
+    def record(self, slot_datetime, started_at, finished_at):
+        """Записывает результат запуска и обновляет среднюю длительность цикла."""
+        duration = (finished_at - started_at).total_seconds()
+        lateness = (finished_at - slot_datetime).total_seconds()
+        self.average_duration = duration if self.average_duration is None else 0.7 * self.average_duration + 0.3 * duration
+        self.last_slot = max(self.last_slot, slot_datetime) if self.last_slot else slot_datetime
+        entry = {
+            'slot': slot_datetime.strftime('%Y-%m-%d %H:%M'),
+            'status': 'late' if lateness > 0 else 'on_time',
+            'started_at': started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': finished_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_seconds': round(duration, 1),
+            'lateness_seconds': round(lateness, 1),
+        }
+        self.history.append(entry)
+        logging.info(
+            f"Слот {entry['slot']}: длительность {duration / 60:.1f} мин, "
+            f"{'опоздание' if lateness > 0 else 'запас'} {abs(lateness) / 60:.1f} мин."
+        )
+        return entry
+
+    def _record_missed(self, slot_datetime, status):
+        self.history.append({
+            'slot': slot_datetime.strftime('%Y-%m-%d %H:%M'),
+            'status': status,
+            'started_at': None,
+            'finished_at': None,
+            'duration_seconds': None,
+            'lateness_seconds': None,
+        })
+
+
+def run_schedule(scheduler, run_slot, timezone_str='Europe/Kiev', after_slot=None, until=None):
+    """
+    Цикл регулярных запусков: ждет старта очередного слота по планировщику, вызывает run_slot(слот)
+    и записывает результат в scheduler; after_slot() вызывается после записи (сводка метрик).
+    until - время, после которого новые слоты не запускаются (None - бесконечно).
+    Время и ожидание берутся из clock, поэтому с SimulatedClock сутки проходят за секунды.
+    """
+    while True:
         try:
-            coupon_value = float(re.sub(r'[^\d.]', '', str(coupon_discount).replace('%', '')))
-            if coupon_value >= coupon_threshold:
-                notifications.append(f"🏷️ Большой купон для ASIN {product_info['ASIN']}: {coupon_value}%")
-        except ValueError:
-            notifications.append(f"⚠️ Некорректная скидка купона для ASIN {product_info['ASIN']}")
+            current_time = get_kyiv_time(timezone_str)
+            logging.info(f"Текущее время: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
-    return notifications
+            # Определение следующего слота и времени старта сбора с упреждением
+            next_slot_time, start_time = scheduler.plan(current_time)
+            if until is not None and start_time >= until:
+                return
+            logging.info(f"Следующий слот: {next_slot_time.strftime('%Y-%m-%d %H:%M')}, старт сбора: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
-def create_xlsx_report(data, current_time_str):
-    """Создание XLSX отчета с данными о продуктах."""
-    try:
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Product Report"
+            # Вычисление времени до старта сбора
+            time_to_wait = (start_time - current_time).total_seconds()
 
-        # Стили
-        header_font = Font(bold=True)
-        header_fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-        bold_blue_font = Font(bold=True, color="0000FF")  # Жирный и синий цвет для кликабельных ASIN
+            if time_to_wait > 0:
+                logging.info(f"Ждем {time_to_wait / 60:.2f} минут до старта сбора.")
+                clock.sleep(time_to_wait)
 
-        # Заголовок
-        ws['A1'] = f"Product Report - {current_time_str}"
-        ws['A1'].font = Font(bold=True, size=14)
-        ws.merge_cells('A1:N1')  # Расширил диапазон для новых колонок
+            # После пробуждения выполняем задачи для слота и записываем опоздание
+            started_at = get_kyiv_time(timezone_str)
+            run_slot(next_slot_time)
+            scheduler.record(next_slot_time, started_at, get_kyiv_time(timezone_str))
+            if after_slot:
+                after_slot()
 
-        # Заголовки столбцов
-        headers = [
-            "Company", "ASIN", "Title", "Full Price", "Prime Price", 
-            "Avg List Price", "Avg Title Price", "Avg Prime Price",
-            "Rating", "Number of Reviews", "Coupon Discount", 
-            "Final Price", "Discount Percent", "Variations Count"
-        ]
-        for col, header in enumerate(headers, start=1):
-            cell = ws.cell(row=2, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
+        except Exception as e:
+            logging.error(f"Ошибка в основном цикле: {e}")
+            clock.sleep(60)  # Ждем минуту перед повторной попыткой
 
-        # Данные
-        row = 3
-        for company, products in data.items():
-            for product in products:
-                ws.cell(row=row, column=1, value=company)
-                asin_cell = ws.cell(row=row, column=2, value=product.get('ASIN', 'Не найдено'))
-                asin = product.get('ASIN', 'Не найдено')
-                if asin != 'Не найдено':
-                    asin_cell.hyperlink = f"https://www.amazon.com/dp/{asin}"
-                    asin_cell.font = bold_blue_font  # Сделать кликабельным ASIN жирным и синим
-                ws.cell(row=row, column=3, value=product.get('Title', 'Не найдено'))
-                ws.cell(row=row, column=4, value=product.get('Price', 'Не найдено'))
-                ws.cell(row=row, column=5, value=product.get('Prime Price', 'Не найдено'))
-                ws.cell(row=row, column=6, value=product.get('List Price', 'Not Found'))
-                ws.cell(row=row, column=7, value=product.get('Sale Price', 'Not Found'))
-                ws.cell(row=row, column=8, value=product.get('Prime Price', 'Not Found'))
-                ws.cell(row=row, column=9, value=product.get('Rating', 'Не найдено'))
-                ws.cell(row=row, column=10, value=product.get('Number of Reviews', 'Не найдено'))
-                ws.cell(row=row, column=11, value=product.get('Coupon Discount', 'Not Found'))
-                ws.cell(row=row, column=12, value=product.get('Final Price', 'Not Found'))
-                ws.cell(row=row, column=13, value=product.get('Discount Percent', 'Not Found'))
-                ws.cell(row=row, column=14, value=product.get('Variations Count', 'Not Found'))
-                row += 1
-
-        # Автоматическая регулировка ширины столбцов
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column  # Получаем индекс столбца
-            column_letter = get_column_letter(column)
-            for cell in col:
-                if cell.value:
-                    cell_length = len(str(cell.value))
-                    if cell_length > max_length:
-                        max_length = cell_length
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-        # Сохранение файла
-        filename = f"product_report_{current_time_str.replace(':', '_')}.xlsx"
-        wb.save(filename)
-        return filename
-    except Exception as e:
-        logging.error(f"Ошибка при создании XLSX отчета: {str(e)}")
-        return None
 
-def send_telegram_notification(config, current_time_str, data):
-    """Отправка уведомления и отчета в Telegram."""
-    bot = telebot.TeleBot(config.get('telegram_bot_token', ''))
-    chat_id = config.get('telegram_chat_id', '')
-    if not chat_id:
-        logging.error("Telegram chat_id не установлен в конфигурации.")
-        return
+SCRAPERAPI_STRUCTURED_PATH = '/structured/amazon/product'
+SCRAPERAPI_ASYNC_URL = 'https://async.scraperapi.com'
 
-    # Формирование сообщения
-    message = f"Отчет за {current_time_str}\n\n"
-    for company, products in data.items():
-        message += f"{company}:\n"
-        for product in products:
-            message += f" ASIN: {product['ASIN']}\n"
-            message += f" Цена: {product.get('Price', 'Не найдено')}\n"
-            message += f" Рейтинг: {product.get('Rating', 'Не найдено')}\n\n"
+# Результаты пакетного сбора текущего цикла: (маркетплейс, ASIN) -> данные продукта
+batch_results = {}
 
-    # Отправка сообщения
-    send_telegram_message(bot, chat_id, message)
+BSR_NUMBER_PATTERN = re.compile(r'(?:#|Nr\.\s*)([\d.,\s]+)')
 
-    # Создание и отправка XLSX файла
-    xlsx_filename = create_xlsx_report(data, current_time_str)
-    if xlsx_filename:
-        try:
-            with open(xlsx_filename, 'rb') as report_file:
-                bot.send_document(chat_id, report_file)
-            logging.info("Отчет успешно отправлен в Telegram.")
-        except Exception as e:
-            logging.error(f"Не удалось отправить отчет в Telegram: {str(e)}")
-        finally:
-            if os.path.exists(xlsx_filename):
-                os.remove(xlsx_filename)
 
-def apply_formatting(sheet, header, start_row, data_length):
-    """
-    Применяет форматирование к заголовкам и определенным ячейкам.
-    Оптимизировано для уменьшения количества запросов к API.
-    """
-    # Форматирование заголовков
-    header_format = CellFormat(
-        backgroundColor=Color(0.85, 0.93, 0.83),  # Цвет #d9ead3
-        textFormat=TextFormat(bold=True)
-    )
-    header_range = f"A1:{get_column_letter(len(header))}1"
-    format_cell_range(sheet, header_range, header_format)
+def get_scraperapi_mode(config):
+    """Режим сбора ScraperAPI: 'html' (по умолчанию), 'structured' или 'batch'."""
+    mode = config.get('scraperapi_mode', 'html').strip().lower()
+    if mode not in ('html', 'structured', 'batch'):
+        logging.error(f"Неизвестный режим ScraperAPI '{mode}'. Используется 'html'.")
+        return 'html'
+    return mode
 
-    # Получаем все значения в колонке "Наименование" (A) за один запрос
-    end_row = start_row + data_length - 1
-    name_column_range = f"A{start_row}:{get_column_letter(1)}{end_row}"
-    name_values = sheet.get(name_column_range)
 
-    # Подготовка списков для форматирования
-    parent_variations_rows = []
-    params_rows = []
+def get_amazon_tld(url):
+    """Возвращает TLD маркетплейса для структурированного API, например 'de' или 'co.uk'."""
+    netloc = urlparse(url).netloc.lower()
+    return netloc.split('amazon.', 1)[-1] if 'amazon.' in netloc else 'com'
 
-    params_to_highlight = ["BSR", "Number of Reviews", "Rating", "Price", "List Price", "Prime Price"]
 
-    for idx, row in enumerate(name_values, start=start_row):
-        cell_value = row[0]
-        if cell_value in ["Parent ASIN", "Variations ASIN"]:
-            parent_variations_rows.append(idx)
-        if cell_value in params_to_highlight:
-            params_rows.append(idx)
+def extract_structured_bsr(product_information):
+    """Извлекает первое значение BSR из блока product_information структурированного ответа."""
+    if not isinstance(product_information, dict):
+        return 'Not Found'
+    for key, value in product_information.items():
+        if 'rank' not in key.lower() and 'rang' not in key.lower():
+            continue
+        text = ' '.join(value) if isinstance(value, list) else str(value)
+        match = BSR_NUMBER_PATTERN.search(text)
+        if match:
+            digits = re.sub(r'[^\d]', '', match.group(1))
+            if digits:
+                return int(digits)
+    return 'Not Found'
 
-    # Форматирование ячеек "Parent ASIN" и "Variations ASIN"
-    if parent_variations_rows:
-        for row in parent_variations_rows:
-            cell_range = f"A{row}"
-            format_cell_range(sheet, cell_range, CellFormat(
-                backgroundColor=Color(1, 1, 0),  # Цвет #ffff00
-                textFormat=TextFormat(bold=True)
-            ))
 
-    # Форматирование параметров
-    if params_rows:
-        for row in params_rows:
-            cell_range = f"A{row}"
-            format_cell_range(sheet, cell_range, CellFormat(
-                backgroundColor=Color(0.85, 0.93, 0.83),  # Цвет #d9ead3
-                textFormat=TextFormat(bold=True)
-            ))
+@stage_metrics.timed('parse')
+def parse_scraperapi_structured(data, asin, url, currency_code=None):
+    """Преобразует JSON структурированного API ScraperAPI в формат product_info."""
+    currency_code = currency_code or determine_currency(url)
+
+    price = extract_price(data.get('pricing'), currency_code) if data.get('pricing') else 'Не найдено'
+    list_price = extract_price(data.get('list_price'), currency_code) if data.get('list_price') else 'Не найдено'
+    coupon_data = data.get('coupon_text') or data.get('coupon')
+    coupon = extract_coupon(coupon_data) if coupon_data else 'Не найдено'
+
+    final_price = calculate_final_price(price, price, coupon, CURRENCY_SYMBOLS.get(currency_code, '$'))
+    discount_percent = calculate_discount_percent(price, final_price)
+
+    reviews_count = data.get('total_reviews', 'Не найдено')
+    if isinstance(reviews_count, str):
+        reviews_count = re.sub(r'[^\d]', '', reviews_count) or 'Не найдено'
+
+    return {
+        "ASIN": asin,
+        "Title": data.get('name') or 'Не найдено',
+        "Price": price,
+        "Prime Price": price,  # ScraperAPI не предоставляет отдельную Prime Price
+        "List Price": list_price,
+        "Coupon Discount": coupon,
+        "Final Price": final_price,
+        "Discount Percent": discount_percent,
+        "Rating": data.get('average_rating', 'Not Found'),
+        "Number of Reviews": reviews_count,
+        "BSR": extract_structured_bsr(data.get('product_information')),
+        "Brand": data.get('brand') or 'Не найдено',
+        "Scrape Date": get_kyiv_time().strftime("%d.%m.%Y"),
+        "URL": url
+    }
 
-def find_nearest_slot(current_time_slot_formatted, all_slots):
-    """Определяет ближайший временной слот к текущему времени."""
-    try:
-        current_time = datetime.strptime(current_time_slot_formatted, "%H:%M")
-        slot_times = []
-        for slot in all_slots:
-            slot_time = datetime.strptime(slot, "%H:%M")
-            slot_times.append(slot_time)
 
-        # Находим ближайшее время
-        nearest_time = min(slot_times, key=lambda x: abs((x - current_time).total_seconds()))
-        nearest_slot = nearest_time.strftime("%H:%M")
-        return nearest_slot
-    except Exception as e:
-        logging.error(f"Ошибка при определении ближайшего временного слота: {e}")
-        return None
-def extract_best_sellers_rank(soup: BeautifulSoup) -> Optional[str]:
+def accept_product_info(job, product_info):
     """
-    Извлекает Best Sellers Rank (BSR) из объекта BeautifulSoup.
-    Поддерживает немецкий формат.
-
-    :param soup: Объект BeautifulSoup HTML страницы
-    :return: Строка с BSR или 'Not Found'
+    Проверка разобранных данных, общая для HTML, структурированного и пакетного сбора: страница
+    без названия товара учитывается как ошибка разбора и попадает в негативный кэш.
     """
-    try:
-        # Поиск в таблице Product Details
-        product_details = soup.find(id='productDetails_detailBullets_sections1')
-        if product_details:
-            rows = product_details.find_all('tr')
-            for row in rows:
-                th = row.find('th')
-                td = row.find('td')
-                if th and td:
-                    key = th.get_text(strip=True)
-                    value = td.get_text(strip=True)
-                    if 'Amazon Bestseller-Rang' in key:
-                        logging.debug(f"Найден BSR в Product Details: {value}")
-                        return value
+    if product_info['Title'] == 'Не найдено':
+        provider_latency.record_parse_failure('scraperapi', job.marketplace)
+        logging.warning(f"На странице ASIN {job.asin} нет названия товара, данные не записываются.")
+        negative_cache.record_failure(job.url, "нет названия товара")
+        return False
+    return True
 
-        # Альтернативный способ поиска в секции "Детали продукта"
-        detail_bullets = soup.find(id='detailBulletsWrapper_feature_div')
-        if detail_bullets:
-            lis = detail_bullets.find_all('li')
-            for li in lis:
-                text = li.get_text(strip=True)
-                if 'Amazon Bestseller-Rang' in text:
-                    # Извлекаем BSR из текста
-                    bsr_text = text.split(':', 1)[1].strip()
-                    logging.debug(f"Найден BSR в Detail Bullets: {bsr_text}")
-                    return bsr_text
 
-        # Если BSR не найден, возвращаем 'Not Found'
-        logging.warning("BSR не найден на странице.")
-        return 'Not Found'
+def scrape_amazon_product_structured(job, config):
+    """Сбор данных через структурированный API ScraperAPI (JSON вместо HTML)."""
+    url, asin = job.url, job.asin
+    if asin == 'Not Found':
+        logging.error(f"ASIN not found in URL: {url}")
+        return None
 
-    except Exception as e:
-        logging.error(f"Ошибка при извлечении BSR: {e}")
+    scraperapi_api_key = config.get('ScraperAPI', '').strip()
+    if not scraperapi_api_key:
+        logging.error("ScraperAPI API key is missing in the configuration")
+        return None
+
+    params = {
+        "api_key": scraperapi_api_key,
+        "asin": asin,
+        "tld": job.marketplace,
+        "country_code": job.country_code,
+    }
+
+    try:
+        api_limiter.wait()
+        response = provider_latency.request(
+            'scraperapi', params['tld'], requests.get,
+            get_scraperapi_endpoint(config) + SCRAPERAPI_STRUCTURED_PATH, params=params, timeout=60
+        )
+        if response.status_code != 200:
+            logging.error(f"Структурированный запрос ScraperAPI не удался с кодом статуса: {response.status_code}")
+            if response.status_code == 404:
+                negative_cache.record_failure(url, "HTTP 404")
+            return None
+        response_archive.store('scraperapi_structured', params['tld'], asin, response.content)
+        product_info = parse_scraperapi_structured(response.json(), asin, url, job.currency)
+        if not accept_product_info(job, product_info):
+            return None
+        logging.info(f"Извлеченные данные (structured) для ASIN {asin}: {product_info}")
+        return product_info
+    except ValueError as e:
+        provider_latency.record_parse_failure('scraperapi', params['tld'])
+        logging.error(f"Ошибка разбора структурированного ответа ScraperAPI для ASIN {asin}: {str(e)}")
+        return None
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Ошибка при структурированном запросе к ScraperAPI для ASIN {asin}: {str(e)}")
+        return None
+
+
+def submit_scraperapi_batch(jobs, config):
+    """Отправляет задания одного маркетплейса в асинхронный структурированный API. Возвращает {адрес статуса: задание}."""
+    by_asin = {job.asin: job for job in jobs}
+    payload = {
+        "apiKey": config.get('ScraperAPI', '').strip(),
+        "asins": list(by_asin),
+        "tld": jobs[0].marketplace,
+        "country_code": jobs[0].country_code,
+    }
+    async_endpoint = (config.get('scraperapi_async_endpoint', '').strip() or SCRAPERAPI_ASYNC_URL).rstrip('/')
+    try:
+        with stage_metrics.timer('provider_request'):
+            response = requests.post(async_endpoint + SCRAPERAPI_STRUCTURED_PATH, json=payload, timeout=60)
+        if response.status_code not in (200, 201, 202):
+            logging.error(f"Пакет не принят ScraperAPI: {response.status_code} - {response.text[:200]}")
+            return {}
+        jobs_data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error(f"Ошибка при отправке пакета в ScraperAPI: {str(e)}")
+        return {}
+
+    pending = {}
+    for index, created in enumerate(jobs_data if isinstance(jobs_data, list) else [jobs_data]):
+        asin = created.get('asin') or (payload['asins'][index] if index < len(payload['asins']) else None)
+        status_url = created.get('statusUrl') or f"{async_endpoint}/jobs/{created.get('id')}"
+        if created.get('id') and asin in by_asin:
+            pending[status_url] = by_asin[asin]
+    logging.info(f"В ScraperAPI отправлен пакет из {len(jobs)} ASIN ({payload['tld']}), создано заданий: {len(pending)}")
+    return pending
+
+
+def iter_scraperapi_batch_results(jobs, config):
+    """
+    Отправляет задания цикла асинхронными заданиями ScraperAPI (по одному пакету на маркетплейс)
+    и по мере готовности отдает пары (задание, JSON структурированного ответа).
+    """
+    by_marketplace = {}
+    for job in jobs:
+        by_marketplace.setdefault(job.marketplace, []).append(job)
+
+    pending = {}
+    for marketplace_jobs in by_marketplace.values():
+        pending.update(submit_scraperapi_batch(marketplace_jobs, config))
+
+    poll_interval = config.get('scraperapi_poll_interval') or 5
+    deadline = clock.time() + (config.get('scraperapi_batch_timeout') or 600)
+    while pending and clock.time() < deadline:
+        for status_url, job in list(pending.items()):
+            try:
+                with stage_metrics.timer('provider_request'):
+                    job_status = requests.get(status_url, timeout=30).json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logging.warning(f"Ошибка при опросе задания ScraperAPI {status_url}: {str(e)}")
+                continue
+            if job_status.get('status') == 'finished':
+                del pending[status_url]
+                if (job_status.get('response') or {}).get('statusCode') == 404:
+                    logging.error(f"Задание ScraperAPI для {job.url} вернуло 404.")
+                    negative_cache.record_failure(job.url, "HTTP 404")
+                    continue
+                body = (job_status.get('response') or {}).get('body')
+                if body:
+                    response_archive.store('scraperapi_structured', job.marketplace, job.asin,
+                                           body if isinstance(body, str) else json.dumps(body, ensure_ascii=False))
+                try:
+                    yield job, json.loads(body) if isinstance(body, str) else body
+                except ValueError:
+                    logging.error(f"Ошибка декодирования результата задания ScraperAPI для {job.url}")
+            elif job_status.get('status') == 'failed':
+                del pending[status_url]
+                logging.error(f"Задание ScraperAPI для {job.url} завершилось ошибкой.")
+        if pending:
+            clock.sleep(poll_interval)
+
+    if pending:
+        logging.warning(f"Не дождались завершения {len(pending)} заданий ScraperAPI, они будут собраны по одному.")
+
+
+def prefetch_batch(config, jobs):
+    """
+    Пакетный сбор полных данных цикла по заданиям плана; результаты забираются в fetch_product.
+    Задание ScraperAPI определяется маркетплейсом и ASIN, поэтому ссылки на один товар собираются один раз.
+    """
+    unique_jobs = {}
+    for job in jobs:
+        unique_jobs.setdefault((job.marketplace, job.asin), job)
+    pending_jobs = [
+        job for job in unique_jobs.values()
+        if job.asin != 'Not Found' and refresh_planner.plan(job.url) != 'cache' and not negative_cache.is_suppressed(job.url)
+    ]
+    logging.info(f"Пакетный сбор ScraperAPI: {len(pending_jobs)} URL.")
+    if not pending_jobs:
+        return
+    for job, data in iter_scraperapi_batch_results(pending_jobs, config):
+        if not isinstance(data, dict):
+            continue
+        product_info = parse_scraperapi_structured(data, job.asin, job.url, job.currency)
+        if not accept_product_info(job, product_info):
+            continue
+        negative_cache.record_success(job.url)
+        refresh_planner.store_full(job.url, product_info, mode='batch')
+        batch_results[(job.marketplace, job.asin)] = product_info
+
+
+@stage_metrics.timed('telegram_send')
+def send_telegram_message(bot, chat_id, message):
+    """Отправляет сообщение в Telegram, разбивая его на части по лимиту длины."""
+    try:
+        for chunk in split_telegram_message(message):
+            bot.send_message(chat_id, chunk)
+        logging.info(f"Отправлено уведомление в Telegram")
+    except Exception as e:
+        logging.error(f"Не удалось отправить уведомление в Telegram: {str(e)}")
+
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина сообщения Telegram
+
+
+def split_telegram_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Разбивает текст на части не длиннее limit по границам строк.
+    Строки длиннее лимита режутся принудительно, пустые части отбрасываются.
+    """
+    chunks = []
+    current = []
+    current_length = 0
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                chunks.append('\n'.join(current))
+                current, current_length = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+        added_length = len(line) + (1 if current else 0)
+        if current and current_length + added_length > limit:
+            chunks.append('\n'.join(current))
+            current, current_length = [line], len(line)
+        else:
+            current.append(line)
+            current_length += added_length
+    if current:
+        chunks.append('\n'.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class TelegramSink:
+    """
+    Фоновая отправка в Telegram: переиспользуемые боты, очередь отправки,
+    глобальный лимит и лимит на чат, повторы с учетом retry_after.
+    """
+    def __init__(self, global_rate=30, chat_rate=1, max_retries=5, max_queue_size=1000):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.global_limiter = APIRateLimiter(max_requests=global_rate, period=1)
+        self.chat_rate = chat_rate
+        self.chat_limiters = {}
+        self.bots = {}
+        self.max_retries = max_retries
+        self.lock = Lock()
+        self.worker = None
+        self.failed = 0  # Неотправленные сообщения и файлы с начала работы
+
+    def get_bot(self, token):
+        """Возвращает бота для токена, создавая его только один раз."""
+        with self.lock:
+            if token not in self.bots:
+                self.bots[token] = telebot.TeleBot(token)
+            return self.bots[token]
+
+    def send_message(self, token, chat_id, text):
+        """Ставит сообщение в очередь, разбивая его на части по лимиту Telegram."""
+        for chunk in split_telegram_message(text):
+            self._enqueue(('message', token, chat_id, chunk))
+
+    def send_document(self, token, chat_id, document):
+        """Ставит файл (буфер в памяти с атрибутом name) в очередь отправки."""
+        self._enqueue(('document', token, chat_id, document))
+
+    def flush(self, timeout=None):
+        """Ждет отправки всех сообщений из очереди. Возвращает True, если очередь пуста."""
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def _enqueue(self, job):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = Thread(target=self._run, name='telegram-sink', daemon=True)
+                self.worker.start()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            logging.error("Очередь отправки в Telegram переполнена, сообщение отброшено.")
+            with self.lock:
+                self.failed += 1
+
+    def _chat_limiter(self, chat_id):
+        with self.lock:
+            if chat_id not in self.chat_limiters:
+                self.chat_limiters[chat_id] = APIRateLimiter(max_requests=self.chat_rate, period=1)
+            return self.chat_limiters[chat_id]
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            delivered = False
+            try:
+                delivered = self._deliver(job)
+            except Exception as e:
+                logging.error(f"Ошибка в очереди отправки Telegram: {str(e)}")
+            finally:
+                if not delivered:
+                    with self.lock:
+                        self.failed += 1
+                self.queue.task_done()
+
+    @stage_metrics.timed('telegram_send')
+    def _deliver(self, job):
+        kind, token, chat_id, payload = job
+        bot = self.get_bot(token)
+        wait_time = 1
+        for attempt in range(1, self.max_retries + 1):
+            self.global_limiter.wait()
+            self._chat_limiter(chat_id).wait()
+            try:
+                if kind == 'message':
+                    bot.send_message(chat_id, payload)
+                    logging.info("Отправлено уведомление в Telegram")
+                else:
+                    payload.seek(0)
+                    bot.send_document(chat_id, payload)
+                    logging.info("Отчет успешно отправлен в Telegram.")
+                return True
+            except telebot.apihelper.ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', wait_time)
+                    logging.warning(f"Telegram ограничил отправку (429). Повтор через {retry_after} секунд...")
+                    clock.sleep(retry_after)
+                    continue
+                if e.error_code < 500:
+                    logging.error(f"Не удалось отправить в Telegram: {str(e)}")
+                    return False
+                logging.warning(f"Ошибка сервера Telegram ({e.error_code}), попытка {attempt}/{self.max_retries}")
+            except Exception as e:
+                logging.warning(f"Ошибка отправки в Telegram: {str(e)}, попытка {attempt}/{self.max_retries}")
+            clock.sleep(wait_time)
+            wait_time *= 2
+        logging.error(f"Не удалось отправить в Telegram после {self.max_retries} попыток.")
+        return False
+
+
+# Общая очередь отправки в Telegram для всех циклов
+telegram_sink = TelegramSink()
+
+
+# Поля снимка, доступные в правилах оповещений: имя поля -> (тип, описание)
+ALERT_RULE_FIELDS = {
+    'company': ('text', "Компания ('us' для нашей компании, иначе имя конкурента)"),
+    'company_name': ('text', 'Отображаемое имя компании'),
+    'asin': ('text', 'ASIN продукта'),
+    'price': ('number', 'Цена'),
+    'prime_price': ('number', 'Prime цена'),
+    'list_price': ('number', 'List Price'),
+    'final_price': ('number', 'Итоговая цена с учетом купона'),
+    'coupon': ('number', 'Купон, %'),
+    'prime_gap_pct': ('number', 'Разница между Full и Prime ценой, %'),
+    'rating': ('number', 'Рейтинг'),
+    'reviews': ('number', 'Количество отзывов'),
+    'bsr': ('number', 'Best Sellers Rank'),
+    'price_delta_pct': ('number', 'Изменение цены относительно прошлого цикла, %'),
+    'rating_change': ('number', 'Изменение рейтинга относительно прошлого цикла'),
+    'reviews_change': ('number', 'Изменение количества отзывов относительно прошлого цикла'),
+    'bsr_rank_change': ('number', 'Изменение BSR относительно прошлого цикла (больше 0 - хуже)'),
+    'rating_invalid': ('number', 'Рейтинг найден, но не является числом (1 или 0)'),
+    'price_invalid': ('number', 'Full и Prime цены найдены, но хотя бы одна не является числом (1 или 0)'),
+    'coupon_invalid': ('number', 'Купон найден, но не является числом (1 или 0)'),
+}
+
+# Функции numpy по именам: numpy импортируется при первой компиляции правила, а не при загрузке скрипта
+_ALERT_RULE_COMPARATORS = {
+    ast.Lt: 'less',
+    ast.LtE: 'less_equal',
+    ast.Gt: 'greater',
+    ast.GtE: 'greater_equal',
+    ast.Eq: 'equal',
+    ast.NotEq: 'not_equal',
+}
+
+# Число с разделителями: точка, запятая, а также пробел, неразрывный или узкий неразрывный пробел
+# перед группой из трех цифр ("1 299,00 €")
+_NUMERIC_VALUE_PATTERN = re.compile(r'-?\d[\d.,]*(?:[ \u00a0\u202f]\d{3}(?!\d)[\d.,]*)*')
+_NUMERIC_GROUP_SPACES = re.compile(r'[ \u00a0\u202f]')
+
+# Текст оповещения правила по умолчанию о разнице Full и Prime цен
+PRICE_GAP_ALERT_MESSAGE = "💰 Значительное изменение цены для ASIN {asin}: Full ${price:.2f}, Prime ${prime_price:.2f}"
+
+# Снимок предыдущего цикла для вычисления дельт: (компания, ASIN) -> значения полей
+_previous_alert_snapshot = {}
+
+
+def parse_numeric_value(value):
+    """
+    Преобразует значение из product_info ("$12.34", "12,34 €", "€ 1 299,00", "10.0%", 1234) в float.
+    Возвращает NaN, если значение не найдено или не является числом.
+    """
+    if isinstance(value, bool):
+        return float('nan')
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return float('nan')
+    match = _NUMERIC_VALUE_PATTERN.search(value)
+    if not match:
+        return float('nan')
+    number = _NUMERIC_GROUP_SPACES.sub('', match.group()).rstrip('.,')
+    if ',' in number and '.' in number:
+        # Последний разделитель - десятичный, остальные - разделители тысяч
+        if number.rfind(',') > number.rfind('.'):
+            number = number.replace('.', '').replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif ',' in number or '.' in number:
+        separator = ',' if ',' in number else '.'
+        parts = number.split(separator)
+        # "1.234" / "1,234,567" - разделители тысяч, "12,34" / "12.34" - десятичная часть
+        if len(parts) > 2 or len(parts[-1]) == 3:
+            number = ''.join(parts)
+        else:
+            number = '.'.join(parts)
+    try:
+        return float(number)
+    except ValueError:
+        return float('nan')
+
+
+def _alert_condition_and(results):
+    """Трехзначное and над парами (значение, известность): известно, если все известны или хоть один ложен."""
+    value = np.logical_and.reduce([value for value, _ in results])
+    all_known = np.logical_and.reduce([known for _, known in results])
+    any_false = np.logical_or.reduce([np.logical_and(known, np.logical_not(value)) for value, known in results])
+    return value, np.logical_or(all_known, any_false)
+
+
+def _alert_condition_or(results):
+    """Трехзначное or над парами (значение, известность): известно, если все известны или хоть один истинен."""
+    value = np.logical_or.reduce([value for value, _ in results])
+    all_known = np.logical_and.reduce([known for _, known in results])
+    return value, np.logical_or(all_known, value)
+
+
+class AlertRule:
+    """
+    Скомпилированное правило оповещения, например `rating < 4.3 and company == "us"`.
+    message - необязательный шаблон текста оповещения: поля правил и исходный продукт ({product[Rating]}).
+    """
+    def __init__(self, expression, message=None):
+        self.expression = expression.strip()
+        self.message = message
+        try:
+            tree = ast.parse(self.expression, mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Синтаксическая ошибка в правиле '{self.expression}': {e.msg}")
+        self.fields = set()
+        self._evaluate = self._compile_condition(tree.body)
+
+    def _compile_condition(self, node):
+        """
+        Компилирует логическое выражение в функцию columns -> (значение, известность), оба - массивы bool.
+        Сравнение с NaN неизвестно, and/or/not следуют трехзначной логике: `not price < 10`
+        не срабатывает для продукта без цены.
+        """
+        if isinstance(node, ast.BoolOp):
+            operands = [self._compile_condition(value) for value in node.values]
+            combine = _alert_condition_and if isinstance(node.op, ast.And) else _alert_condition_or
+            return lambda columns: combine([operand(columns) for operand in operands])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            operand = self._compile_condition(node.operand)
+
+            def negate(columns):
+                value, known = operand(columns)
+                return np.logical_and(np.logical_not(value), known), known
+            return negate
+        if isinstance(node, ast.Compare):
+            return self._compile_comparison(node)
+        raise ValueError(f"Неподдерживаемое выражение в правиле '{self.expression}'")
+
+    def _compile_comparison(self, node):
+        """Компилирует (возможно цепочечное) сравнение: `4.0 <= rating < 4.3`."""
+        operands = [self._compile_operand(item) for item in [node.left] + node.comparators]
+        comparisons = []
+        for op, (left, left_kind), (right, right_kind) in zip(node.ops, operands, operands[1:]):
+            comparator_name = _ALERT_RULE_COMPARATORS.get(type(op))
+            if comparator_name is None:
+                raise ValueError(f"Неподдерживаемый оператор сравнения в правиле '{self.expression}'")
+            if left_kind != right_kind:
+                raise ValueError(f"Сравнение текста с числом в правиле '{self.expression}'")
+            if left_kind == 'text' and comparator_name not in ('equal', 'not_equal'):
+                raise ValueError(f"Текстовые поля можно сравнивать только через == и != в правиле '{self.expression}'")
+            comparisons.append((getattr(np, comparator_name), left, right, left_kind == 'number'))
+
+        def evaluate(columns):
+            results = []
+            for comparator, left, right, numeric in comparisons:
+                left_value, right_value = left(columns), right(columns)
+                value = np.asarray(comparator(left_value, right_value), dtype=bool)
+                if numeric:
+                    known = np.logical_not(np.logical_or(np.isnan(left_value), np.isnan(right_value)))
+                else:
+                    known = np.ones_like(value)
+                results.append((value, known))
+            return _alert_condition_and(results) if len(results) > 1 else results[0]
+        return evaluate
+
+    def _compile_operand(self, node):
+        """Компилирует имя поля или константу в функцию columns -> значение и тип."""
+        if isinstance(node, ast.Name):
+            if node.id not in ALERT_RULE_FIELDS:
+                raise ValueError(f"Неизвестное поле '{node.id}' в правиле '{self.expression}'")
+            self.fields.add(node.id)
+            return (lambda columns: columns[node.id]), ALERT_RULE_FIELDS[node.id][0]
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)) \
+                and isinstance(node.operand, ast.Constant) and isinstance(node.operand.value, (int, float)):
+            value = -node.operand.value if isinstance(node.op, ast.USub) else node.operand.value
+            return (lambda columns: value), 'number'
+        if isinstance(node, ast.Constant) and not isinstance(node.value, bool):
+            value = node.value
+            if isinstance(value, (int, float)):
+                return (lambda columns: value), 'number'
+            if isinstance(value, str):
+                return (lambda columns: value), 'text'
+        raise ValueError(f"Неподдерживаемый операнд в правиле '{self.expression}'")
+
+    def evaluate(self, columns, size):
+        """Возвращает булеву маску длины size для колоночного снимка."""
+        with np.errstate(invalid='ignore'):
+            mask, _ = self._evaluate(columns)
+        return np.broadcast_to(np.asarray(mask, dtype=bool), (size,))
+
+
+@lru_cache(maxsize=32)
+def compile_alert_rules(expressions, messages=None):
+    """
+    Компилирует кортеж текстовых правил и, если заданы, кортеж шаблонов их оповещений.
+    Некорректные правила пропускаются с ошибкой в логе.
+    Результат кэшируется, поэтому повторная загрузка того же конфига не компилирует правила заново.
+    """
+    rules = []
+    for expression, message in zip(expressions, messages or (None,) * len(expressions)):
+        try:
+            rules.append(AlertRule(expression, message))
+        except ValueError as e:
+            logging.error(f"Правило оповещения пропущено: {e}")
+    logging.info(f"Скомпилировано правил оповещений: {len(rules)} из {len(expressions)}")
+    return tuple(rules)
+
+
+def get_alert_rules(config):
+    """
+    Возвращает скомпилированные правила из конфига или правила по умолчанию из порогов.
+    Правила по умолчанию повторяют прежние проверки рейтинга, разницы Full/Prime цен и купона вместе с их текстами.
+    """
+    if config.get('compiled_alert_rules') is not None:
+        return config['compiled_alert_rules']
+    default_rules = (
+        (f"rating < {float(config.get('min_acceptable_rating', 4.0))}",
+         "⚠️ Низкий рейтинг: {product[Rating]} звезд для ASIN {asin}"),
+        ("rating_invalid == 1", "⚠️ Некорректный рейтинг для ASIN {asin}"),
+        (f"price != 0 and prime_price != 0 and prime_gap_pct >= {float(config.get('price_change_threshold', 5.0))}",
+         PRICE_GAP_ALERT_MESSAGE),
+        ("price_invalid == 1", "⚠️ Некорректная цена для ASIN {asin}"),
+        (f"coupon >= {float(config.get('coupon_threshold', 10.0))}", "🏷️ Большой купон для ASIN {asin}: {coupon}%"),
+        ("coupon_invalid == 1", "⚠️ Некорректная скидка купона для ASIN {asin}"),
+    )
+    expressions, messages = zip(*default_rules)
+    return compile_alert_rules(expressions, messages)
+
+
+def build_snapshot_columns(data, our_company_name):
+    """
+    Преобразует результаты цикла {компания: [product_info, ...]} в колоночные массивы NumPy.
+    Цены и прочие строки разбираются один раз за цикл, отсутствующие значения - NaN.
+    Возвращает колонки и список продуктов в порядке строк.
+    """
+    text_fields = [name for name, (kind, _) in ALERT_RULE_FIELDS.items() if kind == 'text']
+    raw_fields = {
+        'price': 'Price', 'prime_price': 'Prime Price', 'list_price': 'List Price',
+        'final_price': 'Final Price', 'coupon': 'Coupon Discount', 'rating': 'Rating',
+        'reviews': 'Number of Reviews', 'bsr': 'BSR',
+    }
+    text_values = {name: [] for name in text_fields}
+    numeric_values = {name: [] for name in raw_fields}
+    previous_values = {name: [] for name in ('price', 'rating', 'reviews', 'bsr')}
+    invalid_values = {'rating_invalid': [], 'price_invalid': [], 'coupon_invalid': []}
+    rows = []
+
+    for company_name, products in data.items():
+        company = 'us' if company_name == our_company_name else company_name
+        for product in products:
+            asin = product.get('ASIN', 'Not Found')
+            text_values['company'].append(company)
+            text_values['company_name'].append(company_name)
+            text_values['asin'].append(asin)
+            for name, key in raw_fields.items():
+                numeric_values[name].append(parse_numeric_value(product.get(key)))
+            # Значение найдено (не None и не "Not Found"), но не разобрано как число
+            found = {name: product.get(raw_fields[name]) not in (None, "Not Found") for name in ('price', 'prime_price', 'coupon', 'rating')}
+            invalid_values['rating_invalid'].append(found['rating'] and np.isnan(numeric_values['rating'][-1]))
+            invalid_values['price_invalid'].append(found['price'] and found['prime_price'] and (
+                np.isnan(numeric_values['price'][-1]) or np.isnan(numeric_values['prime_price'][-1])))
+            invalid_values['coupon_invalid'].append(found['coupon'] and np.isnan(numeric_values['coupon'][-1]))
+            rows.append(product)
+            previous = _previous_alert_snapshot.get((company_name, asin), {})
+            for name in previous_values:
+                previous_values[name].append(previous.get(name, float('nan')))
+
+    columns = {name: np.array(values, dtype=object) for name, values in text_values.items()}
+    columns.update({name: np.array(values, dtype=float) for name, values in numeric_values.items()})
+    columns.update({name: np.array(values, dtype=float) for name, values in invalid_values.items()})
+    previous = {name: np.array(values, dtype=float) for name, values in previous_values.items()}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['prime_gap_pct'] = np.abs(columns['price'] - columns['prime_price']) / columns['price'] * 100
+        columns['price_delta_pct'] = (columns['price'] - previous['price']) / previous['price'] * 100
+    columns['rating_change'] = columns['rating'] - previous['rating']
+    columns['reviews_change'] = columns['reviews'] - previous['reviews']
+    columns['bsr_rank_change'] = columns['bsr'] - previous['bsr']
+    return columns, rows
+
+
+def evaluate_alert_rules(rules, data, our_company_name):
+    """
+    Вычисляет все правила над снимком цикла одним проходом по колонкам.
+    Возвращает список текстов оповещений (по продуктам, внутри продукта - в порядке правил)
+    и запоминает снимок для дельт следующего цикла.
+    """
+    columns, products = build_snapshot_columns(data, our_company_name)
+    size = len(products)
+    fired = []
+    if size:
+        for rule in rules:
+            for index in np.flatnonzero(rule.evaluate(columns, size)):
+                if rule.message is not None:
+                    values = {field: columns[field][index] for field in ALERT_RULE_FIELDS}
+                    fired.append((index, rule.message.format(product=products[index], **values)))
+                    continue
+                details = ', '.join(
+                    f"{field}={columns[field][index]:g}" if ALERT_RULE_FIELDS[field][0] == 'number' else f"{field}={columns[field][index]}"
+                    for field in sorted(rule.fields) if field not in ('asin', 'company')
+                )
+                alert = f"🔔 {rule.expression}: ASIN {columns['asin'][index]} ({columns['company_name'][index]})"
+                fired.append((index, f"{alert} - {details}" if details else alert))
+    fired.sort(key=lambda item: item[0])
+    alerts = [alert for _, alert in fired]
+
+    # Запоминаем снимок; пропущенные значения не затирают последние известные
+    for index in range(size):
+        previous = _previous_alert_snapshot.setdefault((columns['company_name'][index], columns['asin'][index]), {})
+        for name in ('price', 'rating', 'reviews', 'bsr'):
+            if not np.isnan(columns[name][index]):
+                previous[name] = columns[name][index]
+    logging.info(f"Проверено правил оповещений: {len(rules)} для {size} продуктов, сработало: {len(alerts)}")
+    return alerts
+
+# Заголовки столбцов XLSX отчета
+XLSX_REPORT_HEADERS = [
+    "Company", "ASIN", "Title", "Full Price", "Prime Price", 
+    "Avg List Price", "Avg Title Price", "Avg Prime Price",
+    "Rating", "Number of Reviews", "Coupon Discount", 
+    "Final Price", "Discount Percent", "Variations Count"
+]
+
+
+def iter_report_rows(data):
+    """Генерирует строки XLSX отчета по одной, не собирая их в памяти."""
+    for company, products in data.items():
+        for product in products:
+            yield [
+                company,
+                product.get('ASIN', 'Не найдено'),
+                product.get('Title', 'Не найдено'),
+                product.get('Price', 'Не найдено'),
+                product.get('Prime Price', 'Не найдено'),
+                product.get('List Price', 'Not Found'),
+                product.get('Sale Price', 'Not Found'),
+                product.get('Prime Price', 'Not Found'),
+                product.get('Rating', 'Не найдено'),
+                product.get('Number of Reviews', 'Не найдено'),
+                product.get('Coupon Discount', 'Not Found'),
+                product.get('Final Price', 'Not Found'),
+                product.get('Discount Percent', 'Not Found'),
+                product.get('Variations Count', 'Not Found'),
+            ]
+
+
+@stage_metrics.timed('xlsx_report')
+def create_xlsx_report(data, current_time_str):
+    """
+    Создание XLSX отчета с данными о продуктах в потоковом режиме (write-only).
+    Ширина столбцов считается по текущим максимумам за отдельный проход по строкам,
+    отчет пишется в буфер в памяти. Возвращает io.BytesIO с атрибутом name или None.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    try:
+        # Первый проход: ширина столбцов по максимальной длине значений
+        column_widths = [len(header) for header in XLSX_REPORT_HEADERS]
+        for values in iter_report_rows(data):
+            for index, value in enumerate(values):
+                if value:
+                    column_widths[index] = max(column_widths[index], len(str(value)))
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Product Report")
+        # В режиме write-only ширина задается до записи первой строки
+        for index, width in enumerate(column_widths, start=1):
+            ws.column_dimensions[get_column_letter(index)].width = width + 2
+
+        # Стили
+        header_font = Font(bold=True)
+        header_fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
+        bold_blue_font = Font(bold=True, color="0000FF")  # Жирный и синий цвет для кликабельных ASIN
+
+        # Заголовок
+        title_cell = WriteOnlyCell(ws, value=f"Product Report - {current_time_str}")
+        title_cell.font = Font(bold=True, size=14)
+        ws.append([title_cell])
+        ws.merged_cells.add(f"A1:{get_column_letter(len(XLSX_REPORT_HEADERS))}1")
+
+        # Заголовки столбцов
+        header_cells = []
+        for header in XLSX_REPORT_HEADERS:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = header_font
+            cell.fill = header_fill
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        # Второй проход: данные пишутся построчно
+        for values in iter_report_rows(data):
+            asin = values[1]
+            if asin != 'Не найдено':
+                asin_cell = WriteOnlyCell(ws, value=asin)
+                asin_cell.hyperlink = f"https://www.amazon.com/dp/{asin}"
+                asin_cell.font = bold_blue_font  # Сделать кликабельным ASIN жирным и синим
+                values[1] = asin_cell
+            ws.append(values)
+
+        # Сохранение в буфер в памяти
+        report = io.BytesIO()
+        wb.save(report)
+        report.seek(0)
+        report.name = f"product_report_{current_time_str.replace(':', '_')}.xlsx"
+        return report
+    except Exception as e:
+        logging.error(f"Ошибка при создании XLSX отчета: {str(e)}")
+        return None
+
+def save_dry_run_report(data, current_time_str, sheet_name=None):
+    """Пробный запуск (--dry-run): вместо записи в Google Sheets сохраняет XLSX-отчет в рабочую папку."""
+    report = create_xlsx_report(data, current_time_str)
+    if report is None:
+        return None
+    prefix = f"dry_run_{re.sub(r'[^0-9A-Za-z-]+', '_', sheet_name)}_" if sheet_name else 'dry_run_'
+    path = prefix + report.name
+    with open(path, 'wb') as f:
+        f.write(report.getvalue())
+    logging.info(f"Пробный запуск: отчет сохранен в {path}, продуктов: {sum(len(products) for products in data.values())}.")
+    return path
+
+def send_telegram_notification(config, current_time_str, data, alerts=None):
+    """
+    Отправка уведомления, сработавших оповещений и отчета в Telegram.
+    Сообщения ставятся в очередь telegram_sink и отправляются в фоне.
+    """
+    token = config.get('telegram_bot_token', '')
+    chat_id = config.get('telegram_chat_id', '')
+    if not token or not chat_id:
+        logging.error("Telegram bot token или chat_id не установлены в конфигурации.")
+        return
+
+    # Формирование сообщения построчно
+    lines = [f"Отчет за {current_time_str}", ""]
+    if alerts:
+        lines.extend(["Оповещения:", *alerts, ""])
+    for company, products in data.items():
+        lines.append(f"{company}:")
+        for product in products:
+            lines.extend([
+                f" ASIN: {product['ASIN']}",
+                f" Цена: {product.get('Price', 'Не найдено')}",
+                f" Рейтинг: {product.get('Rating', 'Не найдено')}",
+                "",
+            ])
+
+    # Постановка сообщения в очередь отправки
+    telegram_sink.send_message(token, chat_id, "\n".join(lines))
+
+    # Создание XLSX отчета в памяти и постановка в очередь отправки
+    report = create_xlsx_report(data, current_time_str)
+    if report:
+        telegram_sink.send_document(token, chat_id, report)
+
+@stage_metrics.timed('sheets_formatting')
+def apply_formatting(sheet, header, start_row, data_length):
+    """
+    Применяет форматирование к заголовкам и определенным ячейкам.
+    Оптимизировано для уменьшения количества запросов к API.
+    """
+    from gspread_formatting import CellFormat, Color, TextFormat, format_cell_range
+    from openpyxl.utils import get_column_letter
+
+    # Форматирование заголовков
+    header_format = CellFormat(
+        backgroundColor=Color(0.85, 0.93, 0.83),  # Цвет #d9ead3
+        textFormat=TextFormat(bold=True)
+    )
+    header_range = f"A1:{get_column_letter(len(header))}1"
+    format_cell_range(sheet, header_range, header_format)
+
+    # Получаем все значения в колонке "Наименование" (A) за один запрос
+    end_row = start_row + data_length - 1
+    name_column_range = f"A{start_row}:{get_column_letter(1)}{end_row}"
+    name_values = sheet.get(name_column_range)
+
+    # Подготовка списков для форматирования
+    parent_variations_rows = []
+    params_rows = []
+
+    params_to_highlight = ["BSR", "Number of Reviews", "Rating", "Price", "List Price", "Prime Price"]
+
+    for idx, row in enumerate(name_values, start=start_row):
+        cell_value = row[0]
+        if cell_value in ["Parent ASIN", "Variations ASIN", VARIATION_STATS_TITLE]:
+            parent_variations_rows.append(idx)
+        if cell_value in params_to_highlight:
+            params_rows.append(idx)
+
+    # Форматирование ячеек "Parent ASIN", "Variations ASIN" и раздела агрегатов
+    if parent_variations_rows:
+        for row in parent_variations_rows:
+            cell_range = f"A{row}"
+            format_cell_range(sheet, cell_range, CellFormat(
+                backgroundColor=Color(1, 1, 0),  # Цвет #ffff00
+                textFormat=TextFormat(bold=True)
+            ))
+
+    # Форматирование параметров
+    if params_rows:
+        for row in params_rows:
+            cell_range = f"A{row}"
+            format_cell_range(sheet, cell_range, CellFormat(
+                backgroundColor=Color(0.85, 0.93, 0.83),  # Цвет #d9ead3
+                textFormat=TextFormat(bold=True)
+            ))
+
+def find_nearest_slot(current_time_slot_formatted, all_slots):
+    """Определяет ближайший временной слот к текущему времени."""
+    try:
+        current_time = datetime.strptime(current_time_slot_formatted, "%H:%M")
+        slot_times = []
+        for slot in all_slots:
+            slot_time = datetime.strptime(slot, "%H:%M")
+            slot_times.append(slot_time)
+
+        # Находим ближайшее время
+        nearest_time = min(slot_times, key=lambda x: abs((x - current_time).total_seconds()))
+        nearest_slot = nearest_time.strftime("%H:%M")
+        return nearest_slot
+    except Exception as e:
+        logging.error(f"Ошибка при определении ближайшего временного слота: {e}")
+        return None
+def extract_best_sellers_rank(soup: 'bs4.BeautifulSoup') -> Optional[str]:
+    """
+    Извлекает Best Sellers Rank (BSR) из объекта BeautifulSoup.
+    Поддерживает немецкий формат.
+
+    :param soup: Объект BeautifulSoup HTML страницы
+    :return: Строка с BSR или 'Not Found'
+    """
+    try:
+        # Поиск в таблице Product Details
+        product_details = soup.find(id='productDetails_detailBullets_sections1')
+        if product_details:
+            rows = product_details.find_all('tr')
+            for row in rows:
+                th = row.find('th')
+                td = row.find('td')
+                if th and td:
+                    key = th.get_text(strip=True)
+                    value = td.get_text(strip=True)
+                    if 'Amazon Bestseller-Rang' in key:
+                        logging.debug(f"Найден BSR в Product Details: {value}")
+                        return value
+
+        # Альтернативный способ поиска в секции "Детали продукта"
+        detail_bullets = soup.find(id='detailBulletsWrapper_feature_div')
+        if detail_bullets:
+            lis = detail_bullets.find_all('li')
+            for li in lis:
+                text = li.get_text(strip=True)
+                if 'Amazon Bestseller-Rang' in text:
+                    # Извлекаем BSR из текста
+                    bsr_text = text.split(':', 1)[1].strip()
+                    logging.debug(f"Найден BSR в Detail Bullets: {bsr_text}")
+                    return bsr_text
+
+        # Если BSR не найден, возвращаем 'Not Found'
+        logging.warning("BSR не найден на странице.")
+        return 'Not Found'
+
+    except Exception as e:
+        logging.error(f"Ошибка при извлечении BSR: {e}")
         return 'Not Found'
 
 
@@ -789,146 +2288,260 @@ def parse_bsr_ranking(bsr_string: str) -> Dict[str, int]:
         print(f"Error parsing rankings: {e}")
     return rankings
 
-def scrape_amazon_product_scraperapi(url, config, is_variation=False):
+SCRAPERAPI_URL = "http://api.scraperapi.com"
+
+# Определение country_code из домена
+SCRAPERAPI_COUNTRY_CODES = {
+    'amazon.de': 'de',
+    'amazon.fr': 'fr',
+    'amazon.es': 'es',
+    'amazon.it': 'it',
+    'amazon.co.uk': 'gb',
+    'amazon.ca': 'ca',
+    'amazon.com': 'us',
+    # Добавьте другие домены по необходимости
+}
+
+
+def get_scraperapi_endpoint(config):
+    """Возвращает адрес ScraperAPI (можно переопределить для локального сервера-заглушки)."""
+    return (config.get('scraperapi_endpoint', '').strip() or SCRAPERAPI_URL).rstrip('/')
+
+
+def get_scraperapi_country_code(url):
+    """Возвращает country_code ScraperAPI для домена Amazon, по умолчанию 'us'."""
+    domain = urlparse(url).netloc.lower()
+    for key, country_code in SCRAPERAPI_COUNTRY_CODES.items():
+        if key in domain:
+            return country_code
+    logging.warning(f"Неизвестный домен: {domain}. Используется default 'us'")
+    return 'us'
+
+
+# Байтовые маркеры страниц, которые Amazon отдает вместо карточки товара
+CAPTCHA_MARKERS = (b'/errors/validateCaptcha', b'Type the characters you see', b'api-services-support@amazon.com')
+ERROR_PAGE_MARKERS = (b'/error/dogs', b'Dogs of Amazon', b"Sorry! Something went wrong", b'503 - Service Unavailable Error')
+PRODUCT_MARKERS = (b'id="productTitle"', b'id="dp-container"', b'id="dp"')
+MIN_PRODUCT_PAGE_SIZE = 2048
+PAGE_TITLE_PATTERN = re.compile(rb'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+
+def classify_amazon_page(content):
+    """
+    Быстрая классификация ответа до разбора HTML.
+
+    Возвращает 'product', 'captcha', 'error' (страница ошибки / "dogs of Amazon"),
+    'empty' (слишком короткий ответ) или 'not_product' (страница без карточки товара).
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8', errors='ignore')
+    if len(content) < MIN_PRODUCT_PAGE_SIZE:
+        return 'empty'
+    if any(marker in content for marker in CAPTCHA_MARKERS):
+        return 'captcha'
+    if any(marker in content for marker in ERROR_PAGE_MARKERS):
+        return 'error'
+    if any(marker in content for marker in PRODUCT_MARKERS):
+        return 'product'
+    title_match = PAGE_TITLE_PATTERN.search(content, 0, 8192)
+    if title_match and b'robot check' in title_match.group(1).lower():
+        return 'captcha'
+    return 'not_product'
+
+
+class BlockRateTracker:
+    """Доля блокировок (CAPTCHA, страницы ошибок) по маркетплейсам за последние ответы."""
+
+    def __init__(self, window=200):
+        self.lock = Lock()
+        self.window = window
+        self.results = {}
+
+    def record(self, marketplace, page_kind):
+        with self.lock:
+            self.results.setdefault(marketplace, deque(maxlen=self.window)).append(page_kind)
+
+    def get_rates(self):
+        """Возвращает {маркетплейс: (доля блокировок, число ответов)}."""
+        with self.lock:
+            return {
+                marketplace: (sum(kind != 'product' for kind in kinds) / len(kinds), len(kinds))
+                for marketplace, kinds in self.results.items() if kinds
+            }
+
+    def log_summary(self):
+        for marketplace, (rate, total) in sorted(self.get_rates().items()):
+            log = logging.warning if rate >= 0.2 else logging.info
+            log(f"Доля блокировок {marketplace}: {rate:.1%} из {total} последних ответов")
+
+
+block_tracker = BlockRateTracker()
+
+
+def request_scraperapi_page(scraperapi_endpoint, params, marketplace, config):
+    """
+    Запрашивает страницу через ScraperAPI и проверяет ее классификатором до разбора.
+    marketplace – TLD маркетплейса из задания сбора ('de', 'co.uk').
+
+    CAPTCHA, страницы ошибок и пустые ответы сразу повторяются (ScraperAPI выдает новый прокси
+    на каждый запрос) до scraperapi_block_retries раз. Возвращает ответ с карточкой товара,
+    ответ с кодом, отличным от 200, или None, если карточку получить не удалось.
+    """
+    attempts = 1 + (config.get('scraperapi_block_retries') if 'scraperapi_block_retries' in config else 2)
+    for attempt in range(attempts):
+        api_limiter.wait()  # Ждем, чтобы не превысить лимит запросов
+        response = provider_latency.request('scraperapi', marketplace, requests.get, scraperapi_endpoint, params=params, timeout=30)
+        if response.status_code != 200:
+            if response.status_code == 404:
+                negative_cache.record_failure(params.get('url'), "HTTP 404")
+            return response
+
+        page_kind = classify_amazon_page(response.content)
+        block_tracker.record(marketplace, page_kind)
+        if page_kind == 'product':
+            return response
+        provider_latency.record_parse_failure('scraperapi', marketplace)
+        if page_kind == 'not_product':
+            logging.warning(f"Ответ для {params.get('url')} не содержит карточку товара, разбор пропущен.")
+            negative_cache.record_failure(params.get('url'), "нет карточки товара")
+            return None
+        logging.warning(f"Получена страница '{page_kind}' для {params.get('url')} (попытка {attempt + 1}/{attempts}).")
+
+    logging.error(f"Не удалось получить карточку товара для {params.get('url')} после {attempts} попыток.")
+    return None
+
+
+@stage_metrics.timed('parse')
+def parse_scraperapi_html(html_content, asin, url, currency_code=None):
+    """
+    Разбирает HTML страницы продукта, полученной через ScraperAPI.
+    Если на странице нет названия товара, Title равен 'Не найдено'.
+    currency_code – валюта маркетплейса из задания сбора; без него определяется по URL.
+    """
+    currency_code = currency_code or determine_currency(url)
+
+    # Парсинг HTML с помощью BeautifulSoup
+    soup = bs4.BeautifulSoup(html_content, 'html.parser')
+
+    # Извлечение BSR
+    best_sellers_rank_string = extract_best_sellers_rank(soup)
+    if best_sellers_rank_string and isinstance(best_sellers_rank_string, str):
+        # Извлекаем первое числовое значение после "Nr.", учитывая точки
+        match = re.search(r'Nr\.\s*([\d\.]+)', best_sellers_rank_string)
+        if match:
+            number_str = match.group(1).replace('.', '')  # Удаляем точки из числа
+            bsr = int(number_str)
+        else:
+            bsr = 'Not Found'
+    else:
+        bsr = 'Not Found'
+    logging.debug(f"Извлеченный Best Sellers Rank: {bsr}")
+
+    # Извлечение Rating
+    rating = extract_rating(soup)
+
+    # Извлечение других данных
+    title_tag = soup.find(id='productTitle')
+    title = title_tag.get_text().strip() if title_tag else 'Не найдено'
+
+    reviews_tag = soup.find(id='acrCustomerReviewText')
+    reviews_count = re.sub(r'[^\d]', '', reviews_tag.get_text()) if reviews_tag else 'Не найдено'
+
+    brand_tag = soup.find(id='bylineInfo')
+    brand = brand_tag.get_text().strip() if brand_tag else 'Не найдено'
+
+    # Извлечение цен
+    price = 'Не найдено'
+    price_section = soup.find('span', {'id': 'priceblock_ourprice'}) or \
+                    soup.find('span', {'id': 'priceblock_dealprice'}) or \
+                    soup.find('span', {'id': 'priceblock_saleprice'})
+    if price_section:
+        price_text = price_section.get_text().strip()
+        price = extract_price(price_text, currency_code)
+    else:
+        # Альтернативный способ поиска цены
+        price_section = soup.find('span', {'class': 'a-offscreen'})
+        if price_section:
+            price_text = price_section.get_text().strip()
+            price = extract_price(price_text, currency_code)
+
+    # Извлечение купона
+    coupon = 'Не найдено'
+    coupon_section = soup.find('span', {'id': 'couponBadgeRegular'}) or \
+                     soup.find('span', {'id': 'couponBadgeSecondary'})
+    if coupon_section:
+        coupon_text = coupon_section.get_text().strip()
+        coupon = extract_coupon(coupon_text)
+
+    # Вычисление итоговой цены
+    final_price = calculate_final_price(price, price, coupon, CURRENCY_SYMBOLS.get(currency_code, '$'))
+    discount_percent = calculate_discount_percent(price, final_price)
+
+    product_info = {
+        "ASIN": asin,
+        "Title": title,
+        "Price": price,
+        "Prime Price": price,  # ScraperAPI не предоставляет отдельную Prime Price
+        "List Price": 'Не найдено',  # Необходимо реализовать при необходимости
+        "Coupon Discount": coupon,
+        "Final Price": final_price,
+        "Discount Percent": discount_percent,
+        "Rating": rating,
+        "Number of Reviews": reviews_count,
+        "BSR": bsr,
+        "Brand": brand,
+        "Scrape Date": get_kyiv_time().strftime("%d.%m.%Y"),
+        "URL": url
+    }
+    return product_info
+
+
+def scrape_amazon_product_scraperapi(job, config):
     """Скрапинг данных с Amazon через ScraperAPI, включая Best Sellers Rank."""
+    url, asin = job.url, job.asin
 
     # Проверка валидности URL
     if not url.startswith('http'):
         logging.error(f"Invalid URL: {url}")
         return None
 
-    # Извлечение ASIN из URL
-    asin = extract_asin(url)
     if asin == 'Not Found':
         logging.error(f"ASIN not found in URL: {url}")
         return None
 
-    # Определение домена и валюты
-    parsed_url = urlparse(url)
-    domain = parsed_url.netloc.lower()
-    currency_code = determine_currency(url)
-
-    # Определение country_code из домена
-    country_code_map = {
-        'amazon.de': 'de',
-        'amazon.fr': 'fr',
-        'amazon.es': 'es',
-        'amazon.it': 'it',
-        'amazon.co.uk': 'gb',
-        'amazon.ca': 'ca',
-        'amazon.com': 'us',
-        # Добавьте другие домены по необходимости
-    }
-
-    country_code = 'us'  # Значение по умолчанию
-    for key in country_code_map:
-        if key in domain:
-            country_code = country_code_map[key]
-            break
-    else:
-        logging.warning(f"Неизвестный домен: {domain}. Используется default 'us'")
-
     # Формирование URL для ScraperAPI
     scraperapi_api_key = config.get('ScraperAPI', '').strip()
     if not scraperapi_api_key:
         logging.error("ScraperAPI API key is missing in the configuration")
         return None
 
-    scraperapi_endpoint = "http://api.scraperapi.com"
-    target_url = f"https://{domain}{parsed_url.path}"  # Полный URL продукта
+    scraperapi_endpoint = get_scraperapi_endpoint(config)
+    target_url = job.canonical_url  # Каноническая ссылка на товар
 
     params = {
         "api_key": scraperapi_api_key,
         "url": target_url,
         "render": "false",  # Установите "true", если требуется рендеринг JavaScript
         "keep_headers": "true",
-        "country_code": country_code,
+        "country_code": job.country_code,
     }
 
     logging.debug(f"ScraperAPI запрос: {params}")
 
     try:
-        api_limiter.wait()  # Ждем, чтобы не превысить лимит запросов
-        response = requests.get(scraperapi_endpoint, params=params, timeout=30)
+        response = request_scraperapi_page(scraperapi_endpoint, params, job.marketplace, config)
+        if response is None:
+            return None
         logging.debug(f"Получен ответ от ScraperAPI: {response.status_code} - {response.text[:200]}...")
 
         if response.status_code == 200:
+            response_archive.store('scraperapi', job.marketplace, asin, response.content, 'html')
             html_content = response.text
             logging.debug(f"Полученный HTML для ASIN {asin}: {html_content[:500]}...")  # Логирование первых 500 символов
 
-            # Парсинг HTML с помощью BeautifulSoup
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            # Извлечение BSR
-            best_sellers_rank_string = extract_best_sellers_rank(soup)
-            if best_sellers_rank_string and isinstance(best_sellers_rank_string, str):
-                # Извлекаем первое числовое значение после "Nr.", учитывая точки
-                match = re.search(r'Nr\.\s*([\d\.]+)', best_sellers_rank_string)
-                if match:
-                    number_str = match.group(1).replace('.', '')  # Удаляем точки из числа
-                    bsr = int(number_str)
-                else:
-                    bsr = 'Not Found'
-            else:
-                bsr = 'Not Found'
-            logging.debug(f"Извлеченный Best Sellers Rank: {bsr}")
-
-            # Извлечение Rating
-            rating = extract_rating(soup)
-
-            # Извлечение других данных
-            title_tag = soup.find(id='productTitle')
-            title = title_tag.get_text().strip() if title_tag else 'Не найдено'
-
-            reviews_tag = soup.find(id='acrCustomerReviewText')
-            reviews_count = re.sub(r'[^\d]', '', reviews_tag.get_text()) if reviews_tag else 'Не найдено'
-
-            brand_tag = soup.find(id='bylineInfo')
-            brand = brand_tag.get_text().strip() if brand_tag else 'Не найдено'
-
-            # Извлечение цен
-            price = 'Не найдено'
-            price_section = soup.find('span', {'id': 'priceblock_ourprice'}) or \
-                            soup.find('span', {'id': 'priceblock_dealprice'}) or \
-                            soup.find('span', {'id': 'priceblock_saleprice'})
-            if price_section:
-                price_text = price_section.get_text().strip()
-                price = extract_price(price_text, currency_code)
-            else:
-                # Альтернативный способ поиска цены
-                price_section = soup.find('span', {'class': 'a-offscreen'})
-                if price_section:
-                    price_text = price_section.get_text().strip()
-                    price = extract_price(price_text, currency_code)
-
-            # Извлечение купона
-            coupon = 'Не найдено'
-            coupon_section = soup.find('span', {'id': 'couponBadgeRegular'}) or \
-                             soup.find('span', {'id': 'couponBadgeSecondary'})
-            if coupon_section:
-                coupon_text = coupon_section.get_text().strip()
-                coupon = extract_coupon(coupon_text)
-
-            # Вычисление итоговой цены
-            final_price = calculate_final_price(price, price, coupon, CURRENCY_SYMBOLS.get(currency_code, '$'))
-            discount_percent = calculate_discount_percent(price, final_price)
-
-            product_info = {
-                "ASIN": asin,
-                "Title": title,
-                "Price": price,
-                "Prime Price": price,  # ScraperAPI не предоставляет отдельную Prime Price
-                "List Price": 'Не найдено',  # Необходимо реализовать при необходимости
-                "Coupon Discount": coupon,
-                "Final Price": final_price,
-                "Discount Percent": discount_percent,
-                "Rating": rating,
-                "Number of Reviews": reviews_count,
-                "BSR": bsr,
-                "Brand": brand,
-                "Scrape Date": get_kyiv_time().strftime("%d.%m.%Y"),
-                "URL": target_url
-            }
+            product_info = parse_scraperapi_html(html_content, asin, target_url, job.currency)
+            if not accept_product_info(job, product_info):
+                return None
 
             # Детализированное логирование данных
             logging.info(f"Извлеченные данные для ASIN {product_info['ASIN']}:")
@@ -947,260 +2560,609 @@ def scrape_amazon_product_scraperapi(url, config, is_variation=False):
 
 
 
-def gather_product_data(config):
-    """Функция для сбора данных по продуктам. Возвращает текущие результаты."""
-    current_results = {}
+# Задание сбора: все производные от URL значения вычисляются один раз при компиляции плана,
+# сборщик и парсеры берут их из задания. marketplace – TLD маркетплейса ('de', 'co.uk'),
+# country_code – параметр геолокации ScraperAPI
+FetchJob = namedtuple('FetchJob', ['url', 'canonical_url', 'asin', 'marketplace', 'currency', 'country_code', 'company', 'role'])
 
-    # Получаем имя нашей компании из конфига или используем значение по умолчанию
-    our_company_name = config.get('company_name', 'Merino.tech. (Мы)')
-    current_results[our_company_name] = []
 
-    # Обработка основных продуктов (Parent ASIN) нашей компании
-    logging.info(f"Начинаем сбор данных по основным продуктам {our_company_name} (Parent ASIN).")
-    for url in config.get('product_urls', []):
-        logging.debug(f"Обработка Parent ASIN по URL: {url}")
-        try:
-            product_info = scrape_amazon_product_scraperapi(url, config)
-            if product_info:
-                logging.info(f"Успешно собраны данные для основного продукта (Parent ASIN): {url}")
-                current_results[our_company_name].append(product_info)
-            else:
-                logging.warning(f"Не удалось получить данные для основного продукта (Parent ASIN): {url}")
-        except Exception as e:
-            logging.error(f"Ошибка при сборе данных для Parent ASIN по продукту {url}: {str(e)}")
+def canonicalize_amazon_url(url, asin):
+    """Каноническая ссылка на товар вида https://<домен>/dp/<ASIN>."""
+    netloc = urlparse(url).netloc.lower()
+    if asin == 'Not Found' or not netloc:
+        return url
+    return f"https://{netloc}/dp/{asin}"
 
-    # Обработка вариаций продуктов (Variation ASIN) нашей компании
-    logging.info(f"Начинаем сбор данных по вариациям продуктов {our_company_name} (Variation ASIN).")
-    for var_url in config.get('variation_urls', []):
-        logging.debug(f"Обработка Variation ASIN по URL: {var_url}")
-        try:
-            variation_info = scrape_amazon_product_scraperapi(var_url, config, is_variation=True)
-            if variation_info:
-                logging.info(f"Успешно собраны данные для вариации продукта (Variation ASIN): {var_url}")
-                current_results[our_company_name].append(variation_info)
-            else:
-                logging.warning(f"Не удалось получить данные для вариации продукта: {var_url}")
-        except Exception as e:
-            logging.error(f"Ошибка при сборе данных для Variation ASIN по продукту {var_url}: {str(e)}")
 
-    # Обработка конкурентов
-    logging.info("Начинаем сбор данных по конкурентам.")
-    competitor_names = config.get('competitor_names', {})
-    for i in range(1, 6):
-        competitor_name_key = f'competitor_{i}_name'
-        competitor_name = config.get(competitor_name_key)
-        if competitor_name:
-            competitor_urls_key = f'{i}competitor_urls'
-            competitor_variation_urls_key = f'{i}variation_urls'
+def make_fetch_job(url, company=None, role='parent'):
+    """Задание сбора для одного URL."""
+    asin = extract_asin(url)
+    return FetchJob(
+        url=url,
+        canonical_url=canonicalize_amazon_url(url, asin),
+        asin=asin,
+        marketplace=get_amazon_tld(url),
+        currency=determine_currency(url),
+        country_code=get_scraperapi_country_code(url),
+        company=company,
+        role=role,
+    )
+
 
-            competitor_urls = config.get(competitor_urls_key, [])
-            competitor_variation_urls = config.get(competitor_variation_urls_key, [])
+@lru_cache(maxsize=256)
+def compile_fetch_jobs(section, company, role, urls):
+    """
+    Компилирует неизменяемый список заданий для одной секции конфига.
 
-            current_results[competitor_name] = []
+    Результат кэшируется по (секция, компания, роль, URL), поэтому при повторной
+    загрузке неизмененного конфига план не пересчитывается, а сборщик и запись
+    в таблицу используют одни и те же задания. section входит только в ключ кэша:
+    правка одной секции конфига пересчитывает только ее.
+    """
+    return tuple(make_fetch_job(url, company, role) for url in urls)
 
-            # Обработка основных продуктов конкурента (Parent ASIN)
-            logging.info(f"Обработка основных продуктов конкурента {competitor_name} (Parent ASIN).")
-            for url in competitor_urls:
-                logging.debug(f"Обработка продукта конкурента {competitor_name} по URL: {url}")
-                try:
-                    product_info = scrape_amazon_product_scraperapi(url, config)
-                    if product_info:
-                        logging.info(f"Успешно собраны данные для конкурента {competitor_name}: {url}")
-                        current_results[competitor_name].append(product_info)
-                    else:
-                        logging.warning(f"Не удалось получить данные для конкурента {competitor_name}: {url}")
-                except Exception as e:
-                    logging.error(f"Ошибка при сборе данных для конкурента {competitor_name} ({url}): {str(e)}")
-
-            # Обработка вариаций продуктов конкурента (Variation ASIN)
-            logging.info(f"Обработка вариаций продуктов конкурента {competitor_name} (Variation ASIN).")
-            for var_url in competitor_variation_urls:
-                logging.debug(f"Обработка вариации продукта конкурента {competitor_name} по URL: {var_url}")
-                try:
-                    variation_info = scrape_amazon_product_scraperapi(var_url, config, is_variation=True)
-                    if variation_info:
-                        logging.info(f"Успешно собраны данные для вариации конкурента {competitor_name}: {var_url}")
-                        current_results[competitor_name].append(variation_info)
-                    else:
-                        logging.warning(f"Не удалось получить данные для вариации конкурента {competitor_name}: {var_url}")
-                except Exception as e:
-                    logging.error(f"Ошибка при сборе данных для вариации конкурента {competitor_name} ({var_url}): {str(e)}")
 
-    return current_results
+def build_fetch_plan(sources):
+    """Собирает план цикла из секций вида (секция, компания, роль, список URL) в заданном порядке."""
+    return tuple(
+        job
+        for section, company, role, urls in sources
+        for job in compile_fetch_jobs(section, company, role, tuple(urls))
+    )
 
-def update_monitoring_sheet(spreadsheet, data, current_time_slot, config, sheet_name):
+
+# Уровни обновления полей: горячие поля (цены, купон) обновляются каждый слот,
+# тяжелые (BSR, заголовок, бренд, отзывы) – раз в день
+DEFAULT_REFRESH_TIERS = {
+    'Price': 'slot',
+    'Prime Price': 'slot',
+    'Coupon Discount': 'slot',
+    'Final Price': 'slot',
+    'Discount Percent': 'slot',
+    'List Price': 'daily',
+    'Title': 'daily',
+    'Brand': 'daily',
+    'BSR': 'daily',
+    'Rating': 'daily',
+    'Number of Reviews': 'daily',
+}
+
+REFRESH_CADENCE_PATTERN = re.compile(r'^(slot|daily|\d+[hm])$')
+
+
+def parse_refresh_tiers(value):
     """
-    Обновляет данные на указанном листе Google Sheets и применяет форматирование.
+    Разбирает уровни обновления полей из листа Config.
+
+    Формат: 'Price, Coupon Discount = slot; BSR, Title = daily; Rating = 6h'.
+    Допустимые частоты: slot (каждый слот), daily (раз в сутки), <N>h или <N>m.
     """
-    try:
-        sheet = spreadsheet.worksheet(sheet_name)
-    except gspread.exceptions.WorksheetNotFound:
-        logging.error(f"Лист '{sheet_name}' не найден в таблице.")
-        return
+    tiers = {}
+    for entry in re.split(r'[\n\r;]+', value):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if '=' not in entry:
+            logging.error(f"Некорректная запись в refresh_tiers: '{entry}'. Ожидается 'поля = частота'.")
+            continue
+        fields, cadence = entry.rsplit('=', 1)
+        cadence = cadence.strip().lower()
+        if not REFRESH_CADENCE_PATTERN.match(cadence):
+            logging.error(f"Некорректная частота обновления '{cadence}' в refresh_tiers, запись пропущена.")
+            continue
+        for field in fields.split(','):
+            if field.strip():
+                tiers[field.strip()] = cadence
+    return tiers
 
-    # Формируем заголовки для колонок
-    header = [
-        "Наименование", "Параметры", "Данные"
-    ] + config.get('active_trade_slots', []) + ["Зона анализа"] + config.get('analysis_slots', [])
 
-    header = [slot.strip() if isinstance(slot, str) else slot for slot in header]
+class RefreshPlanner:
+    """
+    Планировщик обновления данных по ASIN.
 
-    logging.debug(f"Текущий временной слот: '{current_time_slot}'")
-    logging.debug(f"Заголовки таблицы: {header}")
+    Для каждого продукта и слота решает, нужен ли полный сбор страницы ('full')
+    или данные можно взять из кэша ('cache'). Легкого сбора только цены у этого провайдера нет
+    (он есть только в скрипте Oxylabs): если устарели только цены, выполняется полный сбор.
+    """
 
-    value_ranges = [{
-        'range': f'{sheet_name}!A1',
-        'values': [header]
-    }]
+    def __init__(self):
+        self.lock = Lock()
+        self.cache = {}
+        self.tiers = dict(DEFAULT_REFRESH_TIERS)
+        self.cycle_started = None
+        self.stats = {'full': 0, 'cache': 0}
+
+    def begin_cycle(self, config, current_time=None):
+        """Начинает новый цикл сбора: обновляет уровни из конфига и сбрасывает счетчики."""
+        tiers = dict(DEFAULT_REFRESH_TIERS)
+        tiers.update(config.get('refresh_tiers', {}))
+        with self.lock:
+            self.tiers = tiers
+            self.cycle_started = current_time or get_kyiv_time(config.get('timezone', 'Europe/Kiev'))
+            self.stats = {'full': 0, 'cache': 0}
+
+    @staticmethod
+    def cache_key(url):
+        """Ключ кэша: домен маркетплейса и ASIN."""
+        domain = urlparse(url).netloc.lower()
+        if domain.startswith('www.'):
+            domain = domain[4:]
+        return domain, extract_asin(url)
+
+    def _is_stale(self, cadence, fetched_at):
+        if fetched_at is None:
+            return True
+        if cadence == 'slot':
+            return fetched_at < self.cycle_started
+        if cadence == 'daily':
+            return fetched_at.date() != self.cycle_started.date()
+        amount = int(cadence[:-1])
+        ttl = timedelta(hours=amount) if cadence.endswith('h') else timedelta(minutes=amount)
+        return self.cycle_started - fetched_at >= ttl
+
+    def plan(self, url):
+        """Возвращает режим сбора для продукта: 'full' или 'cache'."""
+        with self.lock:
+            entry = self.cache.get(self.cache_key(url))
+            if entry is None or self.cycle_started is None:
+                return 'full'
+            stale_fields = [
+                field for field, cadence in self.tiers.items()
+                if field in entry['data'] and self._is_stale(cadence, entry['fetched_at'].get(field))
+            ]
+        return 'full' if stale_fields else 'cache'
+
+    def get_cached(self, url):
+        """Возвращает копию кэшированных данных продукта."""
+        with self.lock:
+            entry = self.cache.get(self.cache_key(url))
+            if entry is None:
+                return None
+            self.stats['cache'] += 1
+            return dict(entry['data'])
+
+    def store_full(self, url, product_info, mode='full'):
+        """Сохраняет результат полного сбора: все поля считаются свежими."""
+        with self.lock:
+            fetched_at = {field: self.cycle_started for field in product_info}
+            self.cache[self.cache_key(url)] = {'data': dict(product_info), 'fetched_at': fetched_at}
+            self.stats[mode] = self.stats.get(mode, 0) + 1
 
-    start_row = 3
-    current_row = start_row
+    def log_summary(self):
+        """Логирует распределение режимов сбора за цикл."""
+        with self.lock:
+            stats = dict(self.stats)
+        logging.info(
+            f"План обновления за цикл: полный сбор – {stats['full']}, "
+            f"из кэша – {stats['cache']}, пакетом – {stats.get('batch', 0)}"
+        )
 
-    # Получаем текущее время в формате "YYYY-MM-DD HH:MM:SS" в указанном часовом поясе
-    current_time = get_kyiv_time(config.get('timezone', 'Europe/Kiev'))
-    current_time_formatted = current_time.strftime("%Y-%m-%d %H:%M:%S")
-    current_time_slot_formatted = current_time.strftime("%H:%M")
 
-    # Добавляем запись текущего времени на 2-ю строку в колонку "Данные"
-    time_notation = f'{sheet_name}!C2'  # Ячейка C2 (строка 2, колонка "Данные")
-    value_ranges.append({
-        'range': time_notation,
-        'values': [[current_time_formatted]]  # Записываем текущее время
-    })
+refresh_planner = RefreshPlanner()
+
+
+class NegativeCache:
+    """
+    Негативный кэш для недоступных пар (маркетплейс, ASIN).
+
+    После negative_cache_threshold подряд ответов 204/404 или страниц без товара ASIN
+    исключается из сбора на время, которое удваивается при каждой новой неудаче
+    (от negative_cache_ttl_minutes до negative_cache_max_ttl_hours). По истечении
+    срока выполняется один пробный запрос: успех возвращает ASIN в сбор.
+    """
+
+    def __init__(self, threshold=2, base_ttl=3600, max_ttl=7 * 24 * 3600):
+        self.lock = Lock()
+        self.entries = {}
+        self.threshold = threshold
+        self.base_ttl = base_ttl
+        self.max_ttl = max_ttl
+
+    def configure(self, config):
+        """Обновляет параметры из листа Config."""
+        with self.lock:
+            self.threshold = max(1, config.get('negative_cache_threshold') or 2)
+            self.base_ttl = (config.get('negative_cache_ttl_minutes') or 60) * 60
+            self.max_ttl = (config.get('negative_cache_max_ttl_hours') or 168) * 3600
+
+    @staticmethod
+    def key(url):
+        domain = urlparse(url).netloc.lower()
+        if domain.startswith('www.'):
+            domain = domain[4:]
+        return domain, extract_asin(url)
+
+    def is_suppressed(self, url):
+        """Проверяет, исключен ли ASIN из сбора в данный момент."""
+        with self.lock:
+            entry = self.entries.get(self.key(url))
+            return bool(entry and entry['until'] and clock.time() < entry['until'])
 
-    parameters = ["BSR", "Number of Reviews", "Rating", "Price"]
+    def allow(self, url):
+        """Разрешает запрос, если ASIN не исключен или пора выполнить пробный запрос."""
+        with self.lock:
+            entry = self.entries.get(self.key(url))
+            if not entry or not entry['until']:
+                return True
+            if clock.time() < entry['until']:
+                entry['suppressed'] += 1
+                return False
+            logging.info(f"Пробный запрос для ранее недоступного ASIN {entry['asin']} ({entry['marketplace']}).")
+            return True
+
+    def record_failure(self, url, reason):
+        """Регистрирует неудачу, указывающую на недоступный товар (204, 404, нет товара на странице)."""
+        marketplace, asin = self.key(url)
+        with self.lock:
+            entry = self.entries.setdefault((marketplace, asin), {
+                'marketplace': marketplace, 'asin': asin, 'failures': 0,
+                'until': None, 'suppressed': 0, 'reason': reason, 'first_failure': clock.time(),
+            })
+            entry['failures'] += 1
+            entry['reason'] = reason
+            if entry['failures'] >= self.threshold:
+                ttl = min(self.base_ttl * 2 ** (entry['failures'] - self.threshold), self.max_ttl)
+                entry['until'] = clock.time() + ttl
+                logging.warning(f"ASIN {asin} ({marketplace}) исключен из сбора на {ttl / 3600:.1f} ч: {reason}, неудач подряд – {entry['failures']}.")
+
+    def record_success(self, url):
+        """Снимает ASIN с учета после успешного сбора."""
+        with self.lock:
+            entry = self.entries.pop(self.key(url), None)
+        if entry and entry['until']:
+            logging.info(f"ASIN {entry['asin']} ({entry['marketplace']}) снова доступен после {entry['failures']} неудач.")
+
+    def report(self):
+        """Список исключенных ASIN для отчета."""
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values() if entry['until']]
+        return sorted(entries, key=lambda entry: (entry['marketplace'], entry['asin']))
+
+    def log_report(self):
+        entries = self.report()
+        if not entries:
+            return
+        logging.info(f"Исключенные из сбора ASIN: {len(entries)}")
+        for entry in entries:
+            until = datetime.fromtimestamp(entry['until']).strftime('%d.%m.%Y %H:%M')
+            logging.info(
+                f"  {entry['marketplace']} {entry['asin']}: {entry['reason']}, неудач – {entry['failures']}, "
+                f"пропущено запросов – {entry['suppressed']}, проверка после {until}"
+            )
+
+
+negative_cache = NegativeCache()
+
+
+# Архив сырых ответов провайдеров (raw_archive.py), подпапка скрипта в raw_archive_dir
+response_archive = ResponseArchive('scraperapi', lambda: clock.time())
+
+
+@stage_metrics.timed('fetch')
+def fetch_product(job, config):
+    """Получает данные продукта (задание FetchJob) согласно плану обновления: полный сбор или кэш."""
+    url = job.url
+    if (job.marketplace, job.asin) in batch_results:
+        return batch_results[(job.marketplace, job.asin)]
+    if not negative_cache.allow(url):
+        return None
+
+    mode = refresh_planner.plan(url)
+    if mode == 'cache':
+        logging.info(f"Данные для {url} актуальны, используется кэш.")
+        return refresh_planner.get_cached(url)
+
+    if get_scraperapi_mode(config) == 'html':
+        product_info = scrape_amazon_product_scraperapi(job, config)
+    else:
+        product_info = scrape_amazon_product_structured(job, config)
+    if product_info:
+        refresh_planner.store_full(url, product_info)
+        negative_cache.record_success(url)
+    return product_info
 
-    # Получаем имя нашей компании
+
+def get_fetch_sources(config):
+    """Секции конфига в порядке сбора: (секция, компания, роль, список URL)."""
     our_company_name = config.get('company_name', 'Merino.tech. (Мы)')
+    sources = [
+        ('product_urls', our_company_name, 'parent', config.get('product_urls', [])),
+        ('variation_urls', our_company_name, 'variation', config.get('variation_urls', [])),
+    ]
+    for i in range(1, 6):
+        competitor_name = config.get(f'competitor_{i}_name')
+        if competitor_name:
+            sources.append((f'{i}competitor_urls', competitor_name, 'parent', config.get(f'{i}competitor_urls', [])))
+            sources.append((f'{i}variation_urls', competitor_name, 'variation', config.get(f'{i}variation_urls', [])))
+    return sources
+
+
+@stage_metrics.timed('gather')
+def gather_product_data(config):
+    """Функция для сбора данных по продуктам. Возвращает текущие результаты."""
+    sources = get_fetch_sources(config)
+    plan = build_fetch_plan(sources)
+    current_results = {company: [] for _, company, _, _ in sources}
+
+    refresh_planner.begin_cycle(config)
+    negative_cache.configure(config)
+    response_archive.configure(config)
+    batch_results.clear()
+
+    # В пакетном режиме все URL цикла собираются заранее асинхронными заданиями
+    if get_scraperapi_mode(config) == 'batch':
+        prefetch_batch(config, plan)
+
+    logging.info(f"План сбора: {len(plan)} URL.")
+    for job in plan:
+        role_label = 'Parent ASIN' if job.role == 'parent' else 'Variation ASIN'
+        logging.debug(f"Обработка {role_label} {job.asin} ({job.company}) по URL: {job.url}")
+        try:
+            product_info = fetch_product(job, config)
+            if product_info:
+                logging.info(f"Успешно собраны данные {role_label} для {job.company}: {job.url}")
+                current_results[job.company].append(product_info)
+                stage_metrics.inc('products_collected')
+            else:
+                logging.warning(f"Не удалось получить данные {role_label} для {job.company}: {job.url}")
+                stage_metrics.inc('products_failed')
+        except Exception as e:
+            logging.error(f"Ошибка при сборе данных {role_label} для {job.company} ({job.url}): {str(e)}")
+            stage_metrics.inc('products_failed')
+
+    refresh_planner.log_summary()
+    negative_cache.log_report()
+    block_tracker.log_summary()
+    return current_results
+
+
+# Разметка листа мониторинга: заголовок, подписи секций, строки агрегатов и гиперссылки.
+# Не зависит от собранных данных, поэтому строится один раз на версию конфига
+SheetLayout = namedtuple('SheetLayout', ['version', 'header', 'start_row', 'static_rows', 'asin_row_mapping_parent', 'asin_row_mapping_variations', 'aggregate_rows'])
 
-    # Получаем имена конкурентов из конфига
+MONITORING_PARAMETERS = ["BSR", "Number of Reviews", "Rating", "Price"]
+MONITORING_PRICE_TYPES = ["Price", "List Price", "Prime Price"]  # Убедитесь, что "Prime Price" включён
+
+# Агрегаты цен вариаций: подпись строки и статистика. Считаются локально и пишутся значениями.
+# Средняя цена стоит над вариациями группы, как в листах до появления остальных агрегатов;
+# остальные агрегаты идут в разделе VARIATION_STATS_TITLE после всех строк, чтобы строки листа не сдвигались
+PRICE_AGGREGATES = [
+    ("Средняя цена", 'mean'),
+    ("Мин. цена", 'min'),
+    ("Макс. цена", 'max'),
+    ("Медиана", 'median'),
+    ("Кол-во цен", 'count'),
+]
+VARIATION_STATS_TITLE = "Variations Price Stats"
+
+# Кэш разметки по имени листа
+sheet_layouts = {}
+
+
+def sheet_layout_version(config):
+    """
+    Версия разметки листа: заголовок и задания parent/variation секций.
+    Меняется только при изменении слотов, компаний или списков URL в конфиге.
+    """
+    header = [
+        "Наименование", "Параметры", "Данные"
+    ] + config.get('active_trade_slots', []) + ["Зона анализа"] + config.get('analysis_slots', [])
+    header = tuple(slot.strip() if isinstance(slot, str) else slot for slot in header)
+
+    our_company_name = config.get('company_name', 'Merino.tech. (Мы)')
     competitor_names = config.get('competitor_names', {})
-    companies = [(section, our_company_name) for section in ['product_urls']]
+    companies = [('product_urls', our_company_name)]
+    variations_sections = [('variation_urls', our_company_name)]
     for i in range(1, 6):
         competitor_name = competitor_names.get(str(i))
         if competitor_name:
             companies.append((f'{i}competitor_urls', competitor_name))
+            variations_sections.append((f'{i}variation_urls', competitor_name))
 
-    data_to_write = []
+    parent_sections = tuple(
+        (company_name, compile_fetch_jobs(section, company_name, 'parent', tuple(config.get(section, []))))
+        for section, company_name in companies
+    )
+    variation_sections = tuple(
+        (company_name, compile_fetch_jobs(section, company_name, 'variation', tuple(config.get(section, []))))
+        for section, company_name in variations_sections
+    )
+    return header, parent_sections, variation_sections
 
-    data_to_write.append(["Parent ASIN"])
+
+def build_sheet_layout(version, start_row=3):
+    """Строит статические строки листа (A:C) и номера строк для значений и агрегатов."""
+    header, parent_sections, variation_sections = version
+    current_row = start_row
+    static_rows = []
+
+    static_rows.append(["Parent ASIN"])
     current_row += 1
 
     asin_row_mapping_parent = {}
 
-    for param in parameters:
-        data_to_write.append([param])
+    for param in MONITORING_PARAMETERS:
+        static_rows.append([param])
         current_row += 1
 
-        for section, company_name in companies:
-            urls = config.get(section, [])
-            if urls:
-                for url in urls:
-                    asin = extract_asin(url)
-                    logging.debug(f"Обработка URL: {url}, извлеченный ASIN: {asin}, компания: {company_name}")
-
-                    product_info = next((prod for prod in data.get(company_name, []) if prod.get('ASIN') == asin), {})
-
-                    if not product_info:
-                        asin_display = 'Not Found'
-                        param_value = None
-                    else:
-                        asin_display = asin
-                        param_value = product_info.get(param, None)
-                        if isinstance(param_value, str) and param_value.lower() == "not found":
-                            param_value = None
-
-                    hyperlink_formula = f'=HYPERLINK("{url}", "{asin_display}")' if asin_display != "Not Found" else asin_display
-                    data_to_write.append([company_name, hyperlink_formula, param_value])
-                    asin_row_mapping_parent[(company_name, asin, param)] = current_row
-                    current_row += 1
-
-    data_to_write.append(["Variations ASIN"])
-    current_row += 1
-
-    variations_sections = [(section, our_company_name) for section in ['variation_urls']]
-    for i in range(1, 6):
-        competitor_name = competitor_names.get(str(i))
-        if competitor_name:
-            variations_sections.append((f'{i}variation_urls', competitor_name))
+        for company_name, jobs in parent_sections:
+            for job in jobs:
+                hyperlink_formula = f'=HYPERLINK("{job.url}", "{job.asin}")' if job.asin != "Not Found" else job.asin
+                # Значение в колонке "Данные" пишется при каждом обновлении слота
+                static_rows.append([company_name, hyperlink_formula, None])
+                asin_row_mapping_parent[(company_name, job.asin, param)] = current_row
+                current_row += 1
 
-    price_types = ["Price", "List Price", "Prime Price"]  # Убедитесь, что "Prime Price" включён
+    static_rows.append(["Variations ASIN"])
+    current_row += 1
 
     asin_row_mapping_variations = {}
-    average_row_mapping = {}
+    aggregate_rows = []
 
-    for price_type in price_types:
-        data_to_write.append([price_type])
+    for price_type in MONITORING_PRICE_TYPES:
+        static_rows.append([price_type])
         current_row += 1
 
-        for section, company_name in variations_sections:
-            urls = config.get(section, [])
-            if urls:
-                temp_asin_rows = []
-                num_variations = 0
+        for company_name, jobs in variation_sections:
+            if not jobs:
+                continue
 
-                formula_row = current_row
+            # Строка средней цены; значения агрегатов пишутся при каждом обновлении слота
+            mean_label, mean_stat = PRICE_AGGREGATES[0]
+            static_rows.append([company_name, mean_label, None])
+            aggregate_rows.append((company_name, price_type, tuple(job.asin for job in jobs), {mean_stat: current_row}))
+            current_row += 1
 
-                # Добавляем строку для средней цены в колонку "Данные"
-                data_to_write.append([company_name, "Средняя цена", ""])
+            for job in jobs:
+                hyperlink_formula = f'=HYPERLINK("{job.url}", "{job.asin}")' if job.asin != "Not Found" else job.asin
+                static_rows.append([company_name, hyperlink_formula, None])
+                asin_row_mapping_variations[(company_name, job.asin, price_type)] = current_row
                 current_row += 1
 
-                # Сохраняем номер строки для формулы средней цены
-                average_row_number = current_row - 1
-                average_row_mapping[(company_name, price_type)] = average_row_number
+    # Остальные агрегаты - после всех строк вариаций
+    if aggregate_rows:
+        static_rows.append([VARIATION_STATS_TITLE])
+        current_row += 1
+    for price_type in MONITORING_PRICE_TYPES:
+        groups = [group for group in aggregate_rows if group[1] == price_type]
+        if not groups:
+            continue
+        static_rows.append([price_type])
+        current_row += 1
+        for company_name, _, _, stat_rows in groups:
+            for label, stat in PRICE_AGGREGATES[1:]:
+                static_rows.append([company_name, label, None])
+                stat_rows[stat] = current_row
+                current_row += 1
 
-                for url in urls:
-                    asin = extract_asin(url)
-                    logging.debug(f"Обработка вариации URL: {url}, извлеченный ASIN: {asin}, компания: {company_name}")
+    return SheetLayout(
+        version=version,
+        header=list(header),
+        start_row=start_row,
+        static_rows=static_rows,
+        asin_row_mapping_parent=asin_row_mapping_parent,
+        asin_row_mapping_variations=asin_row_mapping_variations,
+        aggregate_rows=aggregate_rows,
+    )
 
-                    product_info = next((prod for prod in data.get(company_name, []) if prod.get('ASIN') == asin), {})
 
-                    if not product_info:
-                        price_value = None
-                    else:
-                        price_value = product_info.get(price_type, None)
-                        if isinstance(price_value, str) and price_value.lower() == "not found":
-                            price_value = None
+def get_sheet_layout(sheet_name, config):
+    """Возвращает (разметка, изменилась ли она) для листа; разметка перестраивается только при смене версии конфига."""
+    version = sheet_layout_version(config)
+    layout = sheet_layouts.get(sheet_name)
+    if layout is not None and layout.version == version:
+        return layout, False
 
-                    hyperlink_formula = f'=HYPERLINK("{url}", "{asin}")' if asin != "Not Found" else asin
+    layout = build_sheet_layout(version)
+    sheet_layouts[sheet_name] = layout
+    logging.info(f"Разметка листа '{sheet_name}' построена заново: {len(layout.static_rows)} строк.")
+    return layout, True
 
-                    if isinstance(price_value, (int, float)):
-                        price_display = f"${price_value:.2f}"
-                    elif isinstance(price_value, str):
-                        price_display = price_value
-                    else:
-                        price_display = None
 
-                    temp_asin_rows.append([company_name, hyperlink_formula, price_display])
-                    asin_row_mapping_variations[(company_name, asin, price_type)] = current_row
-                    current_row += 1
-                    num_variations += 1
+def compute_price_aggregates(data, aggregate_rows):
+    """
+    Считает агрегаты цен вариаций (mean, min, max, median, count) для всех групп
+    (компания, тип цены) одним векторным проходом NumPy.
+    Цены разбираются в float, нечисловые и отсутствующие значения не учитываются.
+    Возвращает {(компания, тип цены): {статистика: значение}}; пустые группы получают "".
+    """
+    if not aggregate_rows:
+        return {}
 
-                data_to_write.extend(temp_asin_rows)
+    products = {
+        (company_name, product.get('ASIN')): product
+        for company_name, items in data.items()
+        for product in items
+    }
+    width = max(len(asins) for _, _, asins, _ in aggregate_rows) or 1
+    prices = np.full((len(aggregate_rows), width), np.nan)
+    for i, (company_name, price_type, asins, _) in enumerate(aggregate_rows):
+        for j, asin in enumerate(asins):
+            product = products.get((company_name, asin))
+            if product:
+                prices[i, j] = parse_numeric_value(product.get(price_type))
+
+    valid = ~np.isnan(prices)
+    counts = valid.sum(axis=1)
+    has_values = counts > 0
+    totals = np.where(valid, prices, 0.0).sum(axis=1)
+    means = np.divide(totals, counts, out=np.full(counts.shape, np.nan), where=has_values)
+    minimums = np.fmin.reduce(prices, axis=1)
+    maximums = np.fmax.reduce(prices, axis=1)
+    # NaN сортируются в конец строки, поэтому медиана берется из первых count элементов
+    ordered = np.sort(prices, axis=1)
+    lower = np.take_along_axis(ordered, np.maximum((counts - 1) // 2, 0)[:, None], axis=1)[:, 0]
+    upper = np.take_along_axis(ordered, np.maximum(counts // 2, 0)[:, None], axis=1)[:, 0]
+    medians = np.where(has_values, (lower + upper) / 2, np.nan)
+
+    columns = {'mean': means, 'min': minimums, 'max': maximums, 'median': medians}
+    aggregates = {}
+    for i, (company_name, price_type, _, _) in enumerate(aggregate_rows):
+        stats = {'count': int(counts[i])}
+        for stat, values in columns.items():
+            stats[stat] = round(float(values[i]), 2) if has_values[i] else ""
+        aggregates[(company_name, price_type)] = stats
+    return aggregates
+
+
+@stage_metrics.timed('sheets_update')
+def update_monitoring_sheet(spreadsheet, data, current_time_slot, config, sheet_name, cycle_time=None):
+    """
+    Обновляет данные на указанном листе Google Sheets и применяет форматирование.
+    cycle_time - время сбора данных; по нему выбирается временной слот (по умолчанию текущее время).
+    Заголовок, подписи и гиперссылки записываются только при изменении разметки,
+    в остальных циклах обновляются лишь колонка "Данные" и колонка слота.
+    Возвращает True, если данные записаны.
+    """
+    from openpyxl.utils import get_column_letter
 
-                # Обновляем формулу средней цены в колонке "Данные" (C-колонка)
-                first_price_row = formula_row + 1
-                last_price_row = formula_row + num_variations
-                price_range = f"C{first_price_row}:C{last_price_row}"
-                average_formula = f'=AVERAGE(FILTER({price_range}, {price_range}<>""))'
+    try:
+        sheet = spreadsheet.worksheet(sheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        logging.error(f"Лист '{sheet_name}' не найден в таблице.")
+        return False
 
-                data_to_write[formula_row - start_row][2] = average_formula
+    layout, layout_changed = get_sheet_layout(sheet_name, config)
+    header = layout.header
+    start_row = layout.start_row
 
-    end_row = start_row + len(data_to_write) - 1
-    range_notation = f'{sheet_name}!A{start_row}:C{end_row}'
+    logging.debug(f"Текущий временной слот: '{current_time_slot}'")
+    logging.debug(f"Заголовки таблицы: {header}")
+
+    value_ranges = []
+    if layout_changed:
+        end_row = start_row + len(layout.static_rows) - 1
+        value_ranges.append({
+            'range': f'{sheet_name}!A1',
+            'values': [header]
+        })
+        value_ranges.append({
+            'range': f'{sheet_name}!A{start_row}:C{end_row}',
+            'values': layout.static_rows
+        })
+
+    # Получаем текущее время в формате "YYYY-MM-DD HH:MM:SS" в указанном часовом поясе
+    current_time = cycle_time or get_kyiv_time(config.get('timezone', 'Europe/Kiev'))
+    current_time_formatted = current_time.strftime("%Y-%m-%d %H:%M:%S")
+    current_time_slot_formatted = current_time.strftime("%H:%M")
 
+    # Добавляем запись текущего времени на 2-ю строку в колонку "Данные"
+    time_notation = f'{sheet_name}!C2'  # Ячейка C2 (строка 2, колонка "Данные")
     value_ranges.append({
-        'range': range_notation,
-        'values': data_to_write
+        'range': time_notation,
+        'values': [[current_time_formatted]]  # Записываем текущее время
     })
 
     # Определяем колонку 'Данные' (C)
     data_column_index = header.index("Данные") + 1
     data_column_letter = get_column_letter(data_column_index)
 
-    # Определяем ближайший временной слот
+    # Слот, назначенный планировщиком, иначе ближайший к времени сбора
     all_slots = config.get('active_trade_slots', []) + config.get('analysis_slots', [])
-    nearest_slot = find_nearest_slot(current_time_slot_formatted, all_slots)
+    if current_time_slot and current_time_slot in header:
+        nearest_slot = current_time_slot
+    else:
+        nearest_slot = find_nearest_slot(current_time_slot_formatted, all_slots)
     if nearest_slot and nearest_slot in header:
         slot_column_index = header.index(nearest_slot) + 1
         slot_column_letter = get_column_letter(slot_column_index)
@@ -1219,7 +3181,7 @@ def update_monitoring_sheet(spreadsheet, data, current_time_slot, config, sheet_
                 return prod
         return None
 
-    for (company_name, asin, param), row_number in asin_row_mapping_parent.items():
+    for (company_name, asin, param), row_number in layout.asin_row_mapping_parent.items():
         product_info = find_product_info(data, company_name, asin)
         if product_info:
             value = product_info.get(param, None)
@@ -1241,7 +3203,7 @@ def update_monitoring_sheet(spreadsheet, data, current_time_slot, config, sheet_
                     'values': [[value]]
                 })
 
-    for (company_name, asin, price_type), row_number in asin_row_mapping_variations.items():
+    for (company_name, asin, price_type), row_number in layout.asin_row_mapping_variations.items():
         product_info = find_product_info(data, company_name, asin)
         if product_info:
             price_value = product_info.get(price_type, None)
@@ -1265,35 +3227,23 @@ def update_monitoring_sheet(spreadsheet, data, current_time_slot, config, sheet_
                     'values': [[price_value]]
                 })
 
-    # Обновление формулы средней цены в соответствующих колонках
-    for (company_name, price_type), row_number in average_row_mapping.items():
-        variation_rows = [row_num for (comp, asin, ptype), row_num in asin_row_mapping_variations.items()
-                          if comp == company_name and ptype == price_type]
-
-        if variation_rows:
-            first_row = min(variation_rows)
-            last_row = max(variation_rows)
-
-            # Формула для колонки 'Данные'
-            data_price_range = f'{data_column_letter}{first_row}:{data_column_letter}{last_row}'
-            average_formula_data = f'=AVERAGE(FILTER({data_price_range}, {data_price_range}<>""))'
-            data_cell_notation = f'{sheet_name}!{data_column_letter}{row_number}'
+    # Агрегаты цен вариаций считаются локально и пишутся значениями в колонку 'Данные' и слот
+    aggregates = compute_price_aggregates(data, layout.aggregate_rows)
+    for company_name, price_type, _, stat_rows in layout.aggregate_rows:
+        stats = aggregates[(company_name, price_type)]
+        for stat, row_number in stat_rows.items():
             slot_updates.append({
-                'range': data_cell_notation,
-                'values': [[average_formula_data]]
+                'range': f'{sheet_name}!{data_column_letter}{row_number}',
+                'values': [[stats[stat]]]
             })
-
-            # Формула для ближайшего временного слота
             if slot_column_letter:
-                slot_price_range = f'{slot_column_letter}{first_row}:{slot_column_letter}{last_row}'
-                average_formula_slot = f'=AVERAGE(FILTER({slot_price_range}, {slot_price_range}<>""))'
-                slot_cell_notation = f'{sheet_name}!{slot_column_letter}{row_number}'
                 slot_updates.append({
-                    'range': slot_cell_notation,
-                    'values': [[average_formula_slot]]
+                    'range': f'{sheet_name}!{slot_column_letter}{row_number}',
+                    'values': [[stats[stat]]]
                 })
 
     value_ranges.extend(slot_updates)
+    logging.debug(f"Диапазонов к записи: {len(value_ranges)} (разметка {'записывается' if layout_changed else 'из кэша'}).")
 
     try:
         data_body = {
@@ -1303,46 +3253,149 @@ def update_monitoring_sheet(spreadsheet, data, current_time_slot, config, sheet_
         spreadsheet.values_batch_update(data_body)
         logging.info(f"Данные успешно обновлены в листе '{sheet_name}' Google Sheets.")
 
-        # Применение форматирования
-        apply_formatting(sheet, header, start_row, len(data_to_write))
+        # Форматирование зависит только от разметки
+        if layout_changed:
+            apply_formatting(sheet, header, start_row, len(layout.static_rows))
 
-    except APIError as e:
+    except gspread.exceptions.APIError as e:
         logging.error(f"Ошибка API при обновлении Google Sheets: {str(e)}")
         retry_delay = 60
         logging.info(f"Попытка повторного обновления через {retry_delay} секунд...")
-        time.sleep(retry_delay)
+        clock.sleep(retry_delay)
         try:
             spreadsheet.values_batch_update(data_body)
             logging.info(f"Данные успешно обновлены в листе '{sheet_name}' Google Sheets после повторной попытки.")
+            if layout_changed:
+                apply_formatting(sheet, header, start_row, len(layout.static_rows))
         except Exception as e2:
             logging.error(f"Не удалось обновить Google Sheets после повторной попытки: {str(e2)}")
+            # Разметка могла не записаться: в следующем цикле она будет записана заново
+            sheet_layouts.pop(sheet_name, None)
+            return False
     except Exception as e:
         logging.error(f"Ошибка при обновлении Google Sheets: {str(e)}")
+        sheet_layouts.pop(sheet_name, None)
+        return False
+    return True
+
+class SinkExecutor:
+    """
+    Фоновый исполнитель записи результатов (Google Sheets, Telegram/XLSX).
+    У каждого sink своя ограниченная очередь и свой поток, поэтому задачи одного sink
+    выполняются по порядку, а сбор данных для следующего листа не ждет записи.
+    """
+    def __init__(self, max_queue_size=10):
+        self.max_queue_size = max_queue_size
+        self.queues = {}
+        self.workers = {}
+        self.metrics = {}
+        self.lock = Lock()
 
-def update_google_sheets(current_results, spreadsheet_id, config, sheet_name, credentials_file):
-    """Обновление Google Sheets данными из current_results."""
+    def submit(self, sink, func, *args, **kwargs):
+        """
+        Ставит задачу в очередь sink. Если очередь заполнена, ждет освобождения места.
+        Задача, вернувшая False, считается неудачной так же, как завершившаяся исключением.
+        """
+        with self.lock:
+            if sink not in self.queues:
+                self.queues[sink] = queue.Queue(maxsize=self.max_queue_size)
+                self.metrics[sink] = {
+                    'submitted': 0, 'completed': 0, 'failed': 0,
+                    'last_lag': 0.0, 'max_lag': 0.0, 'last_duration': 0.0,
+                }
+                self.workers[sink] = Thread(target=self._run, args=(sink,), name=f'sink-{sink}', daemon=True)
+                self.workers[sink].start()
+            self.metrics[sink]['submitted'] += 1
+            sink_queue = self.queues[sink]
+        if sink_queue.full():
+            logging.warning(f"Очередь записи '{sink}' заполнена, ожидаем освобождения места.")
+        sink_queue.put((time.time(), func, args, kwargs))
+
+    def _run(self, sink):
+        sink_queue = self.queues[sink]
+        while True:
+            submitted_at, func, args, kwargs = sink_queue.get()
+            started_at = time.time()
+            failed = False
+            try:
+                failed = func(*args, **kwargs) is False
+            except Exception as e:
+                failed = True
+                logging.error(f"Ошибка в фоновой задаче '{sink}': {str(e)}")
+            finally:
+                finished_at = time.time()
+                with self.lock:
+                    metrics = self.metrics[sink]
+                    metrics['failed' if failed else 'completed'] += 1
+                    metrics['last_lag'] = started_at - submitted_at
+                    metrics['max_lag'] = max(metrics['max_lag'], metrics['last_lag'])
+                    metrics['last_duration'] = finished_at - started_at
+                sink_queue.task_done()
+
+    def get_metrics(self):
+        """
+        Возвращает метрики по каждому sink: количество задач, глубину очереди,
+        задержку запуска последней задачи (lag) и ее длительность в секундах.
+        """
+        with self.lock:
+            return {
+                sink: dict(metrics, pending=self.queues[sink].unfinished_tasks)
+                for sink, metrics in self.metrics.items()
+            }
+
+    def log_metrics(self):
+        """Записывает метрики очередей в лог."""
+        for sink, metrics in self.get_metrics().items():
+            logging.info(
+                f"Очередь '{sink}': в ожидании {metrics['pending']}, выполнено {metrics['completed']}, "
+                f"ошибок {metrics['failed']}, lag {metrics['last_lag']:.1f} с (макс. {metrics['max_lag']:.1f} с), "
+                f"длительность {metrics['last_duration']:.1f} с"
+            )
+
+    def flush(self, timeout=None, exclude=()):
+        """Ждет выполнения всех поставленных задач, кроме очередей exclude. Возвращает True, если очереди пусты."""
+        deadline = time.time() + timeout if timeout is not None else None
+        while any(sink_queue.unfinished_tasks for sink, sink_queue in list(self.queues.items()) if sink not in exclude):
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+
+# Общий фоновый исполнитель записи результатов
+sink_executor = SinkExecutor()
+
+def update_google_sheets(current_results, spreadsheet_id, config, sheet_name, credentials_file, cycle_time=None, slot=None):
+    """
+    Обновление Google Sheets данными из current_results.
+    slot - временной слот ("HH:MM"), назначенный планировщиком; данные записываются в его колонку.
+    Возвращает True, если данные записаны.
+    """
     try:
         client = authorize_google_sheets(credentials_file)
         spreadsheet = client.open_by_key(spreadsheet_id)
         
         # Получаем текущее время в формате HH:MM
-        current_time_formatted = get_kyiv_time().strftime('%H:%M')
+        current_time_formatted = (cycle_time or get_kyiv_time()).strftime('%H:%M')
         
         all_slots = config.get('active_trade_slots', []) + config.get('analysis_slots', [])
         
-        if current_time_formatted in all_slots:
+        if slot:
+            current_time_slot = slot
+        elif current_time_formatted in all_slots:
             current_time_slot = current_time_formatted
         else:
             current_time_slot = None  # Текущее время не совпадает с временными слотами
 
-        update_monitoring_sheet(spreadsheet, current_results, current_time_slot, config, sheet_name)
+        return update_monitoring_sheet(spreadsheet, current_results, current_time_slot, config, sheet_name, cycle_time)
 
-    except APIError as e:
+    except gspread.exceptions.APIError as e:
         logging.error(f"Ошибка API при обновлении Google Sheets: {str(e)}")
+        return False
 
-def find_credentials_file():
-    """Пытается найти файл учетных данных по нескольким возможным путям."""
-    possible_paths = [
+def find_credentials_file(path=None):
+    """Пытается найти файл учетных данных по нескольким возможным путям; path - явно заданный файл (--credentials)."""
+    possible_paths = [path] if path else [
         os.path.join(os.path.expanduser('~'), 'Downloads', 'maximumstores53-24d4ef8c1298.json'),
         os.path.join(os.getcwd(), 'maximumstores53-24d4ef8c1298.json'),
         'maximumstores53-24d4ef8c1298.json'
@@ -1356,16 +3409,52 @@ def find_credentials_file():
     logging.error("Файл учетных данных не найден ни в одном из возможных путей.")
     return None
 
-def main():
-    """Основная функция скрипта."""
+# ID таблицы Google Sheets по умолчанию
+SPREADSHEET_ID = '1ibuYnN9WeRZdHUqoiU2jFLez59fm5Gfgzeyvq7M4EaI'
+
+
+def parse_args(argv=None):
+    """
+    Разбирает аргументы командной строки.
+    run - цикл сразу при запуске, затем по расписанию (поведение по умолчанию, без подкоманды);
+    run --once - один цикл и выход (для cron и таймеров systemd); daemon - только запуски по расписанию.
+    """
+    parser = argparse.ArgumentParser(description='Check Product Monitor (ScraperAPI): сбор данных о продуктах Amazon в Google Sheets.')
+    subparsers = parser.add_subparsers(dest='command')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--spreadsheet', default=SPREADSHEET_ID, help='ID таблицы Google Sheets.')
+    common.add_argument('--credentials', help='Файл учетных данных сервисного аккаунта (по умолчанию ищется автоматически).')
+    common.add_argument('--sheets', help='Листы через запятую (имя листа данных или конфига); по умолчанию все из Config.')
+    common.add_argument('--concurrency', type=int, help='Лимит запросов к провайдеру в секунду (api_limiter).')
+    common.add_argument('--dry-run', action='store_true', help='Не писать в Google Sheets и Telegram, сохранить XLSX-отчет в рабочую папку.')
+    run_parser = subparsers.add_parser('run', parents=[common], help='Цикл сразу при запуске, затем по расписанию.')
+    run_parser.add_argument('--once', action='store_true', help='Один цикл и выход.')
+    run_parser.add_argument('--slot', help='Слот "HH:MM", в который записываются данные (по умолчанию ближайший).')
+    daemon_parser = subparsers.add_parser('daemon', parents=[common], help='Только запуски по расписанию слотов.')
+    daemon_parser.set_defaults(once=False, slot=None)
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in ('run', 'daemon', '-h', '--help'):
+        argv = ['run'] + argv
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Основная функция скрипта. Возвращает код завершения (для cron и systemd)."""
+    args = parse_args(argv)
+
     # Поиск файла учетных данных Google Sheets
-    credentials_file = find_credentials_file()
+    credentials_file = find_credentials_file(args.credentials)
     if not credentials_file:
         logging.critical("Не удалось найти файл учетных данных.")
-        return
+        return 1
 
     # ID таблицы Google Sheets
-    spreadsheet_id = '1ibuYnN9WeRZdHUqoiU2jFLez59fm5Gfgzeyvq7M4EaI'
+    spreadsheet_id = args.spreadsheet
+
+    # Лимит запросов к провайдеру
+    if args.concurrency:
+        api_limiter.max_requests = args.concurrency
 
     # Авторизация и загрузка основного конфига
     try:
@@ -1373,7 +3462,14 @@ def main():
         main_config = load_config_from_sheets(client, spreadsheet_id)
     except Exception as e:
         logging.critical(f"Не удалось авторизоваться или загрузить основной конфиг: {e}")
-        return
+        return 1
+
+    # Метрики Prometheus на локальном порту, если он задан в конфиге (для однократного запуска не нужны)
+    if main_config.get('metrics_port') and not args.once:
+        start_metrics_server(main_config['metrics_port'])
+
+    # Профилирование по сигналу SIGUSR1 или файлу-флагу
+    cycle_profiler.install(main_config)
 
     # Извлечение соответствий между конфигурационными листами и листами данных
     config_sheet_mappings = []
@@ -1389,9 +3485,14 @@ def main():
         else:
             continue  # Если одно из значений отсутствует, пропускаем
 
+    # Подмножество листов из --sheets: по имени листа данных или листа конфига
+    if args.sheets:
+        selected_sheets = {name.strip() for name in args.sheets.split(',') if name.strip()}
+        config_sheet_mappings = [mapping for mapping in config_sheet_mappings if selected_sheets & set(mapping)]
+
     if not config_sheet_mappings:
         logging.error("Не найдены конфигурационные листы в основном конфиге.")
-        return
+        return 1
 
     # Получение времени обновления из конфигурации
     update_hour = int(main_config.get('update_time_hour', 0))
@@ -1411,8 +3512,14 @@ def main():
 
     logging.info(f"Все временные слоты: {all_slots}")
 
-    def run_tasks():
-        """Выполняет сбор данных и обновление для каждого листа."""
+    def run_tasks(slot=None):
+        """
+        Выполняет сбор данных и обновление для каждого листа. slot - целевой слот "HH:MM".
+        Возвращает число листов, обработка которых завершилась ошибкой.
+        """
+        failed_sheets = 0
+        stage_metrics.begin_cycle(slot)
+        cycle_profiler.on_cycle_start()
         for config_sheet_name, data_sheet_name in config_sheet_mappings:
             try:
                 # Загрузка конфига для листа
@@ -1424,56 +3531,81 @@ def main():
 
                 # Выполнение сбора данных
                 current_results = gather_product_data(config)
+                cycle_time = get_kyiv_time(timezone_str)
+
+                # Обновление Google Sheets в фоне; при пробном запуске - только XLSX-отчет
+                if args.dry_run:
+                    sink_executor.submit(
+                        'sheets',
+                        save_dry_run_report,
+                        current_results,
+                        cycle_time.strftime('%Y-%m-%d %H:%M:%S'),
+                        data_sheet_name
+                    )
+                else:
+                    sink_executor.submit(
+                        'sheets',
+                        update_google_sheets,
+                        current_results,
+                        spreadsheet_id,
+                        config,
+                        data_sheet_name,
+                        credentials_file,
+                        cycle_time,
+                        slot
+                    )
 
-                # Обновление Google Sheets
-                update_google_sheets(
-                    current_results,
-                    spreadsheet_id,
-                    config,
-                    data_sheet_name,
-                    credentials_file
-                )
-
-                # Отправка уведомлений в Telegram
-                if current_results:
-                    current_time_slot = get_kyiv_time(timezone_str).strftime('%Y-%m-%d %H:%M:%S')
-                    send_telegram_notification(
+                # Проверка правил оповещений и отправка уведомлений в Telegram в фоне
+                if current_results and not args.dry_run:
+                    alerts = evaluate_alert_rules(get_alert_rules(config), current_results, config['company_name'])
+                    current_time_slot = cycle_time.strftime('%Y-%m-%d %H:%M:%S')
+                    sink_executor.submit(
+                        'telegram',
+                        send_telegram_notification,
                         config,
                         current_time_slot,
-                        current_results
+                        current_results,
+                        alerts
                     )
 
-                logging.info(f"Обработка листа '{data_sheet_name}' успешно завершена.")
+                logging.info(f"Сбор данных для листа '{data_sheet_name}' завершен, запись поставлена в очередь.")
 
             except Exception as e:
                 logging.error(f"Ошибка при обработке листа '{data_sheet_name}': {e}")
-
-    # **Выполняем задачи сразу при запуске скрипта**
-    run_tasks()
+                failed_sheets += 1
+
+        sink_executor.log_metrics()
+        return failed_sheets
+
+    # run --once: один цикл, ожидание фоновой записи и выход с кодом ошибки, если лист не обработан
+    # или не записан в таблицу, либо не доставлено сообщение в Telegram
+    if args.once:
+        failed_sheets = run_tasks(args.slot)
+        finish_metrics_cycle(main_config)
+        sink_failures = wait_for_sinks()
+        return 1 if failed_sheets or sink_failures else 0
+
+    # run: выполняем задачи сразу при запуске скрипта; daemon - только по расписанию
+    if args.command == 'run':
+        run_tasks()
+        finish_metrics_cycle(main_config)
+
+    # Планировщик слотов: старт с упреждением, явная обработка пропущенных слотов
+    lead_minutes = main_config.get('prefetch_lead_minutes')
+    scheduler = SlotScheduler(
+        all_slots,
+        timezone_str,
+        lead_seconds=lead_minutes * 60 if lead_minutes is not None else None,
+        overrun_policy=main_config.get('overrun_policy', 'skip')
+    )
 
     # Цикл регулярных запусков
-    while True:
-        try:
-            current_time = get_kyiv_time(timezone_str)
-            logging.info(f"Текущее время: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-            # Определение ближайшего следующего слота
-            next_slot_time = get_next_slot(current_time, all_slots, timezone_str)
-            logging.info(f"Следующий слот: {next_slot_time.strftime('%Y-%m-%d %H:%M')}")
-
-            # Вычисление времени до следующего слота
-            time_to_wait = (next_slot_time - current_time).total_seconds()
-
-            if time_to_wait > 0:
-                logging.info(f"Ждем {time_to_wait / 60:.2f} минут до следующего слота.")
-                time.sleep(time_to_wait)
-
-            # После пробуждения выполняем задачи
-            run_tasks()
-
-        except Exception as e:
-            logging.error(f"Ошибка в основном цикле: {e}")
-            time.sleep(60)  # Ждем минуту перед повторной попыткой
+    run_schedule(
+        scheduler,
+        lambda slot_time: run_tasks(slot_time.strftime('%H:%M')),
+        timezone_str,
+        after_slot=lambda: finish_metrics_cycle(main_config)
+    )
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
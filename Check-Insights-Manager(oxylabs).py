@@ -1,32 +1,99 @@
 import time
 import logging
 from datetime import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import requests
 import re
 from urllib.parse import urlparse, parse_qs
 import os
-from threading import Lock
+from threading import Lock, Thread, Event, get_ident
+import queue
 import ast
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill
-from openpyxl.utils import get_column_letter
-import telebot
+from functools import lru_cache, wraps
+from contextlib import contextmanager
 import random
-import pytz
+import math
+import signal
+import sys
+import argparse
+import importlib.util
 import json
-from gspread.exceptions import APIError
-from bs4 import BeautifulSoup  # Добавлено для парсинга HTML, если потребуется
+import io
 from datetime import datetime, timedelta
-from openpyxl.utils import get_column_letter
-import gspread_formatting as gf
-from gspread_formatting import *
-from google.oauth2.service_account import Credentials
+from collections import deque, namedtuple
+from logging.handlers import RotatingFileHandler
+
+from raw_archive import ResponseArchive
+
+
+class LazyModule:
+    """
+    Модуль, который импортируется при первом обращении к атрибуту.
+    Google Sheets, Telegram, numpy и разбор HTML нужны не каждому запуску, а их импорт занимает сотни миллисекунд.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# Тяжелые зависимости импортируются при первом использовании
+gspread = LazyModule('gspread')
+requests = LazyModule('requests')
+telebot = LazyModule('telebot')
+pytz = LazyModule('pytz')
+np = LazyModule('numpy')
+cProfile = LazyModule('cProfile')
+pstats = LazyModule('pstats')
+
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+class Clock:
+    """Источник текущего времени и ожидания для планировщика, лимитеров и повторных попыток."""
+    def time(self):
+        return time.time()
+
+    def now(self, timezone):
+        return datetime.now(timezone)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """
+    Часы симуляции: ожидание не блокирует, а сразу сдвигает время вперед, поэтому сутки слотов
+    проходят за секунды. Реальное время работы (запросы, разбор) тоже идет в счет и умножается
+    на work_scale. start - время начала симуляции (timestamp).
+    """
+    def __init__(self, start, work_scale=1.0):
+        self.lock = Lock()
+        self.start = start
+        self.work_scale = work_scale
+        self.slept = 0.0
+        self.real_started = time.perf_counter()
+
+    def time(self):
+        with self.lock:
+            return self.start + self.slept + (time.perf_counter() - self.real_started) * self.work_scale
+
+    def now(self, timezone):
+        return datetime.fromtimestamp(self.time(), timezone)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.slept += seconds
+
+
+# Часы скрипта; для симуляции заменяются на SimulatedClock
+clock = Clock()
+
 class APIRateLimiter:
     """Класс для ограничения количества запросов к API."""
     def __init__(self, max_requests, period):
@@ -38,21 +105,608 @@ class APIRateLimiter:
     def wait(self):
         """Ожидание перед следующим запросом, если достигнут лимит."""
         with self.lock:
-            now = time.time()
+            now = clock.time()
             # Удаляем устаревшие запросы
             self.requests = [r for r in self.requests if r > now - self.period]
             while len(self.requests) >= self.max_requests:
                 next_request_time = self.requests[0] + self.period
                 sleep_time = max(next_request_time - now, 0)
                 logging.debug(f"Достигнут лимит запросов. Спим {sleep_time:.2f} секунд.")
-                time.sleep(sleep_time)
-                now = time.time()
+                clock.sleep(sleep_time)
+                now = clock.time()
                 self.requests = [r for r in self.requests if r > now - self.period]
             self.requests.append(now)
 
 # Настройка лимитера на 1 запрос в секунду
 api_limiter = APIRateLimiter(max_requests=1, period=1)  # 1 запрос в секунду
 
+# Префикс имен метрик Prometheus и файл JSON-сводок циклов по умолчанию
+METRICS_PREFIX = 'check_insights_manager'
+DEFAULT_METRICS_SUMMARY_FILE = 'cycle_metrics.jsonl'
+# Ротация файла сводок - как у scraper.log
+METRICS_SUMMARY_MAX_BYTES = 5 * 1024 * 1024
+METRICS_SUMMARY_BACKUP_COUNT = 5
+
+
+class StageMetrics:
+    """
+    Таймеры и счетчики этапов цикла: сбор, запросы к провайдеру, разбор, запись в таблицу,
+    форматирование, XLSX и Telegram. Накопительные значения отдаются в формате Prometheus,
+    значения текущего цикла записываются в JSON-сводку (одна строка на цикл).
+    """
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self.lock = Lock()
+        self.stages = {}  # этап -> {'calls', 'errors', 'seconds', 'max_seconds', 'last_seconds'}
+        self.counters = {}
+        self.cycle_stages = {}
+        self.cycle_counters = {}
+        self.active_stages = {}  # id потока -> стек текущих этапов (для профилировщика)
+        self.cycle_started = None
+        self.cycle_slot = None
+        self.cycles = 0
+        self.last_cycle_seconds = 0.0
+
+    @contextmanager
+    def timer(self, stage):
+        """Контекстный менеджер: замеряет время блока как один вызов этапа stage."""
+        started = time.perf_counter()
+        failed = False
+        thread_stages = self.active_stages.setdefault(get_ident(), [])
+        thread_stages.append(stage)
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            thread_stages.pop()
+            self.observe(stage, time.perf_counter() - started, failed)
+
+    def timed(self, stage):
+        """Декоратор: замеряет каждый вызов функции как этап stage."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, stage, seconds, failed=False):
+        """Добавляет замер этапа в накопительные значения и в значения текущего цикла."""
+        with self.lock:
+            for stages in (self.stages, self.cycle_stages):
+                entry = stages.setdefault(stage, {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'last_seconds': 0.0})
+                entry['calls'] += 1
+                entry['errors'] += 1 if failed else 0
+                entry['seconds'] += seconds
+                entry['max_seconds'] = max(entry['max_seconds'], seconds)
+                entry['last_seconds'] = seconds
+
+    def inc(self, name, amount=1):
+        """Увеличивает счетчик name."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            self.cycle_counters[name] = self.cycle_counters.get(name, 0) + amount
+
+    def begin_cycle(self, slot=None):
+        """Начинает новый цикл: обнуляет значения цикла."""
+        with self.lock:
+            self.cycle_stages = {}
+            self.cycle_counters = {}
+            self.cycle_started = time.time()
+            self.cycle_slot = slot
+
+    def close_cycle(self):
+        """
+        Закрывает цикл: фиксирует время окончания и возвращает значения цикла для end_cycle.
+        begin_cycle заводит новые словари, поэтому фоновые этапы (таблица, XLSX, Telegram),
+        завершившиеся до начала следующего цикла, попадают в закрытый цикл.
+        """
+        finished = time.time()
+        with self.lock:
+            started = self.cycle_started or finished
+            self.cycles += 1
+            self.last_cycle_seconds = finished - started
+            return {
+                'started': started, 'finished': finished, 'slot': self.cycle_slot,
+                'stages': self.cycle_stages, 'counters': self.cycle_counters,
+            }
+
+    def end_cycle(self, summary_file=None, extra=None, cycle=None):
+        """
+        Завершает цикл (или закрытый ранее cycle из close_cycle) и дописывает его сводку
+        в summary_file (JSON, одна строка на цикл). Файл ротируется так же, как scraper.log.
+        """
+        cycle = cycle or self.close_cycle()
+        started, finished = cycle['started'], cycle['finished']
+        with self.lock:
+            summary = {
+                'cycle_started': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+                'cycle_finished': datetime.fromtimestamp(finished).isoformat(timespec='seconds'),
+                'duration_seconds': round(finished - started, 3),
+                'slot': cycle['slot'],
+                'stages': {
+                    stage: {key: round(value, 3) if isinstance(value, float) else value for key, value in entry.items()}
+                    for stage, entry in cycle['stages'].items()
+                },
+                'counters': dict(cycle['counters']),
+            }
+        if extra:
+            summary.update(extra)
+
+        stages_line = ", ".join(
+            f"{stage} {entry['seconds']:.1f} с/{entry['calls']}"
+            for stage, entry in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds'])
+        )
+        logging.info(f"Цикл завершен за {summary['duration_seconds']:.1f} с. Этапы: {stages_line or 'нет замеров'}")
+
+        if summary_file:
+            summary_logger = self._summary_logger(summary_file)
+            if summary_logger:
+                summary_logger.info(json.dumps(summary, ensure_ascii=False, default=str))
+        return summary
+
+    def _summary_logger(self, summary_file):
+        """Логгер JSON-сводок с ротацией файла summary_file. None, если файл не открывается."""
+        summary_logger = logging.getLogger(f'{self.prefix}.cycle_summary')
+        summary_logger.propagate = False
+        summary_logger.setLevel(logging.INFO)
+        handler = summary_logger.handlers[0] if summary_logger.handlers else None
+        if handler is not None and handler.baseFilename == os.path.abspath(summary_file):
+            return summary_logger
+        try:
+            new_handler = RotatingFileHandler(summary_file, maxBytes=METRICS_SUMMARY_MAX_BYTES,
+                                              backupCount=METRICS_SUMMARY_BACKUP_COUNT, encoding='utf-8')
+        except OSError as e:
+            logging.error(f"Не удалось записать сводку цикла в '{summary_file}': {str(e)}")
+            return None
+        new_handler.setFormatter(logging.Formatter('%(message)s'))
+        if handler is not None:
+            summary_logger.removeHandler(handler)
+            handler.close()
+        summary_logger.addHandler(new_handler)
+        return summary_logger
+
+    def render_prometheus(self):
+        """Возвращает накопительные метрики в текстовом формате Prometheus."""
+        with self.lock:
+            stages = {stage: dict(entry) for stage, entry in self.stages.items()}
+            counters = dict(self.counters)
+            cycles = self.cycles
+            last_cycle_seconds = self.last_cycle_seconds
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {self.prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{self.prefix}_{name}{labels} {value}")
+
+        def stage_labels(stage):
+            return '{stage="%s"}' % stage
+
+        metric('stage_seconds_total', 'counter', 'Суммарное время этапа в секундах.',
+               [(stage_labels(stage), f"{entry['seconds']:.6f}") for stage, entry in sorted(stages.items())])
+        metric('stage_calls_total', 'counter', 'Число вызовов этапа.',
+               [(stage_labels(stage), entry['calls']) for stage, entry in sorted(stages.items())])
+        metric('stage_errors_total', 'counter', 'Число вызовов этапа, завершившихся исключением.',
+               [(stage_labels(stage), entry['errors']) for stage, entry in sorted(stages.items())])
+        metric('stage_last_seconds', 'gauge', 'Длительность последнего вызова этапа в секундах.',
+               [(stage_labels(stage), f"{entry['last_seconds']:.6f}") for stage, entry in sorted(stages.items())])
+        metric('events_total', 'counter', 'Счетчики событий цикла.',
+               [('{name="%s"}' % name, value) for name, value in sorted(counters.items())])
+        metric('cycles_total', 'counter', 'Число завершенных циклов.', [('', cycles)])
+        metric('last_cycle_seconds', 'gauge', 'Длительность последнего цикла в секундах.', [('', f"{last_cycle_seconds:.3f}")])
+        return "\n".join(lines) + "\n"
+
+
+# Общие метрики этапов для всех циклов
+stage_metrics = StageMetrics()
+
+
+# Диапазон и точность гистограмм задержек запросов к провайдеру
+LATENCY_LOWEST_SECONDS = 0.001
+LATENCY_HIGHEST_SECONDS = 300.0
+LATENCY_SUB_BUCKETS = 32  # Корзин на каждую степень двойки: погрешность квантилей не больше 1/32
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек в духе HdrHistogram: диапазон от LATENCY_LOWEST_SECONDS до LATENCY_HIGHEST_SECONDS
+    разбит на степени двойки, каждая степень - на LATENCY_SUB_BUCKETS равных корзин.
+    Память фиксирована (около 600 счетчиков), значения выше диапазона попадают в последнюю корзину.
+    """
+    magnitudes = math.ceil(math.log2(LATENCY_HIGHEST_SECONDS / LATENCY_LOWEST_SECONDS))
+
+    def __init__(self):
+        self.counts = [0] * (1 + self.magnitudes * LATENCY_SUB_BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket_index(cls, seconds):
+        ratio = seconds / LATENCY_LOWEST_SECONDS
+        if ratio < 1:
+            return 0
+        magnitude = min(int(math.log2(ratio)), cls.magnitudes - 1)
+        sub_bucket = min(int((ratio / 2 ** magnitude - 1) * LATENCY_SUB_BUCKETS), LATENCY_SUB_BUCKETS - 1)
+        return 1 + magnitude * LATENCY_SUB_BUCKETS + sub_bucket
+
+    @staticmethod
+    def bucket_upper_bound(index):
+        if index == 0:
+            return LATENCY_LOWEST_SECONDS
+        magnitude, sub_bucket = divmod(index - 1, LATENCY_SUB_BUCKETS)
+        return LATENCY_LOWEST_SECONDS * 2 ** magnitude * (1 + (sub_bucket + 1) / LATENCY_SUB_BUCKETS)
+
+    def record(self, seconds):
+        self.counts[self.bucket_index(seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Верхняя граница корзины, в которую попадает квантиль q, или None для пустой гистограммы."""
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(q * self.total))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_upper_bound(index), self.max)
+        return self.max
+
+
+class ProviderLatency:
+    """
+    Задержки и исходы запросов к провайдеру по маркетплейсам. Гистограмма ведется на каждую тройку
+    (провайдер, маркетплейс, исход). Исходы: 2xx, 204, 4xx, 429, 5xx, timeout, error (ошибка соединения)
+    и parse_fail - ответ 200, из которого не удалось получить данные товара (он учтен и в 2xx).
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = {}
+        self.outcomes = {}
+
+    @staticmethod
+    def classify_status(status_code):
+        if status_code == 204:
+            return '204'
+        if status_code == 429:
+            return '429'
+        if 200 <= status_code < 300:
+            return '2xx'
+        if 400 <= status_code < 500:
+            return '4xx'
+        if status_code >= 500:
+            return '5xx'
+        return 'other'
+
+    def observe(self, provider, marketplace, outcome, seconds=None):
+        """Учитывает исход запроса; seconds добавляется в гистограмму, если задано."""
+        key = (provider, marketplace, outcome)
+        with self.lock:
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+            if seconds is not None:
+                self.histograms.setdefault(key, LatencyHistogram()).record(seconds)
+
+    def request(self, provider, marketplace, method, *args, **kwargs):
+        """Выполняет method(*args, **kwargs) (requests.get/post) и записывает задержку и исход запроса."""
+        started = time.perf_counter()
+        with stage_metrics.timer('provider_request'):
+            try:
+                response = method(*args, **kwargs)
+            except requests.exceptions.Timeout:
+                self.observe(provider, marketplace, 'timeout', time.perf_counter() - started)
+                raise
+            except requests.exceptions.RequestException:
+                self.observe(provider, marketplace, 'error', time.perf_counter() - started)
+                raise
+        self.observe(provider, marketplace, self.classify_status(response.status_code), time.perf_counter() - started)
+        return response
+
+    def record_parse_failure(self, provider, marketplace):
+        self.observe(provider, marketplace, 'parse_fail')
+
+    def percentiles(self, provider=None, marketplace=None, outcome=None):
+        """Квантили p50/p95/p99 по всем гистограммам, подходящим под фильтр (None - любое значение)."""
+        merged = LatencyHistogram()
+        with self.lock:
+            for (hist_provider, hist_marketplace, hist_outcome), histogram in self.histograms.items():
+                if provider not in (None, hist_provider) or marketplace not in (None, hist_marketplace) \
+                        or outcome not in (None, hist_outcome):
+                    continue
+                merged.merge(histogram)
+        result = {f"p{round(q * 100)}": merged.quantile(q) for q in LATENCY_QUANTILES}
+        result.update({'count': merged.total, 'max': merged.max if merged.total else None})
+        return result
+
+    def snapshot(self):
+        """Возвращает {'провайдер/маркетплейс': {квантили, 'outcomes': {исход: число}}} с начала работы."""
+        with self.lock:
+            outcomes = dict(self.outcomes)
+        result = {}
+        for provider, marketplace in sorted({key[:2] for key in outcomes}):
+            stats = self.percentiles(provider, marketplace)
+            stats = {key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()}
+            stats['outcomes'] = {
+                outcome: count for (p, m, outcome), count in sorted(outcomes.items()) if (p, m) == (provider, marketplace)
+            }
+            result[f"{provider}/{marketplace}"] = stats
+        return result
+
+    def log_summary(self):
+        for name, stats in self.snapshot().items():
+            outcomes_line = ", ".join(f"{outcome} {count}" for outcome, count in stats['outcomes'].items())
+            if stats['count']:
+                logging.info(
+                    f"Задержки {name}: p50 {stats['p50']:.2f} с, p95 {stats['p95']:.2f} с, "
+                    f"p99 {stats['p99']:.2f} с; исходы: {outcomes_line}"
+                )
+            else:
+                logging.info(f"Исходы запросов {name}: {outcomes_line}")
+
+    def render_prometheus(self, prefix):
+        """Возвращает квантили задержек (summary) и счетчики исходов в текстовом формате Prometheus."""
+        with self.lock:
+            histograms = list(self.histograms.items())
+            outcomes = sorted(self.outcomes.items())
+
+        def labels(provider, marketplace, outcome, extra=''):
+            return '{provider="%s",marketplace="%s",outcome="%s"%s}' % (provider, marketplace, outcome, extra)
+
+        lines = [
+            f"# HELP {prefix}_provider_request_seconds Задержка запросов к провайдеру в секундах.",
+            f"# TYPE {prefix}_provider_request_seconds summary",
+        ]
+        for key, histogram in sorted(histograms):
+            for q in LATENCY_QUANTILES:
+                quantile_labels = labels(*key, extra=',quantile="%s"' % q)
+                lines.append(f"{prefix}_provider_request_seconds{quantile_labels} {histogram.quantile(q):.6f}")
+            lines.append(f"{prefix}_provider_request_seconds_sum{labels(*key)} {histogram.sum:.6f}")
+            lines.append(f"{prefix}_provider_request_seconds_count{labels(*key)} {histogram.total}")
+        lines.append(f"# HELP {prefix}_provider_responses_total Исходы запросов к провайдеру.")
+        lines.append(f"# TYPE {prefix}_provider_responses_total counter")
+        for key, count in outcomes:
+            lines.append(f"{prefix}_provider_responses_total{labels(*key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Общие гистограммы задержек запросов к провайдеру
+provider_latency = ProviderLatency()
+
+
+# Профилирование по запросу: сигнал SIGUSR1 или файл-флаг
+DEFAULT_PROFILE_DIR = 'profiles'
+DEFAULT_PROFILE_TRIGGER_FILE = 'profile.request'
+PROFILE_SAMPLE_INTERVAL = 0.005  # Период выборки стеков, секунд
+PROFILE_TRIGGER_POLL = 5  # Как часто проверять файл-флаг, секунд
+PROFILE_TOP_FUNCTIONS = 60  # Сколько функций выводить в текстовый отчет cProfile
+
+
+class CycleProfiler:
+    """
+    Профилирование работающего процесса без перезапуска. Запрос - сигнал SIGUSR1 (Unix)
+    или файл profile_trigger_file в рабочей папке (удаляется после срабатывания).
+
+    По умолчанию профилируются следующие profile_cycles циклов: cProfile в основном потоке
+    и выборка стеков всех потоков, включая фоновую запись. Если задан profile_seconds,
+    выборка стеков запускается сразу на это число секунд, без cProfile.
+    Результаты пишутся в profile_dir: cprofile.prof и cprofile.txt, а также collapsed-стеки
+    (формат flamegraph.pl / speedscope) по этапам stage_metrics.
+    Без запроса профилировщик только раз в PROFILE_TRIGGER_POLL секунд проверяет файл-флаг.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.cycles = 1
+        self.seconds = 0
+        self.output_dir = DEFAULT_PROFILE_DIR
+        self.trigger_file = DEFAULT_PROFILE_TRIGGER_FILE
+        self.requested = False
+        self.cycles_left = 0
+        self.profile = None
+        self.samples = {}
+        self.sampler = None
+        self.stop_sampling = Event()
+
+    def install(self, config):
+        """Читает настройки из конфига и подключает сигнал и проверку файла-флага."""
+        self.cycles = config.get('profile_cycles') or 1
+        self.seconds = config.get('profile_seconds') or 0
+        self.output_dir = config.get('profile_dir', '').strip() or DEFAULT_PROFILE_DIR
+        self.trigger_file = config.get('profile_trigger_file', DEFAULT_PROFILE_TRIGGER_FILE).strip()
+        if hasattr(signal, 'SIGUSR1'):
+            # Обработчик только ставит флаг; профилирование запускается вне обработчика сигнала
+            signal.signal(signal.SIGUSR1, lambda signum, frame: setattr(self, 'requested', True))
+        Thread(target=self._watch_requests, name='profile-trigger', daemon=True).start()
+        logging.info(
+            f"Профилирование по запросу: SIGUSR1 или файл '{self.trigger_file}', "
+            f"{f'{self.seconds} с' if self.seconds else f'циклов: {self.cycles}'}, результаты в '{self.output_dir}'"
+        )
+
+    def _watch_requests(self):
+        while True:
+            time.sleep(PROFILE_TRIGGER_POLL)
+            if self.trigger_file and os.path.exists(self.trigger_file):
+                try:
+                    os.remove(self.trigger_file)
+                except OSError as e:
+                    logging.error(f"Не удалось удалить файл-флаг профилирования '{self.trigger_file}': {str(e)}")
+                    continue
+                self.requested = True
+            if self.requested and self.seconds:
+                self.requested = False
+                if self._start_sampling(time.time() + self.seconds):
+                    logging.info(f"Запущена выборка стеков на {self.seconds} с.")
+
+    def on_cycle_start(self):
+        """Начинает профилирование циклов, если оно запрошено."""
+        if not self.requested or self.seconds or self.profile is not None:
+            return
+        self.requested = False
+        if not self._start_sampling(None):
+            return
+        self.cycles_left = self.cycles
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        logging.info(f"Запущено профилирование следующих циклов: {self.cycles}.")
+
+    def on_cycle_end(self):
+        """Завершает профилирование после заданного числа циклов и сохраняет результаты."""
+        if self.profile is None:
+            return
+        self.cycles_left -= 1
+        if self.cycles_left > 0:
+            return
+        self.profile.disable()
+        self.stop_sampling.set()
+        self.sampler.join()
+        profile, self.profile = self.profile, None
+        self._dump(profile)
+
+    def _start_sampling(self, deadline):
+        with self.lock:
+            if self.sampler is not None and self.sampler.is_alive():
+                return False
+            self.samples = {}
+            self.stop_sampling.clear()
+            self.sampler = Thread(target=self._sample, args=(deadline,), name='profile-sampler', daemon=True)
+            self.sampler.start()
+            return True
+
+    def _sample(self, deadline):
+        """Собирает стеки всех потоков с привязкой к текущему этапу потока."""
+        own_thread = get_ident()
+        while not self.stop_sampling.wait(PROFILE_SAMPLE_INTERVAL):
+            if deadline and time.time() >= deadline:
+                break
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stages = stage_metrics.active_stages.get(thread_id)
+                stage = stages[-1] if stages else 'other'
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = (stage, ';'.join(reversed(frames)))
+                self.samples[key] = self.samples.get(key, 0) + 1
+        if deadline:
+            self._dump(None)
+
+    def _dump(self, profile):
+        path = os.path.join(self.output_dir, datetime.now().strftime('%Y%m%d-%H%M%S'))
+        try:
+            os.makedirs(path, exist_ok=True)
+            if profile is not None:
+                profile.dump_stats(os.path.join(path, 'cprofile.prof'))
+                with open(os.path.join(path, 'cprofile.txt'), 'w', encoding='utf-8') as f:
+                    pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+            by_stage = {}
+            for (stage, stack), count in sorted(self.samples.items()):
+                by_stage.setdefault(stage, []).append(f"{stack} {count}")
+            for stage, lines in by_stage.items():
+                with open(os.path.join(path, f'stacks-{stage}.folded'), 'w', encoding='utf-8') as f:
+                    f.write("\n".join(lines) + "\n")
+            # Общий файл: этап - корневой кадр каждого стека
+            with open(os.path.join(path, 'stacks.folded'), 'w', encoding='utf-8') as f:
+                for (stage, stack), count in sorted(self.samples.items()):
+                    f.write(f"{stage};{stack} {count}\n")
+        except OSError as e:
+            logging.error(f"Не удалось сохранить результаты профилирования в '{path}': {str(e)}")
+            return
+        logging.info(f"Результаты профилирования сохранены в '{path}' (выборок стеков: {sum(self.samples.values())}).")
+
+
+# Профилировщик процесса
+cycle_profiler = CycleProfiler()
+
+
+class MetricsRequestHandler:
+    """
+    Отдает метрики stage_metrics по адресу /metrics.
+    BaseHTTPRequestHandler подмешивается в start_metrics_server, чтобы не импортировать http.server при загрузке скрипта.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = (stage_metrics.render_prometheus() + provider_latency.render_prometheus(METRICS_PREFIX)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Запрос метрик: {format % args}")
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Запускает HTTP-сервер метрик в фоновом потоке. Возвращает сервер или None при ошибке."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handler = type('MetricsRequestHandler', (MetricsRequestHandler, BaseHTTPRequestHandler), {})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logging.error(f"Не удалось запустить сервер метрик на {host}:{port}: {str(e)}")
+        return None
+    Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Метрики Prometheus доступны по адресу http://{host}:{port}/metrics")
+    return server
+
+
+def finish_metrics_cycle(config):
+    """
+    Закрывает цикл метрик. Сводку пишет фоновая очередь 'metrics' после того, как опустеют
+    остальные очереди записи и очередь Telegram, поэтому основной цикл не ждет отправок.
+    """
+    summary_file = config.get('metrics_summary_file', DEFAULT_METRICS_SUMMARY_FILE)
+    cycle = stage_metrics.close_cycle()
+    cycle_profiler.on_cycle_end()
+    sink_executor.submit('metrics', write_metrics_summary, cycle, summary_file)
+
+
+def wait_for_sinks():
+    """
+    Ждет фоновую запись и отправку в Telegram без ограничения по времени: run --once
+    завершается только после них. Возвращает число неудачных задач записи и отправок с начала работы.
+    """
+    sink_executor.flush()
+    telegram_sink.flush()
+    sink_executor.log_metrics()
+    failures = sum(metrics['failed'] for metrics in sink_executor.get_metrics().values()) + telegram_sink.failed
+    if failures:
+        logging.error(f"Фоновая запись завершилась с ошибками: {failures}.")
+    return failures
+
+
+def write_metrics_summary(cycle, summary_file):
+    """Ждет фоновую запись цикла, чтобы в сводку попали таблица, XLSX и Telegram, и пишет сводку."""
+    sink_executor.flush(exclude=('metrics',))
+    telegram_sink.flush()
+    provider_latency.log_summary()
+    return stage_metrics.end_cycle(summary_file, {'sinks': sink_executor.get_metrics(), 'provider_latency': provider_latency.snapshot()}, cycle)
+
+
 def clean_urls(raw_value):
     if isinstance(raw_value, str):
         # Разделяем по переносам строк, запятым и пробелам
@@ -68,13 +722,13 @@ def retry_scrape(url, config, max_retries=5, initial_wait=2):
     for attempt in range(max_retries):
         try:
             api_limiter.wait()  # Ждем, чтобы не превысить лимит запросов
-            product_info = scrape_amazon_product(url, config)
+            product_info = scrape_amazon_product(make_fetch_job(url), config)
             if product_info:
                 return product_info
         except requests.exceptions.RequestException as e:
             if hasattr(e, 'response') and e.response and e.response.status_code == 429:
                 logging.warning(f"Ошибка 429. Повторная попытка через {wait_time} секунд...")
-                time.sleep(wait_time)
+                clock.sleep(wait_time)
                 wait_time *= 2  # Экспоненциальное увеличение времени ожидания
             else:
                 logging.error(f"Ошибка запроса для URL {url}: {str(e)}")
@@ -84,7 +738,7 @@ def retry_scrape(url, config, max_retries=5, initial_wait=2):
 def get_kyiv_time(timezone_str='Europe/Kiev'):
     """Возвращает текущее время в часовом поясе Киева."""
     timezone = pytz.timezone(timezone_str)
-    return datetime.now(timezone)
+    return clock.now(timezone)
 
 
 def get_next_slot(current_time, slots, timezone_str='Europe/Kiev'):
@@ -109,6 +763,147 @@ def get_next_slot(current_time, slots, timezone_str='Europe/Kiev'):
     return timezone.localize(datetime.combine(next_day.date(), first_slot))
 
 
+class SlotScheduler:
+    """
+    Планировщик запусков по временным слотам с учетом дедлайнов.
+    Слот - это дедлайн, к которому данные должны быть собраны, поэтому запуск начинается
+    заранее (lead). Если цикл затянулся и пропустил слоты, они явно пропускаются ('skip')
+    или объединяются в один догоняющий запуск для последнего пропущенного слота ('merge').
+    Для каждого запуска записывается опоздание относительно слота.
+    """
+    def __init__(self, slots, timezone_str='Europe/Kiev', lead_seconds=None, overrun_policy='skip', history_size=200):
+        self.slots = sorted(set(slots))
+        self.timezone = pytz.timezone(timezone_str)
+        self.lead_seconds = lead_seconds
+        self.overrun_policy = overrun_policy if overrun_policy in ('skip', 'merge') else 'skip'
+        self.history = deque(maxlen=history_size)
+        self.average_duration = None
+        self.last_slot = None
+        # Упреждение не может превышать минимальный интервал между слотами
+        minutes = sorted(int(slot.split(':')[0]) * 60 + int(slot.split(':')[1]) for slot in self.slots)
+        gaps = [b - a for a, b in zip(minutes, minutes[1:])] + [minutes[0] + 24 * 60 - minutes[-1]] if minutes else [24 * 60]
+        self.max_lead_seconds = min(gaps) * 60
+
+    def _slots_between(self, start, end):
+        """Возвращает datetime слотов в интервале (start, end]."""
+        result = []
+        day = start.date()
+        while day <= end.date():
+            for slot in self.slots:
+                slot_time = datetime.strptime(slot, "%H:%M").time()
+                slot_datetime = self.timezone.localize(datetime.combine(day, slot_time))
+                if start < slot_datetime <= end:
+                    result.append(slot_datetime)
+            day += timedelta(days=1)
+        return result
+
+    def get_lead_seconds(self):
+        """Время упреждения: из конфига или по средней длительности прошлых циклов с запасом 20%,
+        но не больше минимального интервала между слотами."""
+        if self.lead_seconds is not None:
+            return self.lead_seconds
+        if self.average_duration is None:
+            return 0
+        return min(self.average_duration * 1.2, self.max_lead_seconds)
+
+    def plan(self, current_time):
+        """
+        Возвращает (slot_datetime, start_datetime) следующего запуска.
+        start_datetime может быть в прошлом - тогда запуск нужно начинать сразу.
+        """
+        if self.last_slot is None:
+            self.last_slot = current_time
+
+        missed_slots = self._slots_between(self.last_slot, current_time)
+        if missed_slots:
+            if self.overrun_policy == 'merge':
+                target_slot = missed_slots[-1]
+                for slot_datetime in missed_slots[:-1]:
+                    self._record_missed(slot_datetime, 'merged')
+                logging.warning(
+                    f"Предыдущий цикл пропустил слоты {[s.strftime('%H:%M') for s in missed_slots]}. "
+                    f"Догоняющий запуск для слота {target_slot.strftime('%H:%M')}."
+                )
+                return target_slot, current_time
+            for slot_datetime in missed_slots:
+                self._record_missed(slot_datetime, 'skipped')
+            logging.warning(f"Предыдущий цикл пропустил слоты {[s.strftime('%H:%M') for s in missed_slots]}, они пропущены.")
+            self.last_slot = missed_slots[-1]
+
+        # Следующий слот после текущего времени и после уже обработанного слота
+        next_slot = get_next_slot(max(current_time, self.last_slot), self.slots, self.timezone.zone)
+        start_time = next_slot - timedelta(seconds=self.get_lead_seconds())
+        return next_slot, max(start_time, current_time)
+
+    def record(self, slot_datetime, started_at, finished_at):
+        """Записывает результат запуска и обновляет среднюю длительность цикла."""
+        duration = (finished_at - started_at).total_seconds()
+        lateness = (finished_at - slot_datetime).total_seconds()
+        self.average_duration = duration if self.average_duration is None else 0.7 * self.average_duration + 0.3 * duration
+        self.last_slot = max(self.last_slot, slot_datetime) if self.last_slot else slot_datetime
+        entry = {
+            'slot': slot_datetime.strftime('%Y-%m-%d %H:%M'),
+            'status': 'late' if lateness > 0 else 'on_time',
+            'started_at': started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': finished_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_seconds': round(duration, 1),
+            'lateness_seconds': round(lateness, 1),
+        }
+        self.history.append(entry)
+        logging.info(
+            f"Слот {entry['slot']}: длительность {duration / 60:.1f} мин, "
+            f"{'опоздание' if lateness > 0 else 'запас'} {abs(lateness) / 60:.1f} мин."
+        )
+        return entry
+
+    def _record_missed(self, slot_datetime, status):
+        self.history.append({
+            'slot': slot_datetime.strftime('%Y-%m-%d %H:%M'),
+            'status': status,
+            'started_at': None,
+            'finished_at': None,
+            'duration_seconds': None,
+            'lateness_seconds': None,
+        })
+
+
+def run_schedule(scheduler, run_slot, timezone_str='Europe/Kiev', after_slot=None, until=None):
+    """
+    Цикл регулярных запусков: ждет старта очередного слота по планировщику, вызывает run_slot(слот)
+    и записывает результат в scheduler; after_slot() вызывается после записи (сводка метрик).
+    until - время, после которого новые слоты не запускаются (None - бесконечно).
+    Время и ожидание берутся из clock, поэтому с SimulatedClock сутки проходят за секунды.
+    """
+    while True:
+        try:
+            current_time = get_kyiv_time(timezone_str)
+            logging.info(f"Текущее время: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+            # Определение следующего слота и времени старта сбора с упреждением
+            next_slot_time, start_time = scheduler.plan(current_time)
+            if until is not None and start_time >= until:
+                return
+            logging.info(f"Следующий слот: {next_slot_time.strftime('%Y-%m-%d %H:%M')}, старт сбора: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+            # Вычисление времени до старта сбора
+            time_to_wait = (start_time - current_time).total_seconds()
+
+            if time_to_wait > 0:
+                logging.info(f"Ждем {time_to_wait / 60:.2f} минут до старта сбора.")
+                clock.sleep(time_to_wait)
+
+            # После пробуждения выполняем задачи для слота и записываем опоздание
+            started_at = get_kyiv_time(timezone_str)
+            run_slot(next_slot_time)
+            scheduler.record(next_slot_time, started_at, get_kyiv_time(timezone_str))
+            if after_slot:
+                after_slot()
+
+        except Exception as e:
+            logging.error(f"Ошибка в основном цикле: {e}")
+            clock.sleep(60)  # Ждем минуту перед повторной попыткой
+
+
 def authorize_google_sheets(credentials_file):
     """
     Авторизуется в Google Sheets и возвращает клиентский объект.
@@ -116,6 +911,8 @@ def authorize_google_sheets(credentials_file):
     :param credentials_file: Путь к файлу учетных данных JSON
     :return: gspread.Client объект
     """
+    from google.oauth2.service_account import Credentials
+
     scopes = [
         'https://www.googleapis.com/auth/spreadsheets',
         'https://www.googleapis.com/auth/drive'
@@ -173,7 +970,10 @@ def load_config_from_sheets(client, spreadsheet_id):
                 # Иначе, разбиваем строку на список URL
                 config[key] = clean_urls(value)
             logging.debug(f"Загружены URL для '{key}': {config[key]}")
-        elif key in ['update_time_hour', 'update_time_minute', 'batch_size']:
+        elif key in ['update_time_hour', 'update_time_minute', 'batch_size', 'prefetch_lead_minutes',
+                     'negative_cache_threshold', 'negative_cache_ttl_minutes', 'negative_cache_max_ttl_hours',
+                     'oxylabs_batch_size', 'oxylabs_poll_interval', 'oxylabs_batch_timeout', 'metrics_port',
+                     'profile_cycles', 'profile_seconds', 'raw_archive_max_mb']:
             try:
                 config[key] = int(value)
                 logging.debug(f"Загружено целое число для '{key}': {config[key]}")
@@ -194,6 +994,13 @@ def load_config_from_sheets(client, spreadsheet_id):
                 logging.debug(f"Загружены временные слоты для '{key}': {config[key]}")
             else:
                 config[key] = []
+        elif key == 'refresh_tiers':
+            config[key] = parse_refresh_tiers(value)
+            logging.debug(f"Загружены уровни обновления полей: {config[key]}")
+        elif key == 'alert_rules':
+            # Правила разделяются переносами строк или точкой с запятой
+            config[key] = [rule.strip() for rule in re.split(r'[\n\r;]+', value) if rule.strip()]
+            logging.debug(f"Загружены правила оповещений: {config[key]}")
         else:
             config[key] = value
             logging.debug(f"Загружено значение для '{key}': {config[key]}")
@@ -217,30 +1024,30 @@ def load_config_from_sheets(client, spreadsheet_id):
     }
 
     logging.info(f"Загруженная конфигурация: {json.dumps(config, indent=2, ensure_ascii=False)}")
+
+    # Правила оповещений компилируются один раз при загрузке конфига
+    if config.get('alert_rules'):
+        config['compiled_alert_rules'] = compile_alert_rules(tuple(config['alert_rules']))
     return config
 
 
+# Шаблоны ASIN компилируются один раз; порядок альтернатив соответствует приоритету форматов URL
+ASIN_PATH_PATTERN = re.compile(r'/(?:dp|gp/product|product|ASIN|gp/aw/d|gp/offer-listing)/([A-Z0-9]{10})')
+ASIN_ANY_PATTERN = re.compile(r'([A-Z0-9]{10})')
+
+
+@lru_cache(maxsize=4096)
 def extract_asin(url):
-    """Извлекает ASIN из различных форматов URL Amazon."""
+    """Извлекает ASIN из различных форматов URL Amazon (результат кэшируется по URL)."""
     # Парсим URL
     parsed_url = urlparse(url)
-    path = parsed_url.path
 
     # Регулярное выражение для извлечения ASIN из пути URL
-    patterns = [
-        r'/dp/([A-Z0-9]{10})',
-        r'/gp/product/([A-Z0-9]{10})',
-        r'/product/([A-Z0-9]{10})',
-        r'/ASIN/([A-Z0-9]{10})',
-        r'/gp/aw/d/([A-Z0-9]{10})',
-        r'/gp/offer-listing/([A-Z0-9]{10})',
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, path)
-        if match:
-            asin = match.group(1)
-            logging.debug(f"Extracted ASIN {asin} from URL path: {url}")
-            return asin
+    match = ASIN_PATH_PATTERN.search(parsed_url.path)
+    if match:
+        asin = match.group(1)
+        logging.debug(f"Extracted ASIN {asin} from URL path: {url}")
+        return asin
     # Если не удалось найти ASIN в пути, попробуем извлечь из параметров запроса
     query_params = parse_qs(parsed_url.query)
     if 'asin' in query_params:
@@ -248,7 +1055,7 @@ def extract_asin(url):
         logging.debug(f"Extracted ASIN {asin} from query parameters in URL: {url}")
         return asin
     # Если всё ещё не удалось найти ASIN, попробуем найти его в URL целиком
-    match = re.search(r'([A-Z0-9]{10})', url)
+    match = ASIN_ANY_PATTERN.search(url)
     if match:
         asin = match.group(1)
         logging.debug(f"Extracted ASIN {asin} from entire URL: {url}")
@@ -256,6 +1063,41 @@ def extract_asin(url):
     logging.warning(f"Could not extract ASIN from URL: {url}")
     return 'Not Found'
 
+@lru_cache(maxsize=1024)
+def determine_currency(url):
+    parsed_url = urlparse(url)
+    domain = parsed_url.netloc.lower()
+
+    amazon_currency_mapping = {
+        'amazon.com': 'USD',       # США
+        'amazon.co.uk': 'GBP',     # Великобритания
+        'amazon.de': 'EUR',        # Германия
+        'amazon.fr': 'EUR',        # Франция
+        'amazon.it': 'EUR',        # Италия
+        'amazon.es': 'EUR',        # Испания
+        'amazon.ca': 'CAD',        # Канада
+        'amazon.co.jp': 'JPY',     # Япония
+        'amazon.com.au': 'AUD',    # Австралия
+        'amazon.nl': 'EUR',        # Нидерланды
+        'amazon.se': 'SEK',        # Швеция
+        'amazon.sg': 'SGD',        # Сингапур
+        'amazon.in': 'INR',        # Индия
+        'amazon.com.br': 'BRL',    # Бразилия
+        'amazon.ae': 'AED',        # ОАЭ
+        # Добавьте другие домены и валюты по необходимости
+    }
+
+    # Поиск соответствия домену
+    for amazon_domain, currency in amazon_currency_mapping.items():
+        if domain.endswith(amazon_domain):
+            logging.debug(f"Домен '{domain}' соответствует валюте '{currency}'.")
+            return currency
+
+    # Если домен не найден в сопоставлении, выводим предупреждение и возвращаем символ по умолчанию
+    logging.warning(f"Неизвестный домен Amazon '{domain}'. Используется символ валюты по умолчанию 'USD'.")
+    return 'USD'  # Значение по умолчанию
+
+
 def is_valid_amazon_url(url):
     """Проверяет, является ли URL корректным Amazon продуктом."""
     parsed_url = urlparse(url)
@@ -440,6 +1282,7 @@ def extract_bsr(product_data):
     logging.info(f"Извлеченный BSR: {bsr_value}")
     return bsr_value
 
+@stage_metrics.timed('parse')
 def extract_data_from_json(response_json, asin, is_variation=False):
     logging.debug("Извлечение данных из JSON.")
     try:
@@ -535,20 +1378,21 @@ def format_price(price):
     return f"${price:.2f}" if isinstance(price, (int, float)) else str(price)
 
 
-def scrape_amazon_product(url, config, is_variation=False):
-    """Скрапит данные о продукте с Amazon через Oxylabs."""
+def scrape_amazon_product(job, config):
+    """Скрапит данные о продукте (задание FetchJob) с Amazon через Oxylabs."""
+    url, asin, marketplace = job.url, job.asin, job.marketplace
+    is_variation = job.role == 'variation'
     if not url.startswith('http'):
         logging.error(f"Invalid URL: {url}")
         return None
 
-    asin = extract_asin(url)
     if asin == 'Not Found':
         logging.error(f"ASIN not found in URL: {url}")
         return None
 
     payload = {
         'source': 'amazon',
-        'url': url,  # Используем полный URL вместо ASIN
+        'url': url,  # Используем полный URL вместо ASIN: параметры th/psc выбирают вариант товара
         'parse': True
     }
 
@@ -568,8 +1412,9 @@ def scrape_amazon_product(url, config, is_variation=False):
 
             logging.info(f"Sending request to Oxylabs for ASIN: {asin}")
 
-            response = requests.post(
-                'https://realtime.oxylabs.io/v1/queries',
+            response = provider_latency.request(
+                'oxylabs', marketplace, requests.post,
+                get_oxylabs_endpoint(config),
                 auth=(oxylabs_username, oxylabs_password),
                 json=payload,
                 timeout=30
@@ -577,18 +1422,21 @@ def scrape_amazon_product(url, config, is_variation=False):
 
             logging.debug(f"Received response: {response.status_code} - {response.text}")
 
-            if response.status_code == 204:
-                logging.error(f"No Content for ASIN {asin}")
+            if response.status_code in (204, 404):
+                logging.error(f"No Content for ASIN {asin} ({response.status_code})")
+                negative_cache.record_failure(url, f"HTTP {response.status_code}")
                 return None
 
             if response.status_code != 200:
                 logging.error(f"Non-200 response from Oxylabs: {response.status_code}")
                 continue
 
+            response_archive.store('oxylabs', marketplace, asin, response.content)
             try:
                 response_json = response.json()
                 logging.debug(f"Received JSON for ASIN {asin}: {json.dumps(response_json, indent=2, ensure_ascii=False)}")  # Логирование JSON-ответа
             except ValueError:
+                provider_latency.record_parse_failure('oxylabs', marketplace)
                 logging.error(f"Ошибка декодирования JSON для ASIN {asin}")
                 continue
 
@@ -596,8 +1444,23 @@ def scrape_amazon_product(url, config, is_variation=False):
                 logging.error(f"Error from Oxylabs for ASIN {asin}: {response_json['error']}")
                 return None
 
+            # Amazon вернул 404 для страницы товара – товар недоступен
+            result_status = (response_json.get('results') or [{}])[0].get('status_code')
+            if result_status == 404:
+                logging.error(f"Amazon вернул 404 для ASIN {asin}")
+                negative_cache.record_failure(url, "Amazon 404")
+                return None
+
             product_info = extract_data_from_json(response_json, asin, is_variation=is_variation)
+            if not product_info or product_info.get('Title') in (None, '', 'Not Found'):
+                provider_latency.record_parse_failure('oxylabs', marketplace)
+            if product_info and product_info.get('Title') in (None, '', 'Not Found'):
+                logging.warning(f"На странице ASIN {asin} нет названия товара, данные не записываются.")
+                negative_cache.record_failure(url, "нет названия товара")
+                return None
             if product_info:
+                if not is_variation:
+                    harvest_variations(response_json['results'][0]['content'], url)
                 logging.info(f"Successfully scraped data for ASIN: {asin}")
                 logging.debug(f"Product Info: {product_info}")
                 return product_info
@@ -608,7 +1471,7 @@ def scrape_amazon_product(url, config, is_variation=False):
             if attempt < max_retries - 1:
                 wait_time = 5 * (attempt + 1)
                 logging.info(f"Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
+                clock.sleep(wait_time)
             else:
                 logging.error(f"Failed to retrieve data for ASIN {asin} after {max_retries} attempts.")
                 return None
@@ -616,220 +1479,868 @@ def scrape_amazon_product(url, config, is_variation=False):
     return None
 
 
-def send_telegram_message(bot, chat_id, message):
-    """Отправляет сообщение в Telegram."""
-    try:
-        bot.send_message(chat_id, message)
-        logging.info(f"Отправлено уведомление в Telegram")
-    except Exception as e:
-        logging.error(f"Не удалось отправить уведомление в Telegram: {str(e)}")
-
-def check_product_notifications(product_info, min_rating, price_threshold, coupon_threshold):
-    """Проверяет условия для отправки уведомлений."""
-    notifications = []
-
-    # Проверка рейтинга
-    rating = product_info.get("Rating", "Not Found")
-    if rating != "Not Found":
-        try:
-            rating_value = float(rating)
-            if rating_value < min_rating:
-                notifications.append(f"⚠️ Низкий рейтинг: {rating} звезд для ASIN {product_info['ASIN']}")
-        except ValueError:
-            notifications.append(f"⚠️ Некорректный рейтинг для ASIN {product_info['ASIN']}")
-
-    # Проверка изменения цены
-    full_price = product_info.get("Price", "Not Found")
-    prime_price = product_info.get("Prime Price", "Not Found")
-    if full_price != "Not Found" and prime_price != "Not Found":
-        try:
-            full_price_value = float(re.sub(r'[^\d.]', '', str(full_price))) if isinstance(full_price, (str, float)) else None
-            prime_price_value = float(re.sub(r'[^\d.]', '', str(prime_price))) if isinstance(prime_price, (str, float)) else None
-            if full_price_value and prime_price_value:
-                price_diff_percent = abs(full_price_value - prime_price_value) / full_price_value * 100
-                if price_diff_percent >= price_threshold:
-                    notifications.append(f"💰 Значительное изменение цены для ASIN {product_info['ASIN']}: Full ${full_price_value:.2f}, Prime ${prime_price_value:.2f}")
-        except ValueError:
-            notifications.append(f"⚠️ Некорректная цена для ASIN {product_info['ASIN']}")
-
-    # Проверка купона
-    coupon_discount = product_info.get("Coupon Discount", "Not Found")
-    if coupon_discount != "Not Found":
-        try:
-            coupon_value = float(re.sub(r'[^\d.]', '', str(coupon_discount).replace('%', '')))
-            if coupon_value >= coupon_threshold:
-                notifications.append(f"🏷️ Большой купон для ASIN {product_info['ASIN']}: {coupon_value}%")
-        except ValueError:
-            notifications.append(f"⚠️ Некорректная скидка купона для ASIN {product_info['ASIN']}")
-
-    return notifications
-
+OXYLABS_REALTIME_URL = 'https://realtime.oxylabs.io/v1/queries'
 
-def update_monitoring_sheet(spreadsheet, data, current_time_slot, config):
-    sheet_name = "SS+Sox"  # Название листа в Google Sheets
-    try:
-        sheet = spreadsheet.worksheet(sheet_name)
-    except gspread.exceptions.WorksheetNotFound:
-        logging.error(f"Лист '{sheet_name}' не найден в таблице.")
-        return
-
-    header = [
-        "Наименование", "Параметры", "Данные"
-    ] + config.get('active_trade_slots', []) + ["Зона анализа"] + config.get('analysis_slots', [])
+# Легкие источники Oxylabs для обновления только цены
+OXYLABS_PRICE_SOURCES = ('amazon_pricing', 'amazon_product')
+# amazon_product возвращает купон, без него итоговая цена считалась бы по устаревшему купону
+DEFAULT_OXYLABS_PRICE_SOURCE = 'amazon_product'
 
-    header = [slot.strip() if isinstance(slot, str) else slot for slot in header]
-
-    logging.debug(f"Текущий временной слот: '{current_time_slot}'")
-    logging.debug(f"Заголовки таблицы: {header}")
 
-    value_ranges = [{
-        'range': f'{sheet_name}!A1',
-        'values': [header]
-    }]
+def get_oxylabs_endpoint(config):
+    """Возвращает адрес realtime API Oxylabs (можно переопределить для локального сервера-заглушки)."""
+    return config.get('oxylabs_endpoint', '').strip() or OXYLABS_REALTIME_URL
 
-    start_row = 3
-    current_row = start_row
 
-    # Получаем текущее время в формате "YYYY-MM-DD HH:MM:SS" в киевском часовом поясе
-    current_time = get_kyiv_time().strftime("%Y-%m-%d %H:%M:%S")
+def get_amazon_domain(url):
+    """Возвращает домен маркетплейса для Oxylabs, например 'de' или 'co.uk'."""
+    netloc = urlparse(url).netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[4:]
+    return netloc.split('amazon.', 1)[-1] if 'amazon.' in netloc else 'com'
 
-    # Добавляем запись текущего времени на 2-ю строку в колонку "Данные"
-    time_notation = f'{sheet_name}!C2'  # Ячейка C2 (строка 2, колонка "Данные")
-    value_ranges.append({
-        'range': time_notation,
-        'values': [[current_time]]  # Записываем текущее время
-    })
 
+@stage_metrics.timed('parse')
+def extract_price_data_from_json(response_json, asin):
+    """
+    Извлекает только ценовые поля из ответа легкого источника Oxylabs.
 
-    parameters = ["BSR", "Number of Reviews", "Rating", "Price"]
+    Поддерживает ответ amazon_pricing (список предложений 'pricing')
+    и amazon_product (поля цены и купона на верхнем уровне).
+    """
+    try:
+        content = response_json['results'][0]['content']
+    except (KeyError, IndexError, TypeError):
+        logging.error(f"Некорректная структура ответа с ценами для ASIN {asin}")
+        return None
 
-    companies = [
-        ("product_urls", "Merino.tech. (Мы)"),
-        ("1competitor_urls", config.get('competitor_1_name', 'Competitor 1').strip()),
-        ("2competitor_urls", config.get('competitor_2_name', 'Competitor 2').strip()),
-    ]
-    companies = [(section, name) for section, name in companies if name]
+    pricing = content.get('pricing')
+    if isinstance(pricing, list):
+        offers = [offer for offer in pricing if isinstance(offer, dict) and offer.get('price')]
+        if not offers:
+            logging.warning(f"В ответе amazon_pricing нет предложений для ASIN {asin}")
+            return None
+        # Первое предложение – Buy Box, Prime-цена берется из первого Prime-предложения
+        price = extract_price(offers[0].get('price'))
+        prime_offers = [offer for offer in offers if offer.get('is_prime') or 'prime' in str(offer.get('delivery', '')).lower()]
+        prime_price = extract_price(prime_offers[0].get('price')) if prime_offers else price
+        coupon = None  # amazon_pricing не возвращает купоны
+    else:
+        price = extract_price(content.get('price'))
+        prime_price = extract_price(content.get('prime_offer_price'))
+        coupon = extract_coupon(content.get('coupon'))
 
-    data_to_write = []
+    if price == "Not Found":
+        logging.warning(f"Цена не найдена в ответе с ценами для ASIN {asin}")
+        return None
 
-    data_to_write.append(["Parent ASIN"])
-    current_row += 1
+    price_info = {
+        "ASIN": asin,
+        "Price": price,
+        "Prime Price": prime_price if prime_price != "Not Found" else price,
+        "Scrape Date": get_kyiv_time().strftime("%d.%m.%Y"),
+    }
+    if coupon is not None:
+        price_info["Coupon Discount"] = coupon
 
-    asin_row_mapping_parent = {}
+    logging.info(f"Извлеченные цены для ASIN {asin}: {price_info}")
+    return price_info
 
-    for param in parameters:
-        data_to_write.append([param])  
-        current_row += 1
 
-        for section, company_name in companies:
-            urls = config.get(section, [])
-            if urls:
-                for url in urls:
-                    asin = extract_asin(url)
-                    logging.debug(f"Обработка URL: {url}, извлеченный ASIN: {asin}, компания: {company_name}")
-
-                    product_info = next((prod for prod in data.get(company_name, []) if prod.get('ASIN') == asin), {})
-
-                    if not product_info:
-                        asin_display = 'Not Found'
-                        param_value = None
-                    else:
-                        asin_display = asin
-                        param_value = product_info.get(param, None)
-                        if isinstance(param_value, str) and param_value.lower() == "not found":
-                            param_value = None
-
-                    hyperlink_formula = f'=HYPERLINK("{url}", "{asin_display}")' if asin_display != "Not Found" else asin_display
-                    data_to_write.append([company_name, hyperlink_formula, param_value])
-                    asin_row_mapping_parent[(company_name, asin, param)] = current_row
-                    current_row += 1
-
-                data_to_write.append([''])
-                current_row += 1
+def recalculate_final_price(product_info):
+    """Пересчитывает итоговую цену и процент скидки по текущим цене и купону."""
+    price = product_info.get('Price', 'Not Found')
+    final_price = calculate_final_price(price, product_info.get('Prime Price') or price, product_info.get('Coupon Discount'))
+    return {
+        "Final Price": final_price,
+        "Discount Percent": calculate_discount_percent(price, final_price),
+    }
 
-    data_to_write.append(["Variations ASIN"])
-    current_row += 1
 
-    variations_sections = [
-        ("variation_urls", "Merino.tech. (Мы)"),
-        ("1variation_urls", config.get('competitor_1_name', 'Competitor 1').strip()),
-        ("2variation_urls", config.get('competitor_2_name', 'Competitor 2').strip()),
-    ]
-    variations_sections = [(section, name) for section, name in variations_sections if name]
+def scrape_amazon_price(job, config):
+    """Легкий сбор только цены (задание FetchJob) через источник Oxylabs amazon_pricing или amazon_product."""
+    url, asin, marketplace = job.url, job.asin, job.marketplace
+    if asin == 'Not Found':
+        logging.error(f"ASIN not found in URL: {url}")
+        return None
 
-    price_types = ["Price", "List Price", "Prime Price"]  # Убедитесь, что "Prime Price" включён
+    source = config.get('oxylabs_price_source', '').strip() or DEFAULT_OXYLABS_PRICE_SOURCE
+    if source not in OXYLABS_PRICE_SOURCES:
+        logging.error(f"Неизвестный источник цен Oxylabs '{source}'. Используется '{DEFAULT_OXYLABS_PRICE_SOURCE}'.")
+        source = DEFAULT_OXYLABS_PRICE_SOURCE
 
-    asin_row_mapping_variations = {}
-    average_row_mapping = {}
+    oxylabs_username = config.get('oxylabs_username', '').strip()
+    oxylabs_password = config.get('oxylabs_password', '').strip()
+    if not oxylabs_username or not oxylabs_password:
+        logging.error("Oxylabs credentials are missing in the configuration")
+        return None
 
-    for price_type in price_types:
-        data_to_write.append([price_type])
-        current_row += 1
+    payload = {
+        'source': source,
+        'query': asin,
+        'domain': marketplace,
+        'parse': True
+    }
 
-        for section, company_name in variations_sections:
-            urls = config.get(section, [])
-            if urls:
-                temp_asin_rows = []
-                num_variations = 0
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            api_limiter.wait()
+            logging.info(f"Sending price-only request to Oxylabs ({source}) for ASIN: {asin}")
+            response = provider_latency.request(
+                'oxylabs', marketplace, requests.post,
+                get_oxylabs_endpoint(config),
+                auth=(oxylabs_username, oxylabs_password),
+                json=payload,
+                timeout=30
+            )
 
-                formula_row = current_row  
+            if response.status_code in (204, 404):
+                logging.error(f"No Content for ASIN {asin} ({response.status_code})")
+                negative_cache.record_failure(url, f"HTTP {response.status_code}")
+                return None
 
-                # Добавляем строку для средней цены в колонку "Данные"
-                data_to_write.append([company_name, "Средняя цена", ""])  
-                current_row += 1
+            if response.status_code != 200:
+                logging.error(f"Non-200 response from Oxylabs: {response.status_code}")
+                continue
 
-                # Сохраняем номер строки для формулы средней цены
-                average_row_number = current_row - 1
-                average_row_mapping[(company_name, price_type)] = average_row_number
+            # Ответы легкого источника цен хранятся отдельно от полных ответов amazon
+            response_archive.store(f"oxylabs_{source}", marketplace, asin, response.content)
+            try:
+                response_json = response.json()
+            except ValueError:
+                provider_latency.record_parse_failure('oxylabs', marketplace)
+                logging.error(f"Ошибка декодирования JSON для ASIN {asin}")
+                continue
 
-                for url in urls:
-                    asin = extract_asin(url)
-                    logging.debug(f"Обработка вариации URL: {url}, извлеченный ASIN: {asin}, компания: {company_name}")
+            if 'error' in response_json:
+                logging.error(f"Error from Oxylabs for ASIN {asin}: {response_json['error']}")
+                return None
 
-                    product_info = next((prod for prod in data.get(company_name, []) if prod.get('ASIN') == asin), {})
+            price_data = extract_price_data_from_json(response_json, asin)
+            if not price_data:
+                provider_latency.record_parse_failure('oxylabs', marketplace)
+            elif job.role == 'parent':
+                # amazon_product возвращает список вариаций и для легкого сбора родителя
+                harvest_variations(response_json['results'][0]['content'], url)
+            return price_data
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Request exception for ASIN {asin}: {str(e)}")
+            if attempt < max_retries - 1:
+                wait_time = 5 * (attempt + 1)
+                logging.info(f"Retrying in {wait_time} seconds...")
+                clock.sleep(wait_time)
 
-                    if not product_info:
-                        price_value = None
-                    else:
-                        price_value = product_info.get(price_type, None)
-                        if isinstance(price_value, str) and price_value.lower() == "not found":
-                            price_value = None
+    logging.error(f"Failed to retrieve prices for ASIN {asin} after {max_retries} attempts.")
+    return None
 
-                    hyperlink_formula = f'=HYPERLINK("{url}", "{asin}")' if asin != "Not Found" else asin
 
-                    if isinstance(price_value, (int, float)):
-                        price_display = f"${price_value:.2f}"
-                    elif isinstance(price_value, str):
-                        price_display = price_value
-                    else:
-                        price_display = None
+@stage_metrics.timed('telegram_send')
+def send_telegram_message(bot, chat_id, message):
+    """Отправляет сообщение в Telegram, разбивая его на части по лимиту длины."""
+    try:
+        for chunk in split_telegram_message(message):
+            bot.send_message(chat_id, chunk)
+        logging.info(f"Отправлено уведомление в Telegram")
+    except Exception as e:
+        logging.error(f"Не удалось отправить уведомление в Telegram: {str(e)}")
 
-                    temp_asin_rows.append([company_name, hyperlink_formula, price_display])
-                    asin_row_mapping_variations[(company_name, asin, price_type)] = current_row
-                    current_row += 1
-                    num_variations += 1
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина сообщения Telegram
 
-                data_to_write.extend(temp_asin_rows)
 
-                # Обновляем формулу средней цены в колонке "Данные" (C-колонка)
-                first_price_row = formula_row + 1
-                last_price_row = formula_row + num_variations
-                price_range = f"C{first_price_row}:C{last_price_row}"
-                average_formula = f'=AVERAGE(FILTER({price_range}, {price_range}<>""))'
+def split_telegram_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Разбивает текст на части не длиннее limit по границам строк.
+    Строки длиннее лимита режутся принудительно, пустые части отбрасываются.
+    """
+    chunks = []
+    current = []
+    current_length = 0
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                chunks.append('\n'.join(current))
+                current, current_length = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+        added_length = len(line) + (1 if current else 0)
+        if current and current_length + added_length > limit:
+            chunks.append('\n'.join(current))
+            current, current_length = [line], len(line)
+        else:
+            current.append(line)
+            current_length += added_length
+    if current:
+        chunks.append('\n'.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
 
-                data_to_write[formula_row - start_row][2] = average_formula
 
-                data_to_write.append([''])
-                current_row += 1
+class TelegramSink:
+    """
+    Фоновая отправка в Telegram: переиспользуемые боты, очередь отправки,
+    глобальный лимит и лимит на чат, повторы с учетом retry_after.
+    """
+    def __init__(self, global_rate=30, chat_rate=1, max_retries=5, max_queue_size=1000):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.global_limiter = APIRateLimiter(max_requests=global_rate, period=1)
+        self.chat_rate = chat_rate
+        self.chat_limiters = {}
+        self.bots = {}
+        self.max_retries = max_retries
+        self.lock = Lock()
+        self.worker = None
+        self.failed = 0  # Неотправленные сообщения и файлы с начала работы
 
-    end_row = start_row + len(data_to_write) - 1
-    range_notation = f'{sheet_name}!A{start_row}:C{end_row}'
+    def get_bot(self, token):
+        """Возвращает бота для токена, создавая его только один раз."""
+        with self.lock:
+            if token not in self.bots:
+                self.bots[token] = telebot.TeleBot(token)
+            return self.bots[token]
+
+    def send_message(self, token, chat_id, text):
+        """Ставит сообщение в очередь, разбивая его на части по лимиту Telegram."""
+        for chunk in split_telegram_message(text):
+            self._enqueue(('message', token, chat_id, chunk))
+
+    def send_document(self, token, chat_id, document):
+        """Ставит файл (буфер в памяти с атрибутом name) в очередь отправки."""
+        self._enqueue(('document', token, chat_id, document))
+
+    def flush(self, timeout=None):
+        """Ждет отправки всех сообщений из очереди. Возвращает True, если очередь пуста."""
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def _enqueue(self, job):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = Thread(target=self._run, name='telegram-sink', daemon=True)
+                self.worker.start()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            logging.error("Очередь отправки в Telegram переполнена, сообщение отброшено.")
+            with self.lock:
+                self.failed += 1
 
+    def _chat_limiter(self, chat_id):
+        with self.lock:
+            if chat_id not in self.chat_limiters:
+                self.chat_limiters[chat_id] = APIRateLimiter(max_requests=self.chat_rate, period=1)
+            return self.chat_limiters[chat_id]
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            delivered = False
+            try:
+                delivered = self._deliver(job)
+            except Exception as e:
+                logging.error(f"Ошибка в очереди отправки Telegram: {str(e)}")
+            finally:
+                if not delivered:
+                    with self.lock:
+                        self.failed += 1
+                self.queue.task_done()
+
+    @stage_metrics.timed('telegram_send')
+    def _deliver(self, job):
+        kind, token, chat_id, payload = job
+        bot = self.get_bot(token)
+        wait_time = 1
+        for attempt in range(1, self.max_retries + 1):
+            self.global_limiter.wait()
+            self._chat_limiter(chat_id).wait()
+            try:
+                if kind == 'message':
+                    bot.send_message(chat_id, payload)
+                    logging.info("Отправлено уведомление в Telegram")
+                else:
+                    payload.seek(0)
+                    bot.send_document(chat_id, payload)
+                    logging.info("Отчет успешно отправлен в Telegram.")
+                return True
+            except telebot.apihelper.ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', wait_time)
+                    logging.warning(f"Telegram ограничил отправку (429). Повтор через {retry_after} секунд...")
+                    clock.sleep(retry_after)
+                    continue
+                if e.error_code < 500:
+                    logging.error(f"Не удалось отправить в Telegram: {str(e)}")
+                    return False
+                logging.warning(f"Ошибка сервера Telegram ({e.error_code}), попытка {attempt}/{self.max_retries}")
+            except Exception as e:
+                logging.warning(f"Ошибка отправки в Telegram: {str(e)}, попытка {attempt}/{self.max_retries}")
+            clock.sleep(wait_time)
+            wait_time *= 2
+        logging.error(f"Не удалось отправить в Telegram после {self.max_retries} попыток.")
+        return False
+
+
+# Общая очередь отправки в Telegram для всех циклов
+telegram_sink = TelegramSink()
+
+
+# Поля снимка, доступные в правилах оповещений: имя поля -> (тип, описание)
+ALERT_RULE_FIELDS = {
+    'company': ('text', "Компания ('us' для нашей компании, иначе имя конкурента)"),
+    'company_name': ('text', 'Отображаемое имя компании'),
+    'asin': ('text', 'ASIN продукта'),
+    'price': ('number', 'Цена'),
+    'prime_price': ('number', 'Prime цена'),
+    'list_price': ('number', 'List Price'),
+    'final_price': ('number', 'Итоговая цена с учетом купона'),
+    'coupon': ('number', 'Купон, %'),
+    'prime_gap_pct': ('number', 'Разница между Full и Prime ценой, %'),
+    'rating': ('number', 'Рейтинг'),
+    'reviews': ('number', 'Количество отзывов'),
+    'bsr': ('number', 'Best Sellers Rank'),
+    'price_delta_pct': ('number', 'Изменение цены относительно прошлого цикла, %'),
+    'rating_change': ('number', 'Изменение рейтинга относительно прошлого цикла'),
+    'reviews_change': ('number', 'Изменение количества отзывов относительно прошлого цикла'),
+    'bsr_rank_change': ('number', 'Изменение BSR относительно прошлого цикла (больше 0 - хуже)'),
+    'rating_invalid': ('number', 'Рейтинг найден, но не является числом (1 или 0)'),
+    'price_invalid': ('number', 'Full и Prime цены найдены, но хотя бы одна не является числом (1 или 0)'),
+    'coupon_invalid': ('number', 'Купон найден, но не является числом (1 или 0)'),
+}
+
+# Функции numpy по именам: numpy импортируется при первой компиляции правила, а не при загрузке скрипта
+_ALERT_RULE_COMPARATORS = {
+    ast.Lt: 'less',
+    ast.LtE: 'less_equal',
+    ast.Gt: 'greater',
+    ast.GtE: 'greater_equal',
+    ast.Eq: 'equal',
+    ast.NotEq: 'not_equal',
+}
+
+# Число с разделителями: точка, запятая, а также пробел, неразрывный или узкий неразрывный пробел
+# перед группой из трех цифр ("1 299,00 €")
+_NUMERIC_VALUE_PATTERN = re.compile(r'-?\d[\d.,]*(?:[ \u00a0\u202f]\d{3}(?!\d)[\d.,]*)*')
+_NUMERIC_GROUP_SPACES = re.compile(r'[ \u00a0\u202f]')
+
+# Текст оповещения правила по умолчанию о разнице Full и Prime цен
+PRICE_GAP_ALERT_MESSAGE = "💰 Значительное изменение цены для ASIN {asin}: Full ${price:.2f}, Prime ${prime_price:.2f}"
+
+# Снимок предыдущего цикла для вычисления дельт: (компания, ASIN) -> значения полей
+_previous_alert_snapshot = {}
+
+
+def parse_numeric_value(value):
+    """
+    Преобразует значение из product_info ("$12.34", "12,34 €", "€ 1 299,00", "10.0%", 1234) в float.
+    Возвращает NaN, если значение не найдено или не является числом.
+    """
+    if isinstance(value, bool):
+        return float('nan')
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return float('nan')
+    match = _NUMERIC_VALUE_PATTERN.search(value)
+    if not match:
+        return float('nan')
+    number = _NUMERIC_GROUP_SPACES.sub('', match.group()).rstrip('.,')
+    if ',' in number and '.' in number:
+        # Последний разделитель - десятичный, остальные - разделители тысяч
+        if number.rfind(',') > number.rfind('.'):
+            number = number.replace('.', '').replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif ',' in number or '.' in number:
+        separator = ',' if ',' in number else '.'
+        parts = number.split(separator)
+        # "1.234" / "1,234,567" - разделители тысяч, "12,34" / "12.34" - десятичная часть
+        if len(parts) > 2 or len(parts[-1]) == 3:
+            number = ''.join(parts)
+        else:
+            number = '.'.join(parts)
+    try:
+        return float(number)
+    except ValueError:
+        return float('nan')
+
+
+def _alert_condition_and(results):
+    """Трехзначное and над парами (значение, известность): известно, если все известны или хоть один ложен."""
+    value = np.logical_and.reduce([value for value, _ in results])
+    all_known = np.logical_and.reduce([known for _, known in results])
+    any_false = np.logical_or.reduce([np.logical_and(known, np.logical_not(value)) for value, known in results])
+    return value, np.logical_or(all_known, any_false)
+
+
+def _alert_condition_or(results):
+    """Трехзначное or над парами (значение, известность): известно, если все известны или хоть один истинен."""
+    value = np.logical_or.reduce([value for value, _ in results])
+    all_known = np.logical_and.reduce([known for _, known in results])
+    return value, np.logical_or(all_known, value)
+
+
+class AlertRule:
+    """
+    Скомпилированное правило оповещения, например `rating < 4.3 and company == "us"`.
+    message - необязательный шаблон текста оповещения: поля правил и исходный продукт ({product[Rating]}).
+    """
+    def __init__(self, expression, message=None):
+        self.expression = expression.strip()
+        self.message = message
+        try:
+            tree = ast.parse(self.expression, mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Синтаксическая ошибка в правиле '{self.expression}': {e.msg}")
+        self.fields = set()
+        self._evaluate = self._compile_condition(tree.body)
+
+    def _compile_condition(self, node):
+        """
+        Компилирует логическое выражение в функцию columns -> (значение, известность), оба - массивы bool.
+        Сравнение с NaN неизвестно, and/or/not следуют трехзначной логике: `not price < 10`
+        не срабатывает для продукта без цены.
+        """
+        if isinstance(node, ast.BoolOp):
+            operands = [self._compile_condition(value) for value in node.values]
+            combine = _alert_condition_and if isinstance(node.op, ast.And) else _alert_condition_or
+            return lambda columns: combine([operand(columns) for operand in operands])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            operand = self._compile_condition(node.operand)
+
+            def negate(columns):
+                value, known = operand(columns)
+                return np.logical_and(np.logical_not(value), known), known
+            return negate
+        if isinstance(node, ast.Compare):
+            return self._compile_comparison(node)
+        raise ValueError(f"Неподдерживаемое выражение в правиле '{self.expression}'")
+
+    def _compile_comparison(self, node):
+        """Компилирует (возможно цепочечное) сравнение: `4.0 <= rating < 4.3`."""
+        operands = [self._compile_operand(item) for item in [node.left] + node.comparators]
+        comparisons = []
+        for op, (left, left_kind), (right, right_kind) in zip(node.ops, operands, operands[1:]):
+            comparator_name = _ALERT_RULE_COMPARATORS.get(type(op))
+            if comparator_name is None:
+                raise ValueError(f"Неподдерживаемый оператор сравнения в правиле '{self.expression}'")
+            if left_kind != right_kind:
+                raise ValueError(f"Сравнение текста с числом в правиле '{self.expression}'")
+            if left_kind == 'text' and comparator_name not in ('equal', 'not_equal'):
+                raise ValueError(f"Текстовые поля можно сравнивать только через == и != в правиле '{self.expression}'")
+            comparisons.append((getattr(np, comparator_name), left, right, left_kind == 'number'))
+
+        def evaluate(columns):
+            results = []
+            for comparator, left, right, numeric in comparisons:
+                left_value, right_value = left(columns), right(columns)
+                value = np.asarray(comparator(left_value, right_value), dtype=bool)
+                if numeric:
+                    known = np.logical_not(np.logical_or(np.isnan(left_value), np.isnan(right_value)))
+                else:
+                    known = np.ones_like(value)
+                results.append((value, known))
+            return _alert_condition_and(results) if len(results) > 1 else results[0]
+        return evaluate
+
+    def _compile_operand(self, node):
+        """Компилирует имя поля или константу в функцию columns -> значение и тип."""
+        if isinstance(node, ast.Name):
+            if node.id not in ALERT_RULE_FIELDS:
+                raise ValueError(f"Неизвестное поле '{node.id}' в правиле '{self.expression}'")
+            self.fields.add(node.id)
+            return (lambda columns: columns[node.id]), ALERT_RULE_FIELDS[node.id][0]
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)) \
+                and isinstance(node.operand, ast.Constant) and isinstance(node.operand.value, (int, float)):
+            value = -node.operand.value if isinstance(node.op, ast.USub) else node.operand.value
+            return (lambda columns: value), 'number'
+        if isinstance(node, ast.Constant) and not isinstance(node.value, bool):
+            value = node.value
+            if isinstance(value, (int, float)):
+                return (lambda columns: value), 'number'
+            if isinstance(value, str):
+                return (lambda columns: value), 'text'
+        raise ValueError(f"Неподдерживаемый операнд в правиле '{self.expression}'")
+
+    def evaluate(self, columns, size):
+        """Возвращает булеву маску длины size для колоночного снимка."""
+        with np.errstate(invalid='ignore'):
+            mask, _ = self._evaluate(columns)
+        return np.broadcast_to(np.asarray(mask, dtype=bool), (size,))
+
+
+@lru_cache(maxsize=32)
+def compile_alert_rules(expressions, messages=None):
+    """
+    Компилирует кортеж текстовых правил и, если заданы, кортеж шаблонов их оповещений.
+    Некорректные правила пропускаются с ошибкой в логе.
+    Результат кэшируется, поэтому повторная загрузка того же конфига не компилирует правила заново.
+    """
+    rules = []
+    for expression, message in zip(expressions, messages or (None,) * len(expressions)):
+        try:
+            rules.append(AlertRule(expression, message))
+        except ValueError as e:
+            logging.error(f"Правило оповещения пропущено: {e}")
+    logging.info(f"Скомпилировано правил оповещений: {len(rules)} из {len(expressions)}")
+    return tuple(rules)
+
+
+def get_alert_rules(config):
+    """
+    Возвращает скомпилированные правила из конфига или правила по умолчанию из порогов.
+    Правила по умолчанию повторяют прежние проверки рейтинга, разницы Full/Prime цен и купона вместе с их текстами.
+    """
+    if config.get('compiled_alert_rules') is not None:
+        return config['compiled_alert_rules']
+    default_rules = (
+        (f"rating < {float(config.get('min_acceptable_rating', 4.0))}",
+         "⚠️ Низкий рейтинг: {product[Rating]} звезд для ASIN {asin}"),
+        ("rating_invalid == 1", "⚠️ Некорректный рейтинг для ASIN {asin}"),
+        (f"price != 0 and prime_price != 0 and prime_gap_pct >= {float(config.get('price_change_threshold', 5.0))}",
+         PRICE_GAP_ALERT_MESSAGE),
+        ("price_invalid == 1", "⚠️ Некорректная цена для ASIN {asin}"),
+        (f"coupon >= {float(config.get('coupon_threshold', 10.0))}", "🏷️ Большой купон для ASIN {asin}: {coupon}%"),
+        ("coupon_invalid == 1", "⚠️ Некорректная скидка купона для ASIN {asin}"),
+    )
+    expressions, messages = zip(*default_rules)
+    return compile_alert_rules(expressions, messages)
+
+
+def build_snapshot_columns(data, our_company_name):
+    """
+    Преобразует результаты цикла {компания: [product_info, ...]} в колоночные массивы NumPy.
+    Цены и прочие строки разбираются один раз за цикл, отсутствующие значения - NaN.
+    Возвращает колонки и список продуктов в порядке строк.
+    """
+    text_fields = [name for name, (kind, _) in ALERT_RULE_FIELDS.items() if kind == 'text']
+    raw_fields = {
+        'price': 'Price', 'prime_price': 'Prime Price', 'list_price': 'List Price',
+        'final_price': 'Final Price', 'coupon': 'Coupon Discount', 'rating': 'Rating',
+        'reviews': 'Number of Reviews', 'bsr': 'BSR',
+    }
+    text_values = {name: [] for name in text_fields}
+    numeric_values = {name: [] for name in raw_fields}
+    previous_values = {name: [] for name in ('price', 'rating', 'reviews', 'bsr')}
+    invalid_values = {'rating_invalid': [], 'price_invalid': [], 'coupon_invalid': []}
+    rows = []
+
+    for company_name, products in data.items():
+        company = 'us' if company_name == our_company_name else company_name
+        for product in products:
+            asin = product.get('ASIN', 'Not Found')
+            text_values['company'].append(company)
+            text_values['company_name'].append(company_name)
+            text_values['asin'].append(asin)
+            for name, key in raw_fields.items():
+                numeric_values[name].append(parse_numeric_value(product.get(key)))
+            # Значение найдено (не None и не "Not Found"), но не разобрано как число
+            found = {name: product.get(raw_fields[name]) not in (None, "Not Found") for name in ('price', 'prime_price', 'coupon', 'rating')}
+            invalid_values['rating_invalid'].append(found['rating'] and np.isnan(numeric_values['rating'][-1]))
+            invalid_values['price_invalid'].append(found['price'] and found['prime_price'] and (
+                np.isnan(numeric_values['price'][-1]) or np.isnan(numeric_values['prime_price'][-1])))
+            invalid_values['coupon_invalid'].append(found['coupon'] and np.isnan(numeric_values['coupon'][-1]))
+            rows.append(product)
+            previous = _previous_alert_snapshot.get((company_name, asin), {})
+            for name in previous_values:
+                previous_values[name].append(previous.get(name, float('nan')))
+
+    columns = {name: np.array(values, dtype=object) for name, values in text_values.items()}
+    columns.update({name: np.array(values, dtype=float) for name, values in numeric_values.items()})
+    columns.update({name: np.array(values, dtype=float) for name, values in invalid_values.items()})
+    previous = {name: np.array(values, dtype=float) for name, values in previous_values.items()}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['prime_gap_pct'] = np.abs(columns['price'] - columns['prime_price']) / columns['price'] * 100
+        columns['price_delta_pct'] = (columns['price'] - previous['price']) / previous['price'] * 100
+    columns['rating_change'] = columns['rating'] - previous['rating']
+    columns['reviews_change'] = columns['reviews'] - previous['reviews']
+    columns['bsr_rank_change'] = columns['bsr'] - previous['bsr']
+    return columns, rows
+
+
+def evaluate_alert_rules(rules, data, our_company_name):
+    """
+    Вычисляет все правила над снимком цикла одним проходом по колонкам.
+    Возвращает список текстов оповещений (по продуктам, внутри продукта - в порядке правил)
+    и запоминает снимок для дельт следующего цикла.
+    """
+    columns, products = build_snapshot_columns(data, our_company_name)
+    size = len(products)
+    fired = []
+    if size:
+        for rule in rules:
+            for index in np.flatnonzero(rule.evaluate(columns, size)):
+                if rule.message is not None:
+                    values = {field: columns[field][index] for field in ALERT_RULE_FIELDS}
+                    fired.append((index, rule.message.format(product=products[index], **values)))
+                    continue
+                details = ', '.join(
+                    f"{field}={columns[field][index]:g}" if ALERT_RULE_FIELDS[field][0] == 'number' else f"{field}={columns[field][index]}"
+                    for field in sorted(rule.fields) if field not in ('asin', 'company')
+                )
+                alert = f"🔔 {rule.expression}: ASIN {columns['asin'][index]} ({columns['company_name'][index]})"
+                fired.append((index, f"{alert} - {details}" if details else alert))
+    fired.sort(key=lambda item: item[0])
+    alerts = [alert for _, alert in fired]
+
+    # Запоминаем снимок; пропущенные значения не затирают последние известные
+    for index in range(size):
+        previous = _previous_alert_snapshot.setdefault((columns['company_name'][index], columns['asin'][index]), {})
+        for name in ('price', 'rating', 'reviews', 'bsr'):
+            if not np.isnan(columns[name][index]):
+                previous[name] = columns[name][index]
+    logging.info(f"Проверено правил оповещений: {len(rules)} для {size} продуктов, сработало: {len(alerts)}")
+    return alerts
+
+
+# Разметка листа мониторинга: заголовок, подписи секций, строки агрегатов и гиперссылки.
+# Не зависит от собранных данных, поэтому строится один раз на версию конфига
+SheetLayout = namedtuple('SheetLayout', ['version', 'header', 'start_row', 'static_rows', 'asin_row_mapping_parent', 'asin_row_mapping_variations', 'aggregate_rows'])
+
+MONITORING_PARAMETERS = ["BSR", "Number of Reviews", "Rating", "Price"]
+MONITORING_PRICE_TYPES = ["Price", "List Price", "Prime Price"]  # Убедитесь, что "Prime Price" включён
+
+# Агрегаты цен вариаций: подпись строки и статистика. Считаются локально и пишутся значениями.
+# Средняя цена стоит над вариациями группы, как в листах до появления остальных агрегатов;
+# остальные агрегаты идут в разделе VARIATION_STATS_TITLE после всех строк, чтобы строки листа не сдвигались
+PRICE_AGGREGATES = [
+    ("Средняя цена", 'mean'),
+    ("Мин. цена", 'min'),
+    ("Макс. цена", 'max'),
+    ("Медиана", 'median'),
+    ("Кол-во цен", 'count'),
+]
+VARIATION_STATS_TITLE = "Variations Price Stats"
+
+# Кэш разметки по имени листа
+sheet_layouts = {}
+
+
+def sheet_layout_version(config):
+    """
+    Версия разметки листа: заголовок и задания parent/variation секций.
+    Меняется только при изменении слотов, имен конкурентов или списков URL в конфиге.
+    """
+    header = [
+        "Наименование", "Параметры", "Данные"
+    ] + config.get('active_trade_slots', []) + ["Зона анализа"] + config.get('analysis_slots', [])
+    header = tuple(slot.strip() if isinstance(slot, str) else slot for slot in header)
+
+    companies = [
+        ("product_urls", "Merino.tech. (Мы)"),
+        ("1competitor_urls", config.get('competitor_1_name', 'Competitor 1').strip()),
+        ("2competitor_urls", config.get('competitor_2_name', 'Competitor 2').strip()),
+    ]
+    variations_sections = [
+        ("variation_urls", "Merino.tech. (Мы)"),
+        ("1variation_urls", config.get('competitor_1_name', 'Competitor 1').strip()),
+        ("2variation_urls", config.get('competitor_2_name', 'Competitor 2').strip()),
+    ]
+
+    parent_sections = tuple(
+        (name, compile_fetch_jobs(section, name, 'parent', tuple(config.get(section, []))))
+        for section, name in companies if name
+    )
+    variation_sections = tuple(
+        (name, compile_fetch_jobs(section, name, 'variation', tuple(config.get(section, []))))
+        for section, name in variations_sections if name
+    )
+    return header, parent_sections, variation_sections
+
+
+def build_sheet_layout(version, start_row=3):
+    """Строит статические строки листа (A:C) и номера строк для значений и агрегатов."""
+    header, parent_sections, variation_sections = version
+    current_row = start_row
+    static_rows = []
+
+    static_rows.append(["Parent ASIN"])
+    current_row += 1
+
+    asin_row_mapping_parent = {}
+
+    for param in MONITORING_PARAMETERS:
+        static_rows.append([param])
+        current_row += 1
+
+        for company_name, jobs in parent_sections:
+            if not jobs:
+                continue
+
+            for job in jobs:
+                hyperlink_formula = f'=HYPERLINK("{job.url}", "{job.asin}")' if job.asin != "Not Found" else job.asin
+                # Значение в колонке "Данные" пишется при каждом обновлении слота
+                static_rows.append([company_name, hyperlink_formula, None])
+                asin_row_mapping_parent[(company_name, job.asin, param)] = current_row
+                current_row += 1
+
+            static_rows.append([''])
+            current_row += 1
+
+    static_rows.append(["Variations ASIN"])
+    current_row += 1
+
+    asin_row_mapping_variations = {}
+    aggregate_rows = []
+
+    for price_type in MONITORING_PRICE_TYPES:
+        static_rows.append([price_type])
+        current_row += 1
+
+        for company_name, jobs in variation_sections:
+            if not jobs:
+                continue
+
+            # Строка средней цены; значения агрегатов пишутся при каждом обновлении слота
+            mean_label, mean_stat = PRICE_AGGREGATES[0]
+            static_rows.append([company_name, mean_label, None])
+            aggregate_rows.append((company_name, price_type, tuple(job.asin for job in jobs), {mean_stat: current_row}))
+            current_row += 1
+
+            for job in jobs:
+                hyperlink_formula = f'=HYPERLINK("{job.url}", "{job.asin}")' if job.asin != "Not Found" else job.asin
+                static_rows.append([company_name, hyperlink_formula, None])
+                asin_row_mapping_variations[(company_name, job.asin, price_type)] = current_row
+                current_row += 1
+
+            static_rows.append([''])
+            current_row += 1
+
+    # Остальные агрегаты - после всех строк вариаций
+    if aggregate_rows:
+        static_rows.append([VARIATION_STATS_TITLE])
+        current_row += 1
+    for price_type in MONITORING_PRICE_TYPES:
+        groups = [group for group in aggregate_rows if group[1] == price_type]
+        if not groups:
+            continue
+        static_rows.append([price_type])
+        current_row += 1
+        for company_name, _, _, stat_rows in groups:
+            for label, stat in PRICE_AGGREGATES[1:]:
+                static_rows.append([company_name, label, None])
+                stat_rows[stat] = current_row
+                current_row += 1
+
+            static_rows.append([''])
+            current_row += 1
+
+    return SheetLayout(
+        version=version,
+        header=list(header),
+        start_row=start_row,
+        static_rows=static_rows,
+        asin_row_mapping_parent=asin_row_mapping_parent,
+        asin_row_mapping_variations=asin_row_mapping_variations,
+        aggregate_rows=aggregate_rows,
+    )
+
+
+def get_sheet_layout(sheet_name, config):
+    """Возвращает (разметка, изменилась ли она) для листа; разметка перестраивается только при смене версии конфига."""
+    version = sheet_layout_version(config)
+    layout = sheet_layouts.get(sheet_name)
+    if layout is not None and layout.version == version:
+        return layout, False
+
+    layout = build_sheet_layout(version)
+    sheet_layouts[sheet_name] = layout
+    logging.info(f"Разметка листа '{sheet_name}' построена заново: {len(layout.static_rows)} строк.")
+    return layout, True
+
+
+def compute_price_aggregates(data, aggregate_rows):
+    """
+    Считает агрегаты цен вариаций (mean, min, max, median, count) для всех групп
+    (компания, тип цены) одним векторным проходом NumPy.
+    Цены разбираются в float, нечисловые и отсутствующие значения не учитываются.
+    Возвращает {(компания, тип цены): {статистика: значение}}; пустые группы получают "".
+    """
+    if not aggregate_rows:
+        return {}
+
+    products = {
+        (company_name, product.get('ASIN')): product
+        for company_name, items in data.items()
+        for product in items
+    }
+    width = max(len(asins) for _, _, asins, _ in aggregate_rows) or 1
+    prices = np.full((len(aggregate_rows), width), np.nan)
+    for i, (company_name, price_type, asins, _) in enumerate(aggregate_rows):
+        for j, asin in enumerate(asins):
+            product = products.get((company_name, asin))
+            if product:
+                prices[i, j] = parse_numeric_value(product.get(price_type))
+
+    valid = ~np.isnan(prices)
+    counts = valid.sum(axis=1)
+    has_values = counts > 0
+    totals = np.where(valid, prices, 0.0).sum(axis=1)
+    means = np.divide(totals, counts, out=np.full(counts.shape, np.nan), where=has_values)
+    minimums = np.fmin.reduce(prices, axis=1)
+    maximums = np.fmax.reduce(prices, axis=1)
+    # NaN сортируются в конец строки, поэтому медиана берется из первых count элементов
+    ordered = np.sort(prices, axis=1)
+    lower = np.take_along_axis(ordered, np.maximum((counts - 1) // 2, 0)[:, None], axis=1)[:, 0]
+    upper = np.take_along_axis(ordered, np.maximum(counts // 2, 0)[:, None], axis=1)[:, 0]
+    medians = np.where(has_values, (lower + upper) / 2, np.nan)
+
+    columns = {'mean': means, 'min': minimums, 'max': maximums, 'median': medians}
+    aggregates = {}
+    for i, (company_name, price_type, _, _) in enumerate(aggregate_rows):
+        stats = {'count': int(counts[i])}
+        for stat, values in columns.items():
+            stats[stat] = round(float(values[i]), 2) if has_values[i] else ""
+        aggregates[(company_name, price_type)] = stats
+    return aggregates
+
+
+@stage_metrics.timed('sheets_update')
+def update_monitoring_sheet(spreadsheet, data, current_time_slot, config):
+    from openpyxl.utils import get_column_letter
+
+    sheet_name = config.get('data_sheet_name') or "SS+Sox"  # Название листа в Google Sheets
+    try:
+        sheet = spreadsheet.worksheet(sheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        logging.error(f"Лист '{sheet_name}' не найден в таблице.")
+        return False
+
+    # Заголовок, подписи и гиперссылки записываются только при изменении разметки
+    layout, layout_changed = get_sheet_layout(sheet_name, config)
+    header = layout.header
+    start_row = layout.start_row
+
+    logging.debug(f"Текущий временной слот: '{current_time_slot}'")
+    logging.debug(f"Заголовки таблицы: {header}")
+
+    value_ranges = []
+    if layout_changed:
+        end_row = start_row + len(layout.static_rows) - 1
+        value_ranges.append({
+            'range': f'{sheet_name}!A1',
+            'values': [header]
+        })
+        value_ranges.append({
+            'range': f'{sheet_name}!A{start_row}:C{end_row}',
+            'values': layout.static_rows
+        })
+
+    # Получаем текущее время в формате "YYYY-MM-DD HH:MM:SS" в киевском часовом поясе
+    current_time = get_kyiv_time().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Добавляем запись текущего времени на 2-ю строку в колонку "Данные"
+    time_notation = f'{sheet_name}!C2'  # Ячейка C2 (строка 2, колонка "Данные")
     value_ranges.append({
-        'range': range_notation,
-        'values': data_to_write
+        'range': time_notation,
+        'values': [[current_time]]  # Записываем текущее время
     })
 
+    data_column_letter = get_column_letter(header.index("Данные") + 1)
+
     if current_time_slot and current_time_slot in header:
         slot_column = header.index(current_time_slot) + 1  
         logging.info(f"Данные будут записаны в колонку '{current_time_slot}' (столбец {slot_column})")
@@ -839,6 +2350,11 @@ def update_monitoring_sheet(spreadsheet, data, current_time_slot, config):
 
     column_letter = get_column_letter(slot_column)
 
+    # Колонка "Данные" обновляется всегда, колонка слота – если она отличается от нее
+    target_columns = [data_column_letter]
+    if column_letter != data_column_letter:
+        target_columns.append(column_letter)
+
     slot_updates = []
 
     def find_product_info(all_data, company_name, asin):
@@ -848,19 +2364,19 @@ def update_monitoring_sheet(spreadsheet, data, current_time_slot, config):
                 return prod
         return None
 
-    for (company_name, asin, param), row_number in asin_row_mapping_parent.items():
+    for (company_name, asin, param), row_number in layout.asin_row_mapping_parent.items():
         product_info = find_product_info(data, company_name, asin)
         if product_info:
             value = product_info.get(param, None)
             if isinstance(value, str) and value.lower() == "not found":
                 value = None  
-            cell_notation = f'{sheet_name}!{column_letter}{row_number}'
-            slot_updates.append({
-                'range': cell_notation,
-                'values': [[value]]
-            })
+            for letter in target_columns:
+                slot_updates.append({
+                    'range': f'{sheet_name}!{letter}{row_number}',
+                    'values': [[value]]
+                })
 
-    for (company_name, asin, price_type), row_number in asin_row_mapping_variations.items():
+    for (company_name, asin, price_type), row_number in layout.asin_row_mapping_variations.items():
         product_info = find_product_info(data, company_name, asin)
         if product_info:
             price_value = product_info.get(price_type, None)
@@ -868,32 +2384,22 @@ def update_monitoring_sheet(spreadsheet, data, current_time_slot, config):
                 price_value = None  
             elif isinstance(price_value, (int, float)):
                 price_value = f"${price_value:.2f}"
-            cell_notation = f'{sheet_name}!{column_letter}{row_number}'
-            slot_updates.append({
-                'range': cell_notation,
-                'values': [[price_value]]
-            })
-
-    # Обновление формулы средней цены в соответствующем временном слоте
-    for (company_name, price_type), row_number in average_row_mapping.items():
-        variation_rows = [row_num for (comp, asin, ptype), row_num in asin_row_mapping_variations.items()
-                          if comp == company_name and ptype == price_type]
-
-        if variation_rows:
-            first_row = min(variation_rows)
-            last_row = max(variation_rows)
-            slot_column_letter = column_letter  
-
-            price_range = f'{slot_column_letter}{first_row}:{slot_column_letter}{last_row}'
-
-            average_formula = f'=AVERAGE(FILTER({price_range}, {price_range}<>""))'
-
-            cell_notation = f'{sheet_name}!{slot_column_letter}{row_number}'
-
-            slot_updates.append({
-                'range': cell_notation,
-                'values': [[average_formula]]
-            })
+            for letter in target_columns:
+                slot_updates.append({
+                    'range': f'{sheet_name}!{letter}{row_number}',
+                    'values': [[price_value]]
+                })
+
+    # Агрегаты цен вариаций считаются локально и пишутся значениями
+    aggregates = compute_price_aggregates(data, layout.aggregate_rows)
+    for company_name, price_type, _, stat_rows in layout.aggregate_rows:
+        stats = aggregates[(company_name, price_type)]
+        for stat, row_number in stat_rows.items():
+            for letter in target_columns:
+                slot_updates.append({
+                    'range': f'{sheet_name}!{letter}{row_number}',
+                    'values': [[stats[stat]]]
+                })
 
     value_ranges.extend(slot_updates)
 
@@ -904,23 +2410,24 @@ def update_monitoring_sheet(spreadsheet, data, current_time_slot, config):
         }
         spreadsheet.values_batch_update(data_body)
         logging.info("Данные успешно обновлены в Google Sheets.")
-    except APIError as e:
+    except gspread.exceptions.APIError as e:
         logging.error(f"Ошибка API при обновлении Google Sheets: {str(e)}")
         retry_delay = 60  
         logging.info(f"Попытка повторного обновления через {retry_delay} секунд...")
-        time.sleep(retry_delay)
+        clock.sleep(retry_delay)
         try:
             spreadsheet.values_batch_update(data_body)
             logging.info("Данные успешно обновлены в Google Sheets после повторной попытки.")
         except Exception as e2:
             logging.error(f"Не удалось обновить Google Sheets после повторной попытки: {str(e2)}")
+            # Разметка могла не записаться: в следующем цикле она будет записана заново
+            sheet_layouts.pop(sheet_name, None)
+            return False
     except Exception as e:
         logging.error(f"Ошибка при обновлении Google Sheets: {str(e)}")
-
-
-
-
-
+        sheet_layouts.pop(sheet_name, None)
+        return False
+    return True
 
 
 def extract_reviews_count(product_data):
@@ -945,12 +2452,62 @@ def extract_reviews_count(product_data):
     logging.info(f"Извлеченное количество отзывов: {reviews_count}")
     return reviews_count
 
+# Заголовки столбцов XLSX отчета
+XLSX_REPORT_HEADERS = [
+    "Company", "ASIN", "Title", "Full Price", "Prime Price", 
+    "Avg List Price", "Avg Title Price", "Avg Prime Price",
+    "Rating", "Number of Reviews", "Coupon Discount", 
+    "Final Price", "Discount Percent", "Variations Count"
+]
+
+
+def iter_report_rows(data):
+    """Генерирует строки XLSX отчета по одной, не собирая их в памяти."""
+    for company, products in data.items():
+        for product in products:
+            yield [
+                company,
+                product.get('ASIN', 'Не найдено'),
+                product.get('Title', 'Не найдено'),
+                product.get('Price', 'Не найдено'),
+                product.get('Prime Price', 'Не найдено'),
+                product.get('List Price', 'Not Found'),
+                product.get('Sale Price', 'Not Found'),
+                product.get('Prime Price', 'Not Found'),
+                product.get('Rating', 'Не найдено'),
+                product.get('Number of Reviews', 'Не найдено'),
+                product.get('Coupon Discount', 'Not Found'),
+                product.get('Final Price', 'Not Found'),
+                product.get('Discount Percent', 'Not Found'),
+                product.get('Variations Count', 'Not Found'),
+            ]
+
+
+@stage_metrics.timed('xlsx_report')
 def create_xlsx_report(data, current_time_str):
-    """Создание XLSX отчета с данными о продуктах."""
+    """
+    Создание XLSX отчета с данными о продуктах в потоковом режиме (write-only).
+    Ширина столбцов считается по текущим максимумам за отдельный проход по строкам,
+    отчет пишется в буфер в памяти. Возвращает io.BytesIO с атрибутом name или None.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
     try:
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Product Report"
+        # Первый проход: ширина столбцов по максимальной длине значений
+        column_widths = [len(header) for header in XLSX_REPORT_HEADERS]
+        for values in iter_report_rows(data):
+            for index, value in enumerate(values):
+                if value:
+                    column_widths[index] = max(column_widths[index], len(str(value)))
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Product Report")
+        # В режиме write-only ширина задается до записи первой строки
+        for index, width in enumerate(column_widths, start=1):
+            ws.column_dimensions[get_column_letter(index)].width = width + 2
 
         # Стили
         header_font = Font(bold=True)
@@ -958,99 +2515,84 @@ def create_xlsx_report(data, current_time_str):
         bold_blue_font = Font(bold=True, color="0000FF")  # Жирный и синий цвет для кликабельных ASIN
 
         # Заголовок
-        ws['A1'] = f"Product Report - {current_time_str}"
-        ws['A1'].font = Font(bold=True, size=14)
-        ws.merge_cells('A1:N1')  # Расширил диапазон для новых колонок
+        title_cell = WriteOnlyCell(ws, value=f"Product Report - {current_time_str}")
+        title_cell.font = Font(bold=True, size=14)
+        ws.append([title_cell])
+        ws.merged_cells.add(f"A1:{get_column_letter(len(XLSX_REPORT_HEADERS))}1")
 
         # Заголовки столбцов
-        headers = [
-            "Company", "ASIN", "Title", "Full Price", "Prime Price", 
-            "Avg List Price", "Avg Title Price", "Avg Prime Price",
-            "Rating", "Number of Reviews", "Coupon Discount", 
-            "Final Price", "Discount Percent", "Variations Count"
-        ]
-        for col, header in enumerate(headers, start=1):
-            cell = ws.cell(row=2, column=col, value=header)
+        header_cells = []
+        for header in XLSX_REPORT_HEADERS:
+            cell = WriteOnlyCell(ws, value=header)
             cell.font = header_font
             cell.fill = header_fill
-
-        # Данные
-        row = 3
-        for company, products in data.items():
-            for product in products:
-                ws.cell(row=row, column=1, value=company)
-                asin_cell = ws.cell(row=row, column=2, value=product.get('ASIN', 'Не найдено'))
-                asin = product.get('ASIN', 'Не найдено')
-                if asin != 'Не найдено':
-                    asin_cell.hyperlink = f"https://www.amazon.com/dp/{asin}"
-                    asin_cell.font = bold_blue_font  # Сделать кликабельным ASIN жирным и синим
-                ws.cell(row=row, column=3, value=product.get('Title', 'Не найдено'))
-                ws.cell(row=row, column=4, value=product.get('Price', 'Не найдено'))
-                ws.cell(row=row, column=5, value=product.get('Prime Price', 'Не найдено'))
-                ws.cell(row=row, column=6, value=product.get('List Price', 'Not Found'))
-                ws.cell(row=row, column=7, value=product.get('Sale Price', 'Not Found'))
-                ws.cell(row=row, column=8, value=product.get('Prime Price', 'Not Found'))
-                ws.cell(row=row, column=9, value=product.get('Rating', 'Не найдено'))
-                ws.cell(row=row, column=10, value=product.get('Number of Reviews', 'Не найдено'))
-                ws.cell(row=row, column=11, value=product.get('Coupon Discount', 'Not Found'))
-                ws.cell(row=row, column=12, value=product.get('Final Price', 'Not Found'))
-                ws.cell(row=row, column=13, value=product.get('Discount Percent', 'Not Found'))
-                ws.cell(row=row, column=14, value=product.get('Variations Count', 'Not Found'))
-                row += 1
-
-        # Автоматическая регулировка ширины столбцов
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column  # Получаем индекс столбца
-            column_letter = get_column_letter(column)
-            for cell in col:
-                if cell.value:
-                    cell_length = len(str(cell.value))
-                    if cell_length > max_length:
-                        max_length = cell_length
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-        # Сохранение файла
-        filename = f"product_report_{current_time_str.replace(':', '_')}.xlsx"
-        wb.save(filename)
-        return filename
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        # Второй проход: данные пишутся построчно
+        for values in iter_report_rows(data):
+            asin = values[1]
+            if asin != 'Не найдено':
+                asin_cell = WriteOnlyCell(ws, value=asin)
+                asin_cell.hyperlink = f"https://www.amazon.com/dp/{asin}"
+                asin_cell.font = bold_blue_font  # Сделать кликабельным ASIN жирным и синим
+                values[1] = asin_cell
+            ws.append(values)
+
+        # Сохранение в буфер в памяти
+        report = io.BytesIO()
+        wb.save(report)
+        report.seek(0)
+        report.name = f"product_report_{current_time_str.replace(':', '_')}.xlsx"
+        return report
     except Exception as e:
         logging.error(f"Ошибка при создании XLSX отчета: {str(e)}")
         return None
 
-def send_telegram_notification(config, current_time_str, data):
-    """Отправка уведомления и отчета в Telegram."""
-    bot = telebot.TeleBot(config.get('telegram_bot_token', ''))
+def save_dry_run_report(data, current_time_str, sheet_name=None):
+    """Пробный запуск (--dry-run): вместо записи в Google Sheets сохраняет XLSX-отчет в рабочую папку."""
+    report = create_xlsx_report(data, current_time_str)
+    if report is None:
+        return None
+    prefix = f"dry_run_{re.sub(r'[^0-9A-Za-z-]+', '_', sheet_name)}_" if sheet_name else 'dry_run_'
+    path = prefix + report.name
+    with open(path, 'wb') as f:
+        f.write(report.getvalue())
+    logging.info(f"Пробный запуск: отчет сохранен в {path}, продуктов: {sum(len(products) for products in data.values())}.")
+    return path
+
+def send_telegram_notification(config, current_time_str, data, alerts=None):
+    """
+    Отправка уведомления, сработавших оповещений и отчета в Telegram.
+    Сообщения ставятся в очередь telegram_sink и отправляются в фоне.
+    """
+    token = config.get('telegram_bot_token', '')
     chat_id = config.get('telegram_chat_id', '')
-    if not chat_id:
-        logging.error("Telegram chat_id не установлен в конфигурации.")
+    if not token or not chat_id:
+        logging.error("Telegram bot token или chat_id не установлены в конфигурации.")
         return
 
-    # Формирование сообщения
-    message = f"Отчет за {current_time_str}\n\n"
+    # Формирование сообщения построчно
+    lines = [f"Отчет за {current_time_str}", ""]
+    if alerts:
+        lines.extend(["Оповещения:", *alerts, ""])
     for company, products in data.items():
-        message += f"{company}:\n"
+        lines.append(f"{company}:")
         for product in products:
-            message += f" ASIN: {product['ASIN']}\n"
-            message += f" Цена: {product.get('Price', 'Не найдено')}\n"
-            message += f" Рейтинг: {product.get('Rating', 'Не найдено')}\n\n"
+            lines.extend([
+                f" ASIN: {product['ASIN']}",
+                f" Цена: {product.get('Price', 'Не найдено')}",
+                f" Рейтинг: {product.get('Rating', 'Не найдено')}",
+                "",
+            ])
 
-    # Отправка сообщения
-    send_telegram_message(bot, chat_id, message)
+    # Постановка сообщения в очередь отправки
+    telegram_sink.send_message(token, chat_id, "\n".join(lines))
 
-    # Создание и отправка XLSX файла
-    xlsx_filename = create_xlsx_report(data, current_time_str)
-    if xlsx_filename:
-        try:
-            with open(xlsx_filename, 'rb') as report_file:
-                bot.send_document(chat_id, report_file)
-            logging.info("Отчет успешно отправлен в Telegram.")
-        except Exception as e:
-            logging.error(f"Не удалось отправить отчет в Telegram: {str(e)}")
-        finally:
-            if os.path.exists(xlsx_filename):
-                os.remove(xlsx_filename)
+    # Создание XLSX отчета в памяти и постановка в очередь отправки
+    report = create_xlsx_report(data, current_time_str)
+    if report:
+        telegram_sink.send_document(token, chat_id, report)
 
 def round_time_to_nearest_slot(current_time_str, active_trade_slots, analysis_slots):
     """Округляет текущее время до ближайшего временного слота."""
@@ -1064,8 +2606,95 @@ def round_time_to_nearest_slot(current_time_str, active_trade_slots, analysis_sl
     nearest_slot = min(all_slots, key=lambda slot: abs(current_time_minutes - (int(slot.split(":")[0]) * 60 + int(slot.split(":")[1]))))
     return nearest_slot
 
+class SinkExecutor:
+    """
+    Фоновый исполнитель записи результатов (Google Sheets, Telegram/XLSX).
+    У каждого sink своя ограниченная очередь и свой поток, поэтому задачи одного sink
+    выполняются по порядку, а сбор данных для следующего листа не ждет записи.
+    """
+    def __init__(self, max_queue_size=10):
+        self.max_queue_size = max_queue_size
+        self.queues = {}
+        self.workers = {}
+        self.metrics = {}
+        self.lock = Lock()
+
+    def submit(self, sink, func, *args, **kwargs):
+        """
+        Ставит задачу в очередь sink. Если очередь заполнена, ждет освобождения места.
+        Задача, вернувшая False, считается неудачной так же, как завершившаяся исключением.
+        """
+        with self.lock:
+            if sink not in self.queues:
+                self.queues[sink] = queue.Queue(maxsize=self.max_queue_size)
+                self.metrics[sink] = {
+                    'submitted': 0, 'completed': 0, 'failed': 0,
+                    'last_lag': 0.0, 'max_lag': 0.0, 'last_duration': 0.0,
+                }
+                self.workers[sink] = Thread(target=self._run, args=(sink,), name=f'sink-{sink}', daemon=True)
+                self.workers[sink].start()
+            self.metrics[sink]['submitted'] += 1
+            sink_queue = self.queues[sink]
+        if sink_queue.full():
+            logging.warning(f"Очередь записи '{sink}' заполнена, ожидаем освобождения места.")
+        sink_queue.put((time.time(), func, args, kwargs))
+
+    def _run(self, sink):
+        sink_queue = self.queues[sink]
+        while True:
+            submitted_at, func, args, kwargs = sink_queue.get()
+            started_at = time.time()
+            failed = False
+            try:
+                failed = func(*args, **kwargs) is False
+            except Exception as e:
+                failed = True
+                logging.error(f"Ошибка в фоновой задаче '{sink}': {str(e)}")
+            finally:
+                finished_at = time.time()
+                with self.lock:
+                    metrics = self.metrics[sink]
+                    metrics['failed' if failed else 'completed'] += 1
+                    metrics['last_lag'] = started_at - submitted_at
+                    metrics['max_lag'] = max(metrics['max_lag'], metrics['last_lag'])
+                    metrics['last_duration'] = finished_at - started_at
+                sink_queue.task_done()
+
+    def get_metrics(self):
+        """
+        Возвращает метрики по каждому sink: количество задач, глубину очереди,
+        задержку запуска последней задачи (lag) и ее длительность в секундах.
+        """
+        with self.lock:
+            return {
+                sink: dict(metrics, pending=self.queues[sink].unfinished_tasks)
+                for sink, metrics in self.metrics.items()
+            }
+
+    def log_metrics(self):
+        """Записывает метрики очередей в лог."""
+        for sink, metrics in self.get_metrics().items():
+            logging.info(
+                f"Очередь '{sink}': в ожидании {metrics['pending']}, выполнено {metrics['completed']}, "
+                f"ошибок {metrics['failed']}, lag {metrics['last_lag']:.1f} с (макс. {metrics['max_lag']:.1f} с), "
+                f"длительность {metrics['last_duration']:.1f} с"
+            )
+
+    def flush(self, timeout=None, exclude=()):
+        """Ждет выполнения всех поставленных задач, кроме очередей exclude. Возвращает True, если очереди пусты."""
+        deadline = time.time() + timeout if timeout is not None else None
+        while any(sink_queue.unfinished_tasks for sink, sink_queue in list(self.queues.items()) if sink not in exclude):
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+
+# Общий фоновый исполнитель записи результатов
+sink_executor = SinkExecutor()
+
 def update_google_sheets(current_results, spreadsheet_id, config, current_time_str, credentials_file):
-    """Обновление Google Sheets данными из current_results."""
+    """Обновление Google Sheets данными из current_results. Возвращает True, если данные записаны."""
     try:
         client = authorize_google_sheets(credentials_file)
         spreadsheet = client.open_by_key(spreadsheet_id)
@@ -1080,11 +2709,642 @@ def update_google_sheets(current_results, spreadsheet_id, config, current_time_s
         else:
             current_time_slot = None  # Текущее время не совпадает с временными слотами
 
-        update_monitoring_sheet(spreadsheet, current_results, current_time_slot, config)
+        return update_monitoring_sheet(spreadsheet, current_results, current_time_slot, config)
 
-    except APIError as e:
+    except gspread.exceptions.APIError as e:
         logging.error(f"Ошибка API при обновлении Google Sheets: {str(e)}")
+        return False
+
+# Задание сбора: все производные от URL значения вычисляются один раз при компиляции плана,
+# сборщик берет их из задания. marketplace – домен маркетплейса для Oxylabs ('de', 'co.uk'),
+# canonical_url – ключ дедупликации пакетного сбора; в запросах отправляется исходный url
+FetchJob = namedtuple('FetchJob', ['url', 'canonical_url', 'asin', 'marketplace', 'company', 'role'])
+
+
+def canonicalize_amazon_url(url, asin):
+    """Каноническая ссылка на товар вида https://<домен>/dp/<ASIN>."""
+    netloc = urlparse(url).netloc.lower()
+    if asin == 'Not Found' or not netloc:
+        return url
+    return f"https://{netloc}/dp/{asin}"
+
+
+def make_fetch_job(url, company=None, role='parent'):
+    """Задание сбора для одного URL."""
+    asin = extract_asin(url)
+    return FetchJob(
+        url=url,
+        canonical_url=canonicalize_amazon_url(url, asin),
+        asin=asin,
+        marketplace=get_amazon_domain(url),
+        company=company,
+        role=role,
+    )
+
+
+@lru_cache(maxsize=256)
+def compile_fetch_jobs(section, company, role, urls):
+    """
+    Компилирует неизменяемый список заданий для одной секции конфига.
+
+    Результат кэшируется по (секция, компания, роль, URL), поэтому при повторной
+    загрузке неизмененного конфига план не пересчитывается, а сборщик и запись
+    в таблицу используют одни и те же задания. section входит только в ключ кэша:
+    правка одной секции конфига пересчитывает только ее.
+    """
+    return tuple(make_fetch_job(url, company, role) for url in urls)
+
+
+def build_fetch_plan(sources):
+    """Собирает план цикла из секций вида (секция, компания, роль, список URL) в заданном порядке."""
+    return tuple(
+        job
+        for section, company, role, urls in sources
+        for job in compile_fetch_jobs(section, company, role, tuple(urls))
+    )
+
+
+# Уровни обновления полей: горячие поля (цены, купон) обновляются каждый слот,
+# тяжелые (BSR, заголовок, бренд, отзывы) – раз в день
+DEFAULT_REFRESH_TIERS = {
+    'Price': 'slot',
+    'Prime Price': 'slot',
+    'Coupon Discount': 'slot',
+    'Final Price': 'slot',
+    'Discount Percent': 'slot',
+    'Title Price': 'daily',
+    'List Price': 'daily',
+    'Title': 'daily',
+    'Brand': 'daily',
+    'BSR': 'daily',
+    'Rating': 'daily',
+    'Number of Reviews': 'daily',
+}
+
+# Поля, которые можно обновить легким запросом только цены
+PRICE_ONLY_FIELDS = ('Price', 'Prime Price', 'Coupon Discount', 'Final Price', 'Discount Percent')
+# Поля, которые возвращает легкий источник цен; остальные поля цены вычисляются из них
+PRICE_SOURCE_FIELDS = ('Price', 'Prime Price', 'Coupon Discount')
+
+REFRESH_CADENCE_PATTERN = re.compile(r'^(slot|daily|\d+[hm])$')
+
+
+def parse_refresh_tiers(value):
+    """
+    Разбирает уровни обновления полей из листа Config.
+
+    Формат: 'Price, Coupon Discount = slot; BSR, Title = daily; Rating = 6h'.
+    Допустимые частоты: slot (каждый слот), daily (раз в сутки), <N>h или <N>m.
+    """
+    tiers = {}
+    for entry in re.split(r'[\n\r;]+', value):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if '=' not in entry:
+            logging.error(f"Некорректная запись в refresh_tiers: '{entry}'. Ожидается 'поля = частота'.")
+            continue
+        fields, cadence = entry.rsplit('=', 1)
+        cadence = cadence.strip().lower()
+        if not REFRESH_CADENCE_PATTERN.match(cadence):
+            logging.error(f"Некорректная частота обновления '{cadence}' в refresh_tiers, запись пропущена.")
+            continue
+        for field in fields.split(','):
+            if field.strip():
+                tiers[field.strip()] = cadence
+    return tiers
+
+
+class RefreshPlanner:
+    """
+    Планировщик обновления данных по ASIN.
+
+    Для каждого продукта и слота решает, нужен ли полный сбор страницы ('full'),
+    легкий сбор только цены ('price') или данные можно взять из кэша ('cache').
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.cache = {}
+        self.tiers = dict(DEFAULT_REFRESH_TIERS)
+        self.cycle_started = None
+        self.stats = {'full': 0, 'price': 0, 'cache': 0}
+
+    def begin_cycle(self, config, current_time=None):
+        """Начинает новый цикл сбора: обновляет уровни из конфига и сбрасывает счетчики."""
+        tiers = dict(DEFAULT_REFRESH_TIERS)
+        tiers.update(config.get('refresh_tiers', {}))
+        with self.lock:
+            self.tiers = tiers
+            self.cycle_started = current_time or get_kyiv_time(config.get('timezone', 'Europe/Kiev'))
+            self.stats = {'full': 0, 'price': 0, 'cache': 0}
+
+    @staticmethod
+    def cache_key(url):
+        """Ключ кэша: домен маркетплейса и ASIN."""
+        domain = urlparse(url).netloc.lower()
+        if domain.startswith('www.'):
+            domain = domain[4:]
+        return domain, extract_asin(url)
+
+    def _is_stale(self, cadence, fetched_at):
+        if fetched_at is None:
+            return True
+        if cadence == 'slot':
+            return fetched_at < self.cycle_started
+        if cadence == 'daily':
+            return fetched_at.date() != self.cycle_started.date()
+        amount = int(cadence[:-1])
+        ttl = timedelta(hours=amount) if cadence.endswith('h') else timedelta(minutes=amount)
+        return self.cycle_started - fetched_at >= ttl
+
+    def plan(self, url):
+        """Возвращает режим сбора для продукта: 'full', 'price' или 'cache'."""
+        with self.lock:
+            entry = self.cache.get(self.cache_key(url))
+            if entry is None or self.cycle_started is None:
+                return 'full'
+            stale_fields = [
+                field for field, cadence in self.tiers.items()
+                if field in entry['data'] and self._is_stale(cadence, entry['fetched_at'].get(field))
+            ]
+        if not stale_fields:
+            return 'cache'
+        if all(field in PRICE_ONLY_FIELDS for field in stale_fields):
+            return 'price'
+        return 'full'
+
+    def is_fresh(self, field, fetched_at):
+        """Проверяет, актуально ли значение поля, полученное в момент fetched_at, для текущего цикла."""
+        with self.lock:
+            if self.cycle_started is None:
+                return False
+            return not self._is_stale(self.tiers.get(field, 'slot'), fetched_at)
+
+    def get_cached(self, url):
+        """Возвращает копию кэшированных данных продукта."""
+        with self.lock:
+            entry = self.cache.get(self.cache_key(url))
+            if entry is None:
+                return None
+            self.stats['cache'] += 1
+            return dict(entry['data'])
+
+    def store_full(self, url, product_info, mode='full'):
+        """Сохраняет результат полного сбора: все поля считаются свежими."""
+        with self.lock:
+            fetched_at = {field: self.cycle_started for field in product_info}
+            self.cache[self.cache_key(url)] = {'data': dict(product_info), 'fetched_at': fetched_at}
+            self.stats[mode] = self.stats.get(mode, 0) + 1
+
+    def merge_price(self, url, price_info, recalculate=None, mode='price'):
+        """
+        Объединяет результат легкого сбора цены с кэшированными тяжелыми полями.
+
+        Поле цены, которого нет в ответе источника (купон у amazon_pricing), не берется из кэша:
+        оно сбрасывается в 'Not Found' и остается устаревшим до следующего полного сбора.
+        recalculate – функция, пересчитывающая производные поля (итоговую цену) по объединенным данным.
+        """
+        with self.lock:
+            entry = self.cache.get(self.cache_key(url))
+            if entry is None:
+                return None
+            for field in PRICE_SOURCE_FIELDS:
+                if field in price_info:
+                    entry['data'][field] = price_info[field]
+                    entry['fetched_at'][field] = self.cycle_started
+                elif field in entry['data']:
+                    entry['data'][field] = "Not Found"
+            if recalculate:
+                for field, value in recalculate(entry['data']).items():
+                    entry['data'][field] = value
+                    entry['fetched_at'][field] = self.cycle_started
+            if 'Scrape Date' in price_info:
+                entry['data']['Scrape Date'] = price_info['Scrape Date']
+            self.stats[mode] = self.stats.get(mode, 0) + 1
+            return dict(entry['data'])
+
+    def log_summary(self):
+        """Логирует распределение режимов сбора за цикл."""
+        with self.lock:
+            stats = dict(self.stats)
+        logging.info(
+            f"План обновления за цикл: полный сбор – {stats['full']}, "
+            f"только цены – {stats['price']}, из кэша – {stats['cache']}, "
+            f"со страницы родителя – {stats.get('variation', 0)}, пакетом – {stats.get('batch', 0)}"
+        )
+
+
+refresh_planner = RefreshPlanner()
+
+
+# Вариации со страниц родительских продуктов: (домен, ASIN) -> данные. Хранятся между циклами,
+# пока цена актуальна по уровню обновления 'Price' (при уровне slot – только в цикле сбора)
+variation_harvest = {}
+
+
+def harvest_variations(product_data, parent_url):
+    """
+    Сохраняет вариации из разобранного ответа по родительскому продукту (поле 'variation' Oxylabs).
+
+    Список вариаций есть в ответах источников amazon и amazon_product, поэтому он обновляется
+    и при полном сборе родителя, и при легком сборе цены. Из списка берутся только цена и купон
+    вариации: рейтинг, отзывы и BSR родителя к вариации не относятся.
+    """
+    variations = product_data.get('variation') or product_data.get('variations') or []
+    domain, parent_asin = RefreshPlanner.cache_key(parent_url)
+    harvested = 0
+    for variation in variations:
+        if not isinstance(variation, dict):
+            continue
+        asin = variation.get('asin')
+        if not asin or asin == parent_asin:
+            continue
+        variation_harvest[(domain, asin)] = {
+            'price': extract_price(variation.get('price')) if variation.get('price') else "Not Found",
+            'coupon': extract_coupon(variation.get('coupon')) if variation.get('coupon') else "Not Found",
+            'harvested_at': refresh_planner.cycle_started,
+        }
+        harvested += 1
+    if harvested:
+        logging.info(f"Со страницы {parent_asin} получено вариаций: {harvested}")
+
+
+def prune_variation_harvest():
+    """Удаляет вариации, цена которых устарела по уровню обновления 'Price'."""
+    for key, entry in list(variation_harvest.items()):
+        if not refresh_planner.is_fresh('Price', entry['harvested_at']):
+            del variation_harvest[key]
+
+
+def harvested_variation_price(url):
+    """
+    Цена вариации со страницы родителя в формате легкого сбора цены (для merge_price).
+    Возвращает None, если цены вариации нет или она устарела. Prime-цену страница родителя
+    не дает: при объединении она сбрасывается в 'Not Found'.
+    """
+    domain, asin = RefreshPlanner.cache_key(url)
+    entry = variation_harvest.get((domain, asin))
+    if not entry or entry['price'] == "Not Found" or not refresh_planner.is_fresh('Price', entry['harvested_at']):
+        return None
+    return {
+        "Price": entry['price'],
+        "Coupon Discount": entry['coupon'],
+        "Scrape Date": get_kyiv_time().strftime("%d.%m.%Y"),
+    }
+
+
+class NegativeCache:
+    """
+    Негативный кэш для недоступных пар (маркетплейс, ASIN).
+
+    После negative_cache_threshold подряд ответов 204/404 или страниц без товара ASIN
+    исключается из сбора на время, которое удваивается при каждой новой неудаче
+    (от negative_cache_ttl_minutes до negative_cache_max_ttl_hours). По истечении
+    срока выполняется один пробный запрос: успех возвращает ASIN в сбор.
+    """
+
+    def __init__(self, threshold=2, base_ttl=3600, max_ttl=7 * 24 * 3600):
+        self.lock = Lock()
+        self.entries = {}
+        self.threshold = threshold
+        self.base_ttl = base_ttl
+        self.max_ttl = max_ttl
 
+    def configure(self, config):
+        """Обновляет параметры из листа Config."""
+        with self.lock:
+            self.threshold = max(1, config.get('negative_cache_threshold') or 2)
+            self.base_ttl = (config.get('negative_cache_ttl_minutes') or 60) * 60
+            self.max_ttl = (config.get('negative_cache_max_ttl_hours') or 168) * 3600
+
+    @staticmethod
+    def key(url):
+        domain = urlparse(url).netloc.lower()
+        if domain.startswith('www.'):
+            domain = domain[4:]
+        return domain, extract_asin(url)
+
+    def is_suppressed(self, url):
+        """Проверяет, исключен ли ASIN из сбора в данный момент."""
+        with self.lock:
+            entry = self.entries.get(self.key(url))
+            return bool(entry and entry['until'] and clock.time() < entry['until'])
+
+    def allow(self, url):
+        """Разрешает запрос, если ASIN не исключен или пора выполнить пробный запрос."""
+        with self.lock:
+            entry = self.entries.get(self.key(url))
+            if not entry or not entry['until']:
+                return True
+            if clock.time() < entry['until']:
+                entry['suppressed'] += 1
+                return False
+            logging.info(f"Пробный запрос для ранее недоступного ASIN {entry['asin']} ({entry['marketplace']}).")
+            return True
+
+    def record_failure(self, url, reason):
+        """Регистрирует неудачу, указывающую на недоступный товар (204, 404, нет товара на странице)."""
+        marketplace, asin = self.key(url)
+        with self.lock:
+            entry = self.entries.setdefault((marketplace, asin), {
+                'marketplace': marketplace, 'asin': asin, 'failures': 0,
+                'until': None, 'suppressed': 0, 'reason': reason, 'first_failure': clock.time(),
+            })
+            entry['failures'] += 1
+            entry['reason'] = reason
+            if entry['failures'] >= self.threshold:
+                ttl = min(self.base_ttl * 2 ** (entry['failures'] - self.threshold), self.max_ttl)
+                entry['until'] = clock.time() + ttl
+                logging.warning(f"ASIN {asin} ({marketplace}) исключен из сбора на {ttl / 3600:.1f} ч: {reason}, неудач подряд – {entry['failures']}.")
+
+    def record_success(self, url):
+        """Снимает ASIN с учета после успешного сбора."""
+        with self.lock:
+            entry = self.entries.pop(self.key(url), None)
+        if entry and entry['until']:
+            logging.info(f"ASIN {entry['asin']} ({entry['marketplace']}) снова доступен после {entry['failures']} неудач.")
+
+    def report(self):
+        """Список исключенных ASIN для отчета."""
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values() if entry['until']]
+        return sorted(entries, key=lambda entry: (entry['marketplace'], entry['asin']))
+
+    def log_report(self):
+        entries = self.report()
+        if not entries:
+            return
+        logging.info(f"Исключенные из сбора ASIN: {len(entries)}")
+        for entry in entries:
+            until = datetime.fromtimestamp(entry['until']).strftime('%d.%m.%Y %H:%M')
+            logging.info(
+                f"  {entry['marketplace']} {entry['asin']}: {entry['reason']}, неудач – {entry['failures']}, "
+                f"пропущено запросов – {entry['suppressed']}, проверка после {until}"
+            )
+
+
+negative_cache = NegativeCache()
+
+
+# Архив сырых ответов провайдеров (raw_archive.py), подпапка скрипта в raw_archive_dir
+response_archive = ResponseArchive('oxylabs', lambda: clock.time())
+
+
+@stage_metrics.timed('fetch')
+def fetch_product(job, config):
+    """Получает данные продукта (задание FetchJob) согласно плану обновления: полный сбор, только цены или кэш."""
+    url = job.url
+    if job.canonical_url in batch_results:
+        return batch_results[job.canonical_url]
+    if not negative_cache.allow(url):
+        return None
+
+    mode = refresh_planner.plan(url)
+    if mode == 'cache':
+        logging.info(f"Данные для {url} актуальны, используется кэш.")
+        return refresh_planner.get_cached(url)
+    if mode == 'price':
+        # Рейтинг, отзывы и BSR вариации остаются из ее собственного полного сбора
+        if job.role == 'variation' and config.get('variation_expansion', '').lower() == 'true':
+            price_info = harvested_variation_price(url)
+            if price_info:
+                logging.info(f"Цена вариации {job.asin} взята со страницы родительского продукта.")
+                return refresh_planner.merge_price(url, price_info, recalculate=recalculate_final_price, mode='variation')
+        price_info = scrape_amazon_price(job, config)
+        if price_info:
+            negative_cache.record_success(url)
+            return refresh_planner.merge_price(url, price_info, recalculate=recalculate_final_price)
+        logging.warning(f"Легкий сбор цены не удался, выполняется полный сбор: {url}")
+
+    product_info = scrape_amazon_product(job, config)
+    if product_info:
+        refresh_planner.store_full(url, product_info)
+        negative_cache.record_success(url)
+    return product_info
+
+
+OXYLABS_BATCH_URL = 'https://data.oxylabs.io/v1/queries'
+
+# Результаты пакетного сбора текущего цикла: каноническая ссылка -> данные продукта
+batch_results = {}
+
+
+def get_oxylabs_batch_endpoint(config):
+    """Возвращает адрес push-pull API Oxylabs (можно переопределить для локального сервера-заглушки)."""
+    return (config.get('oxylabs_batch_endpoint', '').strip() or OXYLABS_BATCH_URL).rstrip('/')
+
+
+def submit_oxylabs_batch(urls, config, auth):
+    """Отправляет пакет URL в push-pull API Oxylabs. Возвращает словарь {id задания: URL}."""
+    payload = {
+        'source': 'amazon',
+        'url': urls,
+        'parse': True
+    }
+    try:
+        with stage_metrics.timer('provider_request'):
+            response = requests.post(f"{get_oxylabs_batch_endpoint(config)}/batch", auth=auth, json=payload, timeout=60)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Ошибка при отправке пакета в Oxylabs: {str(e)}")
+        return {}
+
+    if response.status_code not in (200, 201, 202):
+        logging.error(f"Пакет не принят Oxylabs: {response.status_code} - {response.text[:200]}")
+        return {}
+
+    try:
+        queries = response.json().get('queries', [])
+    except ValueError:
+        logging.error("Ошибка декодирования JSON ответа на пакетный запрос")
+        return {}
+
+    jobs = {}
+    for index, query in enumerate(queries):
+        if query.get('id'):
+            jobs[query['id']] = query.get('url') or (urls[index] if index < len(urls) else None)
+    logging.info(f"В Oxylabs отправлен пакет из {len(urls)} URL, создано заданий: {len(jobs)}")
+    return jobs
+
+
+def get_oxylabs_batch_status(job_ids, config, auth):
+    """
+    Статусы заданий одним запросом на пакет: POST <endpoint>/batch/status со списком id.
+    Возвращает {id задания: статус} или None, если эндпоинт статуса пакета не поддерживается.
+    """
+    endpoint = get_oxylabs_batch_endpoint(config)
+    batch_size = config.get('oxylabs_batch_size') or 1000
+    statuses = {}
+    for start in range(0, len(job_ids), batch_size):
+        with stage_metrics.timer('provider_request'):
+            response = requests.post(f"{endpoint}/batch/status", auth=auth, json={'ids': job_ids[start:start + batch_size]}, timeout=30)
+        if response.status_code in (404, 405):
+            return None
+        if response.status_code != 200:
+            logging.warning(f"Статус пакета Oxylabs не получен: {response.status_code}")
+            continue
+        for query in response.json().get('queries', []):
+            statuses[query.get('id')] = query.get('status')
+    return statuses
+
+
+def get_oxylabs_job_statuses(job_ids, config, auth):
+    """Статусы заданий по одному запросу на задание (если статус пакета не поддерживается)."""
+    endpoint = get_oxylabs_batch_endpoint(config)
+    statuses = {}
+    for job_id in job_ids:
+        try:
+            with stage_metrics.timer('provider_request'):
+                status_response = requests.get(f"{endpoint}/{job_id}", auth=auth, timeout=30)
+            statuses[job_id] = status_response.json().get('status') if status_response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.warning(f"Ошибка при опросе задания Oxylabs {job_id}: {str(e)}")
+    return statuses
+
+
+def iter_oxylabs_batch_results(jobs, config):
+    """
+    Отправляет задания сбора пакетами в push-pull API Oxylabs и по мере готовности
+    отдает пары (задание, JSON-ответ). Неудачные и не дождавшиеся задания пропускаются.
+    """
+    oxylabs_username = config.get('oxylabs_username', '').strip()
+    oxylabs_password = config.get('oxylabs_password', '').strip()
+    if not oxylabs_username or not oxylabs_password:
+        logging.error("Oxylabs credentials are missing in the configuration")
+        return
+    auth = (oxylabs_username, oxylabs_password)
+
+    endpoint = get_oxylabs_batch_endpoint(config)
+    batch_size = config.get('oxylabs_batch_size') or 1000
+    poll_interval = config.get('oxylabs_poll_interval') or 5
+    timeout = config.get('oxylabs_batch_timeout') or 600
+
+    jobs_by_url = {job.url: job for job in jobs}
+    urls = list(jobs_by_url)
+    pending = {}
+    for start in range(0, len(urls), batch_size):
+        pending.update(submit_oxylabs_batch(urls[start:start + batch_size], config, auth))
+
+    deadline = clock.time() + timeout
+    batch_status_supported = True
+    while pending and clock.time() < deadline:
+        # Один запрос статуса на пакет; по одному - только если эндпоинт статуса пакета недоступен
+        statuses = {}
+        if batch_status_supported:
+            try:
+                statuses = get_oxylabs_batch_status(list(pending), config, auth)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logging.warning(f"Ошибка при опросе статуса пакета Oxylabs: {str(e)}")
+                statuses = {}
+            if statuses is None:
+                logging.info("Статус пакета Oxylabs не поддерживается, задания опрашиваются по одному.")
+                batch_status_supported = False
+        if not batch_status_supported:
+            statuses = get_oxylabs_job_statuses(list(pending), config, auth)
+
+        for job_id, status in statuses.items():
+            url = pending.get(job_id)
+            if url is None:
+                continue
+            job = jobs_by_url.get(url) or make_fetch_job(url)
+            if status == 'done':
+                del pending[job_id]
+                try:
+                    results_response = provider_latency.request(
+                        'oxylabs', job.marketplace, requests.get, f"{endpoint}/{job_id}/results", auth=auth, timeout=60
+                    )
+                    if results_response.status_code != 200:
+                        logging.error(f"Не удалось получить результат задания {job_id}: {results_response.status_code}")
+                        continue
+                    response_json = results_response.json()
+                except requests.exceptions.RequestException as e:
+                    logging.warning(f"Ошибка при получении результата задания Oxylabs {job_id}: {str(e)}")
+                    continue
+                except ValueError:
+                    provider_latency.record_parse_failure('oxylabs', job.marketplace)
+                    logging.error(f"Ошибка декодирования JSON результата задания {job_id}")
+                    continue
+                response_archive.store('oxylabs', job.marketplace, job.asin, results_response.content)
+                yield job, response_json
+            elif status == 'faulted':
+                del pending[job_id]
+                logging.error(f"Задание Oxylabs {job_id} для {url} завершилось ошибкой.")
+        if pending:
+            clock.sleep(poll_interval)
+
+    if pending:
+        logging.warning(f"Не дождались завершения {len(pending)} заданий Oxylabs, они будут собраны по одному.")
+
+
+def collect_batch(jobs, config):
+    """Собирает задания пакетом и сохраняет разобранные результаты в batch_results и кэш планировщика."""
+    if not jobs:
+        return
+    for job, response_json in iter_oxylabs_batch_results(jobs, config):
+        # Проверки те же, что у одиночного сбора в scrape_amazon_product
+        is_variation = job.role == 'variation'
+        result_status = (response_json.get('results') or [{}])[0].get('status_code')
+        if result_status == 404:
+            logging.error(f"Amazon вернул 404 для ASIN {job.asin}")
+            negative_cache.record_failure(job.url, "Amazon 404")
+            continue
+        product_info = extract_data_from_json(response_json, job.asin, is_variation=is_variation)
+        if not product_info or product_info.get('Title') in (None, '', 'Not Found'):
+            provider_latency.record_parse_failure('oxylabs', job.marketplace)
+        if not product_info:
+            logging.warning(f"Не удалось извлечь данные пакетного задания для ASIN {job.asin}")
+            continue
+        if product_info.get('Title') in (None, '', 'Not Found'):
+            logging.warning(f"На странице ASIN {job.asin} нет названия товара, данные не записываются.")
+            negative_cache.record_failure(job.url, "нет названия товара")
+            continue
+        if not is_variation:
+            harvest_variations(response_json['results'][0]['content'], job.url)
+        negative_cache.record_success(job.url)
+        refresh_planner.store_full(job.url, product_info, mode='batch')
+        batch_results[job.canonical_url] = product_info
+
+
+def prefetch_batch(config, plan):
+    """
+    Пакетный сбор цикла через push-pull API Oxylabs.
+
+    Сначала собираются родительские продукты, затем вариации, которым нужен полный сбор.
+    Ссылки на один товар (разные параметры URL) собираются один раз. Цены (в том числе
+    со страницы родителя) и кэш обрабатываются обычным путем в fetch_product.
+    """
+
+    def pending_jobs(role):
+        jobs = {}
+        for job in plan:
+            if job.role == role and job.canonical_url not in jobs:
+                jobs[job.canonical_url] = job
+        return [
+            job for job in jobs.values()
+            if refresh_planner.plan(job.url) == 'full' and not negative_cache.is_suppressed(job.url)
+        ]
+
+    parents = pending_jobs('parent')
+    logging.info(f"Пакетный сбор родительских продуктов: {len(parents)} URL.")
+    collect_batch(parents, config)
+
+    variations = pending_jobs('variation')
+    logging.info(f"Пакетный сбор вариаций: {len(variations)} URL.")
+    collect_batch(variations, config)
+
+
+def get_fetch_sources(config, competitor_urls, competitor_variation_urls):
+    """Секции в порядке сбора: (секция, компания, роль, список URL)."""
+    sources = [
+        ('product_urls', "Merino.tech. (Мы)", 'parent', config.get('product_urls', [])),
+        ('variation_urls', "Merino.tech. (Мы)", 'variation', config.get('variation_urls', [])),
+    ]
+    sources += [('competitor_urls', name, 'parent', urls) for name, urls in competitor_urls.items()]
+    sources += [('competitor_variation_urls', name, 'variation', urls) for name, urls in competitor_variation_urls.items()]
+    return sources
+
+
+@stage_metrics.timed('gather')
 def gather_product_data(config, competitor_urls, competitor_variation_urls):
     """Функция для сбора данных по продуктам. Возвращает текущие результаты."""
     current_results = {
@@ -1092,71 +3352,46 @@ def gather_product_data(config, competitor_urls, competitor_variation_urls):
         "Merino Protect": [],
         "METARINO": [],
     }
-
-    # Обработка основных продуктов (Parent ASIN)
-    logging.info("Начинаем сбор данных по основным продуктам Merino.tech (Parent ASIN).")
-    for url in config.get('product_urls', []):
-        logging.debug(f"Обработка Parent ASIN по URL: {url}")
+    sources = get_fetch_sources(config, competitor_urls, competitor_variation_urls)
+    plan = build_fetch_plan(sources)
+    for _, company, _, _ in sources:
+        current_results.setdefault(company, [])
+
+    refresh_planner.begin_cycle(config)
+    negative_cache.configure(config)
+    response_archive.configure(config)
+    prune_variation_harvest()
+    batch_results.clear()
+
+    # В пакетном режиме полные страницы собираются заранее через push-pull API
+    if config.get('oxylabs_mode', 'realtime').strip().lower() == 'batch':
+        prefetch_batch(config, plan)
+
+    logging.info(f"План сбора: {len(plan)} URL.")
+    for job in plan:
+        role_label = 'Parent ASIN' if job.role == 'parent' else 'Variation ASIN'
+        logging.debug(f"Обработка {role_label} {job.asin} ({job.company}) по URL: {job.url}")
         try:
-            product_info = scrape_amazon_product(url, config)
+            product_info = fetch_product(job, config)
             if product_info:
-                logging.info(f"Успешно собраны данные для основного продукта (Parent ASIN): {url}")
-                current_results["Merino.tech. (Мы)"].append(product_info)
+                logging.info(f"Успешно собраны данные {role_label} для {job.company}: {job.url}")
+                current_results[job.company].append(product_info)
+                stage_metrics.inc('products_collected')
             else:
-                logging.warning(f"Не удалось получить данные для основного продукта (Parent ASIN): {url}")
+                logging.warning(f"Не удалось получить данные {role_label} для {job.company}: {job.url}")
+                stage_metrics.inc('products_failed')
         except Exception as e:
-            logging.error(f"Ошибка при сборе данных для Parent ASIN по продукту {url}: {str(e)}")
-
-    # Обработка вариаций продуктов (Variation ASIN)
-    logging.info("Начинаем сбор данных по вариациям продуктов Merino.tech (Variation ASIN).")
-    for var_url in config.get('variation_urls', []):
-        logging.debug(f"Обработка Variation ASIN по URL: {var_url}")
-        try:
-            variation_info = scrape_amazon_product(var_url, config, is_variation=True)
-            if variation_info:
-                logging.info(f"Успешно собраны данные для вариации продукта (Variation ASIN): {var_url}")
-                current_results["Merino.tech. (Мы)"].append(variation_info)
-            else:
-                logging.warning(f"Не удалось получить данные для вариации продукта: {var_url}")
-        except Exception as e:
-            logging.error(f"Ошибка при сборе данных для Variation ASIN по продукту {var_url}: {str(e)}")
-
-    # Обработка конкурентов
-    logging.info("Начинаем сбор данных по конкурентам.")
-    for competitor_name, urls in competitor_urls.items():
-        for url in urls:
-            logging.debug(f"Обработка продукта конкурента по URL: {url}")
-            try:
-                product_info = scrape_amazon_product(url, config)
-                if product_info:
-                    logging.info(f"Успешно собраны данные для конкурента {competitor_name}: {url}")
-                    current_results.setdefault(competitor_name, []).append(product_info)
-                else:
-                    logging.warning(f"Не удалось получить данные для конкурента {competitor_name}: {url}")
-            except Exception as e:
-                logging.error(f"Ошибка при сборе данных для конкурента {competitor_name} ({url}): {str(e)}")
-
-    # Обработка вариаций конкурентов
-    logging.info("Начинаем сбор данных по вариациям конкурентов.")
-    for competitor_name, var_urls in competitor_variation_urls.items():
-        for var_url in var_urls:
-            logging.debug(f"Обработка вариации продукта конкурента по URL: {var_url}")
-            try:
-                variation_info = scrape_amazon_product(var_url, config, is_variation=True)
-                if variation_info:
-                    logging.info(f"Успешно собраны данные для вариации конкурента {competitor_name}: {var_url}")
-                    current_results.setdefault(competitor_name, []).append(variation_info)
-                else:
-                    logging.warning(f"Не удалось получить данные для вариации конкурента {competitor_name}: {var_url}")
-            except Exception as e:
-                logging.error(f"Ошибка при сборе данных для вариации конкурента {competitor_name} ({var_url}): {str(e)}")
+            logging.error(f"Ошибка при сборе данных {role_label} для {job.company} ({job.url}): {str(e)}")
+            stage_metrics.inc('products_failed')
 
+    refresh_planner.log_summary()
+    negative_cache.log_report()
     return current_results
 
 
-def find_credentials_file():
-    """Пытается найти файл учетных данных по нескольким возможным путям."""
-    possible_paths = [
+def find_credentials_file(path=None):
+    """Пытается найти файл учетных данных по нескольким возможным путям; path - явно заданный файл (--credentials)."""
+    possible_paths = [path] if path else [
         os.path.join(os.path.expanduser('~'), 'Downloads', 'maximumstores53-24d4ef8c1298.json'),
         os.path.join(os.getcwd(), 'maximumstores53-24d4ef8c1298.json'),
         'maximumstores53-24d4ef8c1298.json'
@@ -1170,16 +3405,56 @@ def find_credentials_file():
     logging.error("Файл учетных данных не найден ни в одном из возможных путей.")
     return None
 
-def main():
-    """Основная функция скрипта."""
+# ID таблицы Google Sheets по умолчанию
+SPREADSHEET_ID = '1ibuYnN9WeRZdHUqoiU2jFLez59fm5Gfgzeyvq7M4EaI'
+
+
+def parse_args(argv=None):
+    """
+    Разбирает аргументы командной строки.
+    run - цикл сразу при запуске, затем по расписанию (поведение по умолчанию, без подкоманды);
+    run --once - один цикл и выход (для cron и таймеров systemd); daemon - только запуски по расписанию.
+    """
+    parser = argparse.ArgumentParser(description='Check Insights Manager (Oxylabs): сбор данных о продуктах Amazon в Google Sheets.')
+    subparsers = parser.add_subparsers(dest='command')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--spreadsheet', default=SPREADSHEET_ID, help='ID таблицы Google Sheets.')
+    common.add_argument('--credentials', help='Файл учетных данных сервисного аккаунта (по умолчанию ищется автоматически).')
+    common.add_argument('--sheets', help='Один лист данных вместо SS+Sox (ключ конфига data_sheet_name).')
+    common.add_argument('--concurrency', type=int, help='Лимит запросов к провайдеру в секунду (api_limiter).')
+    common.add_argument('--dry-run', action='store_true', help='Не писать в Google Sheets и Telegram, сохранить XLSX-отчет в рабочую папку.')
+    run_parser = subparsers.add_parser('run', parents=[common], help='Цикл сразу при запуске, затем по расписанию.')
+    run_parser.add_argument('--once', action='store_true', help='Один цикл и выход.')
+    run_parser.add_argument('--slot', help='Слот "HH:MM", в который записываются данные (по умолчанию ближайший).')
+    daemon_parser = subparsers.add_parser('daemon', parents=[common], help='Только запуски по расписанию слотов.')
+    daemon_parser.set_defaults(once=False, slot=None)
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in ('run', 'daemon', '-h', '--help'):
+        argv = ['run'] + argv
+    args = parser.parse_args(argv)
+    # Все данные цикла пишутся в один лист, поэтому несколько имен в --sheets - ошибка, а не выбор первого
+    if args.sheets is not None and len([name for name in args.sheets.split(',') if name.strip()]) != 1:
+        parser.error(f"--sheets принимает одно имя листа данных, получено: '{args.sheets}'")
+    return args
+
+
+def main(argv=None):
+    """Основная функция скрипта. Возвращает код завершения (для cron и systemd)."""
+    args = parse_args(argv)
+
     # Поиск файла учетных данных Google Sheets
-    credentials_file = find_credentials_file()
+    credentials_file = find_credentials_file(args.credentials)
     if not credentials_file:
         logging.critical("Не удалось найти файл учетных данных.")
-        return
+        return 1
 
     # ID таблицы Google Sheets
-    spreadsheet_id = '1ibuYnN9WeRZdHUqoiU2jFLez59fm5Gfgzeyvq7M4EaI'
+    spreadsheet_id = args.spreadsheet
+
+    # Лимит запросов к провайдеру
+    if args.concurrency:
+        api_limiter.max_requests = args.concurrency
 
     # Авторизация и загрузка конфигурации
     try:
@@ -1187,7 +3462,18 @@ def main():
         config = load_config_from_sheets(client, spreadsheet_id)
     except Exception as e:
         logging.critical(f"Не удалось авторизоваться или загрузить конфигурацию: {e}")
-        return
+        return 1
+
+    # Лист данных из --sheets вместо листа по умолчанию
+    if args.sheets:
+        config['data_sheet_name'] = args.sheets.strip(', ')
+
+    # Метрики Prometheus на локальном порту, если он задан в конфиге (для однократного запуска не нужны)
+    if config.get('metrics_port') and not args.once:
+        start_metrics_server(config['metrics_port'])
+
+    # Профилирование по сигналу SIGUSR1 или файлу-флагу
+    cycle_profiler.install(config)
 
     # Логирование для проверки конфигурации
     logging.info(f"Product URLs after loading config: {config.get('product_urls', [])}")
@@ -1201,14 +3487,11 @@ def main():
     # Инициализация Telegram бота
     telegram_bot_token = config.get('telegram_bot_token', '')
     telegram_chat_id = config.get('telegram_chat_id', '')
-    if not telegram_bot_token or not telegram_chat_id:
-        logging.critical("Telegram bot token или chat_id не установлены в конфигурации.")
-        return
-    bot = telebot.TeleBot(telegram_bot_token)
-
-    # Получение URL-адресов продуктов и вариаций
-    PRODUCT_URLS = config.get('product_urls', [])
-    VARIATION_URLS = config.get('variation_urls', [])
+    if not args.dry_run:
+        if not telegram_bot_token or not telegram_chat_id:
+            logging.critical("Telegram bot token или chat_id не установлены в конфигурации.")
+            return 1
+        telegram_sink.get_bot(telegram_bot_token)
 
     # Определение конкурентных продуктов и вариаций на основе конфигурации
     COMPETITOR_URLS = {
@@ -1221,12 +3504,6 @@ def main():
         "METARINO": config.get('2variation_urls', []),
     }
 
-    # Получение других настроек из конфигурации
-    BATCH_SIZE = config.get('batch_size', 100)
-    MIN_ACCEPTABLE_RATING = config.get('min_acceptable_rating', 4.0)
-    PRICE_CHANGE_THRESHOLD = config.get('price_change_threshold', 5.0)
-    COUPON_THRESHOLD = config.get('coupon_threshold', 10.0)
-
     # Получение времени обновления из конфигурации
     update_hour = config.get('update_time_hour', 0)
     update_minute = config.get('update_time_minute', 0)
@@ -1245,66 +3522,36 @@ def main():
 
     logging.info(f"Все временные слоты: {all_slots}")
 
-    # #### ТЕСТОВАЯ ВЕРСИЯ ЦИКЛА: Немедленный запуск процесса ####
-    try:
-        # Получаем текущее время
-        current_time = get_kyiv_time(timezone_str)
-        logging.info(f"Текущее время: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
+    # Планировщик слотов: старт с упреждением, явная обработка пропущенных слотов
+    lead_minutes = config.get('prefetch_lead_minutes')
+    scheduler = SlotScheduler(
+        all_slots,
+        timezone_str,
+        lead_seconds=lead_minutes * 60 if lead_minutes is not None else None,
+        overrun_policy=config.get('overrun_policy', 'skip')
+    )
 
-        # Устанавливаем текущий слот как ближайший слот (или используем текущее время)
-        nearest_slot = get_next_slot(current_time, all_slots, timezone_str)
-        logging.info(f"Тестовый запуск процесса для временного слота: {nearest_slot.strftime('%H:%M')}")
+    def run_slot(next_slot_time):
+        logging.info(f"Запуск процесса для временного слота: {next_slot_time.strftime('%H:%M')}")
 
         # Выполнение сбора данных
+        stage_metrics.begin_cycle(next_slot_time.strftime('%H:%M'))
+        cycle_profiler.on_cycle_start()
         current_results = gather_product_data(config, COMPETITOR_URLS, COMPETITOR_VARIATION_URLS)
 
-        # Обновление Google Sheets
-        update_google_sheets(
-            current_results,
-            spreadsheet_id,
-            config,
-            nearest_slot.strftime('%Y-%m-%d %H:%M:%S'),
-            credentials_file
-        )
-
-        # Отправка уведомлений в Telegram
-        if current_results:
-            send_telegram_notification(
-                config,
-                nearest_slot.strftime('%Y-%m-%d %H:%M:%S'),
-                current_results
+        # Обновление Google Sheets в фоне; при пробном запуске - только XLSX-отчет
+        if args.dry_run:
+            sink_executor.submit(
+                'sheets',
+                save_dry_run_report,
+                current_results,
+                next_slot_time.strftime('%Y-%m-%d %H:%M:%S'),
+                config.get('data_sheet_name')
             )
-
-        logging.info(f"Тестовый процесс для слота {nearest_slot.strftime('%H:%M')} успешно завершен.")
-
-    except Exception as e:
-        logging.error(f"Ошибка при тестовом запуске процесса: {e}")
-
-    # #### Оригинальный ЦИКЛ: Регулярные Запуски ####
-    while True:
-        try:
-            current_time = get_kyiv_time(timezone_str)
-            logging.info(f"Текущее время: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-            # Определение ближайшего следующего слота
-            next_slot_time = get_next_slot(current_time, all_slots, timezone_str)
-            logging.info(f"Следующий слот: {next_slot_time.strftime('%Y-%m-%d %H:%M')}")
-
-            # Вычисление времени до следующего слота
-            time_to_wait = (next_slot_time - current_time).total_seconds()
-
-            if time_to_wait > 0:
-                logging.info(f"Ждем {time_to_wait / 60:.2f} минут до следующего слота.")
-                time.sleep(time_to_wait)
-
-            # После пробуждения запустить задачу
-            logging.info(f"Запуск процесса для временного слота: {next_slot_time.strftime('%H:%M')}")
-
-            # Выполнение сбора данных
-            current_results = gather_product_data(config, COMPETITOR_URLS, COMPETITOR_VARIATION_URLS)
-
-            # Обновление Google Sheets
-            update_google_sheets(
+        else:
+            sink_executor.submit(
+                'sheets',
+                update_google_sheets,
                 current_results,
                 spreadsheet_id,
                 config,
@@ -1312,21 +3559,49 @@ def main():
                 credentials_file
             )
 
-            # Отправка уведомлений в Telegram
-            if current_results:
-                send_telegram_notification(
-                    config,
-                    next_slot_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    current_results
-                )
+        # Проверка правил оповещений и отправка уведомлений в Telegram в фоне
+        if current_results and not args.dry_run:
+            alerts = evaluate_alert_rules(get_alert_rules(config), current_results, config.get('company_name', 'Merino.tech. (Мы)'))
+            sink_executor.submit(
+                'telegram',
+                send_telegram_notification,
+                config,
+                next_slot_time.strftime('%Y-%m-%d %H:%M:%S'),
+                current_results,
+                alerts
+            )
+
+        logging.info(f"Сбор данных для слота {next_slot_time.strftime('%H:%M')} завершен, запись поставлена в очередь.")
 
-            logging.info(f"Процесс для слота {next_slot_time.strftime('%H:%M')} успешно завершен.")
+    def after_slot():
+        finish_metrics_cycle(config)
+        sink_executor.log_metrics()
 
+    # run: немедленный запуск для ближайшего слота (или слота из --slot); daemon - только по расписанию
+    if args.command == 'run':
+        try:
+            current_time = get_kyiv_time(timezone_str)
+            logging.info(f"Текущее время: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
+            if args.slot:
+                slot_clock = datetime.strptime(args.slot, "%H:%M").time()
+                nearest_slot = pytz.timezone(timezone_str).localize(datetime.combine(current_time.date(), slot_clock))
+            else:
+                nearest_slot = get_next_slot(current_time, all_slots, timezone_str)
+            run_slot(nearest_slot)
+            after_slot()
         except Exception as e:
-            logging.error(f"Ошибка в основном цикле: {e}")
-            time.sleep(60)  # Ждем минуту перед повторной попыткой
-    # #### КОНЕЦ ОРИГИНАЛЬНОГО ЦИКЛА ####
+            logging.error(f"Ошибка при немедленном запуске процесса: {e}")
+            if args.once:
+                return 1
+
+        # run --once: ожидание фоновой записи и выход с кодом ошибки, если таблица не записана
+        # или не доставлено сообщение в Telegram
+        if args.once:
+            return 1 if wait_for_sinks() else 0
+
+    # Регулярные запуски по расписанию слотов
+    run_schedule(scheduler, run_slot, timezone_str, after_slot=after_slot)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
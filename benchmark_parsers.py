@@ -0,0 +1,259 @@
+"""
+Офлайн-бенчмарк парсеров на сохраненном корпусе ответов провайдеров.
+
+Корпус лежит в папке fixtures/:
+- fixtures/scraperapi/*.html - HTML-страницы продуктов (ScraperAPI, render=false);
+- fixtures/scrapingdog/*.json - ответы ScrapingDog Amazon product;
+- fixtures/oxylabs/*.json - ответы realtime API Oxylabs (source=amazon, parse=true).
+Имя файла - <маркетплейс>_<ASIN>, например de_B07ZPKFGJN.html.
+Кроме корпуса проверяются разбор чисел parse_numeric_value на строках NUMERIC_VALUE_CASES
+и правила оповещений на снимке ALERT_RULE_PRODUCTS в каждом из скриптов: выражения ALERT_RULE_CASES
+и правила по умолчанию при порогах ALERT_THRESHOLD_CASES.
+
+Для каждого парсера выводятся пропускная способность (страниц в секунду) и пиковая память
+(tracemalloc). Извлеченные значения сравниваются с эталоном fixtures/golden.json, скорость -
+с fixtures/benchmark_baseline.json. При расхождении значений или замедлении больше допуска
+скрипт завершается с кодом 1.
+
+Запуск: python benchmark_parsers.py
+После намеренного изменения парсера или на новой машине: python benchmark_parsers.py --update
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+from provider_scripts import BASE_DIR, SCRIPTS, load_script
+
+FIXTURES_DIR = os.path.join(BASE_DIR, 'fixtures')
+GOLDEN_FILE = os.path.join(FIXTURES_DIR, 'golden.json')
+BASELINE_FILE = os.path.join(FIXTURES_DIR, 'benchmark_baseline.json')
+
+# Поля, которые зависят от даты запуска и не сравниваются с эталоном
+VOLATILE_FIELDS = {'Scrape Date'}
+
+# Значения полей product_info в форматах разных маркетплейсов: разбор для правил оповещений и агрегатов цен
+NUMERIC_VALUE_CASES = [
+    "$1,299.00", "1.299,00 €", "12,34 €", "€ 1 299,00", "1\u00a0299,00 €", "1\u202f299,00 €", "1 234 567,89 €",
+    "£12.99", "10.0%", "Save 15%", "4.5 out of 5", "1 500 ratings", "2 Artikel", "1,234,567", "-3,5", 12, 4.6,
+    "Not Found", "", None, True,
+]
+
+# Снимок цикла для правил оповещений: у второго продукта нашей компании значения не найдены (NaN),
+# у продукта B0ALERT004 найдены, но не разбираются как числа
+ALERT_RULE_COMPANY = 'Merino'
+ALERT_RULE_PRODUCTS = {
+    'Merino': [
+        {'ASIN': 'B0ALERT001', 'Price': '$25.99', 'Prime Price': '$22.99', 'Coupon Discount': '15%', 'Rating': '4.1'},
+        {'ASIN': 'B0ALERT002', 'Price': 'Not Found', 'Prime Price': 'Not Found', 'Coupon Discount': 'Not Found', 'Rating': 'Not Found'},
+    ],
+    'Competitor': [
+        {'ASIN': 'B0ALERT003', 'Price': '€ 1 299,00', 'Prime Price': '1.199,00 €', 'Coupon Discount': '5%', 'Rating': '4,6'},
+        {'ASIN': 'B0ALERT004', 'Price': 'N/A', 'Prime Price': '$9.99', 'Coupon Discount': 'Coupon', 'Rating': '-'},
+        {'ASIN': 'B0ALERT005', 'Price': '$10.00', 'Prime Price': '$0.00', 'Coupon Discount': '10%', 'Rating': '4.0'},
+    ],
+}
+ALERT_RULE_CASES = [
+    'price < 30', 'not price < 30', 'not not price < 30', 'not (price < 30 and rating < 4.5)',
+    'not (price < 30 or rating < 4.5)', 'price < 30 or rating > 4.5', 'not (rating > 4.5 and coupon > 50)',
+    '4.0 <= rating < 4.5', 'not 4.0 <= rating < 4.5', 'company == "us"', 'not company == "us"',
+]
+# Пороги конфига для правил оповещений по умолчанию
+ALERT_THRESHOLD_CASES = [
+    {},
+    {'min_acceptable_rating': 4.5, 'price_change_threshold': 10.0, 'coupon_threshold': 5.0},
+]
+
+# Парсер: имя, список кейсов (id фикстуры, аргументы) и функция разбора
+Parser = namedtuple('Parser', ['name', 'cases', 'func'])
+
+
+def load_fixtures(provider):
+    """Возвращает [(id фикстуры, URL, ASIN, содержимое)]; JSON-фикстуры разбираются заранее."""
+    folder = os.path.join(FIXTURES_DIR, provider)
+    fixtures = []
+    for file_name in sorted(os.listdir(folder)):
+        name, ext = os.path.splitext(file_name)
+        marketplace, asin = name.split('_', 1)
+        with open(os.path.join(folder, file_name), encoding='utf-8') as f:
+            content = json.load(f) if ext == '.json' else f.read()
+        fixtures.append((f"{provider}/{name}", f"https://www.amazon.{marketplace}/dp/{asin}", asin, content))
+    return fixtures
+
+
+def alert_rule_checker(module):
+    """Функция выражение -> тексты оповещений над ALERT_RULE_PRODUCTS; снимок прошлого цикла сбрасывается."""
+    def check(expression):
+        module._previous_alert_snapshot.clear()
+        return module.evaluate_alert_rules(module.compile_alert_rules((expression,)), ALERT_RULE_PRODUCTS, ALERT_RULE_COMPANY)
+    return check
+
+
+def default_alert_rule_checker(module):
+    """Функция пороги конфига -> тексты оповещений правил по умолчанию над ALERT_RULE_PRODUCTS."""
+    def check(thresholds):
+        module._previous_alert_snapshot.clear()
+        return module.evaluate_alert_rules(module.get_alert_rules(thresholds), ALERT_RULE_PRODUCTS, ALERT_RULE_COMPANY)
+    return check
+
+
+def build_parsers(modules):
+    """Собирает парсеры и их входные данные. Подготовка входа (например, BeautifulSoup) в замер не входит."""
+    api, dog, oxy = modules['scraperapi'], modules['scrapingdog'], modules['oxylabs']
+    pages = load_fixtures('scraperapi')
+    dog_data = load_fixtures('scrapingdog')
+    oxy_data = load_fixtures('oxylabs')
+    soups = [(fixture_id, (api.bs4.BeautifulSoup(html, 'html.parser'),)) for fixture_id, url, asin, html in pages]
+
+    prices = []
+    for fixture_id, url, asin, data in dog_data:
+        currency = dog.determine_currency(url)
+        prices.append((f"{fixture_id}:price", (data.get('price'), currency)))
+        prices.append((f"{fixture_id}:previous_price", (data.get('previous_price'), currency)))
+
+    return [
+        Parser('scraperapi_html', [(fixture_id, (html, asin, url)) for fixture_id, url, asin, html in pages], api.parse_scraperapi_html),
+        Parser('extract_best_sellers_rank', soups, api.extract_best_sellers_rank),
+        Parser('extract_rating', soups, api.extract_rating),
+        Parser('scrapingdog_mapping', [(fixture_id, (data, asin, url)) for fixture_id, url, asin, data in dog_data], dog.convert_scrapingdog_product),
+        Parser('extract_price', prices, dog.extract_price),
+        Parser('extract_bsr', [(fixture_id, (data.get('product_information', {}),)) for fixture_id, url, asin, data in dog_data], dog.extract_bsr),
+        Parser('extract_data_from_json', [(fixture_id, (data, asin)) for fixture_id, url, asin, data in oxy_data], oxy.extract_data_from_json),
+        Parser('parse_numeric_value', [(f"numeric:{value!r}", (value,)) for value in NUMERIC_VALUE_CASES], dog.parse_numeric_value),
+    ] + [
+        Parser(f"alert_rules_{provider}", [(f"rule:{expression}", (expression,)) for expression in ALERT_RULE_CASES],
+               alert_rule_checker(module))
+        for provider, module in modules.items()
+    ] + [
+        Parser(f"alert_default_rules_{provider}", [(f"thresholds:{json.dumps(thresholds)}", (thresholds,)) for thresholds in ALERT_THRESHOLD_CASES],
+               default_alert_rule_checker(module))
+        for provider, module in modules.items()
+    ]
+
+
+def normalize(result):
+    """Приводит результат к виду эталона: без полей, зависящих от даты, NaN как null, и через JSON."""
+    if isinstance(result, float) and math.isnan(result):
+        return None
+    if isinstance(result, dict):
+        result = {key: value for key, value in result.items() if key not in VOLATILE_FIELDS}
+    return json.loads(json.dumps(result, ensure_ascii=False, default=str))
+
+
+def measure_throughput(parser, min_time, rounds):
+    """Лучшая из rounds серий пропускная способность (вызовов в секунду); серия длится не меньше min_time."""
+    best = 0.0
+    for _ in range(rounds):
+        calls = 0
+        started = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time:
+            for _, args in parser.cases:
+                parser.func(*args)
+            calls += len(parser.cases)
+            elapsed = time.perf_counter() - started
+        best = max(best, calls / elapsed)
+    return best
+
+
+def measure_memory(parser):
+    """Пиковая память (байт) одного прохода по корпусу."""
+    tracemalloc.start()
+    try:
+        for _, args in parser.cases:
+            parser.func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def diff_values(expected, actual):
+    """Список расхождений значения с эталоном (по полям для словарей)."""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        return [
+            f"{key}: {expected.get(key, '<нет>')!r} -> {actual.get(key, '<нет>')!r}"
+            for key in sorted(set(expected) | set(actual)) if expected.get(key) != actual.get(key)
+        ]
+    return [] if expected == actual else [f"{expected!r} -> {actual!r}"]
+
+
+def read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Офлайн-бенчмарк парсеров на корпусе фикстур.')
+    parser.add_argument('--parser', action='append', help='Запустить только указанный парсер (можно повторять).')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Минимальная длительность одной серии замера, сек.')
+    parser.add_argument('--rounds', type=int, default=3, help='Число серий; берется лучшая.')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='Допустимое замедление относительно базовой скорости (0.3 = 30%%).')
+    parser.add_argument('--no-speed-check', action='store_true', help='Не сравнивать скорость с базовой.')
+    parser.add_argument('--update', action='store_true', help='Перезаписать эталон значений и базовую скорость.')
+    args = parser.parse_args()
+
+    modules = {provider: load_script(provider) for provider in SCRIPTS}
+    # Логи парсеров не нужны в замерах: их вывод в файл и консоль искажает скорость
+    logging.disable(logging.CRITICAL)
+
+    parsers = [p for p in build_parsers(modules) if not args.parser or p.name in args.parser]
+    golden = read_json(GOLDEN_FILE)
+    baseline = read_json(BASELINE_FILE)
+
+    failures = []
+    print(f"{'Парсер':<28}{'Кейсов':>7}{'Стр./с':>12}{'База':>12}{'Пик, КиБ':>12}  Эталон")
+    for p in parsers:
+        results = {fixture_id: normalize(p.func(*call_args)) for fixture_id, call_args in p.cases}
+        rate = measure_throughput(p, args.min_time, args.rounds)
+        peak = measure_memory(p)
+
+        mismatches = []
+        expected_results = golden.get(p.name, {})
+        for fixture_id, actual in results.items():
+            if fixture_id not in expected_results:
+                mismatches.append(f"{fixture_id}: нет в эталоне")
+                continue
+            mismatches.extend(f"{fixture_id}: {line}" for line in diff_values(expected_results[fixture_id], actual))
+
+        base_rate = baseline.get(p.name)
+        status = 'OK' if not mismatches else f"расхождений: {len(mismatches)}"
+        print(f"{p.name:<28}{len(p.cases):>7}{rate:>12.1f}{(base_rate or 0):>12.1f}{peak / 1024:>12.1f}  {status}")
+
+        if args.update:
+            golden[p.name] = results
+            baseline[p.name] = round(rate, 1)
+            continue
+        for line in mismatches:
+            print(f"    {line}")
+        failures.extend(f"{p.name}: {line}" for line in mismatches)
+        if not args.no_speed_check and base_rate and rate < base_rate * (1 - args.tolerance):
+            print(f"    замедление: {rate:.1f} стр./с при базовой {base_rate:.1f} (допуск {args.tolerance:.0%})")
+            failures.append(f"{p.name}: замедление")
+
+    if args.update:
+        write_json(GOLDEN_FILE, golden)
+        write_json(BASELINE_FILE, baseline)
+        print(f"Эталон и базовая скорость обновлены: {os.path.relpath(GOLDEN_FILE, BASE_DIR)}, {os.path.relpath(BASELINE_FILE, BASE_DIR)}")
+        return 0
+    if failures:
+        print(f"Регрессии: {len(failures)}")
+        return 1
+    print("Регрессий нет.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
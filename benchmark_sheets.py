@@ -0,0 +1,195 @@
+"""
+Офлайн-бенчмарк запросов к Google Sheets API на сервере-заглушке mock_sheets_server.py.
+
+Для каждого скрипта выполняются этапы:
+- load_config - load_config_from_sheets (для ScraperAPI и ScrapingDog - основной конфиг и лист Config_1);
+- first_cycle - update_google_sheets при пустом кэше разметки: заголовок, подписи, данные, форматирование;
+- next_cycle - повторная запись того же листа, когда разметка уже в кэше.
+Для каждого этапа выводятся число запросов по методам API, записанные ячейки и время.
+Число запросов сравнивается с fixtures/sheets_calls_baseline.json: рост любого счетчика -
+регрессия, скрипт завершается с кодом 1.
+
+Запуск: python benchmark_sheets.py
+С задержкой и квотой Google: python benchmark_sheets.py --latency lognormal:150:0.4 --write-quota 60
+После намеренного изменения записи: python benchmark_sheets.py --update
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import mock_sheets_server
+from benchmark_parsers import read_json, write_json
+from provider_scripts import BASE_DIR, SCRIPTS, load_script
+
+BASELINE_FILE = os.path.join(BASE_DIR, 'fixtures', 'sheets_calls_baseline.json')
+
+SPREADSHEET_ID = '1ibuYnN9WeRZdHUqoiU2jFLez59fm5Gfgzeyvq7M4EaI'
+ACTIVE_TRADE_SLOTS = "14:00, 16:00, 18:00, 20:00, 22:00, 00:00, 02:00, 04:00, 06:00"
+ANALYSIS_SLOTS = "08:00, 10:00, 12:00"
+COMPETITORS = ("Merino Protect", "METARINO")
+MARKETPLACES = ('de', 'com', 'co.uk', 'fr', 'it', 'es')
+CYCLE_TIME = datetime(2025, 1, 6, 14, 2)
+SHEET_ROWS = 20000
+
+# Лист данных для каждого скрипта; у Check Insights Manager имя листа задано в коде
+DATA_SHEETS = {'scraperapi': 'SS', 'scrapingdog': 'SS', 'oxylabs': 'SS+Sox'}
+
+
+def synthetic_urls(count, offset):
+    return "\n".join(
+        f"https://www.amazon.{MARKETPLACES[i % len(MARKETPLACES)]}/dp/B0{offset + i:08d}" for i in range(count)
+    )
+
+
+def seed_spreadsheet(store, provider, urls_per_section):
+    """Заполняет таблицу-заглушку листами конфига и пустым листом данных."""
+    sections = ['product_urls', 'variation_urls'] + [
+        f"{i}{kind}" for i in range(1, len(COMPETITORS) + 1) for kind in ('competitor_urls', 'variation_urls')
+    ]
+    data_config = [['Key', 'Value'], ['active_trade_slots', ACTIVE_TRADE_SLOTS], ['analysis_slots', ANALYSIS_SLOTS]]
+    data_config += [[f'competitor_{i}_name', name] for i, name in enumerate(COMPETITORS, 1)]
+    data_config += [[section, synthetic_urls(urls_per_section, n * urls_per_section)] for n, section in enumerate(sections)]
+
+    if provider == 'oxylabs':
+        store.add_sheet(SPREADSHEET_ID, 'Config', data_config)
+    else:
+        store.add_sheet(SPREADSHEET_ID, 'Config', [
+            ['Key', 'Value'], ['Config_1', 'Config SS'], ['Name list_1', DATA_SHEETS[provider]],
+            ['active_trade_slots', ACTIVE_TRADE_SLOTS], ['analysis_slots', ANALYSIS_SLOTS],
+        ])
+        store.add_sheet(SPREADSHEET_ID, 'Config SS', data_config)
+    store.add_sheet(SPREADSHEET_ID, DATA_SHEETS[provider], row_count=SHEET_ROWS)
+
+
+def synthetic_results(module, provider, config):
+    """Собранные данные для всех URL конфига, как их возвращает gather_product_data."""
+    if provider == 'oxylabs':
+        names = [config.get(f'competitor_{i}_name') for i in range(1, len(COMPETITORS) + 1)]
+        sources = module.get_fetch_sources(
+            config,
+            {name: config.get(f'{i}competitor_urls', []) for i, name in enumerate(names, 1)},
+            {name: config.get(f'{i}variation_urls', []) for i, name in enumerate(names, 1)},
+        )
+    else:
+        sources = module.get_fetch_sources(config)
+
+    results = {}
+    for _, company, _, urls in sources:
+        for n, url in enumerate(urls):
+            asin = re.search(r'/dp/([A-Z0-9]{10})', url).group(1)
+            price = 20 + n % 40 + 0.99
+            results.setdefault(company, []).append({
+                'ASIN': asin, 'Price': price, 'List Price': round(price * 1.2, 2), 'Prime Price': round(price * 0.95, 2),
+                'BSR': 1000 + n, 'Number of Reviews': 100 + n, 'Rating': 4.5, 'URL': url,
+            })
+    return results
+
+
+def run_provider(provider, args):
+    """Выполняет этапы для скрипта и возвращает {этап: {'calls': {метод: число}, 'seconds': время}}."""
+    store = mock_sheets_server.configure(args.latency, args.read_quota, args.write_quota, args.quota_window)
+    seed_spreadsheet(store, provider, args.urls)
+    module = load_script(provider)
+    logging.getLogger().setLevel(logging.ERROR)
+    client = mock_sheets_server.connect(args.base_url)
+    # Скрипты авторизуются сами по файлу учетных данных; в бенчмарке клиент уже направлен на заглушку
+    module.authorize_google_sheets = lambda credentials_file: client
+
+    steps = {}
+
+    def measure(step, func):
+        with mock_sheets_server.MockSheetsHandler.stats_lock:
+            mock_sheets_server.MockSheetsHandler.stats.clear()
+        started = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - started
+        with mock_sheets_server.MockSheetsHandler.stats_lock:
+            calls = dict(sorted(mock_sheets_server.MockSheetsHandler.stats.items()))
+        steps[step] = {'calls': calls, 'seconds': seconds}
+        return result
+
+    if provider == 'oxylabs':
+        config = measure('load_config', lambda: module.load_config_from_sheets(client, SPREADSHEET_ID))
+
+        def write_cycle():
+            module.update_google_sheets(results, SPREADSHEET_ID, config, CYCLE_TIME.strftime('%Y-%m-%d 14:00:00'), None)
+    else:
+        def load_configs():
+            module.load_config_from_sheets(client, SPREADSHEET_ID)
+            return module.load_config_from_sheets(client, SPREADSHEET_ID, 'Config SS')
+        config = measure('load_config', load_configs)
+
+        def write_cycle():
+            module.update_google_sheets(results, SPREADSHEET_ID, config, DATA_SHEETS[provider], None, cycle_time=CYCLE_TIME, slot='14:00')
+
+    results = synthetic_results(module, provider, config)
+    measure('first_cycle', write_cycle)
+    measure('next_cycle', write_cycle)
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк запросов к Google Sheets API на сервере-заглушке.')
+    parser.add_argument('--provider', action='append', choices=sorted(SCRIPTS), help='Проверить только указанный скрипт (можно повторять).')
+    parser.add_argument('--urls', type=int, default=50, help='Число URL в каждой секции конфига.')
+    parser.add_argument('--latency', help='Задержка ответа заглушки, мс: fixed:MS, uniform:MIN:MAX, exp:MEAN, lognormal:MEDIAN:SIGMA.')
+    parser.add_argument('--read-quota', type=int, default=0, help='Запросов чтения за окно квоты (0 - без ограничения).')
+    parser.add_argument('--write-quota', type=int, default=0, help='Запросов записи за окно квоты (0 - без ограничения).')
+    parser.add_argument('--quota-window', type=float, default=60.0, help='Окно квоты, сек.')
+    parser.add_argument('--update', action='store_true', help='Перезаписать базовое число запросов.')
+    args = parser.parse_args()
+
+    server, args.base_url = mock_sheets_server.start_server()
+    # Скрипты пишут scraper.log в рабочую папку: запускаем во временной
+    os.chdir(tempfile.mkdtemp(prefix='benchmark_sheets_'))
+    baseline = read_json(BASELINE_FILE)
+    # Число записанных ячеек зависит от размера конфига: база сравнима только при том же --urls
+    compare = not args.update and baseline.get('urls') == args.urls
+    if not args.update and not compare:
+        print(f"База снята для --urls {baseline.get('urls')}, сравнение пропущено.")
+    failures = []
+    try:
+        for provider in args.provider or SCRIPTS:
+            steps = run_provider(provider, args)
+            print(f"{provider}:")
+            for step, entry in steps.items():
+                calls = entry['calls']
+                requests_total = sum(count for key, count in calls.items() if '.' in key and key.split('.')[0] in ('spreadsheets', 'values'))
+                methods = ", ".join(f"{key} {count}" for key, count in calls.items())
+                print(f"  {step:<12} запросов {requests_total:>4}, {entry['seconds']:>7.2f} с: {methods}")
+
+                expected = baseline.get(provider, {}).get(step)
+                if args.update:
+                    baseline.setdefault(provider, {})[step] = calls
+                    continue
+                if not compare:
+                    continue
+                if expected is None:
+                    failures.append(f"{provider}/{step}: нет в базе")
+                    continue
+                for key, count in calls.items():
+                    if count > expected.get(key, 0):
+                        print(f"    рост {key}: {expected.get(key, 0)} -> {count}")
+                        failures.append(f"{provider}/{step}: {key}")
+    finally:
+        server.shutdown()
+
+    if args.update:
+        baseline['urls'] = args.urls
+        write_json(BASELINE_FILE, baseline)
+        print(f"Базовое число запросов обновлено: {os.path.relpath(BASELINE_FILE, BASE_DIR)}")
+        return 0
+    if failures:
+        print(f"Регрессии: {len(failures)}")
+        return 1
+    print("Регрессий нет.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Бенчмарк времени запуска скриптов: загрузка модуля и короткая команда (--help).
+
+Каждый замер выполняется в новом процессе интерпретатора:
+- загрузка скрипта как модуля - время выполнения тела модуля и импортов, которые он делает сразу;
+- `python cli.py --provider <скрипт> run --help` - короткая команда за вычетом запуска пустого интерпретатора;
+- `python <скрипт> --help` - то же при прямом запуске: скрипт как __main__ каждый раз компилируется заново
+  (кэш байткода __pycache__ используется только при загрузке модулем, как в cli.py).
+Разбивка по импортам берется из `python -X importtime`: самые долгие импорты верхнего уровня (без импортов
+самого интерпретатора) и тяжелые зависимости (Google Sheets, XLSX, Telegram, numpy, bs4), загруженные при старте.
+Тяжелые зависимости импортируются при первом использовании (LazyModule), поэтому при старте их быть не должно.
+Если медианное время загрузки больше --budget-ms, скрипт завершается с кодом 1.
+
+Запуск: python benchmark_startup.py
+Только один скрипт, 10 повторов: python benchmark_startup.py --provider scrapingdog --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from provider_scripts import BASE_DIR, SCRIPTS
+
+CLI = os.path.join(BASE_DIR, 'cli.py')
+
+# Зависимости, которые не нужны для загрузки скрипта и коротких команд
+HEAVY_MODULES = ('gspread', 'gspread_formatting', 'oauth2client', 'google.oauth2', 'openpyxl', 'telebot', 'numpy', 'bs4', 'requests', 'pytz')
+
+PROBE = """
+import importlib.util, json, os, sys, time
+# Как при прямом запуске: папка скрипта в sys.path, чтобы импортировался raw_archive.py
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('startup_probe', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+seconds = time.perf_counter() - started
+print(json.dumps({'seconds': seconds, 'heavy': [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+
+def run_process(command, cwd):
+    """Запускает команду и возвращает (длительность, stdout, stderr)."""
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} завершился с кодом {completed.returncode}: {completed.stderr[-500:]}")
+    return seconds, completed.stdout, completed.stderr
+
+
+def parse_importtime(stderr, skip=()):
+    """Импорты верхнего уровня из вывода -X importtime: [(имя, cumulative в секундах)], кроме skip."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith(' ' * 2) and name.strip() not in skip:  # вложенные импорты выводятся с отступом
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    return imports
+
+
+def measure(provider, runs, work_dir):
+    """Медианы времени загрузки и короткой команды и разбивка импортов для скрипта."""
+    path = os.path.join(BASE_DIR, SCRIPTS[provider])
+    load_seconds, cli_seconds, help_seconds, bare_seconds = [], [], [], []
+    heavy = []
+    for _ in range(runs):
+        _, stdout, _ = run_process([sys.executable, '-c', PROBE, path] + list(HEAVY_MODULES), work_dir)
+        result = json.loads(stdout.strip().splitlines()[-1])
+        load_seconds.append(result['seconds'])
+        heavy = result['heavy']
+        cli_seconds.append(run_process([sys.executable, CLI, '--provider', provider, 'run', '--help'], work_dir)[0])
+        help_seconds.append(run_process([sys.executable, path, '--help'], work_dir)[0])
+        bare_seconds.append(run_process([sys.executable, '-c', 'pass'], work_dir)[0])
+
+    # Импорты, которые делает сам интерпретатор при запуске (site, encodings, .pth-файлы)
+    interpreter_imports = {name for name, _ in parse_importtime(run_process([sys.executable, '-X', 'importtime', '-c', 'pass'], work_dir)[2])}
+    _, _, stderr = run_process([sys.executable, '-X', 'importtime', '-c', PROBE, path], work_dir)
+    imports = sorted(parse_importtime(stderr, interpreter_imports), key=lambda item: -item[1])
+    return {
+        'load_seconds': statistics.median(load_seconds),
+        'cli_seconds': statistics.median(cli_seconds),
+        'help_seconds': statistics.median(help_seconds),
+        'interpreter_seconds': statistics.median(bare_seconds),
+        'heavy_modules': heavy,
+        'top_imports': imports,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк времени запуска скриптов.')
+    parser.add_argument('--provider', action='append', choices=sorted(SCRIPTS), help='Проверить только указанный скрипт (можно повторять).')
+    parser.add_argument('--runs', type=int, default=5, help='Число запусков; берется медиана.')
+    parser.add_argument('--top', type=int, default=8, help='Сколько самых долгих импортов показать.')
+    parser.add_argument('--budget-ms', type=float, default=100.0, help='Допустимое время загрузки скрипта, мс.')
+    parser.add_argument('--json', action='store_true', help='Вывести результат в JSON.')
+    args = parser.parse_args(argv)
+
+    # Скрипты пишут scraper.log в рабочую папку: запускаем во временной
+    work_dir = tempfile.mkdtemp(prefix='benchmark_startup_')
+    results = {provider: measure(provider, args.runs, work_dir) for provider in args.provider or SCRIPTS}
+    failures = [provider for provider, result in results.items() if result['load_seconds'] * 1000 > args.budget_ms]
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 1 if failures else 0
+
+    for provider, result in results.items():
+        interpreter = result['interpreter_seconds']
+        print(f"{provider}: загрузка {result['load_seconds'] * 1000:.1f} мс (бюджет {args.budget_ms:.0f} мс); "
+              f"сверх пустого интерпретатора ({interpreter * 1000:.1f} мс): "
+              f"cli.py run --help {(result['cli_seconds'] - interpreter) * 1000:.1f} мс, "
+              f"прямой запуск --help {(result['help_seconds'] - interpreter) * 1000:.1f} мс")
+        if result['heavy_modules']:
+            print(f"  тяжелые зависимости при старте: {', '.join(result['heavy_modules'])}")
+        for name, seconds in result['top_imports'][:args.top]:
+            print(f"  импорт {name:<32}{seconds * 1000:>8.1f} мс")
+    if failures:
+        print(f"Превышен бюджет: {', '.join(failures)}")
+        return 1
+    print("Бюджет соблюден.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Единая точка входа для всех скриптов сбора.
+
+Подкоманды:
+- run [--once] - цикл сбора сразу (с --once - один цикл и выход, для cron и таймеров systemd),
+  без --once затем запуски по расписанию;
+- daemon - только запуски по расписанию слотов;
+- bench - один цикл на сервере-заглушке провайдеров с замером этапов (load_test.py);
+- replay - прогон суток слотов на симулированных часах (simulate_day.py).
+Остальные аргументы передаются выбранной подкоманде, список - в `python cli.py <подкоманда> --help`.
+
+Примеры:
+    python cli.py --provider scrapingdog run --once --sheets SS --dry-run
+    python cli.py --provider oxylabs daemon --spreadsheet <ID> --concurrency 2
+    python cli.py --provider scraperapi bench --asins 2000
+    python cli.py --provider scraperapi replay --asins 3000 --overrun-policy merge
+"""
+import argparse
+import sys
+
+from provider_scripts import SCRIPTS, load_script
+
+COMMANDS = ('run', 'daemon', 'bench', 'replay')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сбор данных о продуктах Amazon: запуск, бенчмарк и симуляция.')
+    parser.add_argument('--provider', choices=sorted(SCRIPTS), default='scrapingdog', help='Скрипт провайдера.')
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Аргументы подкоманды.')
+    args = parser.parse_args(argv)
+
+    # Драйверы бенчмарка и симуляции импортируются только для своих подкоманд: run и daemon стартуют быстрее
+    if args.command == 'bench':
+        import load_test
+        return load_test.main(['--provider', args.provider] + args.args)
+    if args.command == 'replay':
+        import simulate_day
+        return simulate_day.main(['--provider', args.provider] + args.args)
+    return load_script(args.provider).main([args.command] + args.args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+Нагрузочный тест полного цикла сбора на локальном сервере-заглушке провайдеров.
+
+Драйвер запускает mock_provider_server.py отдельным процессом на свободном порту,
+загружает скрипт выбранного провайдера, направляет его запросы на заглушку и выполняет
+цикл gather_product_data -> приемник данных для синтетических ASIN (по умолчанию 10 000).
+В отчете: время цикла по этапам, пропускная способность, исходы и задержки запросов,
+ответы сервера-заглушки и пиковая память (RSS) процесса драйвера.
+
+Приемник данных (--sink):
+- xlsx - XLSX-отчет в памяти (create_xlsx_report), по умолчанию;
+- sheets - update_google_sheets в пустой лист данных на mock_sheets_server.py, запущенном в процессе
+  драйвера; в отчет добавляются запросы к Sheets API по методам. Задержка и квоты заглушки
+  задаются --sheets-latency, --sheets-read-quota и --sheets-write-quota.
+Telegram в тесте не участвует.
+Лимит запросов скрипта (api_limiter, 1 запрос в секунду) снимается, если не задан --client-rps.
+
+Примеры:
+    python load_test.py --provider scraperapi
+    python load_test.py --provider oxylabs --asins 2000 --latency lognormal:300:0.5 --error-429 0.02
+    python load_test.py --provider scraperapi --rate-limit 200 --set scraperapi_mode=structured
+    python load_test.py --provider scrapingdog --asins 2000 --sink sheets --sheets-write-quota 60
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import mock_sheets_server
+from provider_scripts import BASE_DIR, SCRIPTS, load_script
+
+FIXTURES_DIR = os.path.join(BASE_DIR, 'fixtures')
+MOCK_SERVER = os.path.join(BASE_DIR, 'mock_provider_server.py')
+
+MARKETPLACES = ('de', 'com', 'co.uk', 'fr', 'it', 'es')
+OUR_COMPANY = "Merino.tech. (Мы)"
+COMPETITORS = ("Merino Protect", "METARINO")
+
+# Таблица и листы данных для приемника sheets; у Check Insights Manager имя листа задано в коде
+SPREADSHEET_ID = 'load-test'
+DATA_SHEETS = {'scraperapi': 'SS', 'scrapingdog': 'SS', 'oxylabs': 'SS+Sox'}
+CYCLE_TIME = datetime(2025, 1, 6, 14, 2)
+CYCLE_SLOT = '14:00'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(port, args):
+    """Запускает сервер-заглушку и ждет, пока он начнет принимать соединения."""
+    command = [
+        sys.executable, MOCK_SERVER, '--port', str(port), '--quiet',
+        '--error-429', str(args.error_429), '--error-5xx', str(args.error_5xx), '--rate-limit', str(args.rate_limit),
+    ]
+    if args.latency:
+        command += ['--latency', args.latency]
+    if not args.synthetic:
+        command += ['--fixtures', FIXTURES_DIR]
+    server = subprocess.Popen(command)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Сервер-заглушка завершился с кодом {server.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Сервер-заглушка не запустился за 10 секунд")
+
+
+def synthetic_sections(count, dead_share):
+    """
+    Распределяет count синтетических ASIN по секциям: (компания, роль) -> список URL.
+    ASIN с префиксом B0DEAD сервер-заглушка отдает как снятые с продажи (404).
+    """
+    sections = [(company, role) for company in (OUR_COMPANY,) + COMPETITORS for role in ('parent', 'variation')]
+    urls = {section: [] for section in sections}
+    dead_every = round(1 / dead_share) if dead_share else 0
+    for i in range(count):
+        asin = f"B0DEAD{i % 10000:04d}" if dead_every and i % dead_every == dead_every - 1 else f"B0{i:08d}"
+        urls[sections[i % len(sections)]].append(f"https://www.amazon.{MARKETPLACES[i % len(MARKETPLACES)]}/dp/{asin}")
+    return urls
+
+
+def build_config(provider, base_url, sections):
+    """Конфиг в том виде, в каком его возвращает load_config_from_sheets, и аргументы gather_product_data."""
+    config = {
+        'company_name': OUR_COMPANY,
+        'product_urls': sections[(OUR_COMPANY, 'parent')],
+        'variation_urls': sections[(OUR_COMPANY, 'variation')],
+        'metrics_summary_file': '',
+        'active_trade_slots': ["14:00", "16:00", "18:00", "20:00", "22:00", "00:00", "02:00", "04:00", "06:00"],
+        'analysis_slots': ["08:00", "10:00", "12:00"],
+    }
+    for i, name in enumerate(COMPETITORS, 1):
+        config[f'{i}competitor_urls'] = sections[(name, 'parent')]
+        config[f'{i}variation_urls'] = sections[(name, 'variation')]
+    gather_args = ()
+
+    if provider == 'scraperapi':
+        config.update({'ScraperAPI': 'load-test', 'scraperapi_endpoint': base_url, 'scraperapi_async_endpoint': base_url})
+        config.update({f'competitor_{i}_name': name for i, name in enumerate(COMPETITORS, 1)})
+        config['competitor_names'] = {str(i): name for i, name in enumerate(COMPETITORS, 1)}
+    elif provider == 'scrapingdog':
+        config.update({'ScrapingDogAPIKey': 'load-test', 'scrapingdog_endpoint': f"{base_url}/amazon/product"})
+        config['competitor_names'] = {str(i): name for i, name in enumerate(COMPETITORS, 1)}
+    else:
+        config.update({
+            'oxylabs_username': 'load-test', 'oxylabs_password': 'load-test',
+            'oxylabs_endpoint': f"{base_url}/v1/queries", 'oxylabs_batch_endpoint': f"{base_url}/v1/queries",
+        })
+        gather_args = (
+            {name: sections[(name, 'parent')] for name in COMPETITORS},
+            {name: sections[(name, 'variation')] for name in COMPETITORS},
+        )
+    return config, gather_args
+
+
+def start_sheets_sink(module, provider, args):
+    """
+    Запускает заглушку Google Sheets с пустым листом данных и направляет на нее скрипт.
+    Возвращает (сервер, функция записи результатов цикла).
+    """
+    store = mock_sheets_server.configure(args.sheets_latency, args.sheets_read_quota, args.sheets_write_quota)
+    # На каждый ASIN приходится строка данных; запас - на заголовки секций и агрегаты цен
+    store.add_sheet(SPREADSHEET_ID, DATA_SHEETS[provider], row_count=2 * args.asins + 1000)
+    server, base_url = mock_sheets_server.start_server()
+    client = mock_sheets_server.connect(base_url)
+    # Скрипты авторизуются сами по файлу учетных данных; в тесте клиент уже направлен на заглушку
+    module.authorize_google_sheets = lambda credentials_file: client
+
+    def write(results, config):
+        if provider == 'oxylabs':
+            return module.update_google_sheets(results, SPREADSHEET_ID, config, CYCLE_TIME.strftime(f'%Y-%m-%d {CYCLE_SLOT}:00'), None)
+        return module.update_google_sheets(results, SPREADSHEET_ID, config, DATA_SHEETS[provider], None, cycle_time=CYCLE_TIME, slot=CYCLE_SLOT)
+    return server, write
+
+
+def sheets_calls():
+    """Запросы к заглушке Google Sheets по методам API."""
+    with mock_sheets_server.MockSheetsHandler.stats_lock:
+        return dict(sorted(mock_sheets_server.MockSheetsHandler.stats.items()))
+
+
+def parse_overrides(items):
+    """Разбирает --set key=value; числа приводятся к int/float."""
+    overrides = {}
+    for item in items or []:
+        key, _, value = item.partition('=')
+        for cast in (int, float):
+            try:
+                value = cast(value)
+                break
+            except ValueError:
+                continue
+        overrides[key.strip()] = value
+    return overrides
+
+
+def peak_rss_mib():
+    """Пиковая память процесса (RSS) в МиБ или None, если измерить нельзя."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def fetch_server_stats(base_url):
+    try:
+        with urllib.request.urlopen(f"{base_url}/__stats", timeout=5) as response:
+            return json.loads(response.read())
+    except OSError as e:
+        return {'error': str(e)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест цикла сбора на сервере-заглушке провайдеров.')
+    parser.add_argument('--provider', choices=sorted(SCRIPTS), default='scraperapi')
+    parser.add_argument('--asins', type=int, default=10000, help='Число синтетических ASIN.')
+    parser.add_argument('--dead-share', type=float, default=0.01, help='Доля снятых с продажи ASIN (ответ 404).')
+    parser.add_argument('--latency', help='Задержка ответа заглушки, мс: fixed:MS, uniform:MIN:MAX, exp:MEAN, lognormal:MEDIAN:SIGMA.')
+    parser.add_argument('--error-429', type=float, default=0.0, help='Доля ответов 429.')
+    parser.add_argument('--error-5xx', type=float, default=0.0, help='Доля ответов 500/502/503.')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Лимит заглушки, запросов в секунду (0 - без лимита).')
+    parser.add_argument('--client-rps', type=int, default=0, help='Лимит api_limiter скрипта, запросов в секунду (0 - без лимита).')
+    parser.add_argument('--synthetic', action='store_true', help='Синтетические ответы вместо корпуса fixtures/.')
+    parser.add_argument('--sink', choices=('xlsx', 'sheets'), default='xlsx', help='Приемник данных: XLSX-отчет или заглушка Google Sheets.')
+    parser.add_argument('--sheets-latency', help='Задержка ответа заглушки Google Sheets, мс (формат как у --latency).')
+    parser.add_argument('--sheets-read-quota', type=int, default=0, help='Запросов чтения к заглушке Google Sheets за минуту (0 - без ограничения).')
+    parser.add_argument('--sheets-write-quota', type=int, default=0, help='Запросов записи к заглушке Google Sheets за минуту (0 - без ограничения).')
+    parser.add_argument('--set', action='append', metavar='KEY=VALUE', help='Дополнительный ключ конфига, например scraperapi_mode=structured.')
+    parser.add_argument('--log-level', default='ERROR', help='Уровень логов скрипта.')
+    parser.add_argument('--json', action='store_true', help='Вывести отчет в JSON.')
+    args = parser.parse_args(argv)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_mock_server(port, args)
+    sheets_server = None
+    # Скрипты пишут scraper.log и файлы состояния в рабочую папку: запускаем во временной
+    work_dir = tempfile.mkdtemp(prefix='load_test_')
+    os.chdir(work_dir)
+    try:
+        module = load_script(args.provider)
+        logging.getLogger().setLevel(args.log_level.upper())
+        module.api_limiter.max_requests = args.client_rps or float('inf')
+
+        sections = synthetic_sections(args.asins, args.dead_share)
+        config, gather_args = build_config(args.provider, base_url, sections)
+        config.update(parse_overrides(args.set))
+        if args.sink == 'sheets':
+            sheets_server, write_sheets = start_sheets_sink(module, args.provider, args)
+        rss_before = peak_rss_mib()
+
+        module.stage_metrics.begin_cycle('load-test')
+        started = time.perf_counter()
+        results = module.gather_product_data(config, *gather_args)
+        gathered = time.perf_counter()
+        if args.sink == 'sheets':
+            report = None
+            sheets_written = write_sheets(results, config)
+        else:
+            report = module.create_xlsx_report(results, time.strftime('%Y-%m-%d %H:%M:%S'))
+        finished = time.perf_counter()
+        summary = module.stage_metrics.end_cycle()
+        stats = fetch_server_stats(base_url)
+    finally:
+        server.terminate()
+        server.wait()
+        if sheets_server is not None:
+            sheets_server.shutdown()
+
+    collected = sum(len(products) for products in results.values())
+    cycle_seconds = finished - started
+    result = {
+        'provider': args.provider,
+        'asins': args.asins,
+        'collected': collected,
+        'failed': summary['counters'].get('products_failed', 0),
+        'cycle_seconds': round(cycle_seconds, 3),
+        'gather_seconds': round(gathered - started, 3),
+        'sink': args.sink,
+        'sink_seconds': round(finished - gathered, 3),
+        'asins_per_second': round(args.asins / cycle_seconds, 1) if cycle_seconds else None,
+        'peak_rss_mib': peak_rss_mib(),
+        'rss_before_cycle_mib': rss_before,
+        'stages': summary['stages'],
+        'provider_latency': module.provider_latency.snapshot(),
+        'server_responses': stats,
+        'work_dir': work_dir,
+    }
+    if args.sink == 'sheets':
+        result['sheets_written'] = bool(sheets_written)
+        result['sheets_calls'] = sheets_calls()
+    else:
+        result['xlsx_bytes'] = len(report.getvalue()) if report else 0
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    print(f"Провайдер: {args.provider}, ASIN: {args.asins}, собрано: {collected}, не собрано: {result['failed']}")
+    sink_label = 'Google Sheets' if args.sink == 'sheets' else 'XLSX'
+    print(f"Цикл: {cycle_seconds:.1f} с (сбор {result['gather_seconds']:.1f} с, {sink_label} {result['sink_seconds']:.1f} с), "
+          f"{result['asins_per_second']} ASIN/с")
+    if result['peak_rss_mib'] is not None:
+        print(f"Пиковая память (RSS): {result['peak_rss_mib']:.1f} МиБ (до цикла {rss_before:.1f} МиБ)")
+    else:
+        print("Пиковая память (RSS): недоступно на этой платформе")
+    for stage, entry in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"  этап {stage:<20}{entry['seconds']:>10.1f} с{entry['calls']:>10} вызовов")
+    for name, entry in result['provider_latency'].items():
+        if entry['count']:
+            print(f"  {name}: p50 {entry['p50']:.3f} с, p95 {entry['p95']:.3f} с, p99 {entry['p99']:.3f} с; {entry['outcomes']}")
+    print(f"Ответы заглушки: {stats}")
+    if args.sink == 'sheets':
+        written = 'записан' if result['sheets_written'] else 'НЕ записан'
+        print(f"Лист {DATA_SHEETS[args.provider]} {written}, запросы к Sheets API: {result['sheets_calls']}")
+    print(f"Рабочая папка (логи скрипта): {work_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,592 @@
+"""
+Локальный сервер-заглушка API провайдеров скрапинга.
+
+Позволяет проверить сбор данных без расхода кредитов провайдера:
+запустите сервер и укажите его адрес в листе Config, например
+`oxylabs_endpoint = http://127.0.0.1:8765/v1/queries`.
+
+Поддерживаются realtime API Oxylabs (POST /v1/queries) и push-pull API
+(POST /v1/queries/batch, POST /v1/queries/batch/status со списком id, GET /v1/queries/<id>,
+GET /v1/queries/<id>/results) с имитацией жизненного цикла заданий: pending -> done или faulted.
+
+ScraperAPI: HTML-страница (GET /?url=...), структурированный API
+(GET /structured/amazon/product) и асинхронные задания
+(POST /structured/amazon/product, GET /jobs/<id>): running -> finished или failed.
+Для ScraperAPI укажите `scraperapi_endpoint` и `scraperapi_async_endpoint`
+равными http://127.0.0.1:8765.
+
+ScrapingDog: GET /amazon/product?api_key=...&asin=...&domain=...&country=...;
+укажите `scrapingdog_endpoint = http://127.0.0.1:8765/amazon/product`.
+
+Для нагрузочного тестирования (см. load_test.py):
+- --fixtures fixtures - ответы строятся из сохраненного корпуса (ASIN фикстуры заменяется запрошенным);
+- --latency - распределение задержки ответа: fixed:MS, uniform:MIN_MS:MAX_MS, exp:MEAN_MS,
+  lognormal:MEDIAN_MS:SIGMA;
+- --error-429, --error-5xx - доля ответов 429 и 500/502/503;
+- --rate-limit - лимит запросов в секунду на провайдера, сверх лимита - 429;
+- GET /__stats - число ответов по провайдерам и кодам статуса.
+Задержки, ошибки и лимит применяются только к запросам данных товара.
+
+Запуск: python mock_provider_server.py --port 8765
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def stable_number(asin, salt, low, high):
+    """Детерминированное число в диапазоне [low, high] для ASIN, чтобы ответы были воспроизводимы."""
+    digest = hashlib.md5(f"{asin}:{salt}".encode('utf-8')).hexdigest()
+    return low + int(digest[:8], 16) % (high - low + 1)
+
+
+def is_dead_asin(asin):
+    """ASIN с префиксом B0DEAD имитируют снятые с продажи товары: провайдер отвечает 404."""
+    return str(asin).startswith('B0DEAD')
+
+
+def mock_variation_asins(asin):
+    """ASIN вариаций, которые заглушка возвращает для родительского продукта."""
+    return [f"{asin[:9]}{suffix}" for suffix in 'XYZ' if f"{asin[:9]}{suffix}" != asin]
+
+
+def build_oxylabs_product(asin, domain='com'):
+    """Полный разобранный ответ источника 'amazon' / 'amazon_product'."""
+    price = stable_number(asin, 'price', 1500, 6000) / 100
+    return {
+        'asin': asin,
+        'url': f"https://www.amazon.{domain}/dp/{asin}",
+        'title': f"Mock Product {asin}",
+        'brand': 'Mock Brand',
+        'rating': stable_number(asin, 'rating', 35, 50) / 10,
+        'reviews_count': stable_number(asin, 'reviews', 10, 5000),
+        'price': price,
+        'prime_offer_price': round(price * 0.95, 2),
+        'title_price': price,
+        'price_strikethrough': round(price * 1.2, 2),
+        'coupon': f"{stable_number(asin, 'coupon', 0, 20)}%",
+        'sales_rank': [{'rank': stable_number(asin, 'bsr', 100, 90000), 'ladder': [{'name': 'Sports & Outdoors'}]}],
+        # Вариации листинга: у части вариаций Oxylabs возвращает цену, у части – нет
+        'variation': [
+            {
+                'asin': variation_asin,
+                'selected': False,
+                'dimensions': {'Size': size},
+                **({'price': stable_number(variation_asin, 'price', 1500, 6000) / 100} if index < 2 else {}),
+            }
+            for index, (variation_asin, size) in enumerate(zip(mock_variation_asins(asin), ('S', 'M', 'L')))
+        ],
+        # Объемные поля полной страницы, которые не нужны для обновления цены
+        'description': 'Lorem ipsum dolor sit amet. ' * 200,
+        'bullet_points': ['Merino wool, breathable and warm.'] * 20,
+        'images': [f"https://m.media-amazon.com/images/I/{asin}_{i}.jpg" for i in range(15)],
+    }
+
+
+def build_oxylabs_pricing(asin, domain='com'):
+    """Разобранный ответ легкого источника 'amazon_pricing': только список предложений."""
+    price = stable_number(asin, 'price', 1500, 6000) / 100
+    return {
+        'asin': asin,
+        'url': f"https://www.amazon.{domain}/gp/offer-listing/{asin}",
+        'pricing': [
+            {'price': price, 'currency': 'USD', 'seller': 'Mock Seller', 'condition': 'New', 'delivery': 'FREE delivery', 'is_prime': False},
+            {'price': round(price * 0.95, 2), 'currency': 'USD', 'seller': 'Amazon', 'condition': 'New', 'delivery': 'FREE Prime delivery', 'is_prime': True},
+        ],
+    }
+
+
+def build_scraperapi_structured(asin, tld='com'):
+    """Ответ структурированного API ScraperAPI для Amazon product."""
+    price = stable_number(asin, 'price', 1500, 6000) / 100
+    return {
+        'name': f"Mock Product {asin}",
+        'brand': 'Mock Brand',
+        'pricing': f"${price:.2f}",
+        'list_price': f"${price * 1.2:.2f}",
+        'average_rating': stable_number(asin, 'rating', 35, 50) / 10,
+        'total_reviews': stable_number(asin, 'reviews', 10, 5000),
+        'coupon_text': f"Save {stable_number(asin, 'coupon', 0, 20)}% with coupon",
+        'availability_status': 'In Stock',
+        'product_information': {
+            'ASIN': asin,
+            'Best Sellers Rank': [f"#{stable_number(asin, 'bsr', 100, 90000):,} in Sports & Outdoors (See Top 100)"],
+        },
+        'product_url': f"https://www.amazon.{tld}/dp/{asin}",
+        'full_description': 'Lorem ipsum dolor sit amet. ' * 200,
+    }
+
+
+def build_scraperapi_html(asin, tld='com'):
+    """HTML страницы продукта, которую возвращает ScraperAPI в режиме render=false."""
+    price = stable_number(asin, 'price', 1500, 6000) / 100
+    price_text = f"${price:.2f}" if tld == 'com' else f"{price:.2f} €".replace('.', ',')
+    rating = stable_number(asin, 'rating', 35, 50) / 10
+    return f"""<html><head><title>Amazon.com: Mock Product {asin}</title></head><body>
+<span id="productTitle">Mock Product {asin}</span>
+<a id="bylineInfo">Mock Brand</a>
+<span data-hook="rating-out-of-5">{rating} out of 5</span>
+<span id="acrCustomerReviewText">{stable_number(asin, 'reviews', 10, 5000)} ratings</span>
+<span id="priceblock_ourprice">{price_text}</span>
+<span id="couponBadgeRegular">{stable_number(asin, 'coupon', 0, 20)}% coupon</span>
+<table id="productDetails_detailBullets_sections1"><tr><th>Amazon Bestseller-Rang</th><td>Nr. {stable_number(asin, 'bsr', 100, 90000)} in Sport &amp; Freizeit (Siehe Top 100 in Sport &amp; Freizeit)</td></tr></table>
+{'<div>' + 'Lorem ipsum dolor sit amet. ' * 400 + '</div>'}
+</body></html>"""
+
+
+def build_scrapingdog_product(asin, domain='com'):
+    """Ответ ScrapingDog Amazon product: цены и рейтинг строками в формате маркетплейса."""
+    price = stable_number(asin, 'price', 1500, 6000) / 100
+    bsr = stable_number(asin, 'bsr', 100, 90000)
+    if domain == 'com':
+        price_text, previous_price_text = f"${price:.2f}", f"${price * 1.2:.2f}"
+        bsr_key, bsr_text = 'Best Sellers Rank', f"#{bsr:,} in Sports & Outdoors (See Top 100 in Sports & Outdoors)"
+    else:
+        price_text = f"{price:.2f} €".replace('.', ',')
+        previous_price_text = f"{price * 1.2:.2f} €".replace('.', ',')
+        bsr_key, bsr_text = 'Amazon Bestseller-Rang', f"Nr. {bsr:,} in Sport & Freizeit".replace(',', '.')
+    return {
+        'title': f"Mock Product {asin}",
+        'brand': 'Mock Brand',
+        'price': price_text,
+        'previous_price': previous_price_text,
+        'coupon_text': f"Save {stable_number(asin, 'coupon', 0, 20)}% with coupon",
+        'is_prime_exclusive': False,
+        'prime_exclusive_message': '',
+        'average_rating': stable_number(asin, 'rating', 35, 50) / 10,
+        'total_reviews': f"{stable_number(asin, 'reviews', 10, 5000):,} ratings",
+        'availability_status': 'In Stock',
+        'product_information': {'ASIN': asin, bsr_key: bsr_text},
+        'url': f"https://www.amazon.{domain}/dp/{asin}",
+        'full_description': 'Lorem ipsum dolor sit amet. ' * 200,
+    }
+
+
+def build_captcha_html():
+    """Страница проверки на робота, которую Amazon отдает вместо карточки товара."""
+    return """<html><head><title dir="ltr">Robot Check</title></head><body>
+<form method="get" action="/errors/validateCaptcha"><h4>Type the characters you see in this image:</h4>
+<img src="https://images-na.ssl-images-amazon.com/captcha/mock/Captcha_mock.jpg"></form>
+<p>For information about migrating to our APIs refer to api-services-support@amazon.com</p>
+""" + '<!-- padding -->' * 200 + "</body></html>"
+
+
+def build_oxylabs_content(payload):
+    """Разобранный ответ Oxylabs для запроса realtime или одного задания push-pull. None – неизвестный источник."""
+    source = payload.get('source')
+    domain = payload.get('domain', 'com')
+    if source == 'amazon':
+        url = payload.get('url', '')
+        asin = url.rstrip('/').split('/dp/')[-1].split('/')[0][:10] if '/dp/' in url else 'B000000000'
+        return build_oxylabs_product(asin, url.split('amazon.', 1)[-1].split('/')[0] if 'amazon.' in url else domain)
+    if source == 'amazon_product':
+        return build_oxylabs_product(payload.get('query', ''), domain)
+    if source == 'amazon_pricing':
+        return build_oxylabs_pricing(payload.get('query', ''), domain)
+    return None
+
+
+def parse_latency(spec):
+    """
+    Разбирает описание распределения задержки (в миллисекундах) и возвращает функцию,
+    которая выдает задержку в секундах. Пустое описание - без задержки (None).
+    """
+    if not spec:
+        return None
+    kind, _, rest = spec.partition(':')
+    values = [float(value) for value in rest.split(':')] if rest else []
+    if kind == 'fixed' and len(values) == 1:
+        return lambda: values[0] / 1000
+    if kind == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == 'exp' and len(values) == 1:
+        return lambda: random.expovariate(1000 / values[0])
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda: random.lognormvariate(0, values[1]) * values[0] / 1000
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+class TokenBucket:
+    """Лимит запросов в секунду с запасом на одну секунду; сверх лимита провайдер отвечает 429."""
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class FixtureStore:
+    """
+    Ответы провайдеров из корпуса fixtures/ (см. benchmark_parsers.py). Для запрошенного ASIN
+    фикстура выбирается детерминированно среди фикстур маркетплейса, ASIN фикстуры в ответе
+    заменяется запрошенным. Фикстуры снятых товаров (B0DEAD) не используются.
+    """
+    def __init__(self, folder):
+        self.payloads = {}
+        for provider in ('scraperapi', 'scrapingdog', 'oxylabs'):
+            provider_folder = os.path.join(folder, provider)
+            if not os.path.isdir(provider_folder):
+                continue
+            for file_name in sorted(os.listdir(provider_folder)):
+                marketplace, asin = os.path.splitext(file_name)[0].split('_', 1)
+                if is_dead_asin(asin):
+                    continue
+                with open(os.path.join(provider_folder, file_name), encoding='utf-8') as f:
+                    entry = (asin, f.read())
+                by_marketplace = self.payloads.setdefault(provider, {})
+                # ScrapingDog передает только последнюю часть домена (uk для co.uk)
+                for key in {marketplace, marketplace.rsplit('.', 1)[-1]}:
+                    by_marketplace.setdefault(key, []).append(entry)
+                by_marketplace.setdefault('*', []).append(entry)
+
+    def get(self, provider, marketplace, asin):
+        """Текст ответа для ASIN или None, если фикстур провайдера нет."""
+        by_marketplace = self.payloads.get(provider)
+        if not by_marketplace:
+            return None
+        entries = by_marketplace.get(marketplace) or by_marketplace['*']
+        fixture_asin, text = entries[stable_number(asin, 'fixture', 0, len(entries) - 1)]
+        return text.replace(fixture_asin, asin)
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов, имитирующий API провайдеров."""
+
+    # Задания push-pull API: id -> {'payload', 'ready_at', 'faulted'}
+    jobs = {}
+    jobs_lock = threading.Lock()
+    job_delay = 1.0
+    fault_rate = 0.0
+    captcha_rate = 0.0
+    # Нагрузочное тестирование: задержка, доли ошибок, лимиты по провайдерам, фикстуры
+    latency = None
+    error_429_rate = 0.0
+    error_5xx_rate = 0.0
+    rate_limit = 0.0
+    rate_limiters = {}
+    fixtures = None
+    # Число ответов: 'провайдер статус' -> количество
+    stats = {}
+    stats_lock = threading.Lock()
+    provider = 'other'
+
+    def send_body(self, status, payload, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        key = f"{self.provider} {status}"
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+        logging.info(f"{self.command} {self.path[:80]} -> {status}, {len(payload)} байт")
+
+    def send_json(self, status, body):
+        self.send_body(status, json.dumps(body).encode('utf-8'), 'application/json')
+
+    def inject_fault(self, provider):
+        """
+        Имитирует задержку, лимит и ошибки провайдера для запроса данных товара.
+        Возвращает True, если ответ с ошибкой уже отправлен.
+        """
+        self.provider = provider
+        if self.rate_limit:
+            with self.stats_lock:
+                limiter = self.rate_limiters.setdefault(provider, TokenBucket(self.rate_limit))
+            if not limiter.try_acquire():
+                self.send_json(429, {'error': 'Too many requests'})
+                return True
+        if self.latency:
+            time.sleep(self.latency())
+        roll = random.random()
+        if roll < self.error_429_rate:
+            self.send_json(429, {'error': 'Too many requests'})
+            return True
+        if roll < self.error_429_rate + self.error_5xx_rate:
+            self.send_json(random.choice((500, 502, 503)), {'error': 'Internal server error'})
+            return True
+        return False
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return None
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        self.provider = 'other'
+        if path == '/v1/queries':
+            return self.handle_oxylabs_realtime()
+        if path == '/v1/queries/batch':
+            return self.handle_oxylabs_batch()
+        if path == '/v1/queries/batch/status':
+            return self.handle_oxylabs_batch_status()
+        if path == '/structured/amazon/product':
+            return self.handle_scraperapi_async()
+        self.send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        self.provider = 'other'
+        if parsed.path == '/__stats':
+            with self.stats_lock:
+                return self.send_json(200, dict(sorted(self.stats.items())))
+        if parsed.path.rstrip('/') == '/amazon/product':
+            return self.handle_scrapingdog_product(parse_qs(parsed.query))
+        if parsed.path.rstrip('/') == '/structured/amazon/product':
+            return self.handle_scraperapi_structured(parse_qs(parsed.query))
+        if parsed.path in ('', '/'):
+            return self.handle_scraperapi_html(parse_qs(parsed.query))
+        if parsed.path.startswith('/jobs/'):
+            return self.handle_scraperapi_job(parsed.path.rsplit('/', 1)[-1])
+        parts = self.path.strip('/').split('/')
+        if parts[:2] == ['v1', 'queries'] and len(parts) in (3, 4):
+            return self.handle_oxylabs_job(parts[2], with_results=len(parts) == 4 and parts[3] == 'results')
+        self.send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def handle_oxylabs_realtime(self):
+        """Имитация realtime API Oxylabs: источники amazon, amazon_product и amazon_pricing."""
+        payload = self.read_json()
+        if payload is None:
+            return self.send_json(400, {'error': 'Invalid JSON'})
+        if self.inject_fault('oxylabs'):
+            return
+
+        if self.fixtures and payload.get('source') == 'amazon' and '/dp/' in payload.get('url', ''):
+            url = payload['url']
+            asin = url.rstrip('/').split('/dp/')[-1].split('/')[0][:10]
+            text = self.fixtures.get('oxylabs', url.split('amazon.', 1)[-1].split('/')[0], asin)
+            if text is not None and not is_dead_asin(asin):
+                return self.send_body(200, text.encode('utf-8'), 'application/json')
+
+        content = build_oxylabs_content(payload)
+        if content is None:
+            return self.send_json(400, {'error': f"Unsupported source {payload.get('source')}"})
+        if is_dead_asin(content.get('asin')):
+            return self.send_json(200, {'results': [{'content': {}, 'status_code': 404}]})
+
+        self.send_json(200, {'results': [{'content': content, 'status_code': 200}]})
+
+    def handle_oxylabs_batch(self):
+        """Имитация пакетной отправки: по заданию на каждый URL или query, готовность через случайную задержку."""
+        payload = self.read_json()
+        if payload is None:
+            return self.send_json(400, {'error': 'Invalid JSON'})
+
+        key = 'url' if 'url' in payload else 'query'
+        values = payload.get(key) or []
+        if not isinstance(values, list):
+            values = [values]
+
+        queries = []
+        now = time.time()
+        with self.jobs_lock:
+            for value in values:
+                job_payload = dict(payload, **{key: value})
+                if build_oxylabs_content(job_payload) is None:
+                    return self.send_json(400, {'error': f"Unsupported source {payload.get('source')}"})
+                job_id = uuid.uuid4().hex
+                self.jobs[job_id] = {
+                    'payload': job_payload,
+                    'ready_at': now + random.uniform(0, 2 * self.job_delay),
+                    'faulted': random.random() < self.fault_rate,
+                }
+                queries.append({'id': job_id, 'status': 'pending', key: value, 'source': payload.get('source')})
+        self.send_json(202, {'queries': queries})
+
+    @staticmethod
+    def oxylabs_job_status(job):
+        if time.time() < job['ready_at']:
+            return 'pending'
+        return 'faulted' if job['faulted'] else 'done'
+
+    def handle_oxylabs_batch_status(self):
+        """Статусы заданий пакета одним ответом: {'ids': [...]} -> {'queries': [{'id', 'status'}]}."""
+        payload = self.read_json()
+        if payload is None or not isinstance(payload.get('ids'), list):
+            return self.send_json(400, {'error': 'Expected {"ids": [...]}'})
+        with self.jobs_lock:
+            queries = [
+                {'id': job_id, 'status': self.oxylabs_job_status(self.jobs[job_id])}
+                for job_id in payload['ids'] if 'payload' in self.jobs.get(job_id, {})
+            ]
+        self.send_json(200, {'queries': queries})
+
+    def handle_oxylabs_job(self, job_id, with_results=False):
+        """Статус задания push-pull или его результат."""
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+        if job is None or 'payload' not in job:
+            return self.send_json(404, {'error': f"Job {job_id} not found"})
+
+        status = self.oxylabs_job_status(job)
+
+        if not with_results:
+            return self.send_json(200, {'id': job_id, 'status': status})
+        if status != 'done':
+            return self.send_json(404 if status == 'faulted' else 204, {'id': job_id, 'status': status})
+
+        with self.jobs_lock:
+            self.jobs.pop(job_id, None)
+        content = build_oxylabs_content(job['payload'])
+        self.send_json(200, {'results': [{'content': content, 'status_code': 200, 'job_id': job_id}]})
+
+    def send_html(self, status, html):
+        self.send_body(status, html.encode('utf-8'), 'text/html; charset=utf-8')
+
+    def handle_scraperapi_html(self, query):
+        """Имитация основного API ScraperAPI: HTML страницы продукта."""
+        url = query.get('url', [''])[0]
+        if '/dp/' not in url:
+            return self.send_json(400, {'error': 'url parameter is required'})
+        if self.inject_fault('scraperapi'):
+            return
+        asin = url.split('/dp/')[-1].split('/')[0][:10]
+        if is_dead_asin(asin):
+            return self.send_html(404, '<html><head><title>Page Not Found</title></head><body>Dogs of Amazon</body></html>')
+        if random.random() < self.captcha_rate:
+            return self.send_html(200, build_captcha_html())
+        tld = url.split('amazon.', 1)[-1].split('/')[0] if 'amazon.' in url else 'com'
+        html = self.fixtures.get('scraperapi', tld, asin) if self.fixtures else None
+        self.send_html(200, html or build_scraperapi_html(asin, tld))
+
+    def handle_scraperapi_structured(self, query):
+        """Имитация синхронного структурированного API ScraperAPI."""
+        asin = query.get('asin', [''])[0]
+        if not asin:
+            return self.send_json(400, {'error': 'asin parameter is required'})
+        if self.inject_fault('scraperapi'):
+            return
+        if is_dead_asin(asin):
+            return self.send_json(404, {'error': f"Product {asin} not found"})
+        self.send_json(200, build_scraperapi_structured(asin, query.get('tld', ['com'])[0]))
+
+    def handle_scrapingdog_product(self, query):
+        """Имитация ScrapingDog Amazon product API."""
+        asin = query.get('asin', [''])[0]
+        if not asin or not query.get('api_key', [''])[0]:
+            return self.send_json(400, {'error': 'api_key and asin parameters are required'})
+        if self.inject_fault('scrapingdog'):
+            return
+        if is_dead_asin(asin):
+            return self.send_json(404, {'error': f"Product {asin} not found"})
+        domain = query.get('domain', ['com'])[0]
+        text = self.fixtures.get('scrapingdog', domain, asin) if self.fixtures else None
+        if text is not None:
+            return self.send_body(200, text.encode('utf-8'), 'application/json')
+        self.send_json(200, build_scrapingdog_product(asin, domain))
+
+    def handle_scraperapi_async(self):
+        """Имитация асинхронного структурированного API ScraperAPI: задание на каждый ASIN."""
+        payload = self.read_json()
+        if payload is None:
+            return self.send_json(400, {'error': 'Invalid JSON'})
+
+        asins = payload.get('asins') or ([payload['asin']] if payload.get('asin') else [])
+        host = self.headers.get('Host', f"127.0.0.1:{self.server.server_address[1]}")
+        now = time.time()
+        jobs = []
+        with self.jobs_lock:
+            for asin in asins:
+                job_id = uuid.uuid4().hex
+                self.jobs[job_id] = {
+                    'scraperapi': {'asin': asin, 'tld': payload.get('tld', 'com')},
+                    'ready_at': now + random.uniform(0, 2 * self.job_delay),
+                    'faulted': random.random() < self.fault_rate,
+                }
+                jobs.append({'id': job_id, 'status': 'running', 'asin': asin, 'statusUrl': f"http://{host}/jobs/{job_id}"})
+        self.send_json(200, jobs)
+
+    def handle_scraperapi_job(self, job_id):
+        """Статус асинхронного задания ScraperAPI; готовое задание содержит тело ответа."""
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+        if job is None or 'scraperapi' not in job:
+            return self.send_json(404, {'error': f"Job {job_id} not found"})
+
+        if time.time() < job['ready_at']:
+            return self.send_json(200, {'id': job_id, 'status': 'running'})
+        if job['faulted']:
+            return self.send_json(200, {'id': job_id, 'status': 'failed'})
+
+        with self.jobs_lock:
+            self.jobs.pop(job_id, None)
+        body = build_scraperapi_structured(job['scraperapi']['asin'], job['scraperapi']['tld'])
+        self.send_json(200, {'id': job_id, 'status': 'finished', 'response': {'statusCode': 200, 'body': json.dumps(body)}})
+
+    def log_message(self, format, *args):
+        # Стандартный вывод http.server заменен логированием в send_json
+        pass
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    # Очередь входящих соединений по умолчанию (5) мала для нагрузочного теста
+    request_queue_size = 1024
+
+
+def run_server(host='127.0.0.1', port=8765, job_delay=1.0, fault_rate=0.0, captcha_rate=0.0,
+               latency=None, error_429_rate=0.0, error_5xx_rate=0.0, rate_limit=0.0, fixtures_dir=None):
+    """Запускает сервер-заглушку и обслуживает запросы до остановки."""
+    MockProviderHandler.job_delay = job_delay
+    MockProviderHandler.fault_rate = fault_rate
+    MockProviderHandler.captcha_rate = captcha_rate
+    sampler = parse_latency(latency)
+    # staticmethod: иначе функция, сохраненная в атрибуте класса, вызывается как метод обработчика
+    MockProviderHandler.latency = staticmethod(sampler) if sampler else None
+    MockProviderHandler.error_429_rate = error_429_rate
+    MockProviderHandler.error_5xx_rate = error_5xx_rate
+    MockProviderHandler.rate_limit = rate_limit
+    MockProviderHandler.fixtures = FixtureStore(fixtures_dir) if fixtures_dir else None
+    server = MockProviderServer((host, port), MockProviderHandler)
+    logging.info(f"Сервер-заглушка провайдеров запущен на http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Сервер-заглушка остановлен.")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальный сервер-заглушка API провайдеров скрапинга.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--job-delay', type=float, default=1.0, help='Средняя задержка готовности задания push-pull, сек.')
+    parser.add_argument('--fault-rate', type=float, default=0.0, help='Доля заданий push-pull, завершающихся ошибкой.')
+    parser.add_argument('--captcha-rate', type=float, default=0.0, help='Доля HTML-ответов ScraperAPI со страницей проверки на робота.')
+    parser.add_argument('--latency', help='Распределение задержки ответа, мс: fixed:MS, uniform:MIN:MAX, exp:MEAN, lognormal:MEDIAN:SIGMA.')
+    parser.add_argument('--error-429', type=float, default=0.0, help='Доля ответов 429.')
+    parser.add_argument('--error-5xx', type=float, default=0.0, help='Доля ответов 500/502/503.')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Лимит запросов в секунду на провайдера (0 - без лимита).')
+    parser.add_argument('--fixtures', help='Папка корпуса ответов (fixtures); без нее ответы синтетические.')
+    parser.add_argument('--quiet', action='store_true', help='Не логировать каждый запрос.')
+    args = parser.parse_args()
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+    parse_latency(args.latency)
+    run_server(
+        args.host, args.port, args.job_delay, args.fault_rate, args.captcha_rate,
+        args.latency, args.error_429, args.error_5xx, args.rate_limit, args.fixtures,
+    )
@@ -0,0 +1,497 @@
+"""
+Локальный сервер-заглушка Google Sheets API v4.
+
+Позволяет проверить чтение конфига и запись листов мониторинга без доступа к настоящей
+таблице: данные хранятся в памяти, каждый запрос учитывается по методу API.
+
+Поддерживаются методы, которые использует gspread:
+- GET /v4/spreadsheets/<id> - метаданные и список листов (поиск листа по имени);
+- GET /v4/spreadsheets/<id>/values/<range>, GET .../values:batchGet;
+- PUT /v4/spreadsheets/<id>/values/<range>, POST .../values:batchUpdate;
+- POST .../values/<range>:append, .../values/<range>:clear, .../values:batchClear;
+- POST /v4/spreadsheets/<id>:batchUpdate - addSheet, deleteSheet, updateSheetProperties;
+  запросы форматирования (repeatCell и другие) только учитываются.
+
+Имитация ограничений Google:
+- --read-quota, --write-quota - число запросов чтения и записи за --quota-window секунд
+  (по умолчанию 60 в минуту, как пользовательская квота); сверх квоты - 429 RESOURCE_EXHAUSTED;
+- --latency - распределение задержки ответа, как у mock_provider_server.py.
+GET /__stats - число запросов по методам, POST /__reset - обнуление счетчиков.
+
+Клиент gspread, направленный на заглушку, возвращает connect(base_url).
+
+Запуск: python mock_sheets_server.py --port 8766 --seed sheets.json
+Файл --seed: {"<id таблицы>": {"<имя листа>": [[строка], ...]}}.
+"""
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from mock_provider_server import parse_latency
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SHEETS_API_URL = 'https://sheets.googleapis.com'
+DEFAULT_ROW_COUNT = 1000
+DEFAULT_COLUMN_COUNT = 26
+
+A1_CELL = re.compile(r'^([A-Za-z]*)(\d*)$')
+
+
+def column_index(letters):
+    """Номер колонки (с 1) по буквам: A -> 1, AA -> 27."""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index
+
+
+def split_range(range_name):
+    """Разделяет "'Лист'!A1:B2" на имя листа и диапазон; кавычки в имени удваиваются."""
+    if '!' not in range_name:
+        return range_name.strip("'").replace("''", "'"), ''
+    title, _, cells = range_name.rpartition('!')
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title, cells
+
+
+def parse_cells(cells):
+    """
+    Границы диапазона A1 (номера строк и колонок с 1): (строка1, колонка1, строка2, колонка2).
+    Открытые границы (A:A, 3:5, пустой диапазон) - None.
+    """
+    if not cells:
+        return 1, 1, None, None
+    start, _, end = cells.partition(':')
+    start_match, end_match = A1_CELL.match(start), A1_CELL.match(end or start)
+    if not start_match or not end_match:
+        raise ValueError(f"Некорректный диапазон: {cells}")
+    row1 = int(start_match.group(2)) if start_match.group(2) else 1
+    col1 = column_index(start_match.group(1)) if start_match.group(1) else 1
+    row2 = int(end_match.group(2)) if end_match.group(2) else None
+    col2 = column_index(end_match.group(1)) if end_match.group(1) else None
+    return row1, col1, row2, col2
+
+
+class SheetsApiError(Exception):
+    """Ошибка в формате Google API: код, статус и сообщение."""
+    def __init__(self, code, status, message):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+    def body(self):
+        return {'error': {'code': self.code, 'message': str(self), 'status': self.status}}
+
+
+class FakeSpreadsheets:
+    """Таблицы в памяти: id -> {имя листа: {'properties': ..., 'cells': {(строка, колонка): значение}}}."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spreadsheets = {}
+        self.next_sheet_id = 1
+
+    def add_sheet(self, spreadsheet_id, title, rows=None, row_count=DEFAULT_ROW_COUNT, column_count=DEFAULT_COLUMN_COUNT):
+        """Создает лист (при необходимости и таблицу) и записывает в него rows начиная с A1."""
+        with self.lock:
+            sheets = self.spreadsheets.setdefault(spreadsheet_id, {})
+            properties = {
+                'sheetId': self.next_sheet_id,
+                'title': title,
+                'index': len(sheets),
+                'sheetType': 'GRID',
+                'gridProperties': {'rowCount': row_count, 'columnCount': column_count},
+            }
+            self.next_sheet_id += 1
+            sheets[title] = {'properties': properties, 'cells': {}}
+            for row_number, row in enumerate(rows or [], 1):
+                for column_number, value in enumerate(row, 1):
+                    if value not in (None, ''):
+                        sheets[title]['cells'][(row_number, column_number)] = value
+            return properties
+
+    def get_spreadsheet(self, spreadsheet_id):
+        sheets = self.spreadsheets.get(spreadsheet_id)
+        if sheets is None:
+            raise SheetsApiError(404, 'NOT_FOUND', 'Requested entity was not found.')
+        return sheets
+
+    def get_sheet(self, spreadsheet_id, range_name):
+        title, cells = split_range(range_name)
+        sheet = self.get_spreadsheet(spreadsheet_id).get(title)
+        if sheet is None:
+            raise SheetsApiError(400, 'INVALID_ARGUMENT', f"Unable to parse range: {range_name}")
+        return sheet, cells
+
+    def metadata(self, spreadsheet_id):
+        with self.lock:
+            sheets = self.get_spreadsheet(spreadsheet_id)
+            return {
+                'spreadsheetId': spreadsheet_id,
+                'properties': {'title': f"Mock {spreadsheet_id}", 'locale': 'en_US', 'timeZone': 'Europe/Kiev'},
+                'sheets': [
+                    {'properties': json.loads(json.dumps(sheet['properties']))}
+                    for sheet in sorted(sheets.values(), key=lambda item: item['properties']['index'])
+                ],
+            }
+
+    def read(self, spreadsheet_id, range_name, formatted=True):
+        """Значения диапазона без пустых строк и колонок в конце, как отдает Google."""
+        with self.lock:
+            sheet, cells = self.get_sheet(spreadsheet_id, range_name)
+            row1, col1, row2, col2 = parse_cells(cells)
+            used = sheet['cells']
+            row2 = row2 or max((row for row, _ in used), default=0)
+            col2 = col2 or max((column for _, column in used), default=0)
+            values = []
+            for row in range(row1, row2 + 1):
+                line = [used.get((row, column), '') for column in range(col1, col2 + 1)]
+                while line and line[-1] == '':
+                    line.pop()
+                values.append([str(value) if formatted else value for value in line])
+            while values and not values[-1]:
+                values.pop()
+        result = {'range': range_name, 'majorDimension': 'ROWS'}
+        if values:
+            result['values'] = values
+        return result
+
+    def write(self, spreadsheet_id, range_name, values):
+        """Записывает строки values начиная с левого верхнего угла диапазона. Возвращает число ячеек."""
+        with self.lock:
+            sheet, cells = self.get_sheet(spreadsheet_id, range_name)
+            row1, col1, _, _ = parse_cells(cells)
+            grid = sheet['properties']['gridProperties']
+            last_row = row1 + len(values) - 1
+            last_column = col1 + max((len(row) for row in values), default=1) - 1
+            if last_row > grid['rowCount'] or last_column > grid['columnCount']:
+                raise SheetsApiError(
+                    400, 'INVALID_ARGUMENT',
+                    f"Range ({range_name}) exceeds grid limits. Max rows: {grid['rowCount']}, max columns: {grid['columnCount']}"
+                )
+            updated = 0
+            for row_offset, row in enumerate(values):
+                for column_offset, value in enumerate(row):
+                    key = (row1 + row_offset, col1 + column_offset)
+                    if value in (None, ''):
+                        sheet['cells'].pop(key, None)
+                    else:
+                        sheet['cells'][key] = value
+                    updated += 1
+            return updated
+
+    def append(self, spreadsheet_id, range_name, values):
+        """Дописывает строки после последней заполненной строки листа."""
+        with self.lock:
+            sheet, _ = self.get_sheet(spreadsheet_id, range_name)
+            last_row = max((row for row, _ in sheet['cells']), default=0)
+            title = sheet['properties']['title']
+        return self.write(spreadsheet_id, f"'{title}'!A{last_row + 1}", values)
+
+    def clear(self, spreadsheet_id, range_name):
+        with self.lock:
+            sheet, cells = self.get_sheet(spreadsheet_id, range_name)
+            row1, col1, row2, col2 = parse_cells(cells)
+            for row, column in list(sheet['cells']):
+                if row >= row1 and column >= col1 and (row2 is None or row <= row2) and (col2 is None or column <= col2):
+                    del sheet['cells'][(row, column)]
+
+    def apply_request(self, spreadsheet_id, request):
+        """Выполняет один запрос spreadsheets.batchUpdate; форматирование не хранится."""
+        if 'addSheet' in request:
+            properties = request['addSheet'].get('properties', {})
+            grid = properties.get('gridProperties', {})
+            with self.lock:
+                if properties.get('title') in self.get_spreadsheet(spreadsheet_id):
+                    raise SheetsApiError(400, 'INVALID_ARGUMENT', f"A sheet with the name \"{properties['title']}\" already exists.")
+            added = self.add_sheet(
+                spreadsheet_id, properties.get('title', f"Sheet{self.next_sheet_id}"),
+                row_count=grid.get('rowCount', DEFAULT_ROW_COUNT), column_count=grid.get('columnCount', DEFAULT_COLUMN_COUNT),
+            )
+            return {'addSheet': {'properties': added}}
+        if 'deleteSheet' in request:
+            with self.lock:
+                sheets = self.get_spreadsheet(spreadsheet_id)
+                for title, sheet in list(sheets.items()):
+                    if sheet['properties']['sheetId'] == request['deleteSheet'].get('sheetId'):
+                        del sheets[title]
+            return {}
+        if 'updateSheetProperties' in request:
+            update = request['updateSheetProperties'].get('properties', {})
+            with self.lock:
+                for sheet in self.get_spreadsheet(spreadsheet_id).values():
+                    if sheet['properties']['sheetId'] == update.get('sheetId'):
+                        sheet['properties']['gridProperties'].update(update.get('gridProperties', {}))
+                        if 'title' in update:
+                            sheet['properties']['title'] = update['title']
+            return {}
+        return {}
+
+
+class QuotaWindow:
+    """Квота запросов за скользящее окно; limit 0 - без ограничения."""
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        if not self.limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            while self.calls and self.calls[0] <= now - self.window:
+                self.calls.popleft()
+            if len(self.calls) >= self.limit:
+                return False
+            self.calls.append(now)
+            return True
+
+
+class MockSheetsHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов, имитирующий Google Sheets API v4."""
+
+    store = FakeSpreadsheets()
+    latency = None
+    read_quota = QuotaWindow(0, 60)
+    write_quota = QuotaWindow(0, 60)
+    # Число запросов: метод API -> количество (отклоненные по квоте учитываются отдельно)
+    stats = {}
+    stats_lock = threading.Lock()
+
+    def count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        logging.info(f"{self.command} {unquote(self.path)[:100]} -> {status}, {len(payload)} байт")
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return None
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == '/__stats':
+            with self.stats_lock:
+                return self.send_json(200, dict(sorted(self.stats.items())))
+        self.dispatch(parsed)
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        if parsed.path == '/__reset':
+            with self.stats_lock:
+                self.stats.clear()
+            return self.send_json(200, {})
+        self.dispatch(parsed)
+
+    def do_PUT(self):
+        self.dispatch(urlparse(self.path))
+
+    def route(self, path):
+        """Метод API и его аргументы по пути запроса: (метод, id таблицы, диапазон)."""
+        if not path.startswith('/v4/spreadsheets/'):
+            return None, None, None
+        rest = path[len('/v4/spreadsheets/'):]
+        spreadsheet_id, _, tail = rest.partition('/')
+        if not tail:
+            if spreadsheet_id.endswith(':batchUpdate'):
+                return 'spreadsheets.batchUpdate', spreadsheet_id[:-len(':batchUpdate')], None
+            return 'spreadsheets.get', spreadsheet_id, None
+        if tail == 'values:batchGet':
+            return 'values.batchGet', spreadsheet_id, None
+        if tail == 'values:batchUpdate':
+            return 'values.batchUpdate', spreadsheet_id, None
+        if tail == 'values:batchClear':
+            return 'values.batchClear', spreadsheet_id, None
+        if tail.startswith('values/'):
+            range_name = unquote(tail[len('values/'):])
+            for suffix, method in ((':append', 'values.append'), (':clear', 'values.clear')):
+                if range_name.endswith(suffix):
+                    return method, spreadsheet_id, range_name[:-len(suffix)]
+            return ('values.get' if self.command == 'GET' else 'values.update'), spreadsheet_id, range_name
+        return None, None, None
+
+    def dispatch(self, parsed):
+        method, spreadsheet_id, range_name = self.route(parsed.path)
+        if method is None:
+            return self.send_json(404, {'error': {'code': 404, 'message': f"Unknown path {parsed.path}", 'status': 'NOT_FOUND'}})
+
+        quota = self.read_quota if self.command == 'GET' else self.write_quota
+        if not quota.try_acquire():
+            self.count(f"{method} 429")
+            return self.send_json(429, SheetsApiError(
+                429, 'RESOURCE_EXHAUSTED',
+                f"Quota exceeded for quota metric '{'Read' if self.command == 'GET' else 'Write'} requests' "
+                f"and limit '{'Read' if self.command == 'GET' else 'Write'} requests per minute per user'"
+            ).body())
+        self.count(method)
+        if self.latency:
+            time.sleep(self.latency())
+
+        query = parse_qs(parsed.query)
+        try:
+            body = getattr(self, 'handle_' + method.replace('.', '_'))(spreadsheet_id, range_name, query)
+        except SheetsApiError as e:
+            return self.send_json(e.code, e.body())
+        except ValueError as e:
+            return self.send_json(400, SheetsApiError(400, 'INVALID_ARGUMENT', str(e)).body())
+        self.send_json(200, body)
+
+    def handle_spreadsheets_get(self, spreadsheet_id, range_name, query):
+        return self.store.metadata(spreadsheet_id)
+
+    def handle_values_get(self, spreadsheet_id, range_name, query):
+        formatted = query.get('valueRenderOption', ['FORMATTED_VALUE'])[0] == 'FORMATTED_VALUE'
+        return self.store.read(spreadsheet_id, range_name, formatted)
+
+    def handle_values_batchGet(self, spreadsheet_id, range_name, query):
+        formatted = query.get('valueRenderOption', ['FORMATTED_VALUE'])[0] == 'FORMATTED_VALUE'
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'valueRanges': [self.store.read(spreadsheet_id, name, formatted) for name in query.get('ranges', [])],
+        }
+
+    def handle_values_update(self, spreadsheet_id, range_name, query):
+        payload = self.read_json() or {}
+        cells = self.store.write(spreadsheet_id, range_name, payload.get('values', []))
+        self.count('cells_written', cells)
+        return {'spreadsheetId': spreadsheet_id, 'updatedRange': range_name, 'updatedCells': cells}
+
+    def handle_values_batchUpdate(self, spreadsheet_id, range_name, query):
+        payload = self.read_json()
+        if payload is None:
+            raise SheetsApiError(400, 'INVALID_ARGUMENT', 'Invalid JSON payload received.')
+        responses = []
+        for value_range in payload.get('data', []):
+            cells = self.store.write(spreadsheet_id, value_range['range'], value_range.get('values', []))
+            responses.append({'spreadsheetId': spreadsheet_id, 'updatedRange': value_range['range'], 'updatedCells': cells})
+        total = sum(response['updatedCells'] for response in responses)
+        self.count('cells_written', total)
+        self.count('ranges_written', len(responses))
+        return {'spreadsheetId': spreadsheet_id, 'totalUpdatedCells': total, 'responses': responses}
+
+    def handle_values_append(self, spreadsheet_id, range_name, query):
+        payload = self.read_json() or {}
+        cells = self.store.append(spreadsheet_id, range_name, payload.get('values', []))
+        self.count('cells_written', cells)
+        return {'spreadsheetId': spreadsheet_id, 'updates': {'updatedCells': cells}}
+
+    def handle_values_clear(self, spreadsheet_id, range_name, query):
+        self.store.clear(spreadsheet_id, range_name)
+        return {'spreadsheetId': spreadsheet_id, 'clearedRange': range_name}
+
+    def handle_values_batchClear(self, spreadsheet_id, range_name, query):
+        payload = self.read_json() or {}
+        for name in payload.get('ranges', []):
+            self.store.clear(spreadsheet_id, name)
+        return {'spreadsheetId': spreadsheet_id, 'clearedRanges': payload.get('ranges', [])}
+
+    def handle_spreadsheets_batchUpdate(self, spreadsheet_id, range_name, query):
+        payload = self.read_json()
+        if payload is None:
+            raise SheetsApiError(400, 'INVALID_ARGUMENT', 'Invalid JSON payload received.')
+        replies = []
+        for request in payload.get('requests', []):
+            for kind in request:
+                self.count(f"request.{kind}")
+            replies.append(self.store.apply_request(spreadsheet_id, request))
+        return {'spreadsheetId': spreadsheet_id, 'replies': replies}
+
+    def log_message(self, format, *args):
+        # Стандартный вывод http.server заменен логированием в send_json
+        pass
+
+
+def configure(latency=None, read_quota=0, write_quota=0, quota_window=60.0, store=None):
+    """Задает задержку, квоты и хранилище обработчика; счетчики запросов обнуляются."""
+    sampler = parse_latency(latency)
+    # staticmethod: иначе функция, сохраненная в атрибуте класса, вызывается как метод обработчика
+    MockSheetsHandler.latency = staticmethod(sampler) if sampler else None
+    MockSheetsHandler.read_quota = QuotaWindow(read_quota, quota_window)
+    MockSheetsHandler.write_quota = QuotaWindow(write_quota, quota_window)
+    MockSheetsHandler.store = store or FakeSpreadsheets()
+    with MockSheetsHandler.stats_lock:
+        MockSheetsHandler.stats.clear()
+    return MockSheetsHandler.store
+
+
+def start_server(host='127.0.0.1', port=0):
+    """Запускает сервер в фоновом потоке и возвращает (сервер, базовый адрес)."""
+    server = ThreadingHTTPServer((host, port), MockSheetsHandler)
+    threading.Thread(target=server.serve_forever, name='mock-sheets', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def connect(base_url):
+    """Клиент gspread, все запросы которого к Sheets API уходят на заглушку; учетные данные не нужны."""
+    import gspread
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class RedirectAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = base_url + request.url[len(SHEETS_API_URL):]
+            return super().send(request, **kwargs)
+
+    session = requests.Session()
+    session.mount(SHEETS_API_URL, RedirectAdapter())
+    return gspread.Client(auth=None, session=session)
+
+
+def load_seed(path, store):
+    """Заполняет хранилище из JSON {"<id таблицы>": {"<имя листа>": [[строка], ...]}}."""
+    with open(path, encoding='utf-8') as f:
+        seed = json.load(f)
+    for spreadsheet_id, sheets in seed.items():
+        for title, rows in sheets.items():
+            store.add_sheet(spreadsheet_id, title, rows, row_count=max(DEFAULT_ROW_COUNT, len(rows)))
+
+
+def run_server(host='127.0.0.1', port=8766, latency=None, read_quota=60, write_quota=60, quota_window=60.0, seed=None):
+    """Запускает сервер-заглушку и обслуживает запросы до остановки."""
+    store = configure(latency, read_quota, write_quota, quota_window)
+    if seed:
+        load_seed(seed, store)
+    server = ThreadingHTTPServer((host, port), MockSheetsHandler)
+    logging.info(f"Сервер-заглушка Google Sheets API запущен на http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Сервер-заглушка остановлен.")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальный сервер-заглушка Google Sheets API v4.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', help='Распределение задержки ответа, мс: fixed:MS, uniform:MIN:MAX, exp:MEAN, lognormal:MEDIAN:SIGMA.')
+    parser.add_argument('--read-quota', type=int, default=60, help='Запросов чтения за окно квоты (0 - без ограничения).')
+    parser.add_argument('--write-quota', type=int, default=60, help='Запросов записи за окно квоты (0 - без ограничения).')
+    parser.add_argument('--quota-window', type=float, default=60.0, help='Окно квоты, сек.')
+    parser.add_argument('--seed', help='JSON с начальными данными таблиц.')
+    parser.add_argument('--quiet', action='store_true', help='Не логировать каждый запрос.')
+    args = parser.parse_args()
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+    parse_latency(args.latency)
+    run_server(args.host, args.port, args.latency, args.read_quota, args.write_quota, args.quota_window, args.seed)
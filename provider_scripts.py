@@ -0,0 +1,24 @@
+"""
+Скрипты провайдеров для вспомогательных инструментов: бенчмарков, нагрузочного теста,
+симуляции, cli.py и raw_archive.py.
+
+Имена файлов скриптов содержат пробелы и скобки, поэтому скрипты загружаются по пути, а не импортом.
+"""
+import importlib.util
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = {
+    'scraperapi': 'Check Product Monitor(scraperapi).py',
+    'scrapingdog': 'Check Product Monitor(scrapingdog).py',
+    'oxylabs': 'Check-Insights-Manager(oxylabs).py',
+}
+
+
+def load_script(provider):
+    """Загружает скрипт провайдера как модуль. Каждый вызов возвращает новый экземпляр модуля."""
+    spec = importlib.util.spec_from_file_location(f"provider_{provider}", os.path.join(BASE_DIR, SCRIPTS[provider]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,431 @@
+"""
+Архив сырых ответов провайдеров (ключ raw_archive_dir в листе Config): класс ResponseArchive,
+которым пользуются скрипты сбора, и утилита просмотра архива и повторного разбора.
+
+После исправления парсера можно заново разобрать сохраненные ответы без повторных запросов к провайдерам.
+Каждый скрипт пишет в свою подпапку: <raw_archive_dir>/scraperapi, /scrapingdog, /oxylabs.
+
+Подкоманды:
+- stats - число записей, ключей и блобов, размер на диске и степень сжатия по каждой подпапке;
+- get - исходный ответ для (провайдер, маркетплейс, ASIN): последняя версия или действовавшая в момент --at;
+- reparse - разбор последних версий текущими парсерами скриптов, результат в JSON.
+
+Примеры:
+    python raw_archive.py /var/lib/monitor/raw stats
+    python raw_archive.py /var/lib/monitor/raw get scrapingdog de B0TESTASIN --at "2026-10-18 14:00" > response.json
+    python raw_archive.py /var/lib/monitor/raw reparse --provider scraperapi --asin B0TESTASIN
+"""
+import argparse
+import bisect
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from threading import Lock
+
+from provider_scripts import SCRIPTS, load_script
+
+
+DEFAULT_RAW_ARCHIVE_MAX_MB = 1024
+RAW_ARCHIVE_DICTIONARY_SAMPLES = 64  # Ответов провайдера для построения общего словаря сжатия
+RAW_ARCHIVE_DICTIONARY_SIZE = 32 * 1024  # zlib использует не больше 32 КиБ словаря
+RAW_ARCHIVE_SAMPLE_BYTES = 64 * 1024  # Сколько байт каждого ответа берется в выборку для словаря
+# Поля JSON, которые меняются при каждом запросе и не учитываются в хэше содержимого
+RAW_ARCHIVE_VOLATILE_KEYS = {'created_at', 'updated_at', 'job', 'job_id', 'request_id', 'parse_time', 'timestamp', 'session_info'}
+
+
+class ResponseArchive:
+    """
+    Архив сырых ответов провайдеров для повторного разбора после исправления парсера.
+
+    Запись индекса - (провайдер, маркетплейс, ASIN, время) и хэш содержимого. Новая запись и блоб
+    появляются только при изменении хэша для ключа; у JSON хэш считается без полей, которые меняются
+    при каждом запросе. Блобы сжимаются zstd (если установлен zstandard) или zlib со словарем, общим
+    для провайдера: словарь строится по первым ответам провайдера. Индекс index.jsonl дописывается
+    построчно и загружается в память при настройке; последняя версия по ключу находится за O(1).
+    В лимит raw_archive_max_mb входят блобы и индекс: при повторяющихся ответах блобы не растут,
+    а индекс растет. При превышении лимита удаляются самые старые версии, индекс переписывается.
+    Архив выключен, пока не задан raw_archive_dir.
+
+    Каждый скрипт пишет в свою подпапку raw_archive_dir/<scope>: индекс держит в памяти только
+    процесс-владелец, и при сокращении архива он переписывает индекс, не теряя чужих записей.
+    time_source - функция текущего времени (в скриптах - часы clock, которые подменяет симуляция).
+    """
+
+    def __init__(self, scope, time_source=time.time):
+        self.scope = scope
+        self.time_source = time_source
+        self.lock = Lock()
+        self.directory = None
+        self.max_bytes = DEFAULT_RAW_ARCHIVE_MAX_MB * 1024 * 1024
+        self._reset()
+
+    def _reset(self):
+        self.codec = None
+        self.entries = []  # Записи индекса в порядке добавления (по времени)
+        self.by_key = {}  # (провайдер, маркетплейс, ASIN) -> записи по времени
+        self.key_times = {}  # (провайдер, маркетплейс, ASIN) -> время записей из by_key, для двоичного поиска
+        self.blob_refs = {}  # хэш -> число записей
+        self.blobs = {}  # хэш -> {'codec', 'dictionary', 'size'} сжатого блоба
+        self.stored_bytes = 0  # Суммарный размер блобов
+        self.index_bytes = 0  # Размер index.jsonl
+        self.dictionaries = {}  # id словаря -> байты
+        self.provider_dictionary = {}  # провайдер -> id текущего словаря
+        self.samples = {}  # провайдер -> выборка ответов для словаря
+
+    def configure(self, config):
+        """Обновляет параметры из листа Config и при смене папки загружает ее индекс."""
+        root = config.get('raw_archive_dir', '').strip()
+        directory = os.path.join(root, self.scope) if root else None
+        with self.lock:
+            self.max_bytes = (config.get('raw_archive_max_mb') or DEFAULT_RAW_ARCHIVE_MAX_MB) * 1024 * 1024
+            if directory == self.directory:
+                return
+            self._reset()
+            self.directory = directory
+            if directory:
+                self.codec = 'zstd' if importlib.util.find_spec('zstandard') else 'zlib'
+                self._load()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _load(self):
+        """Загружает индекс и словари архива."""
+        try:
+            os.makedirs(self._path('blobs'), exist_ok=True)
+            os.makedirs(self._path('dictionaries'), exist_ok=True)
+            for file_name in os.listdir(self._path('dictionaries')):
+                dictionary_id = os.path.splitext(file_name)[0]
+                with open(self._path('dictionaries', file_name), 'rb') as f:
+                    self.dictionaries[dictionary_id] = f.read()
+                provider = dictionary_id.split('-')[0]
+                self.provider_dictionary[provider] = max(self.provider_dictionary.get(provider, dictionary_id), dictionary_id)
+            if os.path.exists(self._path('index.jsonl')):
+                with open(self._path('index.jsonl'), encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            self._add_entry(json.loads(line), len(line.encode('utf-8')))
+        except (OSError, ValueError) as e:
+            logging.error(f"Не удалось загрузить архив ответов '{self.directory}': {str(e)}. Архив выключен.")
+            self.directory = None
+            return
+        logging.info(
+            f"Архив ответов '{self.directory}': записей {len(self.entries)}, блобов {len(self.blobs)}, "
+            f"{self.total_bytes / 1024 / 1024:.1f} МиБ, сжатие {self.codec}."
+        )
+
+    @property
+    def total_bytes(self):
+        """Размер архива, который сравнивается с лимитом: блобы и индекс."""
+        return self.stored_bytes + self.index_bytes
+
+    @staticmethod
+    def _index_line(entry):
+        return json.dumps(entry, ensure_ascii=False) + '\n'
+
+    def _add_entry(self, entry, line_bytes):
+        self.entries.append(entry)
+        self.index_bytes += line_bytes
+        key = (entry['provider'], entry['marketplace'], entry['asin'])
+        self.by_key.setdefault(key, []).append(entry)
+        self.key_times.setdefault(key, []).append(entry['time'])
+        self.blob_refs[entry['hash']] = self.blob_refs.get(entry['hash'], 0) + 1
+        if entry['hash'] not in self.blobs:
+            self.blobs[entry['hash']] = {'codec': entry['codec'], 'dictionary': entry['dictionary'], 'size': entry['size']}
+            self.stored_bytes += entry['size']
+
+    @staticmethod
+    def content_hash(content, content_format):
+        """SHA-256 содержимого; JSON хэшируется в каноническом виде без изменчивых полей."""
+        if content_format == 'json':
+            def strip(value):
+                if isinstance(value, dict):
+                    return {key: strip(item) for key, item in value.items() if key not in RAW_ARCHIVE_VOLATILE_KEYS}
+                if isinstance(value, list):
+                    return [strip(item) for item in value]
+                return value
+            try:
+                content = json.dumps(strip(json.loads(content)), sort_keys=True, ensure_ascii=False).encode('utf-8')
+            except ValueError:
+                pass
+        # hashlib импортируется при первом сохранении: скриптам без архива он не нужен при запуске
+        hashlib = importlib.import_module('hashlib')
+        return hashlib.sha256(content).hexdigest()
+
+    def _build_dictionary(self, provider):
+        """Строит общий словарь провайдера по выборке ответов и сохраняет его в dictionaries/."""
+        samples = self.samples.pop(provider)
+        dictionary = None
+        if self.codec == 'zstd':
+            zstandard = importlib.import_module('zstandard')
+            try:
+                dictionary = zstandard.train_dictionary(RAW_ARCHIVE_DICTIONARY_SIZE, samples).as_bytes()
+            except zstandard.ZstdError as e:
+                logging.debug(f"Словарь zstd для {provider} не обучен ({str(e)}), используется выборка как есть.")
+        if dictionary is None:
+            # Словарь из содержимого: zlib и zstd ищут совпадения в его конце, туда ставятся последние ответы
+            dictionary = b''.join(samples)[-RAW_ARCHIVE_DICTIONARY_SIZE:]
+        dictionary_id = f"{provider}-{self.codec}-{len(self.dictionaries) + 1:04d}"
+        with open(self._path('dictionaries', f"{dictionary_id}.dict"), 'wb') as f:
+            f.write(dictionary)
+        self.dictionaries[dictionary_id] = dictionary
+        self.provider_dictionary[provider] = dictionary_id
+        logging.info(f"Архив ответов: построен словарь сжатия {dictionary_id} ({len(dictionary)} байт).")
+
+    def _compress(self, content, codec, dictionary_id):
+        dictionary = self.dictionaries.get(dictionary_id) if dictionary_id else None
+        if codec == 'zstd':
+            zstandard = importlib.import_module('zstandard')
+            zstd_dictionary = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            return zstandard.ZstdCompressor(level=10, dict_data=zstd_dictionary).compress(content)
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, **({'zdict': dictionary} if dictionary else {}))
+        return compressor.compress(content) + compressor.flush()
+
+    def _decompress(self, blob, codec, dictionary_id):
+        dictionary = self.dictionaries.get(dictionary_id) if dictionary_id else None
+        if codec == 'zstd':
+            zstandard = importlib.import_module('zstandard')
+            zstd_dictionary = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            return zstandard.ZstdDecompressor(dict_data=zstd_dictionary).decompress(blob)
+        decompressor = zlib.decompressobj(15, **({'zdict': dictionary} if dictionary else {}))
+        return decompressor.decompress(blob) + decompressor.flush()
+
+    def store(self, provider, marketplace, asin, content, content_format='json'):
+        """
+        Сохраняет ответ, если его содержимое изменилось с прошлой версии для ключа.
+        Возвращает запись индекса или None (архив выключен, дубликат или ошибка записи).
+        """
+        if not self.enabled or not content:
+            return None
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        content_hash = self.content_hash(content, content_format)
+        key = (provider, marketplace, asin)
+        with self.lock:
+            versions = self.by_key.get(key)
+            if versions and versions[-1]['hash'] == content_hash:
+                return None
+            try:
+                samples = self.samples.setdefault(provider, []) if provider not in self.provider_dictionary else None
+                if samples is not None:
+                    samples.append(content[:RAW_ARCHIVE_SAMPLE_BYTES])
+                    if len(samples) >= RAW_ARCHIVE_DICTIONARY_SAMPLES:
+                        self._build_dictionary(provider)
+
+                blob_info = self.blobs.get(content_hash)
+                if blob_info:
+                    # Такое же содержимое уже хранится (другой ключ или старая версия): блоб переиспользуется
+                    codec, dictionary_id, size = blob_info['codec'], blob_info['dictionary'], blob_info['size']
+                else:
+                    codec, dictionary_id = self.codec, self.provider_dictionary.get(provider)
+                    blob = self._compress(content, codec, dictionary_id)
+                    size = len(blob)
+                    blob_path = self._path('blobs', content_hash[:2], content_hash)
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    with open(blob_path, 'wb') as f:
+                        f.write(blob)
+
+                entry = {
+                    'provider': provider, 'marketplace': marketplace, 'asin': asin, 'time': round(self.time_source(), 3),
+                    'hash': content_hash, 'format': content_format, 'codec': codec, 'dictionary': dictionary_id,
+                    'size': size, 'raw_size': len(content),
+                }
+                line = self._index_line(entry)
+                with open(self._path('index.jsonl'), 'a', encoding='utf-8') as f:
+                    f.write(line)
+                self._add_entry(entry, len(line.encode('utf-8')))
+                if self.total_bytes > self.max_bytes:
+                    self._prune()
+                return entry
+            except OSError as e:
+                logging.error(f"Не удалось сохранить ответ {provider} для ASIN {asin} в архив: {str(e)}")
+                return None
+
+    def _prune(self):
+        """
+        Удаляет самые старые версии, пока архив (блобы и индекс) не уменьшится до 90% лимита. Сначала
+        удаляются устаревшие версии, последняя версия ключа - только если без нее лимит не соблюсти.
+        Индекс переписывается.
+        """
+        target = self.max_bytes * 0.9
+        removed = set()
+        for only_outdated in (True, False):
+            for entry in self.entries:
+                if self.total_bytes <= target:
+                    break
+                key = (entry['provider'], entry['marketplace'], entry['asin'])
+                versions = self.by_key[key]
+                if id(entry) in removed or (only_outdated and versions[-1] is entry):
+                    continue
+                removed.add(id(entry))
+                # Версии ключа удаляются от старых к новым: удаляемая запись почти всегда первая
+                index = next(i for i, version in enumerate(versions) if version is entry)
+                del versions[index]
+                del self.key_times[key][index]
+                self.index_bytes -= len(self._index_line(entry).encode('utf-8'))
+                self.blob_refs[entry['hash']] -= 1
+                if not self.blob_refs[entry['hash']]:
+                    del self.blob_refs[entry['hash']]
+                    self.stored_bytes -= self.blobs.pop(entry['hash'])['size']
+                    try:
+                        os.remove(self._path('blobs', entry['hash'][:2], entry['hash']))
+                    except OSError as e:
+                        logging.warning(f"Не удалось удалить блоб архива {entry['hash']}: {str(e)}")
+
+        self.entries = [entry for entry in self.entries if id(entry) not in removed]
+        self.by_key = {key: versions for key, versions in self.by_key.items() if versions}
+        self.key_times = {key: times for key, times in self.key_times.items() if times}
+        temporary_path = self._path('index.jsonl.tmp')
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries:
+                f.write(self._index_line(entry))
+        os.replace(temporary_path, self._path('index.jsonl'))
+        logging.info(f"Архив ответов: удалено версий {len(removed)}, размер {self.total_bytes / 1024 / 1024:.1f} МиБ.")
+
+    def lookup(self, provider, marketplace, asin, at=None):
+        """Запись индекса: последняя версия или версия, действовавшая в момент at (timestamp)."""
+        with self.lock:
+            key = (provider, marketplace, asin)
+            versions = self.by_key.get(key)
+            if not versions:
+                return None
+            if at is None:
+                return versions[-1]
+            index = bisect.bisect_right(self.key_times[key], at)
+            return versions[index - 1] if index else None
+
+    def read(self, entry):
+        """Исходные байты ответа для записи индекса."""
+        with open(self._path('blobs', entry['hash'][:2], entry['hash']), 'rb') as f:
+            blob = f.read()
+        return self._decompress(blob, entry['codec'], entry['dictionary'])
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'keys': len(self.by_key),
+                'blobs': len(self.blobs),
+                'stored_bytes': self.stored_bytes,
+                'index_bytes': self.index_bytes,
+                'raw_bytes': sum(entry['raw_size'] for entry in self.entries),
+                'codec': self.codec,
+            }
+
+
+def parse_oxylabs(module, data, asin, url):
+    return module.extract_data_from_json(data, asin)
+
+
+def parse_oxylabs_price(module, data, asin, url):
+    return module.extract_price_data_from_json(data, asin)
+
+
+# Провайдер в архиве -> (скрипт, формат, функция разбора)
+PARSERS = {
+    'scraperapi': ('scraperapi', 'html', lambda module, html, asin, url: module.parse_scraperapi_html(html, asin, url)),
+    'scraperapi_structured': ('scraperapi', 'json', lambda module, data, asin, url: module.parse_scraperapi_structured(data, asin, url)),
+    'scrapingdog': ('scrapingdog', 'json', lambda module, data, asin, url: module.convert_scrapingdog_product(data, asin, url)),
+    'oxylabs': ('oxylabs', 'json', parse_oxylabs),
+    'oxylabs_amazon_pricing': ('oxylabs', 'json', parse_oxylabs_price),
+    'oxylabs_amazon_product': ('oxylabs', 'json', parse_oxylabs_price),
+}
+
+
+def open_archive(directory, scope):
+    """Архив скрипта scope в папке directory (без загрузки самого скрипта)."""
+    archive = ResponseArchive(scope)
+    archive.configure({'raw_archive_dir': directory})
+    if not archive.enabled:
+        raise SystemExit(f"Архив '{os.path.join(directory, scope)}' не загружен: нет доступа к папке или поврежден индекс.")
+    return archive
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Просмотр и повторный разбор архива сырых ответов провайдеров.')
+    parser.add_argument('directory', help='Папка архива (raw_archive_dir).')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Статистика архива.')
+    get_parser = subparsers.add_parser('get', help='Вывести исходный ответ в stdout.')
+    get_parser.add_argument('provider', choices=sorted(PARSERS))
+    get_parser.add_argument('marketplace', help="Маркетплейс, например 'de' или 'co.uk'.")
+    get_parser.add_argument('asin')
+    get_parser.add_argument('--at', help='Версия, действовавшая в момент "YYYY-MM-DD HH:MM" (локальное время).')
+    reparse_parser = subparsers.add_parser('reparse', help='Разобрать последние версии текущими парсерами.')
+    reparse_parser.add_argument('--provider', choices=sorted(PARSERS), action='append', help='Только указанный провайдер (можно повторять).')
+    reparse_parser.add_argument('--asin', action='append', help='Только указанный ASIN (можно повторять).')
+    args = parser.parse_args(argv)
+
+    directory = os.path.abspath(args.directory)
+    if not os.path.isdir(directory):
+        raise SystemExit(f"Папка архива '{directory}' не найдена.")
+    # Скрипты пишут scraper.log в рабочую папку: запускаем во временной
+    os.chdir(tempfile.mkdtemp(prefix='raw_archive_'))
+    # Логи парсеров скриптов идут в stdout и смешались бы с ответом или JSON-результатом
+    logging.disable(logging.CRITICAL)
+    modules = {}
+
+    def get_module(provider):
+        script = PARSERS[provider][0]
+        if script not in modules:
+            modules[script] = load_script(script)
+        return modules[script]
+
+    if args.command == 'stats':
+        report = {}
+        for scope in sorted(SCRIPTS):
+            if os.path.isdir(os.path.join(directory, scope)):
+                stats = open_archive(directory, scope).stats()
+                ratio = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else None
+                report[scope] = dict(stats, compression_ratio=round(ratio, 2) if ratio else None)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    if args.command == 'get':
+        archive = open_archive(directory, PARSERS[args.provider][0])
+        at = datetime.strptime(args.at, '%Y-%m-%d %H:%M').timestamp() if args.at else None
+        entry = archive.lookup(args.provider, args.marketplace, args.asin, at)
+        if entry is None:
+            print("Ответ не найден.", file=sys.stderr)
+            return 1
+        print(f"{entry['provider']} {entry['marketplace']} {entry['asin']}: "
+              f"{datetime.fromtimestamp(entry['time']):%Y-%m-%d %H:%M:%S}, {entry['hash'][:12]}", file=sys.stderr)
+        sys.stdout.buffer.write(archive.read(entry))
+        return 0
+
+    results = []
+    failures = 0
+    for provider in args.provider or sorted(PARSERS):
+        scope, content_format, parse = PARSERS[provider]
+        if not os.path.isdir(os.path.join(directory, scope)):
+            continue
+        module = get_module(provider)
+        archive = open_archive(directory, scope)
+        for (entry_provider, marketplace, asin), versions in sorted(archive.by_key.items()):
+            if entry_provider != provider or (args.asin and asin not in args.asin):
+                continue
+            entry = versions[-1]
+            # Маркетплейс в ключе архива - TLD Amazon ('de', 'co.uk'): по URL парсер определяет валюту
+            url = f"https://www.amazon.{marketplace}/dp/{asin}"
+            content = archive.read(entry).decode('utf-8', errors='replace')
+            try:
+                product_info = parse(module, content if content_format == 'html' else json.loads(content), asin, url)
+            except ValueError as e:
+                product_info, failures = {'error': str(e)}, failures + 1
+            results.append({'provider': provider, 'marketplace': marketplace, 'asin': asin, 'hash': entry['hash'], 'result': product_info})
+    print(json.dumps(results, ensure_ascii=False, indent=2, default=str))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
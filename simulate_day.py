@@ -0,0 +1,179 @@
+"""
+Симуляция суток работы планировщика слотов на сервере-заглушке провайдеров.
+
+Скрипт провайдера получает SimulatedClock: ожидание слота, лимитер запросов (api_limiter) и паузы
+повторных попыток не блокируют, а сдвигают время вперед. Реальное время работы (запросы к заглушке,
+разбор, XLSX-отчет) тоже идет в счет и умножается на --work-scale. Поэтому сутки слотов
+проходят за секунды, а длительность циклов остается правдоподобной: при лимите 1 запрос в секунду
+цикл из 300 ASIN длится в симуляции не меньше 5 минут.
+
+Используется тот же цикл run_schedule и SlotScheduler, что и в main(); каждый слот - это
+gather_product_data -> XLSX-отчет в памяти (Google Sheets и Telegram не участвуют).
+В отчете: опоздание каждого слота, пропущенные и объединенные слоты, перекрытия (цикл закончился
+после следующего слота) и пропускная способность.
+
+Примеры:
+    python simulate_day.py --provider scrapingdog
+    python simulate_day.py --provider scraperapi --asins 3000 --lead-minutes 30 --overrun-policy merge
+    python simulate_day.py --provider oxylabs --latency fixed:20 --work-scale 100   # 2 с на запрос
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from load_test import build_config, fetch_server_stats, free_port, start_mock_server, synthetic_sections
+from provider_scripts import SCRIPTS, load_script
+
+DEFAULT_SLOTS = "14:00,16:00,18:00,20:00,22:00,00:00,02:00,04:00,06:00,08:00,10:00,12:00"
+HISTORY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def find_overlaps(module, history, slots, timezone_str):
+    """Запуски, закончившиеся после следующего слота расписания: [(слот, следующий слот, конец)]."""
+    timezone = pytz.timezone(timezone_str)
+    overlaps = []
+    for entry in history:
+        if not entry['finished_at']:
+            continue
+        slot_time = timezone.localize(datetime.strptime(entry['slot'], '%Y-%m-%d %H:%M'))
+        finished_at = timezone.localize(datetime.strptime(entry['finished_at'], HISTORY_TIME_FORMAT))
+        next_slot = module.get_next_slot(slot_time, slots, timezone_str)
+        if finished_at > next_slot:
+            overlaps.append((entry['slot'], next_slot.strftime('%H:%M'), entry['finished_at']))
+    return overlaps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Симуляция суток слотов на сервере-заглушке провайдеров.')
+    parser.add_argument('--provider', choices=sorted(SCRIPTS), default='scrapingdog')
+    parser.add_argument('--asins', type=int, default=300, help='Число синтетических ASIN в цикле.')
+    parser.add_argument('--dead-share', type=float, default=0.01, help='Доля снятых с продажи ASIN (ответ 404).')
+    parser.add_argument('--slots', default=DEFAULT_SLOTS, help='Слоты "HH:MM" через запятую.')
+    parser.add_argument('--timezone', default='Europe/Kiev')
+    parser.add_argument('--start', help='Начало симуляции "YYYY-MM-DD HH:MM" (по умолчанию сегодня 00:00).')
+    parser.add_argument('--hours', type=float, default=24, help='Длительность симуляции, часов.')
+    parser.add_argument('--lead-minutes', type=int, help='Упреждение старта (prefetch_lead_minutes); по умолчанию - по длительности циклов.')
+    parser.add_argument('--overrun-policy', choices=('skip', 'merge'), default='skip')
+    parser.add_argument('--client-rps', type=int, default=1, help='Лимит api_limiter скрипта, запросов в секунду (0 - без лимита).')
+    parser.add_argument('--work-scale', type=float, default=1.0, help='Множитель реального времени работы в симулированном.')
+    parser.add_argument('--latency', help='Задержка ответа заглушки, мс: fixed:MS, uniform:MIN:MAX, exp:MEAN, lognormal:MEDIAN:SIGMA.')
+    parser.add_argument('--error-429', type=float, default=0.0, help='Доля ответов 429.')
+    parser.add_argument('--error-5xx', type=float, default=0.0, help='Доля ответов 500/502/503.')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Лимит заглушки, запросов в секунду (0 - без лимита).')
+    parser.add_argument('--synthetic', action='store_true', help='Синтетические ответы вместо корпуса fixtures/.')
+    parser.add_argument('--log-level', default='ERROR', help='Уровень логов скрипта.')
+    parser.add_argument('--json', action='store_true', help='Вывести отчет в JSON.')
+    args = parser.parse_args(argv)
+
+    timezone = pytz.timezone(args.timezone)
+    if args.start:
+        start = timezone.localize(datetime.strptime(args.start, '%Y-%m-%d %H:%M'))
+    else:
+        start = timezone.localize(datetime.combine(datetime.now(timezone).date(), datetime.min.time()))
+    until = start + timedelta(hours=args.hours)
+    slots = sorted({slot.strip() for slot in args.slots.split(',') if slot.strip()})
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_mock_server(port, args)
+    # Скрипты пишут scraper.log и файлы состояния в рабочую папку: запускаем во временной
+    work_dir = tempfile.mkdtemp(prefix='simulate_day_')
+    os.chdir(work_dir)
+    cycles = []
+    try:
+        module = load_script(args.provider)
+        logging.getLogger().setLevel(args.log_level.upper())
+        module.clock = module.SimulatedClock(start.timestamp(), args.work_scale)
+        module.api_limiter.max_requests = args.client_rps or float('inf')
+
+        config, gather_args = build_config(args.provider, base_url, synthetic_sections(args.asins, args.dead_share))
+        scheduler = module.SlotScheduler(
+            slots, args.timezone,
+            lead_seconds=args.lead_minutes * 60 if args.lead_minutes is not None else None,
+            overrun_policy=args.overrun_policy,
+        )
+
+        def run_slot(slot_time):
+            module.stage_metrics.begin_cycle(slot_time.strftime('%H:%M'))
+            real_started = time.perf_counter()
+            results = module.gather_product_data(config, *gather_args)
+            module.create_xlsx_report(results, slot_time.strftime('%Y-%m-%d %H:%M:%S'))
+            summary = module.stage_metrics.end_cycle()
+            cycles.append({
+                'slot': slot_time.strftime('%Y-%m-%d %H:%M'),
+                'collected': summary['counters'].get('products_collected', 0),
+                'failed': summary['counters'].get('products_failed', 0),
+                'real_seconds': round(time.perf_counter() - real_started, 3),
+            })
+
+        real_started = time.perf_counter()
+        module.run_schedule(scheduler, run_slot, args.timezone, until=until)
+        real_seconds = time.perf_counter() - real_started
+        stats = fetch_server_stats(base_url)
+    finally:
+        server.terminate()
+        server.wait()
+
+    history = list(scheduler.history)
+    runs = [entry for entry in history if entry['finished_at']]
+    statuses = {}
+    for entry in history:
+        statuses[entry['status']] = statuses.get(entry['status'], 0) + 1
+    lateness = [entry['lateness_seconds'] for entry in runs]
+    busy_seconds = sum(entry['duration_seconds'] for entry in runs)
+    collected = sum(cycle['collected'] for cycle in cycles)
+    overlaps = find_overlaps(module, history, slots, args.timezone)
+    by_slot = {cycle['slot']: cycle for cycle in cycles}
+
+    report = {
+        'provider': args.provider,
+        'start': start.strftime('%Y-%m-%d %H:%M'),
+        'hours': args.hours,
+        'real_seconds': round(real_seconds, 2),
+        'statuses': statuses,
+        'max_lateness_seconds': max(lateness) if lateness else None,
+        'mean_lateness_seconds': round(sum(lateness) / len(lateness), 1) if lateness else None,
+        'overlaps': overlaps,
+        'collected': collected,
+        'busy_seconds': round(busy_seconds, 1),
+        'asins_per_busy_second': round(collected / busy_seconds, 2) if busy_seconds else None,
+        'runs': [dict(entry, **by_slot.get(entry['slot'], {})) for entry in history],
+        'server_responses': stats,
+        'work_dir': work_dir,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"Провайдер: {args.provider}, ASIN в цикле: {args.asins}, симуляция {args.hours:g} ч с {report['start']} "
+          f"за {real_seconds:.1f} с реального времени")
+    print(f"{'Слот':<18}{'Статус':<10}{'Старт':>10}{'Конец':>10}{'Длит., мин':>12}{'Опоздание, мин':>16}{'Собрано':>9}")
+    for entry in report['runs']:
+        if entry['finished_at']:
+            print(f"{entry['slot']:<18}{entry['status']:<10}{entry['started_at'][11:19]:>10}{entry['finished_at'][11:19]:>10}"
+                  f"{entry['duration_seconds'] / 60:>12.1f}{entry['lateness_seconds'] / 60:>16.1f}{entry.get('collected', ''):>9}")
+        else:
+            print(f"{entry['slot']:<18}{entry['status']:<10}")
+    print(f"Статусы слотов: {statuses}")
+    if lateness:
+        print(f"Опоздание: среднее {report['mean_lateness_seconds'] / 60:.1f} мин, максимальное {report['max_lateness_seconds'] / 60:.1f} мин "
+              f"(отрицательное - запас до слота)")
+    print(f"Перекрытия (цикл закончился после следующего слота): {len(overlaps)}")
+    for slot, next_slot, finished_at in overlaps:
+        print(f"  {slot} закончился в {finished_at[11:19]}, следующий слот {next_slot}")
+    if busy_seconds:
+        print(f"Пропускная способность: {report['asins_per_busy_second']} ASIN/с в работе, собрано за период: {collected}, "
+              f"занятость {busy_seconds / (args.hours * 3600):.0%}")
+    print(f"Ответы заглушки: {stats}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())